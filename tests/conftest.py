@@ -41,7 +41,7 @@ import warehouse
 
 from warehouse import admin, config, email, static
 from warehouse.accounts import services as account_services
-from warehouse.accounts.interfaces import ITokenService, IUserService
+from warehouse.accounts.interfaces import ICredentialCache, ITokenService, IUserService
 from warehouse.admin.flags import AdminFlag, AdminFlagValue
 from warehouse.email import services as email_services
 from warehouse.email.interfaces import IEmailSender
@@ -138,6 +138,9 @@ def pyramid_services(
 
     # Register our global services.
     services.register_service(billing_service, IBillingService, None, name="")
+    services.register_service(
+        account_services.NullCredentialCache(), ICredentialCache, None, name=""
+    )
     services.register_service(email_service, IEmailSender, None, name="")
     services.register_service(metrics, IMetricsService, None, name="")
     services.register_service(organization_service, IOrganizationService, None, name="")
@@ -492,6 +495,59 @@ def monkeypatch_session():
     m.undo()
 
 
+class _MockRedisPipeline:
+    """
+    Runs each command against a _MockRedis straight away, returning their
+    results from execute() like a real pipeline, or directly while watching
+    keys before a transaction starts.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.results = []
+        self.watching = False
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            if self.watching:
+                return command(*args, **kwargs)
+            self.results.append(command(*args, **kwargs))
+            return self
+
+        return queue
+
+    def watch(self, *keys):
+        self.watching = True
+
+    def multi(self):
+        self.watching = False
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
+class _MockRedisLock:
+    """
+    A non-blocking lock, held in a _MockRedis.
+    """
+
+    def __init__(self, redis, name):
+        self.redis = redis
+        self.name = name
+
+    def acquire(self, blocking=None):
+        return bool(self.redis.set(self.name, "locked", nx=True))
+
+    def reacquire(self):
+        return True
+
+    def release(self):
+        self.redis.delete(self.name)
+
+
 class _MockRedis:
     """
     Just enough Redis for our tests.
@@ -512,7 +568,12 @@ class _MockRedis:
         pass
 
     def delete(self, key):
-        del self.cache[key]
+        return int(self.cache.pop(key, None) is not None)
+
+    def decr(self, key, amount=1):
+        value = int(self.cache.get(key, 0)) - amount
+        self.cache[key] = value
+        return value
 
     def execute(self):
         pass
@@ -526,33 +587,183 @@ class _MockRedis:
     def from_url(self, _url):
         return self
 
+    def hdel(self, hash_, *keys):
+        fields = self.cache.get(hash_, {})
+        return len([fields.pop(key) for key in keys if key in fields])
+
     def hget(self, hash_, key):
         try:
             return self.cache[hash_][key]
         except KeyError:
             return None
 
-    def hset(self, hash_, key, value, *_args, **_kwargs):
+    def hexists(self, hash_, key):
+        return key in self.cache.get(hash_, {})
+
+    def hgetall(self, hash_):
+        # Like Redis, we hand fields and values back as bytes.
+        return {
+            key.encode("utf8"): value.encode("utf8")
+            for key, value in self.cache.get(hash_, {}).items()
+        }
+
+    def hincrby(self, hash_, key, amount=1):
+        value = int(self.cache.setdefault(hash_, dict()).get(key, 0)) + amount
+        self.cache[hash_][key] = value
+        return value
+
+    def hset(self, hash_, key=None, value=None, *_args, mapping=None, **_kwargs):
         if hash_ not in self.cache:
             self.cache[hash_] = dict()
-        self.cache[hash_][key] = value
+        if mapping is not None:
+            self.cache[hash_].update(mapping)
+        else:
+            self.cache[hash_][key] = value
+
+    def hsetnx(self, hash_, key, value):
+        if self.hexists(hash_, key):
+            return 0
+        self.hset(hash_, key, value)
+        return 1
 
     def get(self, key):
         return self.cache.get(key)
 
+    def llen(self, key):
+        return len(self.cache.get(key, []))
+
+    def lpush(self, key, *values):
+        self.cache[key] = list(reversed(values)) + self.cache.get(key, [])
+        return len(self.cache[key])
+
+    def lrange(self, key, start, end):
+        values = self.cache.get(key, [])
+        return values[start : len(values) if end == -1 else end + 1]
+
+    def lrem(self, key, count, value):
+        values = self.cache.get(key, [])
+        removed = 0
+        while value in values and (count == 0 or removed < count):
+            values.remove(value)
+            removed += 1
+        if key in self.cache and not values:
+            del self.cache[key]
+        return removed
+
+    def ltrim(self, key, start, end):
+        self.cache[key] = self.lrange(key, start, end)
+        if not self.cache[key]:
+            del self.cache[key]
+        return True
+
+    def lock(self, name, **_kwargs):
+        return _MockRedisLock(self, name)
+
     def pipeline(self):
-        return self
+        return _MockRedisPipeline(self)
+
+    def publish(self, channel, message):
+        return 0
+
+    def sadd(self, key, *values):
+        members = self.cache.setdefault(key, set())
+        added = set(values) - members
+        members.update(added)
+        return len(added)
+
+    def sismember(self, key, value):
+        return value in self.cache.get(key, set())
+
+    def smembers(self, key):
+        return set(self.cache.get(key, set()))
+
+    def srem(self, key, *values):
+        members = self.cache.get(key, set())
+        removed = members & set(values)
+        members.difference_update(removed)
+        if not members:
+            self.cache.pop(key, None)
+        return len(removed)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        pipe = self.pipeline()
+        pipe.watch(*watches)
+        value = func(pipe)
+        results = pipe.execute()
+        return value if value_from_callable else results
+
+    def unlink(self, *keys):
+        return len([self.cache.pop(key) for key in keys if key in self.cache])
+
+    def rpoplpush(self, src, dst):
+        values = self.cache.get(src)
+        if not values:
+            return None
+        value = values.pop()
+        if not values:
+            del self.cache[src]
+        self.cache.setdefault(dst, []).insert(0, value)
+        return value
+
+    def rpush(self, key, *values):
+        self.cache.setdefault(key, []).extend(values)
+        return len(self.cache[key])
 
     def scan_iter(self, search, count):
         del count  # unused
         return [key for key in self.cache.keys() if re.search(search, key)]
 
-    def set(self, key, value):
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.cache:
+            return None
         self.cache[key] = value
+        return True
 
     def setex(self, key, value, _seconds):
         self.cache[key] = value
 
+    def zadd(self, key, mapping, nx=False):
+        members = self.cache.setdefault(key, dict())
+        added = 0
+        for member, score in mapping.items():
+            # Like Redis, we hand members back as bytes.
+            if isinstance(member, str):
+                member = member.encode("utf8")
+            if member not in members:
+                added += 1
+            elif nx:
+                continue
+            members[member] = score
+        return added
+
+    def zrem(self, key, *members):
+        members = [m.encode("utf8") if isinstance(m, str) else m for m in members]
+        existing = self.cache.get(key, {})
+        removed = len(
+            [existing.pop(member) for member in members if member in existing]
+        )
+        if key in self.cache and not existing:
+            del self.cache[key]
+        return removed
+
+    def zunionstore(self, dest, keys, aggregate="SUM"):
+        combine = {"SUM": sum, "MIN": min, "MAX": max}[aggregate]
+        scores = {}
+        for key in keys:
+            for member, score in self.cache.get(key, {}).items():
+                scores.setdefault(member, []).append(score)
+        self.cache.pop(dest, None)
+        if scores:
+            self.cache[dest] = {m: combine(s) for m, s in scores.items()}
+        return len(scores)
+
+    def zrange(self, key, start, end, withscores=False):
+        members = sorted(self.cache.get(key, {}).items(), key=lambda m: (m[1], m[0]))
+        members = members[start : len(members) if end == -1 else end + 1]
+        if withscores:
+            return members
+        return [member for member, _ in members]
+
 
 @pytest.fixture
 def mockredis():
@@ -21,6 +21,7 @@ from pyramid.httpexceptions import HTTPUnauthorized
 from warehouse import accounts
 from warehouse.accounts import security_policy
 from warehouse.accounts.interfaces import (
+    ICredentialCache,
     IPasswordBreachedService,
     ITokenService,
     IUserService,
@@ -29,6 +30,8 @@ from warehouse.accounts.models import DisableReason
 from warehouse.accounts.security_policy import _basic_auth_check
 from warehouse.accounts.services import (
     HaveIBeenPwnedPasswordBreachedService,
+    NullCredentialCache,
+    RedisCredentialCache,
     TokenServiceFactory,
     database_login_factory,
 )
@@ -207,11 +210,16 @@ class TestLogin:
         breach_service = pretend.stub(
             check_password=pretend.call_recorder(lambda pw, tags=None: False)
         )
+        credential_cache = pretend.stub(
+            contains=pretend.call_recorder(lambda user, password: False),
+            add=pretend.call_recorder(lambda user, password: None),
+        )
 
         pyramid_services.register_service(service, IUserService, None)
         pyramid_services.register_service(
             breach_service, IPasswordBreachedService, None
         )
+        pyramid_services.register_service(credential_cache, ICredentialCache, None)
 
         pyramid_request.matched_route = pretend.stub(name="forklift.legacy.file_upload")
 
@@ -220,6 +228,9 @@ class TestLogin:
         with freezegun.freeze_time(now):
             assert _basic_auth_check("myuser", "mypass", pyramid_request) is True
 
+        assert credential_cache.contains.calls == [pretend.call(user, "mypass")]
+        assert credential_cache.add.calls == [pretend.call(user, "mypass")]
+
         assert service.find_userid.calls == [pretend.call("myuser")]
         assert service.get_user.calls == [pretend.call(2)]
         assert service.is_disabled.calls == [pretend.call(2)]
@@ -235,6 +246,45 @@ class TestLogin:
         ]
         assert service.update_user.calls == [pretend.call(2, last_login=now)]
 
+    def test_with_cached_credentials(self, pyramid_request, pyramid_services):
+        user = pretend.stub(id=2)
+        service = pretend.stub(
+            get_user=pretend.call_recorder(lambda user_id: user),
+            find_userid=pretend.call_recorder(lambda username: 2),
+            check_password=pretend.call_recorder(
+                lambda userid, password, tags=None: True
+            ),
+            update_user=pretend.call_recorder(lambda userid, last_login: None),
+            is_disabled=pretend.call_recorder(lambda user_id: (False, None)),
+        )
+        breach_service = pretend.stub(
+            check_password=pretend.call_recorder(lambda pw, tags=None: False)
+        )
+        credential_cache = pretend.stub(
+            contains=pretend.call_recorder(lambda user, password: True),
+            add=pretend.call_recorder(lambda user, password: None),
+        )
+
+        pyramid_services.register_service(service, IUserService, None)
+        pyramid_services.register_service(
+            breach_service, IPasswordBreachedService, None
+        )
+        pyramid_services.register_service(credential_cache, ICredentialCache, None)
+
+        pyramid_request.matched_route = pretend.stub(name="forklift.legacy.file_upload")
+
+        now = datetime.datetime.utcnow()
+
+        with freezegun.freeze_time(now):
+            assert _basic_auth_check("myuser", "mypass", pyramid_request) is True
+
+        assert service.is_disabled.calls == [pretend.call(2)]
+        assert credential_cache.contains.calls == [pretend.call(user, "mypass")]
+        assert service.check_password.calls == []
+        assert breach_service.check_password.calls == []
+        assert credential_cache.add.calls == []
+        assert service.update_user.calls == [pretend.call(2, last_login=now)]
+
     def test_via_basic_auth_compromised(
         self, monkeypatch, pyramid_request, pyramid_services
     ):
@@ -306,7 +356,11 @@ class TestUser:
         assert accounts._user(request) is None
 
 
-def test_includeme(monkeypatch):
+@pytest.mark.parametrize(
+    "credential_cache_url, credential_cache_class",
+    [(None, NullCredentialCache), ("redis://localhost/0", RedisCredentialCache)],
+)
+def test_includeme(monkeypatch, credential_cache_url, credential_cache_class):
     authz_obj = pretend.stub()
     authz_cls = pretend.call_recorder(lambda *a, **kw: authz_obj)
     monkeypatch.setattr(accounts, "ACLAuthorizationPolicy", authz_cls)
@@ -338,6 +392,7 @@ def test_includeme(monkeypatch):
                 "warehouse.account.email_add_ratelimit_string": "2 per day",
                 "warehouse.account.verify_email_ratelimit_string": "3 per 6 hours",
                 "warehouse.account.password_reset_ratelimit_string": "5 per day",
+                "accounts.credential_cache_url": credential_cache_url,
             }
         ),
         register_service_factory=pretend.call_recorder(
@@ -364,6 +419,7 @@ def test_includeme(monkeypatch):
             HaveIBeenPwnedPasswordBreachedService.create_service,
             IPasswordBreachedService,
         ),
+        pretend.call(credential_cache_class.create_service, ICredentialCache),
         pretend.call(RateLimit("10 per 5 minutes"), IRateLimiter, name="user.login"),
         pretend.call(RateLimit("10 per 5 minutes"), IRateLimiter, name="ip.login"),
         pretend.call(
@@ -12,12 +12,16 @@
 
 import collections
 import datetime
+import hashlib
+import io
+import os
 import uuid
 
 import freezegun
 import pretend
 import pytest
 import pytz
+import redis
 import requests
 
 from webauthn.helpers import bytes_to_base64url
@@ -31,6 +35,7 @@ import warehouse.utils.webauthn as webauthn
 from warehouse.accounts import services
 from warehouse.accounts.interfaces import (
     BurnedRecoveryCode,
+    ICredentialCache,
     InvalidRecoveryCode,
     IPasswordBreachedService,
     ITokenService,
@@ -1162,6 +1167,77 @@ class TestHaveIBeenPwnedPasswordBreachedService:
             pretend.call(f"https://api.pwnedpasswords.com/range/{prefix}")
         ]
 
+    def test_caches_range(self, monkeypatch, mockredis, metrics):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+        setex = pretend.call_recorder(lambda key, ttl, value: None)
+        monkeypatch.setattr(mockredis, "setex", setex)
+        response = pretend.stub(
+            text=(
+                "A8FF7FCD473D321E0146AFD9E26DF395147:3\r\n"
+                "1E4C9B93F3F0682250B6CF8331B7EE68FD8:5"
+            ),
+            raise_for_status=lambda: None,
+        )
+        session = pretend.stub(get=pretend.call_recorder(lambda url: response))
+
+        svc = services.HaveIBeenPwnedPasswordBreachedService(
+            session=session, metrics=metrics, cache_url="redis://"
+        )
+
+        assert svc.check_password("password")
+        assert setex.calls == [
+            pretend.call(
+                "warehouse/hibp/range/5baa6",
+                services.BREACHED_RANGE_CACHE_TTL,
+                bytes.fromhex(
+                    "01e4c9b93f3f0682250b6cf8331b7ee68fd8"
+                    "0a8ff7fcd473d321e0146afd9e26df395147"
+                ),
+            )
+        ]
+
+    @pytest.mark.parametrize(
+        ("password", "expected"),
+        [("password", True), ("correct horse battery staple", False)],
+    )
+    def test_cached_range(self, monkeypatch, mockredis, metrics, password, expected):
+        prefix = hashlib.sha1(password.encode("utf8")).hexdigest()[:5]
+        mockredis.cache[f"warehouse/hibp/range/{prefix}"] = bytes.fromhex(
+            "01e4c9b93f3f0682250b6cf8331b7ee68fd8"
+        )
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+        session = pretend.stub(get=pretend.call_recorder(lambda url: None))
+
+        svc = services.HaveIBeenPwnedPasswordBreachedService(
+            session=session, metrics=metrics, cache_url="redis://"
+        )
+
+        assert svc.check_password(password) == expected
+        assert session.get.calls == []
+        assert (
+            pretend.call("warehouse.compromised_password_check.cache_hit", tags=None)
+            in metrics.increment.calls
+        )
+
+    def test_cache_errors(self, monkeypatch):
+        def from_url(url):
+            raise redis.ConnectionError()
+
+        monkeypatch.setattr(redis.StrictRedis, "from_url", from_url)
+        response = pretend.stub(
+            text="1e4c9b93f3f0682250b6cf8331b7ee68fd8:5", raise_for_status=lambda: None
+        )
+        session = pretend.stub(get=pretend.call_recorder(lambda url: response))
+
+        svc = services.HaveIBeenPwnedPasswordBreachedService(
+            session=session, metrics=NullMetrics(), cache_url="redis://"
+        )
+
+        assert svc.check_password("password")
+        assert session.get.calls == [
+            pretend.call("https://api.pwnedpasswords.com/range/5baa6")
+        ]
+
     def test_failure(self):
         class AnError(Exception):
             pass
@@ -1217,6 +1293,9 @@ class TestHaveIBeenPwnedPasswordBreachedService:
         context = pretend.stub()
         request = pretend.stub(
             http=pretend.stub(),
+            registry=pretend.stub(
+                settings={"breached_passwords.cache_url": "redis://localhost/0"}
+            ),
             find_service=lambda iface, context: {
                 (IMetricsService, None): NullMetrics()
             }[(iface, context)],
@@ -1227,6 +1306,7 @@ class TestHaveIBeenPwnedPasswordBreachedService:
         )
 
         assert svc._http is request.http
+        assert svc._cache_url == "redis://localhost/0"
         assert isinstance(svc._metrics, NullMetrics)
         assert svc._help_url == "http://localhost/help/#compromised-password"
 
@@ -1255,6 +1335,7 @@ class TestHaveIBeenPwnedPasswordBreachedService:
         context = pretend.stub()
         request = pretend.stub(
             http=pretend.stub(),
+            registry=pretend.stub(settings={}),
             find_service=lambda iface, context: {
                 (IMetricsService, None): NullMetrics()
             }[(iface, context)],
@@ -1289,6 +1370,7 @@ class TestHaveIBeenPwnedPasswordBreachedService:
         context = pretend.stub()
         request = pretend.stub(
             http=pretend.stub(),
+            registry=pretend.stub(settings={}),
             find_service=lambda iface, context: {
                 (IMetricsService, None): NullMetrics()
             }[(iface, context)],
@@ -1300,6 +1382,143 @@ class TestHaveIBeenPwnedPasswordBreachedService:
         assert svc.failure_message_plain == expected
 
 
+class TestSortedDigests:
+    @pytest.mark.parametrize(
+        ("digest", "expected"),
+        [
+            (b"\x00\x01", True),
+            (b"\x00\x05", True),
+            (b"\xff\x00", True),
+            (b"\x00\x00", False),
+            (b"\x00\x02", False),
+            (b"\xff\xff", False),
+        ],
+    )
+    def test_contains(self, digest, expected):
+        digests = services.SortedDigests(b"\x00\x01\x00\x05\x10\x00\xff\x00", 2)
+
+        assert len(digests) == 4
+        assert (digest in digests) is expected
+
+    def test_empty(self):
+        assert b"\x00" not in services.SortedDigests(b"", 1)
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            services.SortedDigests(b"\x00\x01\x02", 2)
+
+
+class TestWriteBreachedDigests:
+    def test_writes_digests(self):
+        fp = io.BytesIO()
+
+        services.write_breached_digests(
+            [
+                "1E4C9B93F3F0682250B6CF8331B7EE68FD800000:5\r\n",
+                "5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3\r\n",
+            ],
+            fp,
+        )
+
+        assert fp.getvalue() == bytes.fromhex(
+            "1e4c9b93f3f0682250b6cf8331b7ee68fd800000"
+            "5baa61e4c9b93f3f0682250b6cf8331b7ee68fd8"
+        )
+
+    @pytest.mark.parametrize(
+        "lines",
+        [
+            ["5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3"] * 2,
+            [
+                "5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3",
+                "1E4C9B93F3F0682250B6CF8331B7EE68FD800000:5",
+            ],
+            ["5BAA61E4C9B9:3"],
+        ],
+    )
+    def test_invalid(self, lines):
+        with pytest.raises(ValueError):
+            services.write_breached_digests(lines, io.BytesIO())
+
+
+class TestOfflinePasswordBreachedService:
+    def test_verify_service(self):
+        assert verifyClass(
+            IPasswordBreachedService, services.OfflinePasswordBreachedService
+        )
+
+    @pytest.mark.parametrize(
+        ("password", "expected"),
+        [("password", True), ("correct horse battery staple", False)],
+    )
+    def test_check_password(self, tmpdir, password, expected):
+        path = str(tmpdir.join("breached"))
+        with open(path, "wb") as fp:
+            services.write_breached_digests(
+                [
+                    "1E4C9B93F3F0682250B6CF8331B7EE68FD800000:5",
+                    "5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3",
+                ],
+                fp,
+            )
+
+        svc = services.OfflinePasswordBreachedService(path=path, metrics=NullMetrics())
+
+        assert svc.check_password(password) is expected
+
+    def _write(self, path, lines):
+        with open(path + ".tmp", "wb") as fp:
+            services.write_breached_digests(lines, fp)
+        os.replace(path + ".tmp", path)
+
+    def test_reloads_replaced_file(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(services, "_breached_digests", {})
+        path = str(tmpdir.join("breached"))
+        svc = services.OfflinePasswordBreachedService(path=path, metrics=NullMetrics())
+
+        self._write(path, ["5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3"])
+        assert svc.check_password("password")
+        assert svc.check_password("password")
+
+        self._write(path, ["1E4C9B93F3F0682250B6CF8331B7EE68FD800000:5"])
+        assert not svc.check_password("password")
+        assert list(services._breached_digests) == [path]
+
+    @pytest.mark.parametrize("contents", [None, b"", b"too short"])
+    def test_unreadable_file_fails_open(self, monkeypatch, tmpdir, metrics, contents):
+        monkeypatch.setattr(services, "_breached_digests", {})
+        path = str(tmpdir.join("breached"))
+        if contents is not None:
+            with open(path, "wb") as fp:
+                fp.write(contents)
+        svc = services.OfflinePasswordBreachedService(path=path, metrics=metrics)
+
+        assert not svc.check_password("password", tags=["method:new_password"])
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.compromised_password_check.start",
+                tags=["method:new_password"],
+            ),
+            pretend.call(
+                "warehouse.compromised_password_check.error",
+                tags=["method:new_password"],
+            ),
+        ]
+        assert services._breached_digests == {}
+
+    def test_factory(self):
+        request = pretend.stub(
+            registry=pretend.stub(settings={"breached_passwords.path": "/a/path"}),
+            find_service=lambda iface, context: NullMetrics(),
+            help_url=lambda _anchor=None: f"http://localhost/help/#{_anchor}",
+        )
+        svc = services.OfflinePasswordBreachedService.create_service(None, request)
+
+        assert svc._path == "/a/path"
+        assert isinstance(svc._metrics, NullMetrics)
+        assert svc._help_url == "http://localhost/help/#compromised-password"
+
+
 class TestNullPasswordBreachedService:
     def test_verify_service(self):
         assert verifyClass(
@@ -1317,3 +1536,111 @@ class TestNullPasswordBreachedService:
 
         assert isinstance(svc, services.NullPasswordBreachedService)
         assert not svc.check_password("hunter2")
+
+
+class TestRedisCredentialCache:
+    def test_verify_service(self):
+        assert verifyClass(ICredentialCache, services.RedisCredentialCache)
+
+    def test_create_service(self, metrics):
+        request = pretend.stub(
+            registry=pretend.stub(
+                settings={
+                    "accounts.credential_cache_url": "redis://localhost/0",
+                    "sessions.secret": "a secret",
+                }
+            ),
+            find_service=lambda iface, context: metrics,
+        )
+
+        svc = services.RedisCredentialCache.create_service(None, request)
+
+        assert svc.redis_url == "redis://localhost/0"
+        assert svc.secret == b"a secret"
+        assert svc.ttl == services.CREDENTIAL_CACHE_TTL
+        assert svc._metrics is metrics
+
+    def test_key(self):
+        svc = services.RedisCredentialCache("redis://", "secret", metrics=None)
+        user = pretend.stub(id=1, password="$argon2$hash")
+        key = svc._key(user, "hunter2")
+
+        assert key.startswith("warehouse/accounts/credentials/")
+        assert "hunter2" not in key
+        assert svc._key(user, "hunter2") == key
+        assert svc._key(user, "hunter3") != key
+        assert svc._key(pretend.stub(id=2, password=user.password), "hunter2") != key
+        assert svc._key(pretend.stub(id=1, password="!"), "hunter2") != key
+        assert (
+            services.RedisCredentialCache("redis://", "other", metrics=None)._key(
+                user, "hunter2"
+            )
+            != key
+        )
+
+    @pytest.mark.parametrize("exists, expected", [(1, True), (0, False)])
+    def test_contains(self, monkeypatch, mockredis, metrics, exists, expected):
+        mockredis.exists = pretend.call_recorder(lambda key: exists)
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+        svc = services.RedisCredentialCache("redis://", "secret", metrics=metrics)
+        user = pretend.stub(id=1, password="hash")
+
+        assert svc.contains(user, "hunter2") is expected
+        assert mockredis.exists.calls == [pretend.call(svc._key(user, "hunter2"))]
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.authentication.credential_cache",
+                tags=["result:hit" if expected else "result:miss"],
+            )
+        ]
+
+    def test_contains_redis_error(self, monkeypatch, metrics):
+        def from_url(url):
+            raise redis.ConnectionError()
+
+        monkeypatch.setattr(redis.StrictRedis, "from_url", from_url)
+        svc = services.RedisCredentialCache("redis://", "secret", metrics=metrics)
+
+        assert not svc.contains(pretend.stub(id=1, password="hash"), "hunter2")
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.authentication.credential_cache", tags=["result:miss"]
+            )
+        ]
+
+    def test_add(self, monkeypatch, mockredis, metrics):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+        setex = pretend.call_recorder(mockredis.setex)
+        monkeypatch.setattr(mockredis, "setex", setex)
+        svc = services.RedisCredentialCache(
+            "redis://", "secret", metrics=metrics, ttl=60
+        )
+        user = pretend.stub(id=1, password="hash")
+
+        svc.add(user, "hunter2")
+
+        assert setex.calls == [pretend.call(svc._key(user, "hunter2"), 60, "1")]
+        assert svc.contains(user, "hunter2")
+        assert not svc.contains(pretend.stub(id=1, password="new hash"), "hunter2")
+
+    def test_add_redis_error(self, monkeypatch, metrics):
+        def from_url(url):
+            raise redis.ConnectionError()
+
+        monkeypatch.setattr(redis.StrictRedis, "from_url", from_url)
+        svc = services.RedisCredentialCache("redis://", "secret", metrics=metrics)
+
+        svc.add(pretend.stub(id=1, password="hash"), "hunter2")
+
+
+class TestNullCredentialCache:
+    def test_verify_service(self):
+        assert verifyClass(ICredentialCache, services.NullCredentialCache)
+
+    def test_factory(self):
+        svc = services.NullCredentialCache.create_service(None, pretend.stub())
+        user = pretend.stub(id=1, password="hash")
+
+        svc.add(user, "hunter2")
+
+        assert not svc.contains(user, "hunter2")
@@ -12,6 +12,13 @@
 
 import enum
 
+import pretend
+import pytest
+import redis
+
+from warehouse.admin import flags
+from warehouse.admin.flags import FLAGS_CACHE_KEY, AdminFlagCache, Flags
+
 from ...common.db.admin import AdminFlagFactory
 
 
@@ -29,3 +36,203 @@ class TestAdminFlag:
         AdminFlagFactory(id="this-flag-is-enabled")
 
         assert db_request.flags.enabled(TestAdminFlagValues.THIS_FLAG_IS_ENABLED)
+
+    def test_notifications(self, db_request):
+        AdminFlagFactory(id="b-flag", notify=True)
+        AdminFlagFactory(id="a-flag", notify=True)
+        AdminFlagFactory(id="c-flag", notify=False)
+        AdminFlagFactory(id="d-flag", enabled=False, notify=True)
+
+        assert [f.id for f in db_request.flags.notifications()] == [
+            "a-flag",
+            "b-flag",
+        ]
+
+
+class TestCachedFlags:
+    @pytest.fixture
+    def flags_request(self, db_request, metrics):
+        db_request.registry[FLAGS_CACHE_KEY] = AdminFlagCache(ttl=30)
+        return db_request
+
+    def test_enabled(self, flags_request, metrics):
+        AdminFlagFactory(id="this-flag-is-enabled")
+        request_flags = Flags(flags_request)
+
+        assert request_flags.enabled(TestAdminFlagValues.THIS_FLAG_IS_ENABLED)
+        assert not request_flags.enabled(TestAdminFlagValues.NOT_A_REAL_FLAG)
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.admin_flags.cache.miss"),
+            pretend.call("warehouse.admin_flags.cache.hit"),
+        ]
+
+    def test_notifications(self, flags_request):
+        AdminFlagFactory(id="b-flag", notify=True)
+        AdminFlagFactory(id="a-flag", notify=True)
+        AdminFlagFactory(id="c-flag", notify=False)
+
+        assert [f.id for f in Flags(flags_request).notifications()] == [
+            "a-flag",
+            "b-flag",
+        ]
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def query(self, model):
+        self.queries += 1
+        return pretend.stub(all=lambda: list(self.rows))
+
+
+class TestAdminFlagCache:
+    def test_caches_until_ttl(self, monkeypatch, metrics):
+        now = [100.0]
+        monkeypatch.setattr(flags.time, "monotonic", lambda: now[0])
+        row = pretend.stub(id="a-flag", description="A", enabled=True, notify=False)
+        session = FakeSession([row])
+        cache = AdminFlagCache(ttl=30)
+
+        first = cache.get(session, metrics)
+        assert first == {"a-flag": flags._FlagState("a-flag", "A", True, False)}
+        assert cache.get(session, metrics) is first
+        assert session.queries == 1
+
+        now[0] = 131.0
+        assert cache.get(session, metrics) == first
+        assert session.queries == 2
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.admin_flags.cache.miss"),
+            pretend.call("warehouse.admin_flags.cache.hit"),
+            pretend.call("warehouse.admin_flags.cache.miss"),
+        ]
+
+    def test_invalidate(self, metrics):
+        session = FakeSession([])
+        cache = AdminFlagCache(ttl=30)
+
+        cache.get(session, metrics)
+        cache.invalidate({"type": "message", "data": b"changed"})
+        cache.get(session, metrics)
+
+        assert session.queries == 2
+
+    def test_invalidated_while_loading(self, metrics):
+        cache = AdminFlagCache(ttl=30)
+
+        class RacingSession(FakeSession):
+            def query(self, model):
+                cache.invalidate()
+                return super().query(model)
+
+        session = RacingSession([])
+        assert cache.get(session, metrics) == {}
+        assert cache._flags is None
+
+    def test_subscribes_once_per_process(self, monkeypatch, metrics):
+        monkeypatch.setattr(flags.os, "getpid", lambda: 1234)
+        pubsub = pretend.stub(
+            subscribe=pretend.call_recorder(lambda **kw: None),
+            run_in_thread=pretend.call_recorder(lambda **kw: None),
+        )
+        redis_client = pretend.stub(pubsub=pretend.call_recorder(lambda **kw: pubsub))
+        from_url = pretend.call_recorder(lambda url: redis_client)
+        monkeypatch.setattr(redis.StrictRedis, "from_url", from_url)
+        cache = AdminFlagCache(ttl=30, redis_url="redis://localhost/0")
+
+        cache.get(FakeSession([]), metrics)
+        cache.get(FakeSession([]), metrics)
+
+        assert from_url.calls == [pretend.call("redis://localhost/0")]
+        assert redis_client.pubsub.calls == [
+            pretend.call(ignore_subscribe_messages=True)
+        ]
+        assert pubsub.subscribe.calls == [
+            pretend.call(**{flags.FLAGS_CHANNEL: cache.invalidate})
+        ]
+        assert pubsub.run_in_thread.calls == [
+            pretend.call(
+                sleep_time=1,
+                daemon=True,
+                exception_handler=cache._on_subscriber_error,
+            )
+        ]
+
+    def test_subscribe_error(self, monkeypatch, metrics):
+        def pubsub(**kw):
+            raise redis.ConnectionError()
+
+        redis_client = pretend.stub(pubsub=pubsub)
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: redis_client)
+        cache = AdminFlagCache(ttl=30, redis_url="redis://localhost/0")
+
+        assert cache.get(FakeSession([]), metrics) == {}
+
+    def test_subscriber_error(self, metrics):
+        cache = AdminFlagCache(ttl=30, redis_url="redis://localhost/0")
+        cache._subscribed_pid = 1234
+        cache.get(FakeSession([]), metrics)
+        thread = pretend.stub(stop=pretend.call_recorder(lambda: None))
+
+        cache._on_subscriber_error(redis.ConnectionError(), pretend.stub(), thread)
+
+        assert thread.stop.calls == [pretend.call()]
+        assert cache._subscribed_pid is None
+        assert cache._flags is None
+
+    def test_publish(self, monkeypatch, metrics):
+        redis_client = pretend.stub(
+            publish=pretend.call_recorder(lambda channel, message: 1)
+        )
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: redis_client)
+        cache = AdminFlagCache(ttl=30, redis_url="redis://localhost/0")
+        cache._flags = {}
+
+        cache.publish()
+
+        assert cache._flags is None
+        assert redis_client.publish.calls == [
+            pretend.call(flags.FLAGS_CHANNEL, "changed")
+        ]
+
+    def test_publish_error(self, monkeypatch):
+        def publish(channel, message):
+            raise redis.ConnectionError()
+
+        redis_client = pretend.stub(publish=publish)
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: redis_client)
+        cache = AdminFlagCache(ttl=30, redis_url="redis://localhost/0")
+
+        cache.publish()
+
+    def test_publish_without_redis(self):
+        cache = AdminFlagCache(ttl=30)
+        cache._flags = {}
+
+        cache.publish()
+
+        assert cache._flags is None
+
+
+def test_includeme():
+    class FakeRegistry(dict):
+        settings = {
+            "admin_flags.cache_ttl": 10,
+            "admin_flags.cache_url": "redis://localhost/0",
+        }
+
+    config = pretend.stub(
+        add_request_method=pretend.call_recorder(lambda *a, **kw: None),
+        registry=FakeRegistry(),
+    )
+
+    flags.includeme(config)
+
+    assert config.add_request_method.calls == [
+        pretend.call(Flags, name="flags", reify=True)
+    ]
+    cache = config.registry[FLAGS_CACHE_KEY]
+    assert cache.ttl == 10
+    assert cache.redis_url == "redis://localhost/0"
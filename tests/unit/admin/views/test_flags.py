@@ -10,9 +10,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pretend
 import pytest
 
-from warehouse.admin.flags import AdminFlag
+from warehouse.admin.flags import FLAGS_CACHE_KEY, AdminFlag
 from warehouse.admin.views import flags as views
 
 from ....common.db.admin import AdminFlagFactory
@@ -108,3 +109,23 @@ class TestEditFlag:
 
         assert flag.enabled == expected_enabled
         assert flag.description == expected_description
+
+    @pytest.mark.parametrize("success, publish_calls", [(True, 1), (False, 0)])
+    def test_edit_flag_publishes_change(self, db_request, success, publish_calls):
+        AdminFlagFactory(id="foo-bar", description="old", enabled=False)
+
+        cache = pretend.stub(publish=pretend.call_recorder(lambda: None))
+        db_request.registry[FLAGS_CACHE_KEY] = cache
+        hooks = []
+        db_request.tm = pretend.stub(
+            get=lambda: pretend.stub(addAfterCommitHook=lambda hook: hooks.append(hook))
+        )
+        db_request.POST = {"id": "foo-bar", "description": "new"}
+        db_request.route_path = lambda *a: "/the/redirect"
+
+        views.edit_flag(db_request)
+
+        assert cache.publish.calls == []
+        assert len(hooks) == 1
+        hooks[0](success)
+        assert len(cache.publish.calls) == publish_calls
@@ -10,13 +10,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import contextmanager
+
+import orjson
 import pretend
 import pytest
 
+from packaging.utils import canonicalize_name
 from pyramid.httpexceptions import HTTPMovedPermanently
 from pyramid.testing import DummyRequest
 
 from warehouse.api import simple
+from warehouse.packaging import utils as packaging_utils
 
 from ...common.db.accounts import UserFactory
 from ...common.db.packaging import (
@@ -66,6 +71,12 @@ class TestContentNegotiation:
         assert simple._select_content_type(request) == expected
 
 
+CONTENT_TYPES = [
+    "text/html",
+    "application/vnd.pypi.simple.v1+html",
+    "application/vnd.pypi.simple.v1+json",
+]
+
 CONTENT_TYPE_PARAMS = [
     ("text/html", None),
     ("application/vnd.pypi.simple.v1+html", None),
@@ -74,70 +85,85 @@ CONTENT_TYPE_PARAMS = [
 
 
 class TestSimpleIndex:
-    @pytest.mark.parametrize(
-        "content_type,renderer_override",
-        CONTENT_TYPE_PARAMS,
-    )
-    def test_no_results_no_serial(self, db_request, content_type, renderer_override):
-        db_request.accept = content_type
-        assert simple.simple_index(db_request) == {
-            "meta": {"_last-serial": 0, "api-version": "1.0"},
-            "projects": [],
+    @pytest.fixture
+    def db_request(self, db_request, jinja):
+        # The index is streamed from its own connection, so make sure that it
+        # sees the same transaction as the rest of the test.
+        @contextmanager
+        def connect():
+            yield db_request.db.connection()
+
+        db_request.registry["sqlalchemy.engine"] = pretend.stub(connect=connect)
+        db_request.route_path = lambda route, name: f"/simple/{name}/"
+        jinja.filters["canonicalize_name"] = canonicalize_name
+        return db_request
+
+    @staticmethod
+    def _render(request, jinja, content_type, serial, projects):
+        context = {
+            "meta": {"_last-serial": serial, "api-version": "1.0"},
+            "projects": projects,
         }
+        if content_type == "application/vnd.pypi.simple.v1+json":
+            return orjson.dumps(
+                context, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+            )
+
+        template = jinja.get_template("templates/api/simple/index.html")
+        return template.render(**context, request=request).encode("utf-8")
+
+    @pytest.mark.parametrize("content_type", CONTENT_TYPES)
+    def test_no_results_no_serial(self, db_request, jinja, content_type):
+        db_request.accept = content_type
+
+        resp = simple.simple_index(db_request)
+
+        assert resp is db_request.response
+        assert b"".join(resp.app_iter) == self._render(
+            db_request, jinja, content_type, 0, []
+        )
         assert db_request.response.headers["X-PyPI-Last-Serial"] == "0"
         assert db_request.response.content_type == content_type
 
-        if renderer_override is not None:
-            db_request.override_renderer == renderer_override
-
-    @pytest.mark.parametrize(
-        "content_type,renderer_override",
-        CONTENT_TYPE_PARAMS,
-    )
-    def test_no_results_with_serial(self, db_request, content_type, renderer_override):
+    @pytest.mark.parametrize("content_type", CONTENT_TYPES)
+    def test_no_results_with_serial(self, db_request, jinja, content_type):
         db_request.accept = content_type
         user = UserFactory.create()
         je = JournalEntryFactory.create(submitted_by=user)
-        assert simple.simple_index(db_request) == {
-            "meta": {"_last-serial": je.id, "api-version": "1.0"},
-            "projects": [],
-        }
+
+        resp = simple.simple_index(db_request)
+
+        assert b"".join(resp.app_iter) == self._render(
+            db_request, jinja, content_type, je.id, []
+        )
         assert db_request.response.headers["X-PyPI-Last-Serial"] == str(je.id)
         assert db_request.response.content_type == content_type
 
-        if renderer_override is not None:
-            db_request.override_renderer == renderer_override
-
-    @pytest.mark.parametrize(
-        "content_type,renderer_override",
-        CONTENT_TYPE_PARAMS,
-    )
-    def test_with_results_no_serial(self, db_request, content_type, renderer_override):
+    @pytest.mark.parametrize("content_type", CONTENT_TYPES)
+    def test_with_results_no_serial(self, db_request, jinja, content_type):
         db_request.accept = content_type
         projects = [
             (x.name, x.normalized_name)
             for x in [ProjectFactory.create() for _ in range(3)]
         ]
-        assert simple.simple_index(db_request) == {
-            "meta": {"_last-serial": 0, "api-version": "1.0"},
-            "projects": [
+
+        resp = simple.simple_index(db_request)
+
+        assert b"".join(resp.app_iter) == self._render(
+            db_request,
+            jinja,
+            content_type,
+            0,
+            [
                 {"name": x[0], "_last-serial": 0}
                 for x in sorted(projects, key=lambda x: x[1])
             ],
-        }
+        )
         assert db_request.response.headers["X-PyPI-Last-Serial"] == "0"
         assert db_request.response.content_type == content_type
 
-        if renderer_override is not None:
-            db_request.override_renderer == renderer_override
-
-    @pytest.mark.parametrize(
-        "content_type,renderer_override",
-        CONTENT_TYPE_PARAMS,
-    )
-    def test_with_results_with_serial(
-        self, db_request, content_type, renderer_override
-    ):
+    @pytest.mark.parametrize("content_type", CONTENT_TYPES)
+    def test_with_results_with_serial(self, db_request, jinja, content_type):
         db_request.accept = content_type
         projects = [
             (x.name, x.normalized_name)
@@ -146,18 +172,46 @@ class TestSimpleIndex:
         user = UserFactory.create()
         je = JournalEntryFactory.create(submitted_by=user)
 
-        assert simple.simple_index(db_request) == {
-            "meta": {"_last-serial": je.id, "api-version": "1.0"},
-            "projects": [
+        resp = simple.simple_index(db_request)
+
+        assert b"".join(resp.app_iter) == self._render(
+            db_request,
+            jinja,
+            content_type,
+            je.id,
+            [
                 {"name": x[0], "_last-serial": 0}
                 for x in sorted(projects, key=lambda x: x[1])
             ],
-        }
+        )
         assert db_request.response.headers["X-PyPI-Last-Serial"] == str(je.id)
         assert db_request.response.content_type == content_type
 
-        if renderer_override is not None:
-            db_request.override_renderer == renderer_override
+    @pytest.mark.parametrize("content_type", CONTENT_TYPES)
+    def test_with_results_in_chunks(self, db_request, jinja, monkeypatch, content_type):
+        monkeypatch.setattr(packaging_utils, "SIMPLE_INDEX_CHUNK_SIZE", 2)
+        monkeypatch.setattr(packaging_utils, "SIMPLE_INDEX_BUFFER_SIZE", 1)
+
+        db_request.accept = content_type
+        projects = [
+            (x.name, x.normalized_name)
+            for x in [ProjectFactory.create() for _ in range(5)]
+        ]
+
+        resp = simple.simple_index(db_request)
+        chunks = list(resp.app_iter)
+
+        assert len(chunks) > 3
+        assert b"".join(chunks) == self._render(
+            db_request,
+            jinja,
+            content_type,
+            0,
+            [
+                {"name": x[0], "_last-serial": 0}
+                for x in sorted(projects, key=lambda x: x[1])
+            ],
+        )
 
 
 class TestSimpleDetail:
@@ -380,3 +434,35 @@ class TestSimpleDetail:
 
         if renderer_override is not None:
             db_request.override_renderer == renderer_override
+
+    def test_with_files_ordered_by_pypi_ordering(self, db_request):
+        project = ProjectFactory.create()
+        # Create the releases out of order, the precomputed ordering should be
+        # used rather than the order they were created in.
+        releases = [
+            ReleaseFactory.create(project=project, version=version, _pypi_ordering=i)
+            for version, i in [("2.0", 2), ("1.0", 0), ("1.5", 1)]
+        ]
+        files = [
+            FileFactory.create(
+                release=r,
+                filename="{}-{}.{}".format(project.name, r.version, ext),
+            )
+            for r in releases
+            for ext in ["whl", "tar.gz"]
+        ]
+        files = sorted(files, key=lambda f: (f.release._pypi_ordering, f.filename))
+        urls_iter = (f"/file/{f.filename}" for f in files)
+        db_request.matchdict["name"] = project.normalized_name
+        db_request.route_url = lambda *a, **kw: next(urls_iter)
+
+        assert simple.simple_detail(project, db_request)["files"] == [
+            {
+                "filename": f.filename,
+                "url": f"/file/{f.filename}",
+                "hashes": {"sha256": f.sha256_digest},
+                "requires-python": f.release.requires_python,
+                "yanked": False,
+            }
+            for f in files
+        ]
@@ -10,15 +10,188 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import http.server
+import json
+import threading
+
 import celery.exceptions
 import pretend
 import pytest
+import redis
 import requests
 
 from zope.interface.verify import verifyClass
 
 from warehouse.cache.origin import fastly
 from warehouse.cache.origin.interfaces import IOriginCache
+from warehouse.metrics import IMetricsService
+
+
+class _FakeFastlyHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):  # noqa: N802
+        keys = self.headers.get("Surrogate-Key", "").split()
+        self.server.purges.append((self.path, dict(self.headers), keys))
+
+        if self.server.status != 200:
+            self.send_error(self.server.status)
+            return
+
+        body = json.dumps(
+            {key: "purge-id" for key in keys if key not in self.server.failing}
+        ).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_fastly():
+    """
+    A local stand in for the Fastly API, which records the purges sent to it.
+    """
+    server = http.server.HTTPServer(("127.0.0.1", 0), _FakeFastlyHandler)
+    server.purges = []
+    server.failing = set()
+    server.status = 200
+    server.api_domain = "http://127.0.0.1:{}".format(server.server_port)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+class TestPurgePendingKeys:
+    @pytest.fixture
+    def task_request(self, metrics, mockredis, monkeypatch):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        cacher = pretend.stub(purge_keys=pretend.call_recorder(lambda keys: None))
+
+        def find_service(iface, context=None):
+            return {IOriginCache: cacher, IMetricsService: metrics}[iface]
+
+        return pretend.stub(
+            cacher=cacher,
+            find_service=find_service,
+            registry=pretend.stub(
+                settings={"celery.scheduler_url": "redis://redis:6379/0"}
+            ),
+            log=pretend.stub(
+                info=pretend.call_recorder(lambda *args, **kwargs: None),
+                error=pretend.call_recorder(lambda *args, **kwargs: None),
+            ),
+        )
+
+    def test_purges_pending(self, monkeypatch, metrics, mockredis, task_request):
+        monkeypatch.setattr(fastly.time, "time", lambda: 110.0)
+        mockredis.zadd(fastly.PENDING_PURGES_KEY, {"two": 100.0, "one": 105.0})
+        mockredis.set(fastly.PURGE_SCHEDULED_KEY, 1)
+
+        fastly.purge_pending_keys(pretend.stub(), task_request)
+
+        assert task_request.cacher.purge_keys.calls == [pretend.call(["two", "one"])]
+        assert not mockredis.exists(fastly.PENDING_PURGES_KEY)
+        assert not mockredis.exists(fastly.IN_PROGRESS_PURGES_KEY)
+        assert not mockredis.exists(fastly.PURGE_SCHEDULED_KEY)
+        assert task_request.log.info.calls == [pretend.call("Purging %s", "two one")]
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.origin_cache.purge.sent", 2)
+        ]
+        assert metrics.histogram.calls == [
+            pretend.call("warehouse.origin_cache.purge.lag", 10.0)
+        ]
+
+    def test_nothing_pending(self, metrics, mockredis, task_request):
+        mockredis.set(fastly.PURGE_SCHEDULED_KEY, 1)
+
+        fastly.purge_pending_keys(pretend.stub(), task_request)
+
+        assert task_request.cacher.purge_keys.calls == []
+        assert not mockredis.exists(fastly.PURGE_SCHEDULED_KEY)
+        assert metrics.increment.calls == []
+
+    @pytest.mark.parametrize(
+        "exception_type",
+        [
+            requests.ConnectionError,
+            requests.HTTPError,
+            requests.Timeout,
+            fastly.UnsuccessfulPurgeError,
+        ],
+    )
+    def test_purge_fails(self, metrics, mockredis, task_request, exception_type):
+        exc = exception_type()
+
+        @pretend.call_recorder
+        def purge_keys(keys):
+            # Another purge of one of our keys comes in while we're purging.
+            mockredis.zadd(fastly.PENDING_PURGES_KEY, {"one": 120.0})
+            raise exc
+
+        class Task:
+            @staticmethod
+            @pretend.call_recorder
+            def retry(exc):
+                raise celery.exceptions.Retry
+
+        task_request.cacher.purge_keys = purge_keys
+        mockredis.zadd(fastly.PENDING_PURGES_KEY, {"one": 100.0, "two": 105.0})
+
+        with pytest.raises(celery.exceptions.Retry):
+            fastly.purge_pending_keys(Task, task_request)
+
+        assert Task.retry.calls == [pretend.call(exc=exc)]
+        # Our keys wait to be purged by the retry, and the new request for one
+        # of them waits to be purged again after that.
+        assert mockredis.zrange(
+            fastly.IN_PROGRESS_PURGES_KEY, 0, -1, withscores=True
+        ) == [(b"one", 100.0), (b"two", 105.0)]
+        assert mockredis.zrange(fastly.PENDING_PURGES_KEY, 0, -1, withscores=True) == [
+            (b"one", 120.0),
+        ]
+        assert task_request.log.error.calls == [
+            pretend.call("Error purging %s: %s", "one two", str(exc))
+        ]
+        assert metrics.increment.calls == []
+
+    def test_purge_crashes(self, metrics, mockredis, task_request):
+        def purge_keys(keys):
+            raise ValueError("Not JSON")
+
+        task_request.cacher.purge_keys = purge_keys
+        mockredis.zadd(fastly.PENDING_PURGES_KEY, {"one": 100.0, "two": 105.0})
+
+        with pytest.raises(ValueError):
+            fastly.purge_pending_keys(pretend.stub(), task_request)
+
+        assert mockredis.zrange(
+            fastly.IN_PROGRESS_PURGES_KEY, 0, -1, withscores=True
+        ) == [(b"one", 100.0), (b"two", 105.0)]
+
+    def test_picks_up_unfinished_purges(
+        self, monkeypatch, metrics, mockredis, task_request
+    ):
+        monkeypatch.setattr(fastly.time, "time", lambda: 110.0)
+        mockredis.zadd(fastly.IN_PROGRESS_PURGES_KEY, {"one": 100.0, "two": 105.0})
+        mockredis.zadd(fastly.PENDING_PURGES_KEY, {"one": 108.0, "three": 109.0})
+
+        fastly.purge_pending_keys(pretend.stub(), task_request)
+
+        assert task_request.cacher.purge_keys.calls == [
+            pretend.call(["one", "two", "three"])
+        ]
+        assert not mockredis.exists(fastly.IN_PROGRESS_PURGES_KEY)
+        assert not mockredis.exists(fastly.PENDING_PURGES_KEY)
+        assert metrics.histogram.calls == [
+            pretend.call("warehouse.origin_cache.purge.lag", 10.0)
+        ]
 
 
 class TestPurgeKey:
@@ -86,22 +259,46 @@ class TestFastlyCache:
     def test_verify_service(self):
         assert verifyClass(IOriginCache, fastly.FastlyCache)
 
-    def test_create_service(self):
-        purge_key = pretend.stub(delay=pretend.stub())
+    @pytest.mark.parametrize(
+        ("settings", "purge_window", "api_domain"),
+        [
+            ({}, 5, "https://api.fastly.com"),
+            (
+                {
+                    "origin_cache.purge_window": "30",
+                    "origin_cache.api_domain": "http://fastly.example.com",
+                },
+                30,
+                "http://fastly.example.com",
+            ),
+        ],
+    )
+    def test_create_service(
+        self, monkeypatch, metrics, mockredis, settings, purge_window, api_domain
+    ):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        purge_pending_keys = pretend.stub(apply_async=pretend.stub())
         request = pretend.stub(
             registry=pretend.stub(
                 settings={
                     "origin_cache.api_key": "the api key",
                     "origin_cache.service_id": "the service id",
+                    "celery.scheduler_url": "redis://redis:6379/0",
+                    **settings,
                 }
             ),
-            task=lambda f: purge_key,
+            task=lambda f: purge_pending_keys,
+            find_service=lambda iface, context=None: metrics,
         )
         cacher = fastly.FastlyCache.create_service(None, request)
         assert isinstance(cacher, fastly.FastlyCache)
         assert cacher.api_key == "the api key"
         assert cacher.service_id == "the service id"
-        assert cacher._purger is purge_key.delay
+        assert cacher._purger is purge_pending_keys.apply_async
+        assert cacher._redis is mockredis
+        assert cacher._metrics is metrics
+        assert cacher.purge_window == purge_window
+        assert cacher._api_domain == api_domain
 
     def test_adds_surrogate_key(self):
         request = pretend.stub()
@@ -156,15 +353,80 @@ class TestFastlyCache:
         assert response_a.headers == {"Surrogate-Key": "abc"}
         assert response_b.headers == {"Surrogate-Key": "defg"}
 
-    def test_purge(self, monkeypatch):
-        purge_delay = pretend.call_recorder(lambda *a, **kw: None)
+    def test_purge(self, monkeypatch, metrics, mockredis):
+        now = iter([100.0, 105.0])
+        monkeypatch.setattr(fastly.time, "time", lambda: next(now))
+        purger = pretend.call_recorder(lambda *a, **kw: None)
         cacher = fastly.FastlyCache(
-            api_key="an api key", service_id="the-service-id", purger=purge_delay
+            api_key="an api key",
+            service_id="the-service-id",
+            purger=purger,
+            redis_client=mockredis,
+            metrics=metrics,
+            purge_window=10,
         )
 
-        cacher.purge(["one", "two"])
+        cacher.purge(["one", "two", "one"])
+        cacher.purge(["two", "three"])
+        cacher.purge([])
+
+        # Only the first purge within the window schedules a task, and each
+        # key remembers when it was first asked to be purged.
+        assert purger.calls == [pretend.call(countdown=10)]
+        assert mockredis.exists(fastly.PURGE_SCHEDULED_KEY)
+        assert mockredis.zrange(fastly.PENDING_PURGES_KEY, 0, -1, withscores=True) == [
+            (b"one", 100.0),
+            (b"two", 100.0),
+            (b"three", 105.0),
+        ]
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.origin_cache.purge.requested", 2),
+            pretend.call("warehouse.origin_cache.purge.requested", 2),
+        ]
+
+    def test_purge_keys(self, fake_fastly, monkeypatch):
+        monkeypatch.setattr(fastly, "PURGE_BATCH_SIZE", 2)
+        cacher = fastly.FastlyCache(
+            api_key="an api key",
+            service_id="the-service-id",
+            purger=None,
+            api_domain=fake_fastly.api_domain,
+        )
+
+        cacher.purge_keys(["two", "one", "three"])
+
+        assert [(path, keys) for path, _, keys in fake_fastly.purges] == [
+            ("/service/the-service-id/purge", ["one", "three"]),
+            ("/service/the-service-id/purge", ["two"]),
+        ]
+        for _, headers, _ in fake_fastly.purges:
+            assert headers["Fastly-Key"] == "an api key"
+            assert headers["Fastly-Soft-Purge"] == "1"
+            assert headers["Accept"] == "application/json"
+
+    def test_purge_keys_unsuccessful(self, fake_fastly):
+        fake_fastly.failing.add("two")
+        cacher = fastly.FastlyCache(
+            api_key="an api key",
+            service_id="the-service-id",
+            purger=None,
+            api_domain=fake_fastly.api_domain,
+        )
+
+        with pytest.raises(fastly.UnsuccessfulPurgeError, match="'two'"):
+            cacher.purge_keys(["one", "two"])
+
+    def test_purge_keys_error(self, fake_fastly):
+        fake_fastly.status = 503
+        cacher = fastly.FastlyCache(
+            api_key="an api key",
+            service_id="the-service-id",
+            purger=None,
+            api_domain=fake_fastly.api_domain,
+        )
 
-        assert purge_delay.calls == [pretend.call("one"), pretend.call("two")]
+        with pytest.raises(requests.HTTPError):
+            cacher.purge_keys(["one"])
 
     def test_purge_key_ok(self, monkeypatch):
         cacher = fastly.FastlyCache(
@@ -10,15 +10,50 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+
 import pretend
 import pytest
 
+from sqlalchemy import event
+
+from warehouse.accounts.models import User
 from warehouse.cache import origin
 from warehouse.cache.origin.derivers import html_cache_deriver
 from warehouse.cache.origin.interfaces import IOriginCache
+from warehouse.integrations.vulnerabilities.models import VulnerabilityRecord
+from warehouse.metrics import IMetricsService
+from warehouse.packaging.models import File, Release, Role
+
+from ....common.db.accounts import UserFactory
+from ....common.db.integrations import VulnerabilityRecordFactory
+from ....common.db.packaging import (
+    FileFactory,
+    ProjectFactory,
+    ReleaseFactory,
+    RoleFactory,
+)
+
+
+@contextlib.contextmanager
+def _statements(session):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
 
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(connection, "before_cursor_execute", record)
+
+
+def test_store_purge_keys(monkeypatch):
+    count_queries = pretend.call_recorder(lambda *a: contextlib.nullcontext())
+    monkeypatch.setattr(origin, "_count_queries", count_queries)
 
-def test_store_purge_keys():
     class Type1:
         pass
 
@@ -40,18 +75,250 @@ def test_store_purge_keys():
             }
         }
     )
+    new, dirty, deleted = Type1(), Type2(), Type3()
     session = pretend.stub(
-        info={}, new={Type1()}, dirty={Type2()}, deleted={Type3(), Type4()}
+        info={"warehouse.cache.origin.purges.staged": {Type3: {deleted}}},
+        new={new},
+        dirty={dirty},
+        deleted={deleted, Type4()},
     )
 
     origin.store_purge_keys(config, session, pretend.stub())
 
-    assert session.info["warehouse.cache.origin.purges"] == {
-        "type_1",
-        "type_2",
-        "type_3",
-        "foo",
+    # Only the deleted objects have their keys worked out straight away, the
+    # rest wait for the commit.
+    assert session.info["warehouse.cache.origin.purges"] == {"type_3", "foo"}
+    assert session.info["warehouse.cache.origin.purges.staged"] == {
+        Type1: {new},
+        Type2: {dirty},
+        Type3: set(),
     }
+    assert count_queries.calls == [pretend.call(config, session, "flush")]
+
+
+def test_store_purge_keys_nothing_deleted(monkeypatch):
+    count_queries = pretend.call_recorder(lambda *a: contextlib.nullcontext())
+    monkeypatch.setattr(origin, "_count_queries", count_queries)
+
+    class Type1:
+        pass
+
+    config = pretend.stub(
+        registry={
+            "cache_keys": {
+                Type1: lambda o: origin.CacheKeys(cache=[], purge=["type_1"])
+            }
+        }
+    )
+    session = pretend.stub(info={}, new={Type1()}, dirty=set(), deleted=set())
+
+    origin.store_purge_keys(config, session, pretend.stub())
+
+    assert session.info["warehouse.cache.origin.purges"] == set()
+    assert count_queries.calls == []
+
+
+class TestResolvePurgeKeys:
+    @pytest.fixture
+    def metrics(self, app_config, metrics):
+        app_config.register_service_factory(lambda ctx, req: metrics, IMetricsService)
+        app_config.commit()
+        return metrics
+
+    @pytest.mark.parametrize("count", [1, 5])
+    def test_loads_in_one_go(self, db_session, app_config, metrics, count):
+        releases = []
+        for _ in range(count):
+            project = ProjectFactory.create()
+            RoleFactory.create_batch(2, project=project)
+            releases.append(ReleaseFactory.create(project=project))
+        db_session.flush()
+        db_session.expire_all()
+        db_session.info.clear()
+        db_session.info["warehouse.cache.origin.purges.staged"] = {
+            Release: set(releases)
+        }
+
+        with _statements(db_session) as statements:
+            origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info["warehouse.cache.origin.purges"] == {
+            "all-projects",
+            *(f"project/{r.project.normalized_name}" for r in releases),
+            *(f"user/{u.username}" for r in releases for u in r.project.users),
+        }
+        assert "warehouse.cache.origin.purges.staged" not in db_session.info
+        # The releases, their projects and the projects' users, however many
+        # releases there are.
+        assert len(statements) == 3
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.cache.purge_keys.queries", 3, tags=["phase:commit"])
+        ]
+
+    def test_loads_key_relationships(self, db_session, app_config, metrics):
+        files = [FileFactory.create() for _ in range(3)]
+        roles = [RoleFactory.create() for _ in range(3)]
+        db_session.flush()
+        db_session.expire_all()
+        db_session.info.clear()
+        db_session.info["warehouse.cache.origin.purges.staged"] = {
+            File: set(files),
+            Role: set(roles),
+        }
+
+        with _statements(db_session) as statements:
+            origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info["warehouse.cache.origin.purges"] == {
+            *(f"project/{f.release.project.normalized_name}" for f in files),
+            *(f"project/{r.project.normalized_name}" for r in roles),
+            *(f"user/{r.user.username}" for r in roles),
+        }
+        # The files, their releases and their projects, then the roles, their
+        # users and their projects.
+        assert len(statements) == 6
+
+    def test_composite_primary_key(self, db_session, app_config, monkeypatch):
+        release = ReleaseFactory.create()
+        record = VulnerabilityRecordFactory.create(releases=[release])
+        db_session.flush()
+        db_session.expire_all()
+        db_session.info.clear()
+        monkeypatch.setitem(
+            app_config.registry["cache_keys"],
+            VulnerabilityRecord,
+            origin.key_maker_factory(
+                cache_keys=None,
+                purge_keys=[
+                    origin.key_factory(
+                        "project/{itr.project.normalized_name}",
+                        iterate_on="releases",
+                    )
+                ],
+            ),
+        )
+        db_session.info["warehouse.cache.origin.purges.staged"] = {
+            VulnerabilityRecord: {record}
+        }
+
+        origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info["warehouse.cache.origin.purges"] == {
+            f"project/{release.project.normalized_name}"
+        }
+
+    def test_already_loaded(self, db_session, app_config, metrics):
+        project = ProjectFactory.create()
+        role = RoleFactory.create(project=project)
+        release = ReleaseFactory.create(project=project)
+        db_session.flush()
+        assert release.project.users == [role.user]
+        db_session.info.clear()
+        db_session.info["warehouse.cache.origin.purges.staged"] = {
+            type(release): {release}
+        }
+
+        with _statements(db_session) as statements:
+            origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info["warehouse.cache.origin.purges"] == {
+            "all-projects",
+            f"project/{project.normalized_name}",
+            f"user/{role.user.username}",
+        }
+        assert statements == []
+        assert metrics.increment.calls == []
+
+    def test_flushes_first(self, db_session, app_config):
+        project = ProjectFactory.create()
+        db_session.flush()
+        db_session.info.clear()
+
+        project.name = "renamed"
+        origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info["warehouse.cache.origin.purges"] == {
+            "all-projects",
+            "project/renamed",
+        }
+
+    def test_skips_objects_no_longer_persistent(self, db_session, app_config):
+        user = UserFactory.create()
+        db_session.flush()
+        db_session.info.clear()
+        db_session.info["warehouse.cache.origin.purges.staged"] = {
+            User.name: {user, User(username="never-flushed")}
+        }
+
+        origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info["warehouse.cache.origin.purges"] == {
+            f"user/{user.username}"
+        }
+
+    def test_nothing_staged(self, db_session, app_config):
+        db_session.info.clear()
+
+        origin.resolve_origin_purge_keys(app_config, db_session)
+
+        assert db_session.info == {}
+
+
+def test_receive_set_is_resolved_on_commit(db_session, app_config):
+    user = UserFactory.create()
+    project = ProjectFactory.create()
+    RoleFactory.create(user=user, project=project)
+    db_session.flush()
+    db_session.refresh(user)
+    db_session.info.clear()
+
+    with _statements(db_session) as statements:
+        user.name = "A New Name"
+
+    assert statements == []
+    assert db_session.info["warehouse.cache.origin.purges.staged"] == {
+        User.name: {user}
+    }
+
+    origin.resolve_origin_purge_keys(app_config, db_session)
+
+    assert db_session.info["warehouse.cache.origin.purges"] >= {
+        f"user/{user.username}",
+        f"project/{project.normalized_name}",
+    }
+
+
+def test_deleted_keys_counted(db_session, app_config, metrics):
+    app_config.register_service_factory(lambda ctx, req: metrics, IMetricsService)
+    app_config.commit()
+    project = ProjectFactory.create()
+    role = RoleFactory.create(project=project)
+    release = ReleaseFactory.create(project=project)
+    db_session.flush()
+    db_session.expire_all()
+    db_session.info.clear()
+
+    db_session.delete(release)
+    db_session.flush()
+
+    assert db_session.info["warehouse.cache.origin.purges"] == {
+        "all-projects",
+        f"project/{project.normalized_name}",
+        f"user/{role.user.username}",
+    }
+    # Loading the release's project, and then its users.
+    assert metrics.increment.calls == [
+        pretend.call("warehouse.cache.purge_keys.queries", 2, tags=["phase:flush"])
+    ]
+
+
+def test_count_queries_no_metrics(db_session):
+    config = pretend.stub(
+        find_service_factory=pretend.raiser(LookupError),
+    )
+
+    with origin._count_queries(config, db_session, "flush"):
+        db_session.execute("SELECT 1")
 
 
 def test_execute_purge_success(app_config):
@@ -230,6 +497,25 @@ class TestKeyMaker:
         assert isinstance(cache_keys, origin.CacheKeys)
         assert cache_keys.cache == ["foo"]
         assert list(cache_keys.purge) == ["bar", "bar/biz", "bar/baz"]
+        assert key_maker.attributes == ["iterate_me"]
+
+    def test_attributes(self):
+        key_maker = origin.key_maker_factory(
+            cache_keys=None,
+            purge_keys=[
+                origin.key_factory("all"),
+                origin.key_factory("project/{obj.release.project.normalized_name}"),
+                origin.key_factory("user/{itr.username}", iterate_on="project.users"),
+                origin.key_factory("thing/{itr}", iterate_on="things"),
+            ],
+        )
+
+        assert key_maker.attributes == [
+            "release.project.normalized_name",
+            "project.users",
+            "project.users.username",
+            "things",
+        ]
 
 
 def test_register_origin_keys(monkeypatch):
@@ -0,0 +1,34 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pretend
+
+from warehouse.cli import breached_passwords
+
+
+def test_import(cli, tmpdir):
+    path = str(tmpdir.join("breached"))
+    config = pretend.stub(
+        registry=pretend.stub(settings={"breached_passwords.path": path})
+    )
+    with open("dump.txt", "w") as fp:
+        fp.write("1E4C9B93F3F0682250B6CF8331B7EE68FD800000:5\n")
+        fp.write("5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3\n")
+
+    result = cli.invoke(breached_passwords.import_, ["dump.txt"], obj=config)
+
+    assert result.exit_code == 0
+    assert tmpdir.join("breached").read_binary() == bytes.fromhex(
+        "1e4c9b93f3f0682250b6cf8331b7ee68fd800000"
+        "5baa61e4c9b93f3f0682250b6cf8331b7ee68fd8"
+    )
+    assert not tmpdir.join("breached.tmp").exists()
@@ -0,0 +1,34 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pretend
+
+from warehouse.cli import downloads
+
+
+def test_ingest(cli, tmpdir):
+    path = str(tmpdir.join("stats"))
+    config = pretend.stub(registry=pretend.stub(settings={"download_stats.path": path}))
+    for name, project in [("one.json", "foo"), ("two.json", "bar")]:
+        with open(name, "w") as fp:
+            download = {
+                "timestamp": "2022-10-01 12:00:00 UTC",
+                "file": {"project": project},
+            }
+            fp.write(json.dumps(download) + "\n")
+
+    result = cli.invoke(downloads.ingest, ["one.json", "two.json"], obj=config)
+
+    assert result.exit_code == 0
+    assert tmpdir.join("stats", "projects").read() == "foo\nbar\n"
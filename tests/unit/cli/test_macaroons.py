@@ -0,0 +1,38 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pretend
+import pytest
+
+from warehouse.cli import macaroons
+from warehouse.macaroons import caveats
+
+
+@pytest.mark.parametrize("count", macaroons.CAVEAT_COUNTS)
+def test_sample_token(count):
+    user = pretend.stub(id="a user id")
+    project = pretend.stub(id="a project id", normalized_name="sample")
+
+    macaroon, key, predicates = macaroons._sample_token(count, user, project)
+
+    assert len(predicates) == count
+    assert [caveats.deserialize(p).tag for p in predicates[:4]] == [1, 2, 3, 0][:count]
+
+
+def test_benchmark(cli):
+    result = cli.invoke(macaroons.benchmark, ["--number", "1"])
+
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert len(lines) == 4 * len(macaroons.CAVEAT_COUNTS)
+    assert lines[0].startswith("  1 caveats  deserialize ")
+    assert lines[-1].startswith(" 20 caveats  verify_caveats ")
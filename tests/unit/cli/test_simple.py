@@ -0,0 +1,57 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from warehouse.cli import simple
+from warehouse.packaging.models import File, Project, Release
+
+from ...common.db.packaging import FileFactory, ProjectFactory, ReleaseFactory
+
+
+def test_legacy_simple_detail(db_request):
+    project = ProjectFactory.create()
+    release1 = ReleaseFactory.create(project=project, version="1.10")
+    release2 = ReleaseFactory.create(project=project, version="1.9")
+    file1 = FileFactory.create(release=release1, filename="b.tar.gz")
+    file2 = FileFactory.create(release=release2, filename="a.tar.gz")
+    db_request.route_url = lambda route, path: path
+
+    detail = simple._legacy_simple_detail(project, db_request)
+
+    assert [f["filename"] for f in detail["files"]] == [file2.filename, file1.filename]
+
+
+def test_add_sample_project(db_session):
+    project_id = simple._add_sample_project(db_session.connection(), 25)
+
+    project = db_session.query(Project).get(project_id)
+    releases = (
+        db_session.query(Release)
+        .filter(Release.project == project)
+        .order_by(Release._pypi_ordering)
+        .all()
+    )
+    assert [r.version for r in releases] == ["0.0", "0.1", "0.2"]
+    assert [
+        db_session.query(File).filter(File.release == r).count() for r in releases
+    ] == [10, 10, 5]
+
+
+def test_benchmark(cli, app_config):
+    result = cli.invoke(
+        simple.benchmark, ["--files", "30", "--number", "1"], obj=app_config
+    )
+
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("    30 files  orm + packaging.version ")
+    assert lines[1].startswith("    30 files  columns ")
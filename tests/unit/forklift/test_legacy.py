@@ -48,7 +48,6 @@ from warehouse.packaging.models import (
     Release,
     Role,
 )
-from warehouse.packaging.tasks import update_bigquery_release_files
 from warehouse.utils.security_policy import AuthenticationMethod
 
 from ...common.db.accounts import EmailFactory, UserFactory
@@ -533,6 +532,104 @@ class TestFileValidation:
 
         assert legacy._is_valid_dist_file(tar_fn, "sdist")
 
+    def test_tarfile_validation_nested_pkg_info(self, tmpdir):
+        tar_fn = str(tmpdir.join("test.tar.gz"))
+        data_file = str(tmpdir.join("dummy_data"))
+
+        with open(data_file, "wb") as fp:
+            fp.write(b"Dummy data file.")
+
+        with tarfile.open(tar_fn, "w:gz") as tar:
+            tar.add(data_file, arcname="package/package.egg-info/PKG-INFO")
+            tar.add(data_file, arcname="package/module.py")
+
+        assert legacy._is_valid_dist_file(tar_fn, "sdist")
+
+    def test_tarfile_validation_stops_at_pkg_info(self, tmpdir):
+        tar_fn = str(tmpdir.join("test.tar.gz"))
+        data_file = str(tmpdir.join("dummy_data"))
+
+        with open(data_file, "wb") as fp:
+            fp.write(b"Dummy data file.")
+
+        with tarfile.open(tar_fn, "w:gz") as tar:
+            tar.add(data_file, arcname="package/PKG-INFO")
+            for i in range(10):
+                tar.add(data_file, arcname=f"package/module{i}.py")
+
+        # Everything after the PKG-INFO would exceed our limits, so this can
+        # only be valid if we stop reading there.
+        limits = legacy.DistFileLimits(max_members=1)
+        assert legacy._is_valid_dist_file(tar_fn, "sdist", limits=limits)
+
+    @pytest.mark.parametrize(
+        ("limits", "reason"),
+        [
+            (
+                legacy.DistFileLimits(max_uncompressed_size=1024),
+                "too-large-uncompressed",
+            ),
+            (legacy.DistFileLimits(max_members=5), "too-many-members"),
+            (legacy.DistFileLimits(max_seconds=-1), "too-slow"),
+        ],
+    )
+    def test_tarfile_validation_limits(self, tmpdir, metrics, limits, reason):
+        tar_fn = str(tmpdir.join("test.tar.gz"))
+        data_file = str(tmpdir.join("dummy_data"))
+
+        with open(data_file, "wb") as fp:
+            fp.write(b"Dummy data file." * 100)
+
+        with tarfile.open(tar_fn, "w:gz") as tar:
+            for i in range(10):
+                tar.add(data_file, arcname=f"package/module{i}.py")
+            tar.add(data_file, arcname="package/PKG-INFO")
+
+        assert not legacy._is_valid_dist_file(
+            tar_fn, "sdist", limits=limits, metrics=metrics
+        )
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.upload.invalid_dist_file", tags=[f"reason:{reason}"]
+            )
+        ]
+
+    @pytest.mark.parametrize(
+        ("limits", "reason"),
+        [
+            (
+                legacy.DistFileLimits(max_uncompressed_size=1024),
+                "too-large-uncompressed",
+            ),
+            (legacy.DistFileLimits(max_members=5), "too-many-members"),
+        ],
+    )
+    def test_zipfile_validation_limits(self, tmpdir, metrics, limits, reason):
+        f = str(tmpdir.join("test.zip"))
+
+        with zipfile.ZipFile(f, "w") as zfp:
+            zfp.writestr("PKG-INFO", b"this is the package info")
+            for i in range(10):
+                zfp.writestr(f"{i}.txt", b"0" * 1024, zipfile.ZIP_DEFLATED)
+
+        assert not legacy._is_valid_dist_file(
+            f, "sdist", limits=limits, metrics=metrics
+        )
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.upload.invalid_dist_file", tags=[f"reason:{reason}"]
+            )
+        ]
+
+    def test_valid_dist_file_no_metrics(self, tmpdir, metrics):
+        f = str(tmpdir.join("test.zip"))
+
+        with zipfile.ZipFile(f, "w") as zfp:
+            zfp.writestr("PKG-INFO", b"this is the package info")
+
+        assert legacy._is_valid_dist_file(f, "sdist", metrics=metrics)
+        assert metrics.increment.calls == []
+
     def test_wininst_unsafe_filename(self, tmpdir):
         f = str(tmpdir.join("test.exe"))
 
@@ -1431,10 +1528,8 @@ class TestFileUpload:
             "warehouse.release_files_table": "example.pypi.distributions"
         }
 
-        update_bigquery = pretend.stub(
-            delay=pretend.call_recorder(lambda *a, **kw: None)
-        )
-        db_request.task = pretend.call_recorder(lambda *a, **kw: update_bigquery)
+        buffer_bigquery = pretend.call_recorder(lambda request, dist_metadata: None)
+        monkeypatch.setattr(legacy, "buffer_bigquery_release_file", buffer_bigquery)
 
         resp = legacy.file_upload(db_request)
 
@@ -1513,7 +1608,11 @@ class TestFileUpload:
             )
         ]
 
-        assert db_request.task.calls == [pretend.call(update_bigquery_release_files)]
+        assert buffer_bigquery.calls == [pretend.call(db_request, mock.ANY)]
+        dist_metadata = buffer_bigquery.calls[0].args[1]
+        assert dist_metadata["filename"] == filename
+        assert dist_metadata["md5_digest"] == uploaded_file.md5_digest
+        assert dist_metadata["upload_time"] == uploaded_file.upload_time
 
         assert metrics.increment.calls == [
             pretend.call("warehouse.upload.attempt"),
@@ -1967,6 +2066,153 @@ class TestFileUpload:
         assert resp.status_code == 400
         assert resp.status == "400 Invalid distribution file."
 
+    def test_upload_fails_with_empty_file(self, pyramid_config, db_request, metrics):
+        pyramid_config.testing_securitypolicy(userid=1)
+
+        user = UserFactory.create()
+        EmailFactory.create(user=user)
+        project = ProjectFactory.create(name="Package-Name")
+        RoleFactory.create(user=user, project=project)
+
+        db_request.user = user
+        db_request.user_agent = "warehouse-tests/6.6.6"
+        db_request.POST = MultiDict(
+            {
+                "metadata_version": "1.1",
+                "name": "empty",
+                "version": "1.1",
+                "summary": "This is my summary!",
+                "filetype": "sdist",
+                "md5_digest": hashlib.md5(b"").hexdigest(),
+                "content": pretend.stub(
+                    filename="empty-1.1.tar.gz",
+                    file=io.BytesIO(b""),
+                    type="application/tar",
+                ),
+            }
+        )
+
+        storage_service = pretend.stub(store=lambda path, filepath, meta: None)
+        db_request.find_service = lambda svc, name=None, context=None: {
+            IFileStorage: storage_service,
+            IMetricsService: metrics,
+        }.get(svc)
+
+        with pytest.raises(HTTPBadRequest) as excinfo:
+            legacy.file_upload(db_request)
+
+        resp = excinfo.value
+
+        assert resp.status_code == 400
+        assert resp.status == "400 Invalid distribution file."
+        assert metrics.histogram.calls == []
+
+    def test_upload_fails_with_dist_file_limits(
+        self, pyramid_config, db_request, metrics
+    ):
+        pyramid_config.testing_securitypolicy(userid=1)
+
+        user = UserFactory.create()
+        EmailFactory.create(user=user)
+        project = ProjectFactory.create()
+        release = ReleaseFactory.create(project=project, version="1.0")
+        RoleFactory.create(user=user, project=project)
+
+        db_request.user = user
+        db_request.user_agent = "warehouse-tests/6.6.6"
+        db_request.POST = MultiDict(
+            {
+                "metadata_version": "1.2",
+                "name": project.name,
+                "version": release.version,
+                "filetype": "sdist",
+                "md5_digest": _TAR_GZ_PKG_MD5,
+                "content": pretend.stub(
+                    filename=f"{project.name}-{release.version}.tar.gz",
+                    file=io.BytesIO(_TAR_GZ_PKG_TESTDATA),
+                    type="application/tar",
+                ),
+            }
+        )
+        db_request.registry.settings = {"forklift.dist_file.max_uncompressed_size": 1}
+
+        storage_service = pretend.stub(store=lambda path, filepath, meta: None)
+        db_request.find_service = lambda svc, name=None, context=None: {
+            IFileStorage: storage_service,
+            IMetricsService: metrics,
+        }.get(svc)
+
+        with pytest.raises(HTTPBadRequest) as excinfo:
+            legacy.file_upload(db_request)
+
+        resp = excinfo.value
+
+        assert resp.status_code == 400
+        assert resp.status == "400 Invalid distribution file."
+        assert (
+            pretend.call(
+                "warehouse.upload.invalid_dist_file",
+                tags=["reason:too-large-uncompressed"],
+            )
+            in metrics.increment.calls
+        )
+
+    def test_upload_hashes_in_chunks(self, pyramid_config, db_request, metrics):
+        pyramid_config.testing_securitypolicy(userid=1)
+
+        user = UserFactory.create()
+        EmailFactory.create(user=user)
+        project = ProjectFactory.create()
+        release = ReleaseFactory.create(project=project, version="1.0")
+        RoleFactory.create(user=user, project=project)
+
+        filename = "{}-{}.tar.gz".format(project.name, release.version)
+
+        db_request.user = user
+        db_request.user_agent = "warehouse-tests/6.6.6"
+        db_request.POST = MultiDict(
+            {
+                "metadata_version": "1.2",
+                "name": project.name,
+                "version": release.version,
+                "filetype": "sdist",
+                "md5_digest": _TAR_GZ_PKG_MD5,
+                "sha256_digest": _TAR_GZ_PKG_SHA256,
+                "blake2_256_digest": _TAR_GZ_PKG_STORAGE_HASH,
+                "content": pretend.stub(
+                    filename=filename,
+                    file=io.BytesIO(_TAR_GZ_PKG_TESTDATA),
+                    type="application/tar",
+                ),
+            }
+        )
+        # Use a buffer that is much smaller than our file, and not a multiple
+        # of its size, so that it has to be hashed across many chunks.
+        db_request.registry.settings = {"forklift.upload_buffer_size": 67}
+
+        storage_service = pretend.stub(store=lambda path, filepath, meta: None)
+        db_request.find_service = lambda svc, name=None, context=None: {
+            IFileStorage: storage_service,
+            IMetricsService: metrics,
+        }.get(svc)
+
+        resp = legacy.file_upload(db_request)
+
+        assert resp.status_code == 200
+        assert metrics.histogram.calls == [
+            pretend.call("warehouse.upload.hash_and_write.ms_per_mb", mock.ANY)
+        ]
+
+        file_ = (
+            db_request.db.query(File)
+            .filter((File.release == release) & (File.filename == filename))
+            .one()
+        )
+        assert file_.size == len(_TAR_GZ_PKG_TESTDATA)
+        assert file_.md5_digest == _TAR_GZ_PKG_MD5
+        assert file_.sha256_digest == _TAR_GZ_PKG_SHA256
+        assert file_.blake2_256_digest == _TAR_GZ_PKG_STORAGE_HASH
+
     def test_upload_fails_with_too_large_file(self, pyramid_config, db_request):
         pyramid_config.testing_securitypolicy(userid=1)
 
@@ -10,13 +10,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
+from contextlib import contextmanager
+
+import orjson
 import pretend
 import pytest
 
-from pyramid.httpexceptions import HTTPMovedPermanently, HTTPNotFound
+from pyramid.httpexceptions import (
+    HTTPMovedPermanently,
+    HTTPNotFound,
+    HTTPTooManyRequests,
+)
 
 from warehouse.legacy.api import json
+from warehouse.packaging import utils as packaging_utils
 from warehouse.packaging.models import ReleaseURL
+from warehouse.rate_limiting import IRateLimiter
 
 from ....common.db.accounts import UserFactory
 from ....common.db.integrations import VulnerabilityRecordFactory
@@ -730,3 +741,127 @@ class TestJSONReleaseSlash:
         assert db_request.current_route_path.calls == [
             pretend.call(name=release.project.normalized_name)
         ]
+
+
+class TestJSONChangelog:
+    @pytest.fixture
+    def db_request(self, db_request):
+        # The changelog is streamed from its own connection, so make sure that
+        # it sees the same transaction as the rest of the test.
+        @contextmanager
+        def connect():
+            yield db_request.db.connection()
+
+        db_request.registry["sqlalchemy.engine"] = pretend.stub(connect=connect)
+        return db_request
+
+    def test_changelog(self, db_request):
+        entries = [JournalEntryFactory.create() for _ in range(5)]
+        db_request.matchdict = {"serial": str(entries[1].id)}
+
+        resp = json.json_changelog(db_request)
+
+        assert resp.content_type == "application/json"
+        _assert_has_cors_headers(resp.headers)
+        assert orjson.loads(b"".join(resp.app_iter)) == {
+            "changelog": [
+                {
+                    "action": e.action,
+                    "name": e.name,
+                    "serial": e.id,
+                    "timestamp": int(
+                        e.submitted_date.replace(
+                            tzinfo=datetime.timezone.utc
+                        ).timestamp()
+                    ),
+                    "version": e.version,
+                }
+                for e in entries[2:]
+            ]
+        }
+
+    def test_changelog_pages(self, db_request, monkeypatch):
+        monkeypatch.setattr(packaging_utils, "JOURNAL_PAGE_SIZE", 2)
+        entries = [JournalEntryFactory.create() for _ in range(5)]
+        db_request.matchdict = {"serial": "-1"}
+
+        resp = json.json_changelog(db_request)
+
+        assert [
+            e["serial"] for e in orjson.loads(b"".join(resp.app_iter))["changelog"]
+        ] == [e.id for e in entries]
+
+    def test_changelog_empty(self, db_request):
+        db_request.matchdict = {"serial": "0"}
+
+        resp = json.json_changelog(db_request)
+
+        assert b"".join(resp.app_iter) == b'{"changelog":[]}\n'
+
+    def test_changelog_invalid_serial(self, db_request):
+        db_request.matchdict = {"serial": "nope"}
+
+        resp = json.json_changelog(db_request)
+
+        assert isinstance(resp, HTTPNotFound)
+        _assert_has_cors_headers(resp.headers)
+
+
+class TestChangelogRateLimit:
+    @pytest.fixture
+    def ratelimiter(self, pyramid_services):
+        ratelimiter = pretend.stub(
+            hit=pretend.call_recorder(lambda *a: None),
+            test=lambda *a: True,
+            resets_in=lambda *a: None,
+        )
+        pyramid_services.register_service(
+            ratelimiter, IRateLimiter, None, name="xmlrpc.client"
+        )
+        return ratelimiter
+
+    def test_rate_limit_is_applied_first(self):
+        assert json._CHANGELOG_DECORATOR[0] is json._changelog_ratelimit
+
+    def test_pass(self, pyramid_request, ratelimiter, metrics):
+        response = pretend.stub()
+        view = pretend.call_recorder(lambda context, request: response)
+        context = pretend.stub()
+        pyramid_request.remote_addr = "127.0.0.1"
+
+        assert json._changelog_ratelimit(view)(context, pyramid_request) is response
+        assert view.calls == [pretend.call(context, pyramid_request)]
+        assert ratelimiter.hit.calls == [pretend.call("127.0.0.1")]
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.json.changelog.ratelimiter.hit", tags=[])
+        ]
+
+    @pytest.mark.parametrize(
+        ("resets_in", "expected"),
+        [
+            (None, ""),
+            (
+                datetime.timedelta(minutes=11, seconds=6.9),
+                " Limit may reset in 666 seconds.",
+            ),
+            (datetime.timedelta(seconds=0), " Limit may reset in 1 seconds."),
+        ],
+    )
+    def test_block(self, pyramid_request, ratelimiter, metrics, resets_in, expected):
+        ratelimiter.test = lambda *a: False
+        ratelimiter.resets_in = lambda *a: resets_in
+        view = pretend.call_recorder(lambda context, request: None)
+        pyramid_request.remote_addr = "127.0.0.1"
+
+        resp = json._changelog_ratelimit(view)(pretend.stub(), pyramid_request)
+
+        assert isinstance(resp, HTTPTooManyRequests)
+        assert resp.detail == (
+            "The action could not be performed because there were too many "
+            "requests by the client." + expected
+        )
+        _assert_has_cors_headers(resp.headers)
+        assert view.calls == []
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.json.changelog.ratelimiter.exceeded", tags=[])
+        ]
@@ -10,6 +10,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import json
+
 import celery
 import pretend
 import pytest
@@ -19,8 +22,10 @@ from pyramid.exceptions import ConfigurationError
 
 import warehouse.legacy.api.xmlrpc.cache
 
+from warehouse.cache import origin
 from warehouse.legacy.api.xmlrpc import cache
 from warehouse.legacy.api.xmlrpc.cache import (
+    LocalLru,
     NullXMLRPCCache,
     RedisLru,
     RedisXMLRPCCache,
@@ -59,6 +64,7 @@ class TestRedisXMLRPCCache:
                 lambda func, args, kwargs, key, tag, expires: func(*args, **kwargs)
             ),
             purge=pretend.call_recorder(lambda tag: None),
+            purge_many=pretend.call_recorder(lambda tags: None),
         )
         redis_lru_cls = pretend.call_recorder(
             lambda redis_conn, **kwargs: redis_lru_obj
@@ -76,7 +82,11 @@ class TestRedisXMLRPCCache:
         ]
         assert redis_lru_cls.calls == [
             pretend.call(
-                strict_redis_obj, name="lru", expires=None, metric_reporter=None
+                strict_redis_obj,
+                name="lru",
+                expires=None,
+                metric_reporter=None,
+                local=None,
             )
         ]
 
@@ -85,6 +95,7 @@ class TestRedisXMLRPCCache:
         ) == [[1, 2], {"kwarg0": 3, "kwarg1": 4}]
 
         assert service.purge(None) is None
+        assert service.purge_many(["foo", "bar"]) is None
 
         assert redis_lru_obj.fetch.calls == [
             pretend.call(
@@ -92,6 +103,7 @@ class TestRedisXMLRPCCache:
             )
         ]
         assert redis_lru_obj.purge.calls == [pretend.call(None)]
+        assert redis_lru_obj.purge_many.calls == [pretend.call(["foo", "bar"])]
 
 
 class TestIncludeMe:
@@ -131,6 +143,49 @@ class TestIncludeMe:
                 cache.cached_return_view, under="rendered_view", over="mapped_view"
             )
         ]
+        if cache_class == "RedisXMLRPCCache":
+            local = registry["warehouse.xmlrpc.cache.local"]
+            assert isinstance(local, LocalLru)
+            assert local.max_bytes == 32 * 1024 * 1024
+            assert local.expires == 5 * 60
+        else:
+            assert "warehouse.xmlrpc.cache.local" not in registry
+
+    def test_local_disabled(self, monkeypatch):
+        client_cls = pretend.stub(create_service=lambda *a, **kw: pretend.stub())
+        monkeypatch.setattr(cache, "RedisXMLRPCCache", client_cls)
+
+        registry = {}
+        config = pretend.stub(
+            add_view_deriver=lambda deriver, over=None, under=None: None,
+            register_service_factory=lambda service, iface=None: None,
+            registry=pretend.stub(
+                settings={
+                    "warehouse.xmlrpc.cache.url": "redis://",
+                    "warehouse.xmlrpc.cache.local.max_bytes": "0",
+                },
+                __setitem__=registry.__setitem__,
+            ),
+        )
+
+        cache.includeme(config)
+
+        assert registry == {}
+
+    def test_bad_local_configuration(self):
+        registry = {}
+        config = pretend.stub(
+            registry=pretend.stub(
+                settings={
+                    "warehouse.xmlrpc.cache.url": "redis://",
+                    "warehouse.xmlrpc.cache.local.expires": "Never",
+                },
+                __setitem__=registry.__setitem__,
+            )
+        )
+
+        with pytest.raises(ConfigurationError):
+            cache.includeme(config)
 
     def test_no_url_configuration(self, monkeypatch):
         registry = {}
@@ -179,32 +234,162 @@ class TestIncludeMe:
             task=lambda f: purge_tags,
         )
         service = NullXMLRPCCache.create_service(None, request)
+        service.purge_tags([])
         service.purge_tags(["wu", "tang", "4", "evah"])
+        assert service.purge_many(["wu"]) is None
         assert isinstance(service, NullXMLRPCCache)
         assert service._purger is purge_tags.delay
-        assert purge_tags.delay.calls == [
-            pretend.call("wu"),
-            pretend.call("tang"),
-            pretend.call("4"),
-            pretend.call("evah"),
-        ]
+        assert purge_tags.delay.calls == [pretend.call(["4", "evah", "tang", "wu"])]
 
     def test_create_redis_service(self):
         purge_tags = pretend.stub(delay=pretend.call_recorder(lambda tag: None))
+        local = LocalLru(1024, 60)
         request = pretend.stub(
-            registry=pretend.stub(settings={"warehouse.xmlrpc.cache.url": "redis://"}),
+            registry=pretend.stub(
+                settings={"warehouse.xmlrpc.cache.url": "redis://"},
+                get={"warehouse.xmlrpc.cache.local": local}.get,
+            ),
             task=lambda f: purge_tags,
         )
         service = RedisXMLRPCCache.create_service(None, request)
+        service.purge_tags(set())
         service.purge_tags(["wu", "tang", "4", "evah"])
         assert isinstance(service, RedisXMLRPCCache)
         assert service._purger is purge_tags.delay
-        assert purge_tags.delay.calls == [
-            pretend.call("wu"),
-            pretend.call("tang"),
-            pretend.call("4"),
-            pretend.call("evah"),
+        assert service.redis_lru.local is local
+        assert purge_tags.delay.calls == [pretend.call(["4", "evah", "tang", "wu"])]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLocalLru:
+    def test_get_add(self):
+        local = LocalLru(100, 60)
+
+        assert local.get("key") is None
+        local.add("key", ["value"], 10, "tag")
+        assert local.get("key") == ["value"]
+        assert local.size == 10
+
+    def test_replace(self):
+        local = LocalLru(100, 60)
+
+        local.add("key", ["one"], 10, "tag")
+        local.add("key", ["two"], 20, "other")
+
+        assert local.get("key") == ["two"]
+        assert local.size == 20
+        local.purge("tag")
+        assert local.get("key") == ["two"]
+
+    def test_expires(self):
+        clock = FakeClock()
+        local = LocalLru(100, 60, clock=clock)
+
+        local.add("key", ["value"], 10, "tag")
+        clock.now = 59
+        assert local.get("key") == ["value"]
+        clock.now = 60
+        assert local.get("key") is None
+        assert local.size == 0
+
+    def test_evicts_least_recently_used_by_size(self):
+        local = LocalLru(100, 60)
+
+        local.add("one", 1, 40, "tag")
+        local.add("two", 2, 40, "tag")
+        assert local.get("one") == 1
+        local.add("three", 3, 40, "tag")
+
+        assert local.get("one") == 1
+        assert local.get("two") is None
+        assert local.get("three") == 3
+        assert local.size == 80
+
+    def test_too_large(self):
+        local = LocalLru(100, 60)
+
+        local.add("key", ["value"], 101, "tag")
+
+        assert local.get("key") is None
+        assert local.size == 0
+
+    def test_purge(self):
+        local = LocalLru(100, 60)
+
+        local.add("one", 1, 10, "tag")
+        local.add("two", 2, 10, "tag")
+        local.add("three", 3, 10, "other")
+        local.purge("tag")
+        local.purge("missing")
+
+        assert local.get("one") is None
+        assert local.get("two") is None
+        assert local.get("three") == 3
+        assert local.size == 10
+
+    def test_listen(self, monkeypatch):
+        thread = pretend.stub(is_alive=lambda: True)
+        pubsub = pretend.stub(
+            subscribe=pretend.call_recorder(lambda **kw: None),
+            run_in_thread=pretend.call_recorder(lambda **kw: thread),
+        )
+        conn = pretend.stub(
+            pubsub=pretend.call_recorder(lambda **kw: pubsub),
+        )
+        local = LocalLru(100, 60)
+
+        local.listen(conn, "lru:purge")
+        local.add("key", 1, 10, "tag")
+        local.listen(conn, "lru:purge")
+
+        assert local.get("key") == 1
+        assert conn.pubsub.calls == [pretend.call(ignore_subscribe_messages=True)]
+        assert pubsub.subscribe.calls == [
+            pretend.call(**{"lru:purge": local._handle_purge})
         ]
+        assert pubsub.run_in_thread.calls == [pretend.call(sleep_time=1, daemon=True)]
+
+        local._handle_purge({"data": b"tag"})
+        assert local.get("key") is None
+
+    def test_listen_after_fork(self, monkeypatch):
+        thread = pretend.stub(is_alive=lambda: True)
+        pubsub = pretend.stub(
+            subscribe=lambda **kw: None,
+            run_in_thread=pretend.call_recorder(lambda **kw: thread),
+        )
+        conn = pretend.stub(pubsub=lambda **kw: pubsub)
+        local = LocalLru(100, 60)
+
+        local.listen(conn, "lru:purge")
+        local.add("key", 1, 10, "tag")
+        monkeypatch.setattr(local, "_pid", -1)
+        local.listen(conn, "lru:purge")
+
+        assert local.get("key") is None
+        assert local.size == 0
+        assert len(pubsub.run_in_thread.calls) == 2
+
+    def test_listen_after_listener_died(self):
+        thread = pretend.stub(is_alive=lambda: False)
+        pubsub = pretend.stub(
+            subscribe=lambda **kw: None,
+            run_in_thread=pretend.call_recorder(lambda **kw: thread),
+        )
+        conn = pretend.stub(pubsub=lambda **kw: pubsub)
+        local = LocalLru(100, 60)
+
+        local.listen(conn, "lru:purge")
+        local.listen(conn, "lru:purge")
+
+        assert len(pubsub.run_in_thread.calls) == 2
 
 
 class TestRedisLru:
@@ -268,6 +453,134 @@ class TestRedisLru:
             pretend.call("lru.cache.hit"),
         ]
 
+    def test_redis_purge_index(self, mockredis):
+        redis_lru = RedisLru(mockredis)
+
+        redis_lru.fetch(func_test, [0, 1], {}, "one", "test", None)
+        redis_lru.fetch(func_test, [0, 1], {}, "one", "other", None)
+        redis_lru.fetch(func_test, [0, 1], {}, "one", None, None)
+
+        assert mockredis.smembers("lru-tags:test") == {"lru:test:v2:func_test"}
+        assert mockredis.smembers("lru-tags:tag") == {"lru:tag:v2:func_test"}
+
+        redis_lru.purge_many(["test", "missing", None])
+
+        assert set(mockredis.cache) == {"lru:other:v2:func_test", "lru-tags:other"}
+
+    def test_redis_ignores_unindexed_entries(self, mockredis):
+        # Entries cached before keys were indexed by tag can't be purged, so
+        # they are never read.
+        mockredis.hset("lru:test:func_test", "one", json.dumps("stale"))
+        redis_lru = RedisLru(mockredis)
+
+        assert redis_lru.fetch(func_test, [0, 1], {}, "one", "test", None) == (
+            func_test(0, 1)
+        )
+
+    def test_redis_purge_many_pipelines(self):
+        metric_reporter = pretend.stub(
+            increment=pretend.call_recorder(lambda *args: None)
+        )
+        results = [[{"lru:one:func"}, set()], []]
+        pipeline = pretend.stub(
+            smembers=pretend.call_recorder(lambda key: None),
+            unlink=pretend.call_recorder(lambda *keys: None),
+            srem=pretend.call_recorder(lambda key, *values: None),
+            publish=pretend.call_recorder(lambda channel, message: None),
+            execute=pretend.call_recorder(lambda: results.pop(0)),
+        )
+        conn = pretend.stub(pipeline=pretend.call_recorder(lambda: pipeline))
+        redis_lru = RedisLru(conn, metric_reporter=metric_reporter)
+
+        redis_lru.purge_many(["one", "two"])
+
+        assert len(conn.pipeline.calls) == 2
+        assert len(pipeline.execute.calls) == 2
+        assert pipeline.smembers.calls == [
+            pretend.call("lru-tags:one"),
+            pretend.call("lru-tags:two"),
+        ]
+        assert pipeline.unlink.calls == [pretend.call("lru:one:func")]
+        assert pipeline.srem.calls == [pretend.call("lru-tags:one", "lru:one:func")]
+        assert pipeline.publish.calls == [
+            pretend.call("lru:purge", "one"),
+            pretend.call("lru:purge", "two"),
+        ]
+        assert metric_reporter.increment.calls == [
+            pretend.call("lru.cache.purge"),
+            pretend.call("lru.cache.purge"),
+        ]
+
+    def test_redis_local(self, mockredis, monkeypatch):
+        metric_reporter = pretend.stub(
+            increment=pretend.call_recorder(lambda *args: None)
+        )
+        local = LocalLru(1024, 60)
+        monkeypatch.setattr(
+            local, "listen", pretend.call_recorder(lambda conn, channel: None)
+        )
+        redis_lru = RedisLru(mockredis, metric_reporter=metric_reporter, local=local)
+        calls = []
+
+        def func_local(*args, **kwargs):
+            calls.append(args)
+            return func_test(*args, **kwargs)
+
+        expected = func_test(0, 1, kwarg0=2, kwarg1=3)
+        serialized = '[[0, 1], {"kwarg0": 2, "kwarg1": 3}]'
+
+        for _ in range(2):
+            assert expected == redis_lru.fetch(
+                func_local, [0, 1], {"kwarg0": 2, "kwarg1": 3}, None, "test", None
+            )
+        assert len(calls) == 1
+        assert local.size == len(serialized)
+        assert local.listen.calls[0] == pretend.call(mockredis, "lru:purge")
+
+        redis_lru.purge("test")
+        assert local.size == 0
+
+        # Another process has populated Redis, so we fill our cache from it.
+        mockredis.hset(
+            redis_lru.format_key("func_local", "test"), str(None), serialized
+        )
+        for _ in range(2):
+            assert expected == redis_lru.fetch(
+                func_local, [0, 1], {"kwarg0": 2, "kwarg1": 3}, None, "test", None
+            )
+        assert len(calls) == 1
+        assert local.size == len(serialized)
+
+        assert metric_reporter.increment.calls == [
+            pretend.call("lru.cache.miss"),
+            pretend.call("lru.cache.local.hit"),
+            pretend.call("lru.cache.purge"),
+            pretend.call("lru.cache.hit"),
+            pretend.call("lru.cache.local.hit"),
+        ]
+
+    def test_redis_local_cannot_listen(self, mockredis):
+        metric_reporter = pretend.stub(
+            increment=pretend.call_recorder(lambda *args: None)
+        )
+        local = pretend.stub(listen=pretend.raiser(redis.exceptions.ConnectionError))
+        redis_lru = RedisLru(mockredis, metric_reporter=metric_reporter, local=local)
+
+        expected = func_test(0, 1, kwarg0=2, kwarg1=3)
+
+        for _ in range(2):
+            assert expected == redis_lru.fetch(
+                func_test, [0, 1], {"kwarg0": 2, "kwarg1": 3}, None, "test", None
+            )
+
+        assert metric_reporter.increment.calls == [
+            pretend.call("lru.cache.error"),  # Failed listen
+            pretend.call("lru.cache.miss"),
+            pretend.call("lru.cache.error"),  # Failed listen
+            pretend.call("lru.cache.error"),  # Failed listen
+            pretend.call("lru.cache.hit"),
+        ]
+
     def test_redis_down(self):
         metric_reporter = pretend.stub(
             increment=pretend.call_recorder(lambda *args: None)
@@ -450,7 +763,52 @@ class TestPurgeTask:
             pretend.call("Error purging %s: %s", "foo", str(exception_type()))
         ]
 
-    def test_store_purge_keys(self):
+    def test_purges_many_successfully(self):
+        task = pretend.stub()
+        service = pretend.stub(purge_many=pretend.call_recorder(lambda k: None))
+        request = pretend.stub(
+            find_service=pretend.call_recorder(lambda iface: service),
+            log=pretend.stub(info=pretend.call_recorder(lambda *args, **kwargs: None)),
+        )
+
+        services.purge_tags(task, request, ["foo", "bar"])
+
+        assert request.find_service.calls == [pretend.call(IXMLRPCCache)]
+        assert service.purge_many.calls == [pretend.call(["foo", "bar"])]
+        assert request.log.info.calls == [pretend.call("Purging %s", "foo, bar")]
+
+    def test_purges_many_fails(self):
+        exc = CacheError()
+
+        class Task:
+            @staticmethod
+            @pretend.call_recorder
+            def retry(exc):
+                raise celery.exceptions.Retry
+
+        task = Task()
+        service = pretend.stub(purge_many=pretend.call_recorder(pretend.raiser(exc)))
+        request = pretend.stub(
+            find_service=pretend.call_recorder(lambda iface: service),
+            log=pretend.stub(
+                info=pretend.call_recorder(lambda *args, **kwargs: None),
+                error=pretend.call_recorder(lambda *args, **kwargs: None),
+            ),
+        )
+
+        with pytest.raises(celery.exceptions.Retry):
+            services.purge_tags(task, request, ["foo", "bar"])
+
+        assert service.purge_many.calls == [pretend.call(["foo", "bar"])]
+        assert task.retry.calls == [pretend.call(exc=exc)]
+        assert request.log.error.calls == [
+            pretend.call("Error purging %s: %s", "foo, bar", str(exc))
+        ]
+
+    def test_store_purge_keys(self, monkeypatch):
+        count_queries = pretend.call_recorder(lambda *a: contextlib.nullcontext())
+        monkeypatch.setattr(origin, "_count_queries", count_queries)
+
         class Type1:
             pass
 
@@ -472,18 +830,32 @@ class TestPurgeTask:
                 }
             }
         )
+        new, dirty = Type1(), Type2()
         session = pretend.stub(
-            info={}, new={Type1()}, dirty={Type2()}, deleted={Type3(), Type4()}
+            info={}, new={new}, dirty={dirty}, deleted={Type3(), Type4()}
         )
 
         cache.store_purge_keys(config, session, pretend.stub())
 
         assert session.info["warehouse.legacy.api.xmlrpc.cache.purges"] == {
-            "type_1",
-            "type_2",
             "type_3",
             "foo",
         }
+        assert session.info["warehouse.legacy.api.xmlrpc.cache.purges.staged"] == {
+            Type1: {new},
+            Type2: {dirty},
+        }
+
+    def test_resolve_purge_keys(self, monkeypatch):
+        resolve_purge_keys = pretend.call_recorder(lambda *a: None)
+        monkeypatch.setattr(cache, "resolve_purge_keys", resolve_purge_keys)
+        config, session = pretend.stub(), pretend.stub()
+
+        cache.resolve_xmlrpc_purge_keys(config, session)
+
+        assert resolve_purge_keys.calls == [
+            pretend.call(config, session, "warehouse.legacy.api.xmlrpc.cache.purges")
+        ]
 
     def test_execute_purge(self, app_config):
         service = pretend.stub(purge_tags=pretend.call_recorder(lambda purges: None))
@@ -12,6 +12,9 @@
 
 import datetime
 
+from contextlib import contextmanager
+from xmlrpc.client import dumps
+
 import elasticsearch
 import pretend
 import pytest
@@ -804,7 +807,24 @@ def test_changelog_last_serial(db_request):
     assert xmlrpc.changelog_last_serial(db_request) == expected
 
 
-def test_changelog_since_serial(db_request):
+@pytest.fixture
+def changelog_request(db_request):
+    # The changelog is streamed from its own connection, so make sure that it
+    # sees the same transaction as the rest of the test.
+    @contextmanager
+    def connect():
+        yield db_request.db.connection()
+
+    db_request.registry["sqlalchemy.engine"] = pretend.stub(connect=connect)
+    return db_request
+
+
+def _xmlrpc_response(values):
+    return dumps((values,), methodresponse=True, allow_none=True).encode("utf8")
+
+
+def test_changelog_since_serial(changelog_request, metrics):
+    db_request = changelog_request
     projects = [ProjectFactory.create() for _ in range(10)]
     entries = []
     for project in projects:
@@ -824,11 +844,50 @@ def test_changelog_since_serial(db_request):
 
     serial = entries[int(len(entries) / 2) - 1].id
 
-    assert xmlrpc.changelog_since_serial(db_request, serial) == expected
+    response = xmlrpc.changelog_since_serial(db_request, serial)
+
+    assert response.content_type == "text/xml"
+    assert metrics.timed.calls == []
+    assert b"".join(response.app_iter) == _xmlrpc_response(expected)
+    assert metrics.timed.calls == [
+        pretend.call(
+            "warehouse.xmlrpc.stream.timing",
+            tags=["rpc_method:changelog_since_serial"],
+        )
+    ]
+
+
+def test_changelog_since_serial_cleans_action(changelog_request):
+    entry = JournalEntryFactory.create(action="add \x08 thing")
+
+    response = xmlrpc.changelog_since_serial(changelog_request, entry.id - 1)
+
+    assert b"".join(response.app_iter) == _xmlrpc_response(
+        [
+            (
+                entry.name,
+                entry.version,
+                int(
+                    entry.submitted_date.replace(
+                        tzinfo=datetime.timezone.utc
+                    ).timestamp()
+                ),
+                "add  thing",
+                entry.id,
+            )
+        ]
+    )
+
+
+def test_changelog_since_serial_empty(changelog_request):
+    response = xmlrpc.changelog_since_serial(changelog_request, 0)
+
+    assert b"".join(response.app_iter) == _xmlrpc_response([])
 
 
 @pytest.mark.parametrize("with_ids", [True, False, None])
-def test_changelog(db_request, with_ids):
+def test_changelog(changelog_request, with_ids):
+    db_request = changelog_request
     projects = [ProjectFactory.create() for _ in range(10)]
     entries = []
     for project in projects:
@@ -862,7 +921,10 @@ def test_changelog(db_request, with_ids):
     if with_ids is not None:
         extra_args.append(with_ids)
 
-    assert xmlrpc.changelog(db_request, since, *extra_args) == expected
+    response = xmlrpc.changelog(db_request, since, *extra_args)
+
+    assert response.content_type == "text/xml"
+    assert b"".join(response.app_iter) == _xmlrpc_response(expected)
 
 
 def test_browse(db_request):
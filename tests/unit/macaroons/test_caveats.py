@@ -32,6 +32,7 @@ from warehouse.macaroons.caveats import (
     deserialize,
     serialize,
     verify,
+    verify_caveats,
 )
 from warehouse.macaroons.caveats._core import _CaveatRegistry
 
@@ -136,6 +137,22 @@ class TestDeserialization:
         with pytest.raises(CaveatError):
             deserialize(b'{"version": 1, "permissions": "user"}')
 
+    def test_caches_current_caveats(self):
+        first = deserialize(b'[1,["cached"]]')
+
+        assert deserialize('[1,["cached"]]') is first
+        assert deserialize(b'[1,["cached"]]') is first
+        assert deserialize(b'[1,["other"]]') is not first
+
+    def test_does_not_cache_legacy_caveats(self, pyramid_request, pyramid_config):
+        data = b'{"version": 1, "permissions": "user"}'
+
+        pyramid_request.user = pretend.stub(id="a uuid")
+        assert deserialize(data) == RequestUser(user_id="a uuid")
+
+        pyramid_request.user = pretend.stub(id="another uuid")
+        assert deserialize(data) == RequestUser(user_id="another uuid")
+
     def test_deserialize_with_defaults(self):
         assert SampleCaveat.__deserialize__([1]) == SampleCaveat(
             first=1, second=2, third=3
@@ -333,3 +350,31 @@ class TestVerification:
         )
         assert not status
         assert status.msg == "unknown error"
+
+
+class TestVerifyCaveats:
+    def test_no_caveats(self):
+        status = verify_caveats([], pretend.stub(), pretend.stub(), pretend.stub())
+        assert status
+        assert status.msg == "caveats OK"
+
+    def test_valid_caveats(self):
+        now = int(time.time())
+        status = verify_caveats(
+            [serialize(Expiration(expires_at=now + 1000, not_before=now - 1000))],
+            pretend.stub(),
+            pretend.stub(),
+            pretend.stub(),
+        )
+        assert status
+        assert status.msg == "caveats OK"
+
+    def test_invalid_caveats(self):
+        status = verify_caveats(
+            [serialize(Expiration(expires_at=10, not_before=0)), b"[]"],
+            pretend.stub(),
+            pretend.stub(),
+            pretend.stub(),
+        )
+        assert not status
+        assert status.msg == "token is expired, caveat array cannot be empty"
@@ -0,0 +1,51 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pretend
+import pytest
+
+from celery.schedules import crontab
+
+from warehouse import macaroons
+from warehouse.macaroons.interfaces import IMacaroonService
+from warehouse.macaroons.services import (
+    MACAROON_CACHE_KEY,
+    VerifiedMacaroonCache,
+    database_macaroon_factory,
+)
+from warehouse.macaroons.tasks import flush_last_used
+
+
+@pytest.mark.parametrize("cache_url", [None, "redis://localhost/0"])
+def test_includeme(cache_url):
+    class FakeRegistry(dict):
+        settings = {"macaroons.cache_url": cache_url}
+
+    config = pretend.stub(
+        registry=FakeRegistry(),
+        register_service_factory=pretend.call_recorder(lambda factory, iface: None),
+        add_periodic_task=pretend.call_recorder(lambda *a, **kw: None),
+    )
+
+    macaroons.includeme(config)
+
+    assert config.register_service_factory.calls == [
+        pretend.call(database_macaroon_factory, IMacaroonService)
+    ]
+    if cache_url:
+        assert isinstance(config.registry[MACAROON_CACHE_KEY], VerifiedMacaroonCache)
+        assert config.add_periodic_task.calls == [
+            pretend.call(crontab(minute="*"), flush_last_used)
+        ]
+    else:
+        assert MACAROON_CACHE_KEY not in config.registry
+        assert config.add_periodic_task.calls == []
@@ -19,6 +19,7 @@ from uuid import uuid4
 import pretend
 import pymacaroons
 import pytest
+import redis
 
 from pymacaroons.exceptions import MacaroonDeserializationException
 
@@ -27,14 +28,98 @@ from warehouse.macaroons import caveats, services
 from warehouse.macaroons.models import Macaroon
 
 from ...common.db.accounts import UserFactory
+from ...common.db.packaging import ProjectFactory
 
 
 def test_database_macaroon_factory():
     db = pretend.stub()
-    request = pretend.stub(db=db)
+    cache = pretend.stub()
+    request = pretend.stub(
+        db=db, registry={services.MACAROON_CACHE_KEY: cache}, tm=pretend.stub()
+    )
 
     service = services.database_macaroon_factory(pretend.stub(), request)
     assert service.db is db
+    assert service.cache is cache
+    assert service.transaction_manager is request.tm
+
+
+class TestVerifiedMacaroonCache:
+    @pytest.fixture
+    def cache(self, monkeypatch, mockredis):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+        return services.VerifiedMacaroonCache("redis://", ttl=60, maxsize=2)
+
+    def test_get_missing(self, cache):
+        assert cache.get("pypi-foo") is None
+
+    def test_add_and_get(self, monkeypatch, cache):
+        monkeypatch.setattr(services.time, "monotonic", lambda: 100)
+        cache.add("pypi-foo", "an id", "a user", [b"[0,1,2]"])
+
+        assert cache.get("pypi-foo") == services.VerifiedMacaroon(
+            "an id", "a user", (b"[0,1,2]",), 160
+        )
+        assert cache.get("pypi-bar") is None
+
+    def test_expires(self, monkeypatch, cache):
+        now = [100]
+        monkeypatch.setattr(services.time, "monotonic", lambda: now[0])
+        cache.add("pypi-foo", "an id", "a user", [])
+
+        now[0] = 160
+        assert cache.get("pypi-foo") is None
+        assert not cache._entries
+
+    def test_evicts_least_recently_used(self, cache):
+        cache.add("pypi-one", "one", "a user", [])
+        cache.add("pypi-two", "two", "a user", [])
+        cache.get("pypi-one")
+        cache.add("pypi-three", "three", "a user", [])
+
+        assert cache.get("pypi-one") is not None
+        assert cache.get("pypi-two") is None
+        assert cache.get("pypi-three") is not None
+
+    def test_record_use(self, cache, mockredis):
+        assert cache.record_use("an id") is True
+        assert mockredis.hget(services.LAST_USED_KEY, "an id") is not None
+
+    def test_record_use_revoked(self, cache, mockredis):
+        cache.add("pypi-foo", "an id", "a user", [])
+        cache.add("pypi-bar", "another id", "a user", [])
+
+        cache.revoke("an id")
+
+        assert cache.get("pypi-foo") is None
+        assert cache.get("pypi-bar") is not None
+        assert cache.record_use("an id") is False
+        assert cache.record_use("another id") is True
+
+    def test_revoke_drops_pending_use(self, cache, mockredis):
+        cache.record_use("an id")
+        cache.revoke("an id")
+
+        assert mockredis.hget(services.LAST_USED_KEY, "an id") is None
+
+    def test_revoke_redis_error(self, cache):
+        def pipeline():
+            raise redis.ConnectionError()
+
+        cache.add("pypi-foo", "an id", "a user", [])
+        cache.redis = pretend.stub(pipeline=pipeline)
+
+        cache.revoke("an id")
+
+        assert cache.get("pypi-foo") is None
+
+    def test_record_use_redis_error(self, cache):
+        def pipeline():
+            raise redis.ConnectionError()
+
+        cache.redis = pretend.stub(pipeline=pipeline)
+
+        assert cache.record_use("an id") is None
 
 
 class TestDatabaseMacaroonService:
@@ -43,6 +128,7 @@ class TestDatabaseMacaroonService:
         service = services.DatabaseMacaroonService(session)
 
         assert service.db is session
+        assert service.cache is None
 
     @pytest.mark.parametrize(
         ["raw_macaroon", "result"],
@@ -308,3 +394,145 @@ class TestDatabaseMacaroonService:
                 "fake description",
                 [{"version": 1, "permissions": "user"}],
             )
+
+
+class TestCachedDatabaseMacaroonService:
+    @pytest.fixture
+    def cache(self, monkeypatch, mockredis):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+        return services.VerifiedMacaroonCache("redis://")
+
+    @pytest.fixture
+    def after_commit_hooks(self):
+        return []
+
+    @pytest.fixture
+    def macaroon_service(self, db_session, cache, after_commit_hooks):
+        transaction_manager = pretend.stub(
+            get=lambda: pretend.stub(addAfterCommitHook=after_commit_hooks.append)
+        )
+        return services.DatabaseMacaroonService(
+            db_session, cache=cache, transaction_manager=transaction_manager
+        )
+
+    @pytest.fixture
+    def user(self):
+        return UserFactory.create()
+
+    @pytest.fixture
+    def raw_macaroon(self, macaroon_service, user):
+        raw_macaroon, _ = macaroon_service.create_macaroon(
+            "fake location",
+            user.id,
+            "fake description",
+            [caveats.ProjectName(normalized_names=["foo"])],
+        )
+        return raw_macaroon
+
+    def test_verify_caches(self, macaroon_service, cache, mockredis, raw_macaroon):
+        context = ProjectFactory.create(name="foo")
+        dm = macaroon_service.find_from_raw(raw_macaroon)
+
+        assert macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+
+        assert cache.get(raw_macaroon) == services.VerifiedMacaroon(
+            str(dm.id),
+            dm.user_id,
+            (caveats.serialize(caveats.ProjectName(normalized_names=["foo"])),),
+            mock.ANY,
+        )
+        assert mockredis.hget(services.LAST_USED_KEY, str(dm.id)) is not None
+        assert dm.last_used is None
+
+    def test_verify_cached(self, monkeypatch, macaroon_service, raw_macaroon):
+        context = ProjectFactory.create(name="foo")
+        macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+
+        verify = pretend.call_recorder(lambda *a: True)
+        monkeypatch.setattr(caveats, "verify", verify)
+        find_macaroon = pretend.call_recorder(lambda id_: None)
+        monkeypatch.setattr(macaroon_service, "find_macaroon", find_macaroon)
+
+        assert macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+        assert verify.calls == []
+        assert find_macaroon.calls == []
+
+    def test_verify_cached_checks_caveats(self, macaroon_service, raw_macaroon):
+        macaroon_service.verify(
+            raw_macaroon, pretend.stub(), ProjectFactory.create(name="foo"), "upload"
+        )
+
+        with pytest.raises(services.InvalidMacaroonError) as excinfo:
+            macaroon_service.verify(
+                raw_macaroon,
+                pretend.stub(),
+                ProjectFactory.create(name="bar"),
+                "upload",
+            )
+
+        assert str(excinfo.value) == (
+            "project-scoped token is not valid for project: 'bar'"
+        )
+
+    def test_verify_cached_revoked(
+        self, monkeypatch, macaroon_service, cache, raw_macaroon
+    ):
+        context = ProjectFactory.create(name="foo")
+        macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+        monkeypatch.setattr(cache, "record_use", lambda id_: False)
+
+        with pytest.raises(services.InvalidMacaroonError) as excinfo:
+            macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+
+        assert str(excinfo.value) == "deleted or nonexistent macaroon"
+
+    def test_verify_without_redis(
+        self, monkeypatch, macaroon_service, cache, raw_macaroon
+    ):
+        context = ProjectFactory.create(name="foo")
+        macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+        monkeypatch.setattr(cache, "record_use", lambda id_: None)
+
+        verify = pretend.call_recorder(lambda *a: True)
+        monkeypatch.setattr(caveats, "verify", verify)
+
+        assert macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+        assert len(verify.calls) == 1
+        assert macaroon_service.find_from_raw(raw_macaroon).last_used is not None
+
+    def test_find_userid_cached(self, monkeypatch, macaroon_service, user):
+        raw_macaroon, _ = macaroon_service.create_macaroon(
+            "fake location",
+            user.id,
+            "fake description",
+            [caveats.RequestUser(user_id=str(user.id))],
+        )
+        macaroon_service.verify(
+            raw_macaroon, pretend.stub(identity=user), pretend.stub(), "upload"
+        )
+
+        find_macaroon = pretend.call_recorder(lambda id_: None)
+        monkeypatch.setattr(macaroon_service, "find_macaroon", find_macaroon)
+
+        assert macaroon_service.find_userid(raw_macaroon) == user.id
+        assert macaroon_service.find_userid(None) is None
+        assert find_macaroon.calls == []
+
+    @pytest.mark.parametrize("success", [True, False])
+    def test_delete_macaroon_revokes(
+        self, macaroon_service, cache, raw_macaroon, after_commit_hooks, success
+    ):
+        context = ProjectFactory.create(name="foo")
+        macaroon_service.verify(raw_macaroon, pretend.stub(), context, "upload")
+        dm = macaroon_service.find_from_raw(raw_macaroon)
+
+        macaroon_service.delete_macaroon(str(dm.id))
+
+        # Nothing is revoked until the deletion has been committed.
+        assert cache.get(raw_macaroon) is not None
+        assert len(after_commit_hooks) == 1
+
+        after_commit_hooks[0](success)
+
+        assert (cache.get(raw_macaroon) is None) is success
+        assert cache.record_use(str(dm.id)) is not success
@@ -0,0 +1,55 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import redis
+
+from warehouse.macaroons import caveats
+from warehouse.macaroons.services import LAST_USED_KEY, DatabaseMacaroonService
+from warehouse.macaroons.tasks import flush_last_used
+
+from ...common.db.accounts import UserFactory
+
+
+def test_flush_last_used(db_request, monkeypatch, mockredis):
+    monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+    db_request.registry.settings = {"macaroons.cache_url": "redis://"}
+
+    service = DatabaseMacaroonService(db_request.db)
+    user = UserFactory.create()
+    _, used = service.create_macaroon(
+        "fake location", user.id, "used", [caveats.RequestUser(user_id=str(user.id))]
+    )
+    _, unused = service.create_macaroon(
+        "fake location",
+        user.id,
+        "unused",
+        [caveats.RequestUser(user_id=str(user.id))],
+    )
+    when = datetime.datetime(2022, 10, 1, 12, 30)
+    mockredis.hset(LAST_USED_KEY, str(used.id), when.isoformat())
+
+    flush_last_used(db_request)
+
+    db_request.db.refresh(used)
+    db_request.db.refresh(unused)
+    assert used.last_used == when
+    assert unused.last_used is None
+    assert mockredis.hgetall(LAST_USED_KEY) == {}
+
+
+def test_flush_last_used_nothing_recorded(db_request, monkeypatch, mockredis):
+    monkeypatch.setattr(redis.StrictRedis, "from_url", lambda url: mockredis)
+    db_request.registry.settings = {"macaroons.cache_url": "redis://"}
+
+    flush_last_used(db_request)
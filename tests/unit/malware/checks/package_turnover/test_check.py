@@ -11,7 +11,9 @@
 # limitations under the License.
 
 import pretend
+import pytest
 
+from warehouse.accounts.models import WebAuthn
 from warehouse.events.tags import EventTag
 from warehouse.malware.checks.package_turnover import check as c
 from warehouse.malware.models import (
@@ -25,6 +27,14 @@ from .....common.db.malware import MalwareCheckFactory
 from .....common.db.packaging import ProjectFactory, ReleaseFactory, RoleFactory
 
 
+@pytest.fixture
+def check(db_session):
+    MalwareCheckFactory.create(
+        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
+    )
+    return c.PackageTurnoverCheck(db_session)
+
+
 def test_initializes(db_session):
     check_model = MalwareCheckFactory.create(
         name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
@@ -34,20 +44,36 @@ def test_initializes(db_session):
     assert check.id == check_model.id
 
 
-def test_user_posture_verdicts(db_session):
+def _remove_2fa(user):
+    user.record_event(
+        tag=EventTag.Account.TwoFactorMethodRemoved, ip_address="0.0.0.0", additional={}
+    )
+
+
+def test_user_posture_verdicts(db_session, check):
     user = UserFactory.create()
-    project = pretend.stub(users=[user], id=pretend.stub())
+    project = ProjectFactory.create()
+    RoleFactory.create(user=user, project=project)
+    _remove_2fa(user)
 
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
+    # Users who still have 2FA, or never removed any method, are fine.
+    totp_user = UserFactory.create(totp_secret=b"fake secret")
+    webauthn_user = UserFactory.create()
+    db_session.add(
+        WebAuthn(user=webauthn_user, label="key", credential_id="fake credential")
     )
-    check = c.PackageTurnoverCheck(db_session)
+    safe_project = ProjectFactory.create()
+    for safe_user in [totp_user, webauthn_user, UserFactory.create()]:
+        RoleFactory.create(user=safe_user, project=safe_project)
+        RoleFactory.create(user=safe_user, project=project)
+    _remove_2fa(totp_user)
+    _remove_2fa(webauthn_user)
 
-    user.record_event(
-        tag=EventTag.Account.TwoFactorMethodRemoved, ip_address="0.0.0.0", additional={}
-    )
+    # A project we're not scanning.
+    RoleFactory.create(user=user, project=ProjectFactory.create())
+
+    check.user_posture_verdicts([project.id, safe_project.id])
 
-    check.user_posture_verdicts(project)
     assert len(check._verdicts) == 1
     assert check._verdicts[0].check_id == check.id
     assert check._verdicts[0].project_id == project.id
@@ -59,37 +85,16 @@ def test_user_posture_verdicts(db_session):
     )
 
 
-def test_user_posture_verdicts_hasnt_removed_2fa(db_session):
+def test_user_posture_verdicts_hasnt_removed_2fa(db_session, check):
     user = UserFactory.create()
-    project = pretend.stub(users=[user], id=pretend.stub())
-
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
-    )
-    check = c.PackageTurnoverCheck(db_session)
-
-    check.user_posture_verdicts(project)
-    assert len(check._verdicts) == 0
-
-
-def test_user_posture_verdicts_has_2fa(db_session):
-    user = UserFactory.create(totp_secret=b"fake secret")
-    project = pretend.stub(users=[user], id=pretend.stub())
-
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
-    )
-    check = c.PackageTurnoverCheck(db_session)
-
-    user.record_event(
-        tag=EventTag.Account.TwoFactorMethodRemoved, ip_address="0.0.0.0", additional={}
-    )
+    project = ProjectFactory.create()
+    RoleFactory.create(user=user, project=project)
 
-    check.user_posture_verdicts(project)
+    check.user_posture_verdicts([project.id])
     assert len(check._verdicts) == 0
 
 
-def test_user_turnover_verdicts(db_session):
+def test_user_turnover_verdicts(db_session, check):
     user = UserFactory.create()
     project = ProjectFactory.create()
     RoleFactory.create(user=user, project=project, role_name="Owner")
@@ -100,12 +105,17 @@ def test_user_turnover_verdicts(db_session):
         additional={"target_user": user.username},
     )
 
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
+    # Only one of the two maintainers is new.
+    other_project = ProjectFactory.create()
+    RoleFactory.create(user=user, project=other_project, role_name="Owner")
+    RoleFactory.create(project=other_project, role_name="Owner")
+    other_project.record_event(
+        tag="project:role:accepted",
+        ip_address="0.0.0.0",
+        additional={"target_user": user.username},
     )
-    check = c.PackageTurnoverCheck(db_session)
 
-    check.user_turnover_verdicts(project)
+    check.user_turnover_verdicts([project.id, other_project.id])
     assert len(check._verdicts) == 1
     assert check._verdicts[0].check_id == check.id
     assert check._verdicts[0].project_id == project.id
@@ -117,64 +127,66 @@ def test_user_turnover_verdicts(db_session):
     )
 
 
-def test_user_turnover_verdicts_no_turnover(db_session):
+def test_user_turnover_verdicts_no_turnover(db_session, check):
     user = UserFactory.create()
     project = ProjectFactory.create()
     RoleFactory.create(user=user, project=project, role_name="Owner")
 
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
-    )
-    check = c.PackageTurnoverCheck(db_session)
-
-    check.user_turnover_verdicts(project)
+    check.user_turnover_verdicts([project.id])
     assert len(check._verdicts) == 0
 
 
-def test_scan(db_session, monkeypatch):
-    user = UserFactory.create()
-    project = ProjectFactory.create()
-    RoleFactory.create(user=user, project=project, role_name="Owner")
-
-    for _ in range(3):
-        ReleaseFactory.create(project=project)
-
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
-    )
-    check = c.PackageTurnoverCheck(db_session)
+def test_scan(db_session, check, monkeypatch):
+    projects = ProjectFactory.create_batch(2)
+    for project in projects:
+        RoleFactory.create(project=project, role_name="Owner")
+        for _ in range(3):
+            ReleaseFactory.create(project=project)
 
     monkeypatch.setattr(
-        check, "user_posture_verdicts", pretend.call_recorder(lambda project: None)
+        check, "user_posture_verdicts", pretend.call_recorder(lambda ids: None)
     )
     monkeypatch.setattr(
-        check, "user_turnover_verdicts", pretend.call_recorder(lambda project: None)
+        check, "user_turnover_verdicts", pretend.call_recorder(lambda ids: None)
     )
 
     check.scan()
 
-    # Each verdict rendering method is only called once per project,
-    # thanks to deduplication.
-    assert check.user_posture_verdicts.calls == [pretend.call(project)]
-    assert check.user_turnover_verdicts.calls == [pretend.call(project)]
+    # Each verdict rendering method is called once, for every project
+    # at the same time.
+    project_ids = sorted(p.id for p in projects)
+    assert check.user_posture_verdicts.calls == [pretend.call(project_ids)]
+    assert check.user_turnover_verdicts.calls == [pretend.call(project_ids)]
+
+
+def test_scan_partitioned(db_session, check, monkeypatch):
+    projects = ProjectFactory.create_batch(8)
+    for project in projects:
+        for _ in range(2):
+            ReleaseFactory.create(project=project)
 
+    scanned = []
+    monkeypatch.setattr(check, "user_posture_verdicts", scanned.extend)
+    monkeypatch.setattr(check, "user_turnover_verdicts", lambda ids: None)
 
-def test_scan_too_few_releases(db_session, monkeypatch):
+    for partition in range(check._partitions):
+        check.scan(partition=partition)
+
+    # Every project is scanned by exactly one partition.
+    assert sorted(scanned) == sorted(p.id for p in projects)
+
+
+def test_scan_too_few_releases(db_session, check, monkeypatch):
     user = UserFactory.create()
     project = ProjectFactory.create()
     RoleFactory.create(user=user, project=project, role_name="Owner")
     ReleaseFactory.create(project=project)
 
-    MalwareCheckFactory.create(
-        name="PackageTurnoverCheck", state=MalwareCheckState.Enabled
-    )
-    check = c.PackageTurnoverCheck(db_session)
-
     monkeypatch.setattr(
-        check, "user_posture_verdicts", pretend.call_recorder(lambda project: None)
+        check, "user_posture_verdicts", pretend.call_recorder(lambda ids: None)
     )
     monkeypatch.setattr(
-        check, "user_turnover_verdicts", pretend.call_recorder(lambda project: None)
+        check, "user_turnover_verdicts", pretend.call_recorder(lambda ids: None)
     )
 
     check.scan()
@@ -10,6 +10,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+
 import pretend
 import pytest
 import yara
@@ -34,6 +36,9 @@ def test_initializes(db_session):
     assert check.id == check_model.id
     assert isinstance(check._yara_rules, yara.Rules)
 
+    # The compiled rules are shared between instances.
+    assert c.SetupPatternCheck(db_session)._yara_rules is check._yara_rules
+
 
 @pytest.mark.parametrize(
     ("obj", "file_url"), [(None, pretend.stub()), (pretend.stub(), None)]
@@ -62,7 +67,7 @@ def test_scan_non_sdist(db_session):
 
 def test_scan_no_setup_contents(db_session, monkeypatch):
     monkeypatch.setattr(
-        c, "fetch_url_content", pretend.call_recorder(lambda *a: pretend.stub())
+        c, "fetch_url_content", pretend.call_recorder(lambda *a, **kw: io.BytesIO())
     )
     monkeypatch.setattr(
         c, "extract_file_content", pretend.call_recorder(lambda *a: None)
@@ -88,10 +93,56 @@ def test_scan_no_setup_contents(db_session, monkeypatch):
     )
 
 
+def test_scan_fetches_with_session(db_session, monkeypatch):
+    archive_stream = io.BytesIO()
+    fetch_url_content = pretend.call_recorder(lambda *a, **kw: archive_stream)
+    monkeypatch.setattr(c, "fetch_url_content", fetch_url_content)
+    extract_file_content = pretend.call_recorder(lambda *a: b"")
+    monkeypatch.setattr(c, "extract_file_content", extract_file_content)
+
+    MalwareCheckFactory.create(
+        name="SetupPatternCheck", state=MalwareCheckState.Enabled
+    )
+    check = c.SetupPatternCheck(db_session)
+
+    file = FileFactory.create(packagetype="sdist")
+    http = pretend.stub()
+
+    check.scan(obj=file, file_url="fake_url", http=http)
+
+    assert fetch_url_content.calls == [pretend.call("fake_url", session=http)]
+    assert extract_file_content.calls == [pretend.call(archive_stream, "setup.py")]
+    assert archive_stream.closed
+
+
+def test_scan_local_file_storage(db_session, monkeypatch):
+    fetch_url_content = pretend.call_recorder(lambda *a, **kw: None)
+    monkeypatch.setattr(c, "fetch_url_content", fetch_url_content)
+    extract_file_content = pretend.call_recorder(lambda *a: b"")
+    monkeypatch.setattr(c, "extract_file_content", extract_file_content)
+
+    MalwareCheckFactory.create(
+        name="SetupPatternCheck", state=MalwareCheckState.Enabled
+    )
+    check = c.SetupPatternCheck(db_session)
+
+    file = FileFactory.create(packagetype="sdist")
+    archive_stream = io.BytesIO()
+    file_storage = pretend.stub(get=pretend.call_recorder(lambda path: archive_stream))
+
+    check.scan(obj=file, file_url="fake_url", file_storage=file_storage)
+
+    assert fetch_url_content.calls == []
+    assert file_storage.get.calls == [pretend.call(file.path)]
+    assert extract_file_content.calls == [pretend.call(archive_stream, "setup.py")]
+    assert archive_stream.closed
+    assert check._verdicts[0].classification == VerdictClassification.Benign
+
+
 @pytest.mark.parametrize("benign", ["", """from os import path"""])
 def test_scan_benign_contents(db_session, monkeypatch, benign):
     monkeypatch.setattr(
-        c, "fetch_url_content", pretend.call_recorder(lambda *a: pretend.stub())
+        c, "fetch_url_content", pretend.call_recorder(lambda *a, **kw: io.BytesIO())
     )
     monkeypatch.setattr(
         c,
@@ -1127,7 +1178,7 @@ def test_scan_benign_contents(db_session, monkeypatch, benign):
 )
 def test_scan_matched_content(db_session, monkeypatch, malicious, rule):
     monkeypatch.setattr(
-        c, "fetch_url_content", pretend.call_recorder(lambda *a: pretend.stub())
+        c, "fetch_url_content", pretend.call_recorder(lambda *a, **kw: io.BytesIO())
     )
     monkeypatch.setattr(
         c,
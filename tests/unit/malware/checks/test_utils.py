@@ -15,23 +15,82 @@ import tarfile
 import zipfile
 
 import pretend
+import pytest
 
 from warehouse.malware.checks import utils
 
 
+class FakeResponse:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+        self.iter_content = pretend.call_recorder(lambda chunk_size: iter(chunks))
+
+    def raise_for_status(self):
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+
 def test_fetch_url_content(monkeypatch):
-    response = pretend.stub(
-        raise_for_status=pretend.call_recorder(lambda: None), content=b"fake content"
-    )
-    requests = pretend.stub(get=pretend.call_recorder(lambda url: response))
+    response = FakeResponse([b"fake ", b"content"])
+    requests = pretend.stub(get=pretend.call_recorder(lambda url, **kw: response))
 
     monkeypatch.setattr(utils, "requests", requests)
 
-    io = utils.fetch_url_content("hxxp://fake_url.com")
+    with utils.fetch_url_content("hxxp://fake_url.com") as stream:
+        assert stream.read() == b"fake content"
+
+    assert requests.get.calls == [pretend.call("hxxp://fake_url.com", stream=True)]
+    assert response.iter_content.calls == [pretend.call(chunk_size=utils.CHUNK_SIZE)]
+    assert response.closed
+
+
+def test_fetch_url_content_session():
+    response = FakeResponse([b"fake content"])
+    session = pretend.stub(get=pretend.call_recorder(lambda url, **kw: response))
+
+    with utils.fetch_url_content("hxxp://fake_url.com", session=session) as stream:
+        assert stream.read() == b"fake content"
+
+    assert session.get.calls == [pretend.call("hxxp://fake_url.com", stream=True)]
+
+
+def test_fetch_url_content_spools_to_disk(monkeypatch):
+    monkeypatch.setattr(utils, "SPOOL_MAX_SIZE", 8)
+    response = FakeResponse([b"fake ", b"content"])
+    session = pretend.stub(get=lambda url, **kw: response)
+
+    with utils.fetch_url_content("hxxp://fake_url.com", session=session) as stream:
+        assert stream._rolled
+        assert stream.read() == b"fake content"
+
+    # It also needs to be usable as a dist.
+    zipbuf = io.BytesIO()
+    with zipfile.ZipFile(zipbuf, mode="w") as zipobj:
+        zipobj.writestr("foo/setup.py", b"these are some contents")
+    response = FakeResponse([zipbuf.getvalue()])
+
+    with utils.fetch_url_content("hxxp://fake_url.com", session=session) as stream:
+        assert (
+            utils.extract_file_content(stream, "setup.py") == b"these are some contents"
+        )
+
+
+def test_fetch_url_content_error():
+    error = ValueError("404")
+    session = pretend.stub(get=lambda url, **kw: FakeResponse([], error=error))
+
+    with pytest.raises(ValueError) as excinfo:
+        utils.fetch_url_content("hxxp://fake_url.com", session=session)
 
-    assert requests.get.calls == [pretend.call("hxxp://fake_url.com")]
-    assert response.raise_for_status.calls == [pretend.call()]
-    assert io.getvalue() == b"fake content"
+    assert excinfo.value is error
 
 
 def test_extract_file_contents_zip():
@@ -18,9 +18,13 @@ import pytest
 import warehouse.malware.checks as prod_checks
 
 from warehouse.malware.checks.base import MalwareCheckBase
+from warehouse.malware.models import MalwareCheckState, MalwareVerdict
 from warehouse.malware.utils import get_check_fields
+from warehouse.packaging.interfaces import IFileStorage
+from warehouse.packaging.services import InsecureStorageWarning, LocalFileStorage
 
 from ...common import checks as test_checks
+from ...common.db.malware import MalwareCheckFactory
 from ...common.db.packaging import FileFactory
 
 
@@ -57,15 +61,82 @@ def test_checks_fields(checks):
 
 def test_base_prepare_file_hooked(db_session):
     file = FileFactory.create()
+    file_storage = pretend.stub()
     request = pretend.stub(
-        db=db_session, route_url=pretend.call_recorder(lambda *a, **kw: "fake_url")
+        db=db_session,
+        route_url=pretend.call_recorder(lambda *a, **kw: "fake_url"),
+        http=pretend.stub(),
+        find_service=pretend.call_recorder(lambda iface: file_storage),
     )
 
     kwargs = test_checks.ExampleHookedCheck.prepare(request, file.id)
 
     assert request.route_url.calls == [pretend.call("packaging.file", path=file.path)]
+    assert request.find_service.calls == [pretend.call(IFileStorage)]
     assert "file_url" in kwargs
     assert kwargs["file_url"] == "fake_url"
+    assert kwargs["http"] is request.http
+    assert "file_storage" not in kwargs
+
+
+def test_base_prepare_file_hooked_local_storage(db_session, tmpdir):
+    file = FileFactory.create()
+    with pytest.warns(InsecureStorageWarning):
+        file_storage = LocalFileStorage(str(tmpdir))
+    request = pretend.stub(
+        db=db_session,
+        route_url=lambda *a, **kw: "fake_url",
+        http=pretend.stub(),
+        find_service=lambda iface: file_storage,
+    )
+
+    kwargs = test_checks.ExampleHookedCheck.prepare(request, file.id)
+
+    assert kwargs["file_storage"] is file_storage
+
+
+def test_base_prepare_batch(db_session):
+    files = FileFactory.create_batch(3)
+    request = pretend.stub(
+        db=db_session,
+        route_url=lambda *a, path: path,
+        http=pretend.stub(),
+        find_service=lambda iface: pretend.stub(),
+    )
+    obj_ids = [
+        str(files[2].id),
+        "ba70267f-fabf-496f-9ac2-d237a983b187",
+        str(files[0].id),
+    ]
+
+    batch = test_checks.ExampleHookedCheck.prepare_batch(request, obj_ids)
+
+    assert batch == [
+        {
+            "obj_id": str(f.id),
+            "obj": f,
+            "file_url": f.path,
+            "http": request.http,
+        }
+        for f in [files[2], files[0]]
+    ]
+
+
+def test_base_insert_verdicts(db_session):
+    check = MalwareCheckFactory.create(
+        name="ExampleHookedCheck", state=MalwareCheckState.Enabled
+    )
+    files = FileFactory.create_batch(2)
+    hooked_check = test_checks.ExampleHookedCheck(db_session)
+
+    for file in files:
+        hooked_check.scan(obj_id=file.id)
+    hooked_check.insert_verdicts()
+
+    assert hooked_check._verdicts == []
+    assert {
+        (v.check_id, v.file_id) for v in db_session.query(MalwareVerdict).all()
+    } == {(check.id, f.id) for f in files}
 
 
 def test_base_prepare_nonfile_hooked(db_session):
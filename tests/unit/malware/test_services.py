@@ -15,12 +15,13 @@ import pytest
 
 from zope.interface.verify import verifyClass
 
+from warehouse.malware import services
 from warehouse.malware.interfaces import IMalwareCheckService
 from warehouse.malware.services import (
     DatabaseMalwareCheckService,
     PrinterMalwareCheckService,
 )
-from warehouse.malware.tasks import run_check
+from warehouse.malware.tasks import run_check, run_check_batch
 
 
 class TestPrinterMalwareCheckService:
@@ -47,25 +48,46 @@ class TestDatabaseMalwareService:
         assert verifyClass(IMalwareCheckService, DatabaseMalwareCheckService)
 
     def test_create_service(self, db_request):
-        _delay = pretend.call_recorder(lambda *args: None)
-        db_request.task = lambda x: pretend.stub(delay=_delay)
+        tasks = {
+            run_check: pretend.stub(delay=pretend.stub()),
+            run_check_batch: pretend.stub(delay=pretend.stub()),
+        }
+        db_request.task = lambda x: tasks[x]
         service = DatabaseMalwareCheckService.create_service(None, db_request)
-        assert service.executor == db_request.task(run_check).delay
+        assert service.executor is tasks[run_check].delay
+        assert service.batch_executor is tasks[run_check_batch].delay
 
-    def test_run_hooked_check(self, db_request):
+    def test_run_hooked_check(self, db_request, monkeypatch):
+        monkeypatch.setattr(services, "HOOKED_CHECK_BATCH_SIZE", 2)
         _delay = pretend.call_recorder(lambda *args, **kwargs: None)
         db_request.task = lambda x: pretend.stub(delay=_delay)
         service = DatabaseMalwareCheckService.create_service(None, db_request)
         checks = [
             "MyTestCheck:ba70267f-fabf-496f-9ac2-d237a983b187",
             "AnotherCheck:44f57b0e-c5b0-47c5-8713-341cf392efe2",
-            "FinalCheck:e8518a15-8f01-430e-8f5b-87644007c9c0",
+            "MyTestCheck:e8518a15-8f01-430e-8f5b-87644007c9c0",
+            "MyTestCheck:9e4a1a35-5ba8-4b0b-b6e4-17f4bb1c5bd0",
         ]
-        service.run_checks(checks)
+        service.run_checks(checks, manually_triggered=True)
         assert _delay.calls == [
-            pretend.call("MyTestCheck", obj_id="ba70267f-fabf-496f-9ac2-d237a983b187"),
-            pretend.call("AnotherCheck", obj_id="44f57b0e-c5b0-47c5-8713-341cf392efe2"),
-            pretend.call("FinalCheck", obj_id="e8518a15-8f01-430e-8f5b-87644007c9c0"),
+            pretend.call(
+                "MyTestCheck",
+                [
+                    "ba70267f-fabf-496f-9ac2-d237a983b187",
+                    "e8518a15-8f01-430e-8f5b-87644007c9c0",
+                ],
+                manually_triggered=True,
+            ),
+            pretend.call(
+                "MyTestCheck",
+                ["9e4a1a35-5ba8-4b0b-b6e4-17f4bb1c5bd0"],
+                manually_triggered=True,
+            ),
+            pretend.call(
+                "AnotherCheck",
+                ["44f57b0e-c5b0-47c5-8713-341cf392efe2"],
+                manually_triggered=True,
+            ),
         ]
 
     def test_run_scheduled_check(self, db_request):
@@ -15,6 +15,7 @@ import pretend
 import pytest
 
 from warehouse.malware import tasks
+from warehouse.malware.errors import FatalCheckError
 from warehouse.malware.models import MalwareCheck, MalwareCheckState, MalwareVerdict
 from warehouse.malware.services import PrinterMalwareCheckService
 
@@ -26,6 +27,8 @@ from ...common.db.packaging import FileFactory, ProjectFactory, ReleaseFactory
 class TestRunCheck:
     def test_success(self, db_request, monkeypatch):
         db_request.route_url = pretend.call_recorder(lambda *a, **kw: "fake_route")
+        db_request.http = pretend.stub()
+        db_request.find_service = lambda iface: pretend.stub()
 
         monkeypatch.setattr(tasks, "checks", test_checks)
         file0 = FileFactory.create()
@@ -72,6 +75,36 @@ manually triggered to run."
             ]
             assert db_session.query(MalwareVerdict).all() == []
 
+    def test_partitioned(self, db_request, monkeypatch):
+        monkeypatch.setattr(tasks, "checks", test_checks)
+        monkeypatch.setattr(test_checks.ExampleScheduledCheck, "_partitions", 2)
+        delay = pretend.call_recorder(lambda *a, **kw: None)
+        db_request.task = pretend.call_recorder(lambda t: pretend.stub(delay=delay))
+        scan = pretend.call_recorder(lambda self, **kwargs: None)
+        monkeypatch.setattr(test_checks.ExampleScheduledCheck, "scan", scan)
+        MalwareCheckFactory.create(
+            name="ExampleScheduledCheck", state=MalwareCheckState.Enabled
+        )
+        task = pretend.stub()
+
+        tasks.run_check(task, db_request, "ExampleScheduledCheck")
+
+        assert db_request.task.calls == [pretend.call(tasks.run_check)] * 2
+        assert delay.calls == [
+            pretend.call(
+                "ExampleScheduledCheck", manually_triggered=False, partition=0
+            ),
+            pretend.call(
+                "ExampleScheduledCheck", manually_triggered=False, partition=1
+            ),
+        ]
+        assert scan.calls == []
+
+        tasks.run_check(task, db_request, "ExampleScheduledCheck", partition=1)
+
+        assert len(scan.calls) == 1
+        assert scan.calls[0].kwargs == {"partition": 1}
+
     def test_disabled_check(self, db_session, monkeypatch):
         monkeypatch.setattr(tasks, "checks", test_checks)
         MalwareCheckFactory.create(
@@ -140,6 +173,8 @@ manually triggered to run."
             db=db_session,
             log=pretend.stub(error=pretend.call_recorder(lambda *args, **kwargs: None)),
             route_url=pretend.call_recorder(lambda *a, **kw: pretend.stub()),
+            http=pretend.stub(),
+            find_service=lambda iface: pretend.stub(),
         )
 
         file = FileFactory.create()
@@ -154,6 +189,121 @@ manually triggered to run."
         assert task.retry.calls == [pretend.call(exc=exc)]
 
 
+class TestRunCheckBatch:
+    def test_success(self, db_request, monkeypatch):
+        db_request.route_url = lambda *a, **kw: "fake_route"
+        db_request.http = pretend.stub()
+        db_request.find_service = lambda iface: pretend.stub()
+
+        monkeypatch.setattr(tasks, "checks", test_checks)
+        files = FileFactory.create_batch(3)
+        check = MalwareCheckFactory.create(
+            name="ExampleHookedCheck", state=MalwareCheckState.Enabled
+        )
+        task = pretend.stub()
+
+        tasks.run_check_batch(
+            task,
+            db_request,
+            "ExampleHookedCheck",
+            # A file which has since been deleted is skipped.
+            [str(f.id) for f in files] + ["ba70267f-fabf-496f-9ac2-d237a983b187"],
+        )
+
+        verdicts = db_request.db.query(MalwareVerdict).all()
+        assert {v.file_id for v in verdicts} == {f.id for f in files}
+        assert {v.check_id for v in verdicts} == {check.id}
+
+    def test_disabled_check(self, db_session, monkeypatch):
+        monkeypatch.setattr(tasks, "checks", test_checks)
+        MalwareCheckFactory.create(
+            name="ExampleHookedCheck", state=MalwareCheckState.Evaluation
+        )
+        task = pretend.stub()
+        request = pretend.stub(
+            db=db_session,
+            log=pretend.stub(info=pretend.call_recorder(lambda *args, **kwargs: None)),
+        )
+
+        file = FileFactory.create()
+
+        tasks.run_check_batch(task, request, "ExampleHookedCheck", [str(file.id)])
+
+        assert request.log.info.calls == [
+            pretend.call(
+                "ExampleHookedCheck is in the `evaluation` state and must be \
+manually triggered to run."
+            )
+        ]
+        assert db_session.query(MalwareVerdict).all() == []
+
+    def test_fatal_exception(self, db_request, monkeypatch):
+        db_request.route_url = lambda *a, **kw: "fake_route"
+        db_request.http = pretend.stub()
+        db_request.find_service = lambda iface: pretend.stub()
+        db_request.log = pretend.stub(
+            error=pretend.call_recorder(lambda *args, **kwargs: None)
+        )
+
+        monkeypatch.setattr(tasks, "checks", test_checks)
+        bad_file, good_file = FileFactory.create_batch(2)
+        scan = tasks.checks.ExampleHookedCheck.scan
+
+        def fail_one(self, **kwargs):
+            if kwargs["obj"] is bad_file:
+                raise FatalCheckError("Bad file")
+            scan(self, **kwargs)
+
+        monkeypatch.setattr(tasks.checks.ExampleHookedCheck, "scan", fail_one)
+        MalwareCheckFactory.create(
+            name="ExampleHookedCheck", state=MalwareCheckState.Enabled
+        )
+        task = pretend.stub()
+
+        tasks.run_check_batch(
+            task, db_request, "ExampleHookedCheck", [bad_file.id, good_file.id]
+        )
+
+        assert db_request.log.error.calls == [
+            pretend.call(
+                "Fatal exception: ExampleHookedCheck: %s: Bad file" % bad_file.id
+            )
+        ]
+        assert db_request.db.query(MalwareVerdict.file_id).all() == [(good_file.id,)]
+
+    def test_retry(self, db_request, monkeypatch):
+        db_request.route_url = lambda *a, **kw: "fake_route"
+        db_request.http = pretend.stub()
+        db_request.find_service = lambda iface: pretend.stub()
+        db_request.log = pretend.stub(
+            error=pretend.call_recorder(lambda *args, **kwargs: None)
+        )
+
+        monkeypatch.setattr(tasks, "checks", test_checks)
+        exc = Exception("Scan failed")
+
+        def scan(self, **kwargs):
+            raise exc
+
+        monkeypatch.setattr(tasks.checks.ExampleHookedCheck, "scan", scan)
+        MalwareCheckFactory.create(
+            name="ExampleHookedCheck", state=MalwareCheckState.Enabled
+        )
+        task = pretend.stub(
+            retry=pretend.call_recorder(pretend.raiser(celery.exceptions.Retry))
+        )
+
+        file = FileFactory.create()
+
+        with pytest.raises(celery.exceptions.Retry):
+            tasks.run_check_batch(task, db_request, "ExampleHookedCheck", [file.id])
+
+        assert db_request.log.error.calls == [
+            pretend.call("Error executing check ExampleHookedCheck: Scan failed")
+        ]
+        assert task.retry.calls == [pretend.call(exc=exc)]
+
+
 class TestRunScheduledCheck:
     def test_invalid_check_name(self, db_request, monkeypatch):
         monkeypatch.setattr(tasks, "checks", test_checks)
@@ -237,6 +387,33 @@ class TestBackfill:
 
         assert num_output_lines == num_runs
 
+    def test_run_in_batches(self, db_session, monkeypatch):
+        monkeypatch.setattr(tasks, "checks", test_checks)
+        monkeypatch.setattr(tasks, "BACKFILL_BATCH_SIZE", 2)
+
+        ids = {str(FileFactory.create().id) for _ in range(5)}
+
+        MalwareCheckFactory.create(
+            name="ExampleHookedCheck", state=MalwareCheckState.Enabled
+        )
+
+        service = pretend.stub(run_checks=pretend.call_recorder(lambda *a, **kw: None))
+        request = pretend.stub(
+            db=db_session,
+            log=pretend.stub(info=lambda *args, **kwargs: None),
+            find_service_factory=lambda interface: lambda context, request: service,
+        )
+
+        tasks.backfill(pretend.stub(), request, "ExampleHookedCheck", 5)
+
+        assert [len(c.args[0]) for c in service.run_checks.calls] == [2, 2, 1]
+        assert {run for c in service.run_checks.calls for run in c.args[0]} == {
+            f"ExampleHookedCheck:{id_}" for id_ in ids
+        }
+        assert {tuple(c.kwargs.items()) for c in service.run_checks.calls} == {
+            (("manually_triggered", True),)
+        }
+
 
 class TestSyncChecks:
     def test_no_updates(self, db_session, monkeypatch):
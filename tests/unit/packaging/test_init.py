@@ -18,19 +18,29 @@ from celery.schedules import crontab
 from warehouse import packaging
 from warehouse.accounts.models import Email, User
 from warehouse.manage.tasks import update_role_invitation_status
-from warehouse.packaging.interfaces import IDocsStorage, IFileStorage, ISimpleStorage
+from warehouse.packaging.interfaces import (
+    IDocsStorage,
+    IDownloadStatsService,
+    IFileStorage,
+    ISimpleStorage,
+)
 from warehouse.packaging.models import File, Project, Release, Role
 from warehouse.packaging.tasks import (  # sync_bigquery_release_files,
     compute_2fa_mandate,
     compute_trending,
+    flush_bigquery_release_files,
     update_description_html,
+    update_simple_index_shards,
 )
 
 
 @pytest.mark.parametrize("with_trending", [True, False])
+@pytest.mark.parametrize("with_download_stats", [True, False])
 @pytest.mark.parametrize("with_bq_sync", [True, False])
 @pytest.mark.parametrize("with_2fa_mandate", [True, False])
-def test_includeme(monkeypatch, with_trending, with_bq_sync, with_2fa_mandate):
+def test_includeme(
+    monkeypatch, with_trending, with_download_stats, with_bq_sync, with_2fa_mandate
+):
     storage_class = pretend.stub(
         create_service=pretend.call_recorder(lambda *a, **kw: pretend.stub())
     )
@@ -42,13 +52,21 @@ def test_includeme(monkeypatch, with_trending, with_bq_sync, with_2fa_mandate):
     settings = dict()
     if with_trending:
         settings["warehouse.trending_table"] = "foobar"
+    if with_download_stats:
+        settings["download_stats.backend"] = "foo.baz"
     if with_bq_sync:
         settings["warehouse.release_files_table"] = "fizzbuzz"
     if with_2fa_mandate:
         settings["warehouse.two_factor_mandate.available"] = True
 
+    dotted_names = []
+
+    def maybe_dotted(dotted):
+        dotted_names.append(dotted)
+        return storage_class
+
     config = pretend.stub(
-        maybe_dotted=lambda dotted: storage_class,
+        maybe_dotted=maybe_dotted,
         register_service_factory=pretend.call_recorder(
             lambda factory, iface, name=None: None
         ),
@@ -57,6 +75,7 @@ def test_includeme(monkeypatch, with_trending, with_bq_sync, with_2fa_mandate):
                 "files.backend": "foo.bar",
                 "simple.backend": "bread.butter",
                 "docs.backend": "wu.tang",
+                **settings,
             }
         ),
         register_origin_cache_keys=pretend.call_recorder(lambda c, **kw: None),
@@ -66,10 +85,19 @@ def test_includeme(monkeypatch, with_trending, with_bq_sync, with_2fa_mandate):
 
     packaging.includeme(config)
 
+    assert dotted_names == [
+        "foo.bar",
+        "bread.butter",
+        "wu.tang",
+        "foo.baz"
+        if with_download_stats
+        else "warehouse.packaging.services.BigQueryDownloadStatsService",
+    ]
     assert config.register_service_factory.calls == [
         pretend.call(storage_class.create_service, IFileStorage),
         pretend.call(storage_class.create_service, ISimpleStorage),
         pretend.call(storage_class.create_service, IDocsStorage),
+        pretend.call(storage_class.create_service, IDownloadStatsService),
     ]
     assert config.register_origin_cache_keys.calls == [
         pretend.call(
@@ -122,17 +150,19 @@ def test_includeme(monkeypatch, with_trending, with_bq_sync, with_2fa_mandate):
     ]
 
     if with_bq_sync:
+        assert (
+            pretend.call(60, flush_bigquery_release_files)
+            in config.add_periodic_task.calls
+        )
         # assert (
         #    pretend.call(crontab(minute=0), sync_bigquery_release_files)
         #    in config.add_periodic_task.calls
         # )
-        pass
 
-    if with_trending:
-        assert (
-            pretend.call(crontab(minute=0, hour=3), compute_trending)
-            in config.add_periodic_task.calls
-        )
+    assert (
+        pretend.call(crontab(minute=0, hour=3), compute_trending)
+        in config.add_periodic_task.calls
+    ) == (with_trending or with_download_stats)
 
     if with_2fa_mandate:
         assert (
@@ -148,3 +178,7 @@ def test_includeme(monkeypatch, with_trending, with_bq_sync, with_2fa_mandate):
         pretend.call(crontab(minute="*/5"), update_role_invitation_status)
         in config.add_periodic_task.calls
     )
+    assert (
+        pretend.call(crontab(minute="*/5"), update_simple_index_shards)
+        in config.add_periodic_task.calls
+    )
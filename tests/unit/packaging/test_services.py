@@ -10,8 +10,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import io
+import json
 import os.path
+import statistics
 
 import boto3.session
 import botocore.exceptions
@@ -22,12 +25,19 @@ from zope.interface.verify import verifyClass
 
 import warehouse.packaging.services
 
-from warehouse.packaging.interfaces import IDocsStorage, IFileStorage, ISimpleStorage
+from warehouse.packaging.interfaces import (
+    IDocsStorage,
+    IDownloadStatsService,
+    IFileStorage,
+    ISimpleStorage,
+)
 from warehouse.packaging.services import (
+    BigQueryDownloadStatsService,
     GCSFileStorage,
     GCSSimpleStorage,
     GenericLocalBlobStorage,
     LocalDocsStorage,
+    LocalDownloadStatsService,
     LocalFileStorage,
     LocalSimpleStorage,
     S3DocsStorage,
@@ -661,3 +671,198 @@ class TestGenericLocalBlobStorage:
     def test_notimplementederror(self):
         with pytest.raises(NotImplementedError):
             GenericLocalBlobStorage.create_service(pretend.stub(), pretend.stub())
+
+
+class TestBigQueryDownloadStatsService:
+    def test_verify_service(self):
+        assert verifyClass(IDownloadStatsService, BigQueryDownloadStatsService)
+
+    def test_create_service(self):
+        bigquery = pretend.stub()
+        request = pretend.stub(
+            find_service=pretend.call_recorder(lambda name=None: bigquery),
+            registry=pretend.stub(
+                settings={
+                    "warehouse.trending_table": "example.pypi.downloads*",
+                    "warehouse.downloads_table": "downloads_table",
+                }
+            ),
+        )
+
+        service = BigQueryDownloadStatsService.create_service(None, request)
+
+        assert request.find_service.calls == [pretend.call(name="gcloud.bigquery")]
+        assert service.bigquery is bigquery
+        assert service.trending_table == "example.pypi.downloads*"
+        assert service.downloads_table == "downloads_table"
+
+    def test_trending_zscores(self):
+        results = [{"project": "foo", "zscore": 2}, {"project": "bar", "zscore": None}]
+        query = pretend.stub(result=pretend.call_recorder(lambda: iter(results)))
+        bigquery = pretend.stub(query=pretend.call_recorder(lambda q: query))
+        service = BigQueryDownloadStatsService(
+            bigquery, trending_table="example.pypi.downloads*"
+        )
+
+        assert service.trending_zscores() == {"foo": 2, "bar": None}
+        assert bigquery.query.calls == [
+            pretend.call(
+                """ SELECT project,
+                   IF(
+                        STDDEV(downloads) > 0,
+                        (todays_downloads - AVG(downloads))/STDDEV(downloads),
+                        NULL
+                    ) as zscore
+            FROM (
+                SELECT project,
+                       date,
+                       downloads,
+                       FIRST_VALUE(downloads) OVER (
+                            PARTITION BY project
+                            ORDER BY DATE DESC
+                            ROWS BETWEEN UNBOUNDED PRECEDING
+                                AND UNBOUNDED FOLLOWING
+                        ) as todays_downloads
+                FROM (
+                    SELECT file.project as project,
+                           DATE(timestamp) AS date,
+                           COUNT(*) as downloads
+                    FROM `example.pypi.downloads*`
+                    WHERE _TABLE_SUFFIX BETWEEN
+                        FORMAT_DATE(
+                            "%Y%m%d",
+                            DATE_ADD(CURRENT_DATE(), INTERVAL -31 day))
+                        AND
+                        FORMAT_DATE(
+                            "%Y%m%d",
+                            DATE_ADD(CURRENT_DATE(), INTERVAL -1 day))
+                    GROUP BY file.project, date
+                )
+            )
+            GROUP BY project, todays_downloads
+            HAVING SUM(downloads) >= 5000
+            ORDER BY zscore DESC
+        """
+            )
+        ]
+        assert query.result.calls == [pretend.call()]
+
+    def test_top_projects(self):
+        results = [{"project_name": "foo"}, {"project_name": "bar"}]
+        query = pretend.stub(result=lambda: results)
+        bigquery = pretend.stub(query=pretend.call_recorder(lambda q: query))
+        service = BigQueryDownloadStatsService(
+            bigquery, downloads_table="downloads_table"
+        )
+
+        assert service.top_projects(666) == ["foo", "bar"]
+        assert bigquery.query.calls == [
+            pretend.call(
+                """ SELECT
+              COUNT(*) AS num_downloads,
+              file.project as project_name
+            FROM
+              downloads_table
+            WHERE
+              DATE(timestamp) BETWEEN DATE_TRUNC(
+                DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH), MONTH
+              )
+              AND CURRENT_DATE()
+            GROUP BY
+              file.project
+            ORDER BY
+              num_downloads DESC
+            LIMIT
+              666
+        """
+            )
+        ]
+
+
+def _downloads(day, project, count):
+    return [
+        json.dumps(
+            {
+                "timestamp": f"{day.isoformat()} 12:00:00 UTC",
+                "file": {"project": project},
+            }
+        )
+    ] * count
+
+
+class TestLocalDownloadStatsService:
+    def test_verify_service(self):
+        assert verifyClass(IDownloadStatsService, LocalDownloadStatsService)
+
+    def test_create_service(self):
+        request = pretend.stub(
+            registry=pretend.stub(settings={"download_stats.path": "/downloads/"})
+        )
+        service = LocalDownloadStatsService.create_service(None, request)
+        assert service.path == "/downloads/"
+
+    def test_empty(self, tmpdir):
+        service = LocalDownloadStatsService(str(tmpdir.join("stats")))
+        assert service.trending_zscores() == {}
+        assert service.top_projects(10) == []
+
+    def test_ingest(self, tmpdir):
+        service = LocalDownloadStatsService(str(tmpdir))
+        day = datetime.date(2022, 10, 1)
+        next_day = day + datetime.timedelta(days=1)
+
+        service.ingest(_downloads(day, "foo", 3) + _downloads(day, "bar", 1))
+        service.ingest(_downloads(next_day, "baz", 2) + _downloads(next_day, "bar", 4))
+
+        assert tmpdir.join("projects").read() == "bar\nfoo\nbaz\n"
+        # The first day was written before we'd seen baz, and is one shorter.
+        assert len(tmpdir.join("20221001").read_binary()) == 2 * 8
+        assert service._read_day(day).tolist() == [1, 3]
+        assert service._read_day(next_day).tolist() == [4, 0, 2]
+
+        service.ingest(_downloads(day, "foo", 1))
+
+        assert tmpdir.join("projects").read() == "bar\nfoo\nbaz\n"
+        assert service._read_day(day).tolist() == [1, 4, 0]
+
+    def test_trending_zscores(self, tmpdir):
+        service = LocalDownloadStatsService(str(tmpdir))
+        today = datetime.date(2022, 10, 18)
+
+        foo = [1000, 900, 0, 1100, 3000]
+        downloads = []
+        for days_ago, count in enumerate(reversed(foo), start=1):
+            day = today - datetime.timedelta(days=days_ago)
+            downloads += _downloads(day, "foo", count)
+            # Steady, but only just popular enough.
+            downloads += _downloads(day, "bar", 1000)
+            # Not popular enough.
+            downloads += _downloads(day, "baz", 10)
+        # Too long ago, and today isn't over yet.
+        downloads += _downloads(today - datetime.timedelta(days=32), "baz", 5000)
+        downloads += _downloads(today, "baz", 5000)
+        service.ingest(downloads)
+
+        foo = [c for c in foo if c]
+        assert service.trending_zscores(today=today) == {
+            "foo": pytest.approx(
+                (foo[-1] - statistics.mean(foo)) / statistics.stdev(foo)
+            ),
+            "bar": None,
+        }
+
+    def test_top_projects(self, tmpdir):
+        service = LocalDownloadStatsService(str(tmpdir))
+        today = datetime.date(2022, 10, 18)
+
+        service.ingest(
+            # Within the current month.
+            _downloads(today, "foo", 3)
+            # From the start of the month, six months ago.
+            + _downloads(datetime.date(2022, 4, 1), "bar", 2)
+            + _downloads(datetime.date(2022, 4, 1), "foo", 1)
+            + _downloads(datetime.date(2022, 3, 31), "baz", 10)
+            + _downloads(datetime.date(2022, 10, 1), "qux", 1)
+        )
+
+        assert service.top_projects(2, today=today) == ["foo", "bar"]
@@ -10,26 +10,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from itertools import product
+import contextlib
+import datetime
+import json
 
+import freezegun
 import pretend
 import pytest
+import redis
 
-from google.cloud.bigquery import Row, SchemaField
+from google.cloud.bigquery import SchemaField
 from wtforms import Field, Form, StringField
 
 import warehouse.packaging.tasks
 
 from warehouse.accounts.models import WebAuthn
 from warehouse.cache.origin import IOriginCache
+from warehouse.metrics import IMetricsService
+from warehouse.packaging.interfaces import IDownloadStatsService
 from warehouse.packaging.models import Description, Project
 from warehouse.packaging.tasks import (
+    BIGQUERY_RELEASE_FILES_FAILED_KEY,
+    BIGQUERY_RELEASE_FILES_KEY,
+    BIGQUERY_RELEASE_FILES_LOCK,
+    BIGQUERY_RELEASE_FILES_MAX_REJECTIONS,
+    BIGQUERY_RELEASE_FILES_PROCESSING_KEY,
+    BIGQUERY_RELEASE_FILES_REJECTIONS_KEY,
+    BIGQUERY_RELEASE_FILES_TABLES_KEY,
+    buffer_bigquery_release_file,
     compute_2fa_mandate,
     compute_2fa_metrics,
     compute_trending,
+    flush_bigquery_release_files,
     sync_bigquery_release_files,
+    sync_bigquery_release_files_prefix,
     update_bigquery_release_files,
     update_description_html,
+    update_simple_index_shards,
 )
 from warehouse.utils import readme
 
@@ -38,6 +55,7 @@ from ...common.db.packaging import (
     DependencyFactory,
     DescriptionFactory,
     FileFactory,
+    JournalEntryFactory,
     ProjectFactory,
     ReleaseFactory,
     RoleFactory,
@@ -52,20 +70,19 @@ class TestComputeTrending:
             ProjectFactory.create(zscore=1 if not i else None) for i in range(3)
         ]
 
-        results = iter(
-            [
-                Row((projects[1].normalized_name, 2), {"project": 0, "zscore": 1}),
-                Row((projects[2].normalized_name, -1), {"project": 0, "zscore": 1}),
-            ]
+        download_stats = pretend.stub(
+            trending_zscores=pretend.call_recorder(
+                lambda: {
+                    projects[1].normalized_name: 2,
+                    projects[2].normalized_name: -1,
+                }
+            )
         )
-        query = pretend.stub(result=pretend.call_recorder(lambda *a, **kw: results))
-        bigquery = pretend.stub(query=pretend.call_recorder(lambda q: query))
-
         cacher = pretend.stub(purge=pretend.call_recorder(lambda keys: None))
 
         def find_service(iface=None, name=None):
-            if iface is None and name == "gcloud.bigquery":
-                return bigquery
+            if iface is IDownloadStatsService:
+                return download_stats
 
             if with_purges and issubclass(iface, IOriginCache):
                 return cacher
@@ -73,53 +90,10 @@ class TestComputeTrending:
             raise LookupError
 
         db_request.find_service = find_service
-        db_request.registry.settings = {
-            "warehouse.trending_table": "example.pypi.downloads*"
-        }
 
         compute_trending(db_request)
 
-        assert bigquery.query.calls == [
-            pretend.call(
-                """ SELECT project,
-                   IF(
-                        STDDEV(downloads) > 0,
-                        (todays_downloads - AVG(downloads))/STDDEV(downloads),
-                        NULL
-                    ) as zscore
-            FROM (
-                SELECT project,
-                       date,
-                       downloads,
-                       FIRST_VALUE(downloads) OVER (
-                            PARTITION BY project
-                            ORDER BY DATE DESC
-                            ROWS BETWEEN UNBOUNDED PRECEDING
-                                AND UNBOUNDED FOLLOWING
-                        ) as todays_downloads
-                FROM (
-                    SELECT file.project as project,
-                           DATE(timestamp) AS date,
-                           COUNT(*) as downloads
-                    FROM `example.pypi.downloads*`
-                    WHERE _TABLE_SUFFIX BETWEEN
-                        FORMAT_DATE(
-                            "%Y%m%d",
-                            DATE_ADD(CURRENT_DATE(), INTERVAL -31 day))
-                        AND
-                        FORMAT_DATE(
-                            "%Y%m%d",
-                            DATE_ADD(CURRENT_DATE(), INTERVAL -1 day))
-                    GROUP BY file.project, date
-                )
-            )
-            GROUP BY project, todays_downloads
-            HAVING SUM(downloads) >= 5000
-            ORDER BY zscore DESC
-        """
-            )
-        ]
-        assert query.result.calls == [pretend.call()]
+        assert download_stats.trending_zscores.calls == [pretend.call()]
         assert cacher.purge.calls == (
             [pretend.call(["trending"])] if with_purges else []
         )
@@ -132,6 +106,58 @@ class TestComputeTrending:
             projects[2].name: -1,
         }
 
+    @pytest.mark.parametrize(
+        ("rows", "expected"),
+        [
+            # Nothing's trending any more.
+            ([], [None, None, None, None, None, None]),
+            # Only the order of the top two has changed.
+            (
+                [(0, 5), (1, 6), (2, 4), (3, 3), (4, 2), (5, 1)],
+                [5, 6, 4, 3, 2, 1],
+            ),
+        ],
+    )
+    def test_purges_trending_on_change(self, db_request, rows, expected):
+        projects = [ProjectFactory.create(zscore=6 - i) for i in range(6)]
+        self._compute_trending(db_request, projects, rows, purged=True)
+
+        results = dict(db_request.db.query(Project.name, Project.zscore).all())
+        assert results == {p.name: z for p, z in zip(projects, expected)}
+
+    def test_skips_purge_when_unchanged(self, db_request):
+        projects = [ProjectFactory.create(zscore=6 - i) for i in range(6)]
+        # Nothing outside of the top five is shown.
+        rows = [(0, 6), (1, 5), (2, 4), (3, 3), (4, 2), (5, 0.5)]
+        self._compute_trending(db_request, projects, rows, purged=False)
+
+        results = dict(db_request.db.query(Project.name, Project.zscore).all())
+        assert results == {
+            projects[0].name: 6,
+            projects[1].name: 5,
+            projects[2].name: 4,
+            projects[3].name: 3,
+            projects[4].name: 2,
+            projects[5].name: 0.5,
+        }
+
+    def _compute_trending(self, db_request, projects, rows, purged):
+        download_stats = pretend.stub(
+            trending_zscores=lambda: {projects[i].normalized_name: z for i, z in rows}
+        )
+        cacher = pretend.stub(purge=pretend.call_recorder(lambda keys: None))
+
+        def find_service(iface=None, name=None):
+            if iface is IDownloadStatsService:
+                return download_stats
+            return cacher
+
+        db_request.find_service = find_service
+
+        compute_trending(db_request)
+
+        assert cacher.purge.calls == ([pretend.call(["trending"])] if purged else [])
+
 
 def test_update_description_html(monkeypatch, db_request):
     current_version = "24.0"
@@ -199,6 +225,424 @@ bq_schema = [
 ]
 
 
+class TestUpdateSimpleIndexShards:
+    @pytest.fixture
+    def render(self, monkeypatch):
+        render = pretend.call_recorder(lambda request, shard, serial, store: None)
+        monkeypatch.setattr(
+            warehouse.packaging.tasks, "render_simple_index_shard", render
+        )
+        return render
+
+    @pytest.fixture
+    def scheduler_redis(self, monkeypatch, mockredis):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        return mockredis
+
+    @pytest.fixture
+    def task_request(self, db_request):
+        db_request.registry.settings = {"celery.scheduler_url": "redis://redis:0/"}
+        return db_request
+
+    def test_renders_all_shards_first_time(self, task_request, render, scheduler_redis):
+        user = UserFactory.create()
+        JournalEntryFactory.create(name="bar", submitted_by=user)
+        je = JournalEntryFactory.create(name="foo", submitted_by=user)
+
+        update_simple_index_shards(task_request)
+
+        assert render.calls == [
+            pretend.call(task_request, shard, je.id, store=True)
+            for shard in sorted("0123456789abcdefghijklmnopqrstuvwxyz")
+        ]
+        assert scheduler_redis.get("warehouse:simple-index:last-serial") == je.id
+
+    def test_renders_changed_shards(self, task_request, render, scheduler_redis):
+        user = UserFactory.create()
+        old = JournalEntryFactory.create(name="old", submitted_by=user)
+        JournalEntryFactory.create(name="Foo.Bar", submitted_by=user)
+        JournalEntryFactory.create(name="foo", submitted_by=user)
+        JournalEntryFactory.create(name="9-lives", submitted_by=user)
+        JournalEntryFactory.create(name=None, submitted_by=user)
+        je = JournalEntryFactory.create(name="_invalid", submitted_by=user)
+        scheduler_redis.set("warehouse:simple-index:last-serial", str(old.id))
+
+        update_simple_index_shards(task_request)
+
+        assert render.calls == [
+            pretend.call(task_request, "9", je.id, store=True),
+            pretend.call(task_request, "f", je.id, store=True),
+        ]
+        assert scheduler_redis.get("warehouse:simple-index:last-serial") == je.id
+
+    def test_nothing_changed(self, task_request, render, scheduler_redis):
+        je = JournalEntryFactory.create(name="foo", submitted_by=UserFactory.create())
+        scheduler_redis.set("warehouse:simple-index:last-serial", str(je.id))
+
+        update_simple_index_shards(task_request)
+
+        assert render.calls == []
+
+
+@pytest.fixture(autouse=True)
+def table_schemas(monkeypatch):
+    table_schemas = {}
+    monkeypatch.setattr(warehouse.packaging.tasks, "_table_schemas", table_schemas)
+    return table_schemas
+
+
+class FakeBigQuery:
+    """
+    Just enough of a BigQuery client for our tests, keeping the rows inserted
+    into each of its tables in memory.
+    """
+
+    def __init__(self, schemas):
+        self.schemas = schemas
+        self.rows = {table: [] for table in schemas}
+        self.get_table_calls = []
+        self.insert_calls = []
+        self.row_ids = {}
+
+    def get_table(self, table):
+        self.get_table_calls.append(table)
+        return pretend.stub(schema=self.schemas[table])
+
+    def insert_rows_json(self, table, json_rows, row_ids=None):
+        self.insert_calls.append((table, len(json_rows)))
+        if table not in self.rows:
+            raise ValueError(f"No such table {table}")
+        self.rows[table].extend(json_rows)
+        if row_ids is not None:
+            self.row_ids.setdefault(table, []).extend(row_ids)
+        return []
+
+
+def _dist_metadata(**kwargs):
+    dist_metadata = {field.name: None for field in bq_schema}
+    dist_metadata.update(
+        name="foo",
+        version="1.0",
+        platform="any",
+        upload_time=datetime.datetime(2022, 1, 2, 3, 4, 5),
+        has_signature=False,
+    )
+    dist_metadata.update(kwargs)
+    return dist_metadata
+
+
+class TestBufferBigQueryReleaseFile:
+    @pytest.fixture
+    def task_request(self, monkeypatch, mockredis):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        transaction = pretend.stub(hooks=[])
+        transaction.addAfterCommitHook = transaction.hooks.append
+        flush = pretend.stub(delay=pretend.call_recorder(lambda: None))
+        return pretend.stub(
+            registry=pretend.stub(
+                settings={
+                    "celery.scheduler_url": "redis://redis:0/",
+                    "warehouse.release_files_table.batch_size": "2",
+                }
+            ),
+            tm=pretend.stub(get=lambda: transaction),
+            task=pretend.call_recorder(lambda t: flush),
+            transaction=transaction,
+            flush=flush,
+        )
+
+    def test_buffers_on_commit(self, task_request, mockredis):
+        buffer_bigquery_release_file(task_request, _dist_metadata(name="one"))
+        buffer_bigquery_release_file(task_request, _dist_metadata(name="two"))
+
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_KEY)
+
+        for hook in task_request.transaction.hooks:
+            hook(True)
+
+        buffered = mockredis.lrange(BIGQUERY_RELEASE_FILES_KEY, 0, -1)
+        assert [json.loads(row) for row in buffered] == [
+            _dist_metadata(name=name, upload_time="2022-01-02T03:04:05")
+            for name in ["two", "one"]
+        ]
+
+    def test_not_buffered_on_abort(self, task_request, mockredis):
+        buffer_bigquery_release_file(task_request, _dist_metadata())
+
+        for hook in task_request.transaction.hooks:
+            hook(False)
+
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_KEY)
+
+    def test_flushes_full_batches(self, task_request, mockredis):
+        for name in ["one", "two", "three", "four"]:
+            buffer_bigquery_release_file(task_request, _dist_metadata(name=name))
+            task_request.transaction.hooks.pop()(True)
+
+        assert task_request.task.calls == [
+            pretend.call(flush_bigquery_release_files),
+            pretend.call(flush_bigquery_release_files),
+        ]
+        assert task_request.flush.delay.calls == [pretend.call(), pretend.call()]
+
+    def test_unserializable(self, task_request):
+        with pytest.raises(TypeError):
+            buffer_bigquery_release_file(task_request, _dist_metadata(size=object()))
+
+
+class TestFlushBigQueryReleaseFiles:
+    @pytest.fixture
+    def bigquery(self):
+        return FakeBigQuery(
+            {
+                "example.pypi.distributions": bq_schema,
+                "some.other.table": bq_schema[:2],
+            }
+        )
+
+    @pytest.fixture
+    def task_request(self, monkeypatch, mockredis, metrics, bigquery):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+
+        def find_service(iface=None, name=None, context=None):
+            if name == "gcloud.bigquery":
+                return bigquery
+            if iface is IMetricsService:
+                return metrics
+            raise LookupError
+
+        return pretend.stub(
+            find_service=find_service,
+            registry=pretend.stub(
+                settings={
+                    "celery.scheduler_url": "redis://redis:0/",
+                    "warehouse.release_files_table": (
+                        "example.pypi.distributions some.other.table"
+                    ),
+                    "warehouse.release_files_table.batch_size": "2",
+                }
+            ),
+            log=pretend.stub(error=pretend.call_recorder(lambda *a: None)),
+        )
+
+    def _buffer(self, mockredis, *names):
+        for name in names:
+            mockredis.lpush(
+                BIGQUERY_RELEASE_FILES_KEY,
+                json.dumps(
+                    _dist_metadata(
+                        name=name,
+                        upload_time="2022-01-02T03:04:05",
+                        sha256_digest=f"{name}-digest",
+                    )
+                ),
+            )
+
+    def _names(self, mockredis, key):
+        return [json.loads(row)["name"] for row in mockredis.lrange(key, 0, -1)]
+
+    def test_flushes_in_batches(self, task_request, mockredis, metrics, bigquery):
+        self._buffer(mockredis, "one", "two", "three")
+
+        flush_bigquery_release_files(task_request)
+
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_KEY)
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_PROCESSING_KEY)
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_TABLES_KEY)
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_LOCK)
+        assert bigquery.insert_calls == [
+            ("example.pypi.distributions", 2),
+            ("some.other.table", 2),
+            ("example.pypi.distributions", 1),
+            ("some.other.table", 1),
+        ]
+        assert [row["name"] for row in bigquery.rows["some.other.table"]] == [
+            "one",
+            "two",
+            "three",
+        ]
+        assert bigquery.row_ids["some.other.table"] == [
+            "one-digest",
+            "two-digest",
+            "three-digest",
+        ]
+        assert bigquery.rows["example.pypi.distributions"][0] == {
+            **{field.name: None for field in bq_schema},
+            **{field.name: [] for field in bq_schema if field.mode == "REPEATED"},
+            "name": "one",
+            "version": "1.0",
+            "platform": ["any"],
+            "upload_time": "2022-01-02T03:04:05",
+            "has_signature": False,
+            "sha256_digest": "one-digest",
+        }
+        # The schemas are only fetched once.
+        assert bigquery.get_table_calls == [
+            "example.pypi.distributions",
+            "some.other.table",
+        ]
+        assert metrics.increment.calls == [
+            pretend.call("warehouse.bigquery.release_files.flushed", 2),
+            pretend.call("warehouse.bigquery.release_files.flushed", 1),
+        ]
+
+    def test_nothing_buffered(self, task_request, metrics, bigquery):
+        flush_bigquery_release_files(task_request)
+
+        assert bigquery.insert_calls == []
+        assert metrics.increment.calls == []
+
+    def test_failure_keeps_batch(self, task_request, mockredis, metrics, bigquery):
+        task_request.registry.settings["warehouse.release_files_table"] = "missing"
+        bigquery.schemas["missing"] = bq_schema
+        self._buffer(mockredis, "one", "two", "three")
+
+        with pytest.raises(ValueError):
+            flush_bigquery_release_files(task_request)
+
+        assert self._names(mockredis, BIGQUERY_RELEASE_FILES_KEY) == ["three"]
+        assert self._names(mockredis, BIGQUERY_RELEASE_FILES_PROCESSING_KEY) == [
+            "two",
+            "one",
+        ]
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_LOCK)
+        assert metrics.increment.calls == []
+
+    def test_partial_failure_resumes(self, task_request, mockredis, bigquery):
+        task_request.registry.settings[
+            "warehouse.release_files_table"
+        ] = "example.pypi.distributions missing"
+        bigquery.schemas["missing"] = bq_schema
+        self._buffer(mockredis, "one", "two", "three")
+
+        with pytest.raises(ValueError):
+            flush_bigquery_release_files(task_request)
+
+        assert mockredis.smembers(BIGQUERY_RELEASE_FILES_TABLES_KEY) == {
+            "example.pypi.distributions"
+        }
+
+        bigquery.rows["missing"] = []
+        bigquery.insert_calls = []
+        flush_bigquery_release_files(task_request)
+
+        # The first table already has the unfinished batch, so it only gets
+        # the rest of the files.
+        assert bigquery.insert_calls == [
+            ("missing", 2),
+            ("example.pypi.distributions", 1),
+            ("missing", 1),
+        ]
+        for table in ["example.pypi.distributions", "missing"]:
+            assert [row["name"] for row in bigquery.rows[table]] == [
+                "one",
+                "two",
+                "three",
+            ]
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_KEY)
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_PROCESSING_KEY)
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_TABLES_KEY)
+
+    def test_insert_errors_keep_batch(self, task_request, mockredis, bigquery):
+        bigquery.insert_rows_json = lambda **kw: [
+            {"index": 0, "errors": [{"reason": "backendError"}]}
+        ]
+        self._buffer(mockredis, "one")
+
+        with pytest.raises(RuntimeError):
+            flush_bigquery_release_files(task_request)
+
+        assert self._names(mockredis, BIGQUERY_RELEASE_FILES_PROCESSING_KEY) == ["one"]
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_TABLES_KEY)
+        assert mockredis.hget(BIGQUERY_RELEASE_FILES_REJECTIONS_KEY, "one-digest") == 1
+
+    def test_rejected_files_are_set_aside(self, task_request, mockredis, bigquery):
+        insert_rows_json = bigquery.insert_rows_json
+
+        def reject_two(table, json_rows, row_ids):
+            if "two-digest" in row_ids:
+                bigquery.insert_calls.append((table, len(json_rows)))
+                return [
+                    {"index": 0, "errors": [{"reason": "stopped"}]},
+                    {"index": 1, "errors": [{"reason": "invalid"}]},
+                ]
+            return insert_rows_json(table, json_rows, row_ids=row_ids)
+
+        bigquery.insert_rows_json = reject_two
+        self._buffer(mockredis, "one", "two", "three")
+
+        for _ in range(BIGQUERY_RELEASE_FILES_MAX_REJECTIONS):
+            with pytest.raises(RuntimeError):
+                flush_bigquery_release_files(task_request)
+
+        # Only the invalid row counts against its file, and once it has been
+        # rejected too many times, it is set aside.
+        assert mockredis.hgetall(BIGQUERY_RELEASE_FILES_REJECTIONS_KEY) == {}
+        assert self._names(mockredis, BIGQUERY_RELEASE_FILES_FAILED_KEY) == ["two"]
+        assert self._names(mockredis, BIGQUERY_RELEASE_FILES_PROCESSING_KEY) == ["one"]
+        assert task_request.log.error.calls == [
+            pretend.call(
+                "Giving up on adding release file %s to %s",
+                "two-digest",
+                "example.pypi.distributions",
+            )
+        ]
+
+        # Everything else still makes it in.
+        bigquery.insert_calls = []
+        flush_bigquery_release_files(task_request)
+
+        assert bigquery.insert_calls == [
+            ("example.pypi.distributions", 1),
+            ("some.other.table", 1),
+            ("example.pypi.distributions", 1),
+            ("some.other.table", 1),
+        ]
+        for table in ["example.pypi.distributions", "some.other.table"]:
+            assert [row["name"] for row in bigquery.rows[table]] == ["one", "three"]
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_KEY)
+        assert not mockredis.exists(BIGQUERY_RELEASE_FILES_PROCESSING_KEY)
+
+    def test_already_flushing(self, task_request, mockredis, metrics, bigquery):
+        mockredis.set(BIGQUERY_RELEASE_FILES_LOCK, "locked")
+        self._buffer(mockredis, "one")
+
+        flush_bigquery_release_files(task_request)
+
+        assert bigquery.insert_calls == []
+        assert self._names(mockredis, BIGQUERY_RELEASE_FILES_KEY) == ["one"]
+
+    def test_lock_expired(self, task_request, mockredis, bigquery):
+        lock = pretend.stub(
+            acquire=lambda blocking: True,
+            reacquire=lambda: True,
+            release=pretend.raiser(redis.exceptions.LockError),
+        )
+        mockredis.lock = lambda name, **kw: lock
+        self._buffer(mockredis, "one")
+
+        flush_bigquery_release_files(task_request)
+
+        assert bigquery.insert_calls == [
+            ("example.pypi.distributions", 1),
+            ("some.other.table", 1),
+        ]
+
+    def test_schema_expires(self, monkeypatch, task_request, bigquery, table_schemas):
+        now = iter([0, 10, 3601])
+        monkeypatch.setattr(
+            warehouse.packaging.tasks.time, "monotonic", lambda: next(now)
+        )
+
+        for _ in range(3):
+            warehouse.packaging.tasks._get_table_schema(
+                task_request, bigquery, "some.other.table"
+            )
+
+        assert bigquery.get_table_calls == ["some.other.table", "some.other.table"]
+        assert table_schemas == {"some.other.table": (7201, bq_schema[:2])}
+
+
 class TestUpdateBigQueryMetadata:
     class ListField(Field):
         def process_formdata(self, valuelist):
@@ -410,35 +854,197 @@ class TestUpdateBigQueryMetadata:
         ]
 
 
-class TestSyncBigQueryMetadata:
+class TestSyncBigQueryReleaseFiles:
+    @pytest.fixture
+    def bigquery(self):
+        bigquery = pretend.stub(
+            query_results=[],
+            query=pretend.call_recorder(
+                lambda q: pretend.stub(result=lambda: bigquery.query_results.pop(0))
+            ),
+        )
+        return bigquery
+
+    @pytest.fixture
+    def task_request(self, db_request, monkeypatch, mockredis, bigquery):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        sync_prefix = pretend.stub(delay=pretend.call_recorder(lambda *a: None))
+
+        def find_service(name=None):
+            if name == "gcloud.bigquery":
+                return bigquery
+            raise LookupError
+
+        db_request.find_service = find_service
+        db_request.task = pretend.call_recorder(lambda t: sync_prefix)
+        db_request.sync_prefix = sync_prefix
+        db_request.registry.settings = {
+            "celery.scheduler_url": "redis://redis:0/",
+            "warehouse.release_files_table": (
+                "example.pypi.distributions some.other.table"
+            ),
+        }
+        return db_request
+
+    def _files(self, *digests, upload_time=datetime.datetime(2022, 1, 1)):
+        release = ReleaseFactory.create()
+        for md5_digest in digests:
+            FileFactory.create(
+                release=release, md5_digest=md5_digest, upload_time=upload_time
+            )
+
+    def _checksum(self, *digests):
+        return (len(digests), sum(int(digest[2:10], 16) for digest in digests))
+
+    def test_db_prefix_checksums(self, db_request):
+        self._files(
+            "aa" + "f" * 30, "aa" + "0123456789abcdef" * 1 + "0" * 14, "b0" + "1" * 30
+        )
+        self._files("b0" + "2" * 30, upload_time=datetime.datetime(2022, 2, 1))
+        self._files("cc" + "3" * 30, upload_time=datetime.datetime(2021, 1, 1))
+
+        checksums = warehouse.packaging.tasks._db_prefix_checksums(
+            db_request, "2021-06-01T00:00:00", "2022-01-15T00:00:00"
+        )
+
+        assert checksums == {
+            "aa": self._checksum("aa" + "f" * 30, "aa0123456789abcdef"),
+            "b0": self._checksum("b0" + "1" * 30),
+        }
+
+    def test_db_prefix_checksums_shared_bits(self, db_request):
+        # Different digests can share the 32 bits that we sum, and every one of
+        # them has to be counted, just like BigQuery does for distinct digests.
+        self._files("aa12345678" + "0" * 22, "aa12345678" + "f" * 22)
+
+        checksums = warehouse.packaging.tasks._db_prefix_checksums(
+            db_request, None, "2022-01-15T00:00:00"
+        )
+
+        assert checksums == {"aa": (2, 2 * 0x12345678)}
+
+    @freezegun.freeze_time("2022-03-01 12:00:00")
+    def test_syncs_divergent_prefixes(self, task_request, mockredis, bigquery):
+        self._files("aa" + "1" * 30, "bb" + "2" * 30, "bb" + "3" * 30, "cc" + "4" * 30)
+        # Not old enough to expect them in BigQuery yet.
+        self._files("dd" + "5" * 30, upload_time=datetime.datetime(2022, 3, 1, 11))
+        mockredis.set(
+            "warehouse:bigquery:release-files-synced:some.other.table",
+            b"2021-01-01T00:00:00",
+        )
+
+        def rows(**checksums):
+            return [
+                {"prefix": prefix, "count": count, "checksum": checksum}
+                for prefix, (count, checksum) in checksums.items()
+            ]
+
+        bigquery.query_results = [
+            # Everything matches, except for a missing file in bb, and a file
+            # that was since deleted in cc.
+            rows(
+                aa=self._checksum("aa" + "1" * 30),
+                bb=self._checksum("bb" + "2" * 30),
+                cc=self._checksum("cc" + "4" * 30, "cc" + "6" * 30),
+            ),
+            # Only the deleted file.
+            rows(
+                aa=self._checksum("aa" + "1" * 30),
+                bb=self._checksum("bb" + "2" * 30, "bb" + "3" * 30),
+                cc=self._checksum("cc" + "4" * 30, "cc" + "6" * 30),
+            ),
+        ]
+
+        sync_bigquery_release_files(task_request)
+
+        end = "2022-03-01T11:00:00"
+        assert bigquery.query.calls == [
+            pretend.call(
+                "SELECT SUBSTR(md5_digest, 1, 2) AS prefix, "
+                "COUNT(*) AS count, "
+                "SUM(CAST(CONCAT('0x', SUBSTR(md5_digest, 3, 8)) AS INT64)) "
+                "AS checksum "
+                "FROM ("
+                f"SELECT DISTINCT md5_digest FROM {table} "
+                f"WHERE upload_time < TIMESTAMP('{end}'){window}"
+                ") "
+                "GROUP BY prefix"
+            )
+            for table, window in [
+                ("example.pypi.distributions", ""),
+                (
+                    "some.other.table",
+                    " AND upload_time >= TIMESTAMP('2021-01-01T00:00:00')",
+                ),
+            ]
+        ]
+        assert (
+            task_request.task.calls
+            == [pretend.call(sync_bigquery_release_files_prefix)] * 3
+        )
+        assert task_request.sync_prefix.delay.calls == [
+            pretend.call("example.pypi.distributions", "bb", None, end),
+            pretend.call("example.pypi.distributions", "cc", None, end),
+            pretend.call("some.other.table", "cc", "2021-01-01T00:00:00", end),
+        ]
+        # Neither table moves on until the prefixes we're syncing have finished.
+        assert not mockredis.exists(
+            "warehouse:bigquery:release-files-synced:example.pypi.distributions"
+        )
+        assert (
+            mockredis.get("warehouse:bigquery:release-files-synced:some.other.table")
+            == b"2021-01-01T00:00:00"
+        )
+        assert (
+            mockredis.get(
+                "warehouse:bigquery:release-files-sync-pending:"
+                f"example.pypi.distributions:{end}"
+            )
+            == 2
+        )
+        assert (
+            mockredis.get(
+                f"warehouse:bigquery:release-files-sync-pending:some.other.table:{end}"
+            )
+            == 1
+        )
+
+    @freezegun.freeze_time("2022-03-01 12:00:00")
+    def test_in_sync(self, task_request, mockredis, bigquery):
+        self._files("aa" + "1" * 30)
+        bigquery.query_results = [
+            [{"prefix": "aa", "count": 1, "checksum": int("1" * 8, 16)}]
+        ] * 2
+
+        sync_bigquery_release_files(task_request)
+
+        assert task_request.sync_prefix.delay.calls == []
+        for table in ["example.pypi.distributions", "some.other.table"]:
+            assert (
+                mockredis.get(f"warehouse:bigquery:release-files-synced:{table}")
+                == "2022-03-01T11:00:00"
+            )
+
+
+class TestSyncBigQueryReleaseFilesPrefix:
     @pytest.mark.filterwarnings(
         "ignore:This collection has been invalidated.:sqlalchemy.exc.SAWarning"
     )
     @pytest.mark.parametrize(
-        ("release_files_table", "expected_get_table_calls"),
+        ("start", "window"),
         [
+            (None, ""),
             (
-                "example.pypi.distributions",
-                [pretend.call("example.pypi.distributions")],
-            ),
-            (
-                "example.pypi.distributions some.other.table",
-                [
-                    pretend.call("example.pypi.distributions"),
-                    pretend.call("some.other.table"),
-                ],
+                "2008-01-01T00:00:00",
+                " AND upload_time >= TIMESTAMP('2008-01-01T00:00:00')",
             ),
         ],
     )
     @pytest.mark.parametrize("bq_schema", [bq_schema])
     def test_sync_rows(
-        self,
-        db_request,
-        monkeypatch,
-        release_files_table,
-        expected_get_table_calls,
-        bq_schema,
+        self, db_request, monkeypatch, mockredis, start, window, bq_schema
     ):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
         project = ProjectFactory.create()
         description = DescriptionFactory.create()
         release = ReleaseFactory.create(project=project, description=description)
@@ -447,11 +1053,20 @@ class TestSyncBigQueryMetadata:
             release=release,
             filename=f"foobar-{release.version}.tar.gz",
             md5_digest="feca4238a0b923820dcc509a6f75849b",
+            upload_time=datetime.datetime(2022, 1, 1),
         )
         release_file2 = FileFactory.create(
             release=release,
             filename=f"fizzbuzz-{release.version}.tar.gz",
             md5_digest="fecasd342fb952820dcc509a6f75849b",
+            upload_time=datetime.datetime(2022, 1, 1),
+        )
+        # Outside of the window we're syncing.
+        FileFactory.create(
+            release=release,
+            filename=f"later-{release.version}.tar.gz",
+            md5_digest="fe0000342fb952820dcc509a6f75849b",
+            upload_time=datetime.datetime(2022, 3, 1),
         )
         release._classifiers.append(ClassifierFactory.create(classifier="foo :: bar"))
         release._classifiers.append(ClassifierFactory.create(classifier="foo :: baz"))
@@ -484,21 +1099,26 @@ class TestSyncBigQueryMetadata:
             raise LookupError
 
         db_request.find_service = find_service
-        db_request.registry.settings = {
-            "warehouse.release_files_table": release_files_table
-        }
+        db_request.registry.settings = {"celery.scheduler_url": "redis://redis:0/"}
 
-        sync_bigquery_release_files(db_request)
+        task = pretend.stub()
+        sync_bigquery_release_files_prefix(
+            task,
+            db_request,
+            "example.pypi.distributions",
+            "fe",
+            start,
+            "2022-02-01T00:00:00",
+        )
 
         assert db_request.find_service.calls == [pretend.call(name="gcloud.bigquery")]
-        assert bigquery.get_table.calls == expected_get_table_calls
+        assert bigquery.get_table.calls == [pretend.call("example.pypi.distributions")]
         assert bigquery.query.calls == [
-            pretend.call(query.format(table))
-            for table in release_files_table.split()
-            for query in [
-                "SELECT md5_digest FROM {} WHERE md5_digest LIKE 'ff%'",
-                "SELECT md5_digest FROM {} WHERE md5_digest LIKE 'fe%'",
-            ]
+            pretend.call(
+                "SELECT md5_digest FROM example.pypi.distributions "
+                "WHERE md5_digest LIKE 'fe%' AND "
+                f"upload_time < TIMESTAMP('2022-02-01T00:00:00'){window}"
+            )
         ]
         assert bigquery.load_table_from_json.calls == [
             pretend.call(
@@ -543,54 +1163,93 @@ class TestSyncBigQueryMetadata:
                         "blake2_256_digest": release_file.blake2_256_digest,
                     },
                 ],
-                table,
+                "example.pypi.distributions",
                 job_config=None,
             )
-            for table in release_files_table.split()
         ]
 
-    @pytest.mark.parametrize("bq_schema", [bq_schema])
-    def test_no_diff(self, db_request, monkeypatch, bq_schema):
-        project = ProjectFactory.create()
-        release = ReleaseFactory.create(project=project)
-        release_file = FileFactory.create(
-            release=release, filename=f"foobar-{release.version}.tar.gz"
+    def test_sync_in_batches(self, db_request, monkeypatch, mockredis):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        monkeypatch.setattr(warehouse.packaging.tasks, "BIGQUERY_SYNC_BATCH_SIZE", 2)
+        monkeypatch.setattr(
+            "warehouse.packaging.tasks.LoadJobConfig", lambda *a, **kw: None
         )
-
-        query = pretend.stub(
-            result=pretend.call_recorder(
-                lambda *a, **kw: [{"md5_digest": release_file.md5_digest}]
+        release = ReleaseFactory.create()
+        for md5_digest in ["ab" + c * 30 for c in "123"]:
+            FileFactory.create(
+                release=release,
+                md5_digest=md5_digest,
+                upload_time=datetime.datetime(2022, 1, 1),
             )
+
+        bigquery = pretend.stub(
+            get_table=lambda t: pretend.stub(
+                schema=[SchemaField("md5_digest", "STRING")]
+            ),
+            load_table_from_json=pretend.call_recorder(
+                lambda *a, **kw: pretend.stub(result=lambda: None)
+            ),
+            query=lambda q: pretend.stub(result=lambda: []),
         )
-        get_table = pretend.stub(schema=bq_schema)
+        db_request.find_service = lambda name=None: bigquery
+        db_request.registry.settings = {"celery.scheduler_url": "redis://redis:0/"}
+
+        task = pretend.stub()
+        sync_bigquery_release_files_prefix(
+            task, db_request, "some.table", "ab", None, "2022-02-01T00:00:00"
+        )
+
+        assert [
+            sorted(row["md5_digest"] for row in call.args[0])
+            for call in bigquery.load_table_from_json.calls
+        ] == [["ab" + "1" * 30, "ab" + "2" * 30], ["ab" + "3" * 30]]
+
+    def test_last_prefix_moves_table_on(self, db_request, monkeypatch, mockredis):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
         bigquery = pretend.stub(
-            get_table=pretend.call_recorder(lambda t: get_table),
-            query=pretend.call_recorder(lambda q: query),
+            get_table=lambda t: pretend.stub(schema=[]),
+            query=lambda q: pretend.stub(result=lambda: []),
         )
+        db_request.find_service = lambda name=None: bigquery
+        db_request.registry.settings = {"celery.scheduler_url": "redis://redis:0/"}
+        end = "2022-02-01T00:00:00"
+        pending_key = f"warehouse:bigquery:release-files-sync-pending:some.table:{end}"
+        synced_key = "warehouse:bigquery:release-files-synced:some.table"
+        mockredis.set(pending_key, 2)
 
-        @pretend.call_recorder
-        def find_service(name=None):
-            if name == "gcloud.bigquery":
-                return bigquery
-            raise LookupError
+        task = pretend.stub()
+        sync_bigquery_release_files_prefix(
+            task, db_request, "some.table", "aa", None, end
+        )
 
-        db_request.find_service = find_service
-        db_request.registry.settings = {
-            "warehouse.release_files_table": "example.pypi.distributions"
-        }
+        assert mockredis.get(pending_key) == 1
+        assert not mockredis.exists(synced_key)
 
-        sync_bigquery_release_files(db_request)
+        sync_bigquery_release_files_prefix(
+            task, db_request, "some.table", "bb", None, end
+        )
 
-        assert db_request.find_service.calls == [pretend.call(name="gcloud.bigquery")]
-        assert bigquery.get_table.calls == [pretend.call("example.pypi.distributions")]
-        assert bigquery.query.calls == [
-            pretend.call(
-                "SELECT md5_digest "
-                "FROM example.pypi.distributions "
-                f"WHERE md5_digest LIKE '{first}{second}%'",
-            )
-            for first, second in product("fedcba9876543210", repeat=2)
-        ]
+        assert not mockredis.exists(pending_key)
+        assert mockredis.get(synced_key) == end
+
+    def test_expired_run_does_not_move_table_on(
+        self, db_request, monkeypatch, mockredis
+    ):
+        monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+        bigquery = pretend.stub(
+            get_table=lambda t: pretend.stub(schema=[]),
+            query=lambda q: pretend.stub(result=lambda: []),
+        )
+        db_request.find_service = lambda name=None: bigquery
+        db_request.registry.settings = {"celery.scheduler_url": "redis://redis:0/"}
+        end = "2022-02-01T00:00:00"
+
+        task = pretend.stub()
+        sync_bigquery_release_files_prefix(
+            task, db_request, "some.table", "aa", None, end
+        )
+
+        assert mockredis.cache == {}
 
 
 def test_compute_2fa_mandate(db_request, monkeypatch):
@@ -639,27 +1298,27 @@ def test_compute_2fa_mandate(db_request, monkeypatch):
         send_two_factor_mandate_email,
     )
 
-    results = [
-        {"project_name": "new_critical_project"},
-        {"project_name": "previous_critical_project"},
-    ]
-    query = pretend.stub(result=pretend.call_recorder(lambda *a, **kw: results))
-    bigquery = pretend.stub(query=pretend.call_recorder(lambda q: query))
+    download_stats = pretend.stub(
+        top_projects=pretend.call_recorder(
+            lambda limit: ["new_critical_project", "previous_critical_project"]
+        )
+    )
 
     def find_service(iface=None, name=None):
-        if iface is None and name == "gcloud.bigquery":
-            return bigquery
+        if iface is IDownloadStatsService:
+            return download_stats
 
         raise LookupError
 
     db_request.find_service = find_service
     db_request.registry.settings = {
-        "warehouse.downloads_table": "downloads_table",
         "warehouse.two_factor_mandate.cohort_size": 666,
     }
 
     compute_2fa_mandate(db_request)
 
+    assert download_stats.top_projects.calls == [pretend.call(666)]
+
     assert main_dependency.pypi_mandates_2fa
     assert deploy_dependency.pypi_mandates_2fa
     assert previous_critical_project.pypi_mandates_2fa
@@ -719,21 +1378,30 @@ def test_compute_2fa_metrics(db_request, monkeypatch):
         user=non_critical_project_maintainer, project=non_critical_project
     )
 
+    # A maintainer of two critical projects counts as a critical maintainer for
+    # each of them, but only once towards those with 2FA enabled
+    second_critical_project = ProjectFactory.create(pypi_mandates_2fa=True)
+    RoleFactory.create(
+        user=second_critical_project_maintainer, project=second_critical_project
+    )
+
     gauge = pretend.call_recorder(lambda metric, value: None)
-    db_request.find_service = lambda *a, **kw: pretend.stub(gauge=gauge)
+    timed = pretend.call_recorder(lambda metric: contextlib.nullcontext())
+    db_request.find_service = lambda *a, **kw: pretend.stub(gauge=gauge, timed=timed)
 
     compute_2fa_metrics(db_request)
 
+    assert timed.calls == [pretend.call("warehouse.2fa.compute_metrics")]
     assert gauge.calls == [
-        pretend.call("warehouse.2fa.total_critical_projects", 1),
-        pretend.call("warehouse.2fa.total_critical_maintainers", 3),
+        pretend.call("warehouse.2fa.total_critical_projects", 2),
+        pretend.call("warehouse.2fa.total_critical_maintainers", 4),
         pretend.call("warehouse.2fa.total_critical_maintainers_with_totp_enabled", 1),
         pretend.call(
             "warehouse.2fa.total_critical_maintainers_with_webauthn_enabled", 1
         ),
         pretend.call("warehouse.2fa.total_critical_maintainers_with_2fa_enabled", 2),
         pretend.call("warehouse.2fa.total_projects_with_2fa_opt_in", 1),
-        pretend.call("warehouse.2fa.total_projects_with_two_factor_required", 2),
+        pretend.call("warehouse.2fa.total_projects_with_two_factor_required", 3),
         pretend.call("warehouse.2fa.total_users_with_totp_enabled", 2),
         pretend.call("warehouse.2fa.total_users_with_webauthn_enabled", 1),
         pretend.call("warehouse.2fa.total_users_with_two_factor_enabled", 3),
@@ -10,15 +10,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import hashlib
 import tempfile
 
+from contextlib import contextmanager
+
+import orjson
 import pretend
+import pytest
+
+from packaging.utils import canonicalize_name
 
+from warehouse.packaging import utils
 from warehouse.packaging.interfaces import ISimpleStorage
-from warehouse.packaging.utils import _simple_detail, render_simple_detail
+from warehouse.packaging.utils import (
+    _simple_detail,
+    _simple_index,
+    iter_journal_entries,
+    render_simple_detail,
+    render_simple_index_shard,
+    trending_project_ids,
+)
 
-from ...common.db.packaging import ProjectFactory
+from ...common.db.packaging import JournalEntryFactory, ProjectFactory
 
 
 def test_render_simple_detail(db_request, monkeypatch, jinja):
@@ -88,15 +103,20 @@ def test_render_simple_detail_with_store(db_request, monkeypatch, jinja):
 
     monkeypatch.setattr(tempfile, "NamedTemporaryFile", FakeNamedTemporaryFile)
 
+    context = _simple_detail(project, db_request)
     template = jinja.get_template("templates/api/simple/detail.html")
-    expected_content = template.render(
-        **_simple_detail(project, db_request), request=db_request
-    ).encode("utf-8")
+    expected_content = template.render(**context, request=db_request).encode("utf-8")
+    expected_json_content = orjson.dumps(
+        context, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+    )
 
     content_hash, path = render_simple_detail(project, db_request, store=True)
 
-    assert fake_named_temporary_file.write.calls == [pretend.call(expected_content)]
-    assert fake_named_temporary_file.flush.calls == [pretend.call()]
+    assert fake_named_temporary_file.write.calls == [
+        pretend.call(expected_content),
+        pretend.call(expected_json_content),
+    ]
+    assert fake_named_temporary_file.flush.calls == [pretend.call(), pretend.call()]
 
     assert fakeblake2b.calls == [pretend.call(digest_size=32)]
     assert fake_hasher.update.calls == [pretend.call(expected_content)]
@@ -124,6 +144,27 @@ def test_render_simple_detail_with_store(db_request, monkeypatch, jinja):
                 "hash": "deadbeefdeadbeefdeadbeefdeadbeef",
             },
         ),
+        pretend.call(
+            (
+                f"{project.normalized_name}/deadbeefdeadbeefdeadbeefdeadbeef"
+                + f".{project.normalized_name}.json"
+            ),
+            "/tmp/wutang",
+            meta={
+                "project": project.normalized_name,
+                "pypi-last-serial": project.last_serial,
+                "hash": "deadbeefdeadbeefdeadbeefdeadbeef",
+            },
+        ),
+        pretend.call(
+            f"{project.normalized_name}/index.json",
+            "/tmp/wutang",
+            meta={
+                "project": project.normalized_name,
+                "pypi-last-serial": project.last_serial,
+                "hash": "deadbeefdeadbeefdeadbeefdeadbeef",
+            },
+        ),
     ]
 
     assert content_hash == "deadbeefdeadbeefdeadbeefdeadbeef"
@@ -131,3 +172,138 @@ def test_render_simple_detail_with_store(db_request, monkeypatch, jinja):
         f"{project.normalized_name}/deadbeefdeadbeefdeadbeefdeadbeef"
         + f".{project.normalized_name}.html"
     )
+
+
+def test_simple_index_shard(db_request):
+    projects = [
+        ProjectFactory.create(name=name) for name in ["foo", "Bar", "fOO-Bar", "ofoo"]
+    ]
+
+    assert _simple_index(db_request, 7, shard="f") == {
+        "meta": {"api-version": "1.0", "_last-serial": 7},
+        "projects": [
+            {"name": p.name, "_last-serial": p.last_serial}
+            for p in [projects[0], projects[2]]
+        ],
+    }
+
+
+def test_trending_project_ids(db_session):
+    ProjectFactory.create_batch(3)
+    tied = sorted(ProjectFactory.create_batch(5, zscore=1.0), key=lambda p: p.id)
+    top = ProjectFactory.create(zscore=2.0)
+    db_session.flush()
+
+    # Projects without a zscore aren't trending, and ties are broken by id.
+    assert trending_project_ids(db_session) == [top.id] + [p.id for p in tied[:4]]
+
+
+def test_render_simple_index_shard(db_request, jinja):
+    ProjectFactory.create(name="foo")
+    jinja.filters["canonicalize_name"] = canonicalize_name
+    db_request.route_path = lambda route, name: f"/simple/{name}/"
+    db_request.find_service = pretend.call_recorder(lambda *a, **kw: None)
+
+    assert render_simple_index_shard(db_request, "f", 7) == "_index/f.html"
+    assert db_request.find_service.calls == []
+
+
+def test_render_simple_index_shard_with_store(db_request, monkeypatch, jinja):
+    ProjectFactory.create(name="foo")
+    jinja.filters["canonicalize_name"] = canonicalize_name
+    db_request.route_path = lambda route, name: f"/simple/{name}/"
+
+    storage_service = pretend.stub(
+        store=pretend.call_recorder(lambda path, file_path, *, meta=None: None)
+    )
+    db_request.find_service = pretend.call_recorder(
+        lambda svc, name=None, context=None: {
+            ISimpleStorage: storage_service,
+        }.get(svc)
+    )
+
+    fake_named_temporary_file = pretend.stub(
+        name="/tmp/wutang",
+        write=pretend.call_recorder(lambda data: None),
+        flush=pretend.call_recorder(lambda: None),
+    )
+
+    class FakeNamedTemporaryFile:
+        def __enter__(self):
+            return fake_named_temporary_file
+
+        def __exit__(self, type, value, traceback):
+            pass
+
+    monkeypatch.setattr(tempfile, "NamedTemporaryFile", FakeNamedTemporaryFile)
+
+    context = _simple_index(db_request, 7, shard="f")
+    template = jinja.get_template("templates/api/simple/index.html")
+    expected_content = template.render(**context, request=db_request).encode("utf-8")
+    expected_json_content = orjson.dumps(
+        context, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+    )
+
+    assert render_simple_index_shard(db_request, "f", 7, store=True) == (
+        "_index/f.html"
+    )
+
+    assert fake_named_temporary_file.write.calls == [
+        pretend.call(expected_content),
+        pretend.call(expected_json_content),
+    ]
+    assert storage_service.store.calls == [
+        pretend.call(
+            "_index/f.html", "/tmp/wutang", meta={"shard": "f", "pypi-last-serial": 7}
+        ),
+        pretend.call(
+            "_index/f.json", "/tmp/wutang", meta={"shard": "f", "pypi-last-serial": 7}
+        ),
+    ]
+
+
+class TestIterJournalEntries:
+    @pytest.fixture
+    def db_request(self, db_request):
+        @contextmanager
+        def connect():
+            yield db_request.db.connection()
+
+        db_request.registry["sqlalchemy.engine"] = pretend.stub(connect=connect)
+        return db_request
+
+    @pytest.mark.parametrize(
+        ("kwargs", "expected"),
+        [
+            ({}, [[0, 1, 2], [3, 4, 5], [6]]),
+            ({"serial": 1}, [[2, 3, 4], [5, 6]]),
+            ({"serial": 0, "limit": 4}, [[1, 2, 3], [4]]),
+            ({"serial": 0, "limit": 3}, [[1, 2, 3]]),
+            ({"serial": 3}, [[4, 5, 6]]),
+            ({"serial": 6}, []),
+        ],
+    )
+    def test_pages(self, db_request, monkeypatch, kwargs, expected):
+        monkeypatch.setattr(utils, "JOURNAL_PAGE_SIZE", 3)
+        entries = [JournalEntryFactory.create() for _ in range(7)]
+        if "serial" in kwargs:
+            kwargs["serial"] = entries[kwargs["serial"]].id
+
+        pages = iter_journal_entries(db_request, **kwargs)
+
+        assert [[e.id for e in page] for page in pages] == [
+            [entries[i].id for i in page] for page in expected
+        ]
+
+    def test_since(self, db_request):
+        now = datetime.datetime.utcnow()
+        JournalEntryFactory.create(submitted_date=now - datetime.timedelta(days=1))
+        entry = JournalEntryFactory.create(submitted_date=now)
+
+        pages = iter_journal_entries(
+            db_request, since=now - datetime.timedelta(hours=1)
+        )
+
+        assert [[(e.name, e.id) for e in page] for page in pages] == [
+            [(entry.name, entry.id)]
+        ]
@@ -11,6 +11,7 @@
 # limitations under the License.
 
 import os
+import uuid
 
 import celery
 import elasticsearch
@@ -23,11 +24,15 @@ from first import first
 
 import warehouse.search.tasks
 
+from warehouse.packaging.models import Project
 from warehouse.search.tasks import (
+    REINDEX_SHARDS,
     SearchLock,
     _project_docs,
+    finish_reindex,
     reindex,
     reindex_project,
+    reindex_shard,
     unindex_project,
 )
 
@@ -153,6 +158,17 @@ def test_project_docs_empty(db_session):
     ]
 
 
+def test_project_docs_range(db_session):
+    projects = sorted((ProjectFactory.create() for _ in range(3)), key=lambda p: p.id)
+    for project in projects:
+        release = ReleaseFactory.create(project=project)
+        FileFactory.create(release=release, filename=f"{project.name}.tar.gz")
+
+    docs = _project_docs(db_session, start=projects[0].id, end=projects[1].id)
+
+    assert [d["_id"] for d in docs] == [projects[1].normalized_name]
+
+
 class FakeESIndices:
     def __init__(self):
         self.indices = {}
@@ -161,6 +177,7 @@ class FakeESIndices:
         self.put_settings = pretend.call_recorder(lambda *a, **kw: None)
         self.delete = pretend.call_recorder(lambda *a, **kw: None)
         self.create = pretend.call_recorder(lambda *a, **kw: None)
+        self.delete_alias = pretend.call_recorder(lambda *a, **kw: None)
 
     def exists_alias(self, name):
         return name in self.aliases
@@ -220,221 +237,145 @@ class TestSearchLock:
         assert lock_stub.acquire.calls == [pretend.call()]
 
 
-class TestReindex:
-    def test_fails_when_raising(self, db_request, monkeypatch):
-        docs = pretend.stub()
-
-        def project_docs(db):
-            return docs
-
-        monkeypatch.setattr(warehouse.search.tasks, "_project_docs", project_docs)
-
-        task = pretend.stub()
-        es_client = FakeESClient()
-
-        db_request.registry.update({"elasticsearch.index": "warehouse"})
-        db_request.registry.settings = {
-            "elasticsearch.url": "http://some.url",
-            "celery.scheduler_url": "redis://redis:6379/0",
-        }
-        monkeypatch.setattr(
-            warehouse.search.tasks.elasticsearch,
-            "Elasticsearch",
-            lambda *a, **kw: es_client,
-        )
-
-        class TestError(Exception):
-            pass
-
-        def parallel_bulk(client, iterable, index=None):
-            assert client is es_client
-            assert iterable is docs
-            assert index == "warehouse-cbcbcbcbcb"
-            raise TestError
-
-        monkeypatch.setattr(
-            redis.StrictRedis, "from_url", lambda *a, **kw: pretend.stub(lock=NotLock)
-        )
+class FakeLock:
+    def __init__(self, acquired=True):
+        self.acquired = acquired
+        self.local = pretend.stub(token=None)
+        self.acquire = pretend.call_recorder(self._acquire)
+        self.release = pretend.call_recorder(lambda: None)
+
+    def _acquire(self, token=None):
+        self.local.token = token
+        return self.acquired
+
+
+@pytest.fixture
+def scheduler_redis(monkeypatch, mockredis):
+    mockredis.lock = pretend.call_recorder(lambda *a, **kw: FakeLock())
+    monkeypatch.setattr(redis.StrictRedis, "from_url", mockredis.from_url)
+    return mockredis
+
+
+@pytest.fixture
+def task_request(db_request, monkeypatch):
+    es_client = FakeESClient()
+    monkeypatch.setattr(
+        warehouse.search.tasks.elasticsearch, "Elasticsearch", lambda **kw: es_client
+    )
+    db_request.registry.update(
+        {"elasticsearch.index": "warehouse", "elasticsearch.shards": 42}
+    )
+    db_request.registry.settings = {
+        "elasticsearch.url": "http://some.url",
+        "celery.scheduler_url": "redis://redis:6379/0",
+    }
+    db_request.es_client = es_client
+    db_request.delayed = []
+    db_request.task = lambda task: pretend.stub(
+        delay=lambda *a: db_request.delayed.append((task, a))
+    )
+    return db_request
 
-        monkeypatch.setattr(warehouse.search.tasks, "parallel_bulk", parallel_bulk)
 
+class TestReindex:
+    def test_dispatches_shards(self, task_request, scheduler_redis, monkeypatch):
         monkeypatch.setattr(os, "urandom", lambda n: b"\xcb" * n)
-
-        with pytest.raises(TestError):
-            reindex(task, db_request)
-
-        assert es_client.indices.delete.calls == [
-            pretend.call(index="warehouse-cbcbcbcbcb")
-        ]
-        assert es_client.indices.put_settings.calls == []
-
-    def test_retry_on_lock(self, db_request, monkeypatch):
-        task = pretend.stub(
-            retry=pretend.call_recorder(pretend.raiser(celery.exceptions.Retry))
-        )
-
-        db_request.registry.settings = {"celery.scheduler_url": "redis://redis:6379/0"}
-
-        le = redis.exceptions.LockError()
-        monkeypatch.setattr(
-            redis.StrictRedis,
-            "from_url",
-            lambda *a, **kw: pretend.stub(lock=pretend.raiser(le)),
+        ids = [uuid.uuid4(), uuid.uuid4()]
+        column_ranges = pretend.call_recorder(
+            lambda db, column, count: [(None, ids[0]), (ids[0], ids[1]), (ids[1], None)]
         )
+        monkeypatch.setattr(warehouse.search.tasks, "column_ranges", column_ranges)
 
-        with pytest.raises(celery.exceptions.Retry):
-            reindex(task, db_request)
+        reindex(pretend.stub(), task_request)
 
-        assert task.retry.calls == [pretend.call(countdown=60, exc=le)]
-
-    def test_successfully_indexes_and_adds_new(self, db_request, monkeypatch):
-
-        docs = pretend.stub()
-
-        def project_docs(db):
-            return docs
-
-        monkeypatch.setattr(warehouse.search.tasks, "_project_docs", project_docs)
-
-        task = pretend.stub()
-        es_client = FakeESClient()
-
-        db_request.registry.update(
-            {"elasticsearch.index": "warehouse", "elasticsearch.shards": 42}
-        )
-        db_request.registry.settings = {
-            "elasticsearch.url": "http://some.url",
-            "celery.scheduler_url": "redis://redis:6379/0",
-        }
-        monkeypatch.setattr(
-            warehouse.search.tasks.elasticsearch,
-            "Elasticsearch",
-            lambda *a, **kw: es_client,
-        )
-        monkeypatch.setattr(
-            redis.StrictRedis, "from_url", lambda *a, **kw: pretend.stub(lock=NotLock)
-        )
-
-        parallel_bulk = pretend.call_recorder(lambda client, iterable, index: [None])
-        monkeypatch.setattr(warehouse.search.tasks, "parallel_bulk", parallel_bulk)
-
-        monkeypatch.setattr(os, "urandom", lambda n: b"\xcb" * n)
-
-        reindex(task, db_request)
-
-        assert parallel_bulk.calls == [
-            pretend.call(es_client, docs, index="warehouse-cbcbcbcbcb")
-        ]
-        assert es_client.indices.create.calls == [
+        assert task_request.es_client.indices.create.calls == [
             pretend.call(
                 body={
                     "settings": {
                         "number_of_shards": 42,
                         "number_of_replicas": 0,
                         "refresh_interval": "-1",
-                    }
+                    },
+                    "aliases": {"warehouse-cbcbcbcbcb-reindex": {}},
                 },
                 wait_for_active_shards=42,
                 index="warehouse-cbcbcbcbcb",
             )
         ]
-        assert es_client.indices.delete.calls == []
-        assert es_client.indices.aliases == {"warehouse": ["warehouse-cbcbcbcbcb"]}
-        assert es_client.indices.put_settings.calls == [
+        lock = scheduler_redis.lock.calls
+        assert lock == [
             pretend.call(
-                index="warehouse-cbcbcbcbcb",
-                body={"index": {"number_of_replicas": 0, "refresh_interval": "1s"}},
+                "search-index",
+                timeout=2 * 60 * 60,
+                blocking_timeout=30,
+                thread_local=False,
             )
         ]
+        assert scheduler_redis.cache == {
+            "search-reindex:warehouse-cbcbcbcbcb": {
+                "lock": "cb" * 16,
+                "remaining": 3,
+            }
+        }
+        assert column_ranges.calls == [
+            pretend.call(task_request.db, Project.id, REINDEX_SHARDS)
+        ]
+        assert task_request.delayed == [
+            (reindex_shard, ("warehouse-cbcbcbcbcb", 0, None, str(ids[0]))),
+            (reindex_shard, ("warehouse-cbcbcbcbcb", 1, str(ids[0]), str(ids[1]))),
+            (reindex_shard, ("warehouse-cbcbcbcbcb", 2, str(ids[1]), None)),
+        ]
+        assert task_request.es_client.indices.put_settings.calls == []
 
-    def test_successfully_indexes_and_replaces(self, db_request, monkeypatch):
-        docs = pretend.stub()
-        task = pretend.stub()
-
-        def project_docs(db):
-            return docs
-
-        monkeypatch.setattr(warehouse.search.tasks, "_project_docs", project_docs)
+    def test_fails_when_raising(self, task_request, scheduler_redis, monkeypatch):
+        lock = FakeLock()
+        scheduler_redis.lock = lambda *a, **kw: lock
+        monkeypatch.setattr(os, "urandom", lambda n: b"\xcb" * n)
 
-        es_client = FakeESClient()
-        es_client.indices.indices["warehouse-aaaaaaaaaa"] = None
-        es_client.indices.aliases["warehouse"] = ["warehouse-aaaaaaaaaa"]
-        db_engine = pretend.stub()
+        class TestError(Exception):
+            pass
 
-        db_request.registry.update(
-            {
-                "elasticsearch.index": "warehouse",
-                "elasticsearch.shards": 42,
-                "sqlalchemy.engine": db_engine,
-            }
-        )
-        db_request.registry.settings = {
-            "elasticsearch.url": "http://some.url",
-            "celery.scheduler_url": "redis://redis:6379/0",
-        }
-        monkeypatch.setattr(
-            warehouse.search.tasks.elasticsearch,
-            "Elasticsearch",
-            lambda *a, **kw: es_client,
-        )
         monkeypatch.setattr(
-            redis.StrictRedis, "from_url", lambda *a, **kw: pretend.stub(lock=NotLock)
+            warehouse.search.tasks, "column_ranges", pretend.raiser(TestError)
         )
 
-        parallel_bulk = pretend.call_recorder(lambda client, iterable, index: [None])
-        monkeypatch.setattr(warehouse.search.tasks, "parallel_bulk", parallel_bulk)
-
-        monkeypatch.setattr(os, "urandom", lambda n: b"\xcb" * n)
-
-        reindex(task, db_request)
+        with pytest.raises(TestError):
+            reindex(pretend.stub(), task_request)
 
-        assert parallel_bulk.calls == [
-            pretend.call(es_client, docs, index="warehouse-cbcbcbcbcb")
-        ]
-        assert es_client.indices.create.calls == [
-            pretend.call(
-                body={
-                    "settings": {
-                        "number_of_shards": 42,
-                        "number_of_replicas": 0,
-                        "refresh_interval": "-1",
-                    }
-                },
-                wait_for_active_shards=42,
-                index="warehouse-cbcbcbcbcb",
-            )
-        ]
-        assert es_client.indices.delete.calls == [pretend.call("warehouse-aaaaaaaaaa")]
-        assert es_client.indices.aliases == {"warehouse": ["warehouse-cbcbcbcbcb"]}
-        assert es_client.indices.put_settings.calls == [
-            pretend.call(
-                index="warehouse-cbcbcbcbcb",
-                body={"index": {"number_of_replicas": 0, "refresh_interval": "1s"}},
-            )
+        assert task_request.es_client.indices.delete.calls == [
+            pretend.call(index="warehouse-cbcbcbcbcb")
         ]
+        assert lock.release.calls == [pretend.call()]
+        assert lock.local.token == "cb" * 16
+        assert task_request.delayed == []
+
+    @pytest.mark.parametrize(
+        "acquire", [pretend.raiser(redis.exceptions.LockError()), lambda token: False]
+    )
+    def test_retry_on_lock(self, task_request, scheduler_redis, acquire):
+        task = pretend.stub(
+            retry=pretend.call_recorder(pretend.raiser(celery.exceptions.Retry))
+        )
+        scheduler_redis.lock = lambda *a, **kw: pretend.stub(acquire=acquire)
 
-    def test_client_aws(self, db_request, monkeypatch):
-        docs = pretend.stub()
-
-        def project_docs(db):
-            return docs
+        with pytest.raises(celery.exceptions.Retry):
+            reindex(task, task_request)
 
-        monkeypatch.setattr(warehouse.search.tasks, "_project_docs", project_docs)
+        assert len(task.retry.calls) == 1
+        assert task.retry.calls[0].kwargs["countdown"] == 60
+        assert isinstance(task.retry.calls[0].kwargs["exc"], redis.exceptions.LockError)
+        assert task_request.es_client.indices.create.calls == []
 
-        task = pretend.stub()
+    def test_client_aws(self, db_request, monkeypatch):
         aws4auth_stub = pretend.stub()
         aws4auth = pretend.call_recorder(lambda *a, **kw: aws4auth_stub)
         es_client = FakeESClient()
         es_client_init = pretend.call_recorder(lambda *a, **kw: es_client)
 
-        db_request.registry.update(
-            {"elasticsearch.index": "warehouse", "elasticsearch.shards": 42}
-        )
         db_request.registry.settings = {
             "aws.key_id": "AAAAAAAAAAAAAAAAAA",
             "aws.secret_key": "deadbeefdeadbeefdeadbeef",
             "elasticsearch.url": "https://some.url?aws_auth=1&region=us-east-2",
-            "celery.scheduler_url": "redis://redis:6379/0",
         }
         monkeypatch.setattr(
             warehouse.search.tasks.requests_aws4auth, "AWS4Auth", aws4auth
@@ -442,16 +383,8 @@ class TestReindex:
         monkeypatch.setattr(
             warehouse.search.tasks.elasticsearch, "Elasticsearch", es_client_init
         )
-        monkeypatch.setattr(
-            redis.StrictRedis, "from_url", lambda *a, **kw: pretend.stub(lock=NotLock)
-        )
-
-        parallel_bulk = pretend.call_recorder(lambda client, iterable, index: [None])
-        monkeypatch.setattr(warehouse.search.tasks, "parallel_bulk", parallel_bulk)
-
-        monkeypatch.setattr(os, "urandom", lambda n: b"\xcb" * n)
 
-        reindex(task, db_request)
+        assert warehouse.search.tasks._reindex_client(db_request) is es_client
 
         assert len(es_client_init.calls) == 1
         assert es_client_init.calls[0].kwargs["hosts"] == ["https://some.url"]
@@ -468,30 +401,214 @@ class TestReindex:
             )
         ]
 
-        assert parallel_bulk.calls == [
-            pretend.call(es_client, docs, index="warehouse-cbcbcbcbcb")
-        ]
-        assert es_client.indices.create.calls == [
-            pretend.call(
-                body={
-                    "settings": {
-                        "number_of_shards": 42,
-                        "number_of_replicas": 0,
-                        "refresh_interval": "-1",
-                    }
-                },
-                wait_for_active_shards=42,
-                index="warehouse-cbcbcbcbcb",
-            )
+
+class TestReindexShard:
+    @pytest.fixture
+    def parallel_bulk(self, monkeypatch):
+        docs = ["doc0", "doc1", "doc2"]
+        monkeypatch.setattr(warehouse.search.tasks, "REINDEX_CHUNK_SIZE", 2)
+        monkeypatch.setattr(
+            warehouse.search.tasks,
+            "_project_docs",
+            lambda db, start=None, end=None: docs if (start, end) == ("a", "b") else [],
+        )
+
+        @pretend.call_recorder
+        def parallel_bulk(client, actions, **kwargs):
+            for doc in actions:
+                if parallel_bulk.before_doc is not None:
+                    parallel_bulk.before_doc(doc)
+                parallel_bulk.sent.append(doc)
+                yield None
+
+        parallel_bulk.before_doc = None
+        parallel_bulk.sent = []
+        monkeypatch.setattr(warehouse.search.tasks, "parallel_bulk", parallel_bulk)
+        return parallel_bulk
+
+    def test_indexes_range(self, task_request, scheduler_redis, parallel_bulk):
+        scheduler_redis.hset("search-reindex:new", mapping={"remaining": 2})
+
+        reindex_shard(pretend.stub(), task_request, "new", 1, "a", "b")
+
+        assert len(parallel_bulk.calls) == 1
+        assert parallel_bulk.calls[0].args[0] is task_request.es_client
+        assert parallel_bulk.calls[0].kwargs == {
+            "index": "new-reindex",
+            "chunk_size": 2,
+            "require_alias": True,
+        }
+        assert parallel_bulk.sent == ["doc0", "doc1", "doc2"]
+        assert scheduler_redis.cache["search-reindex:new"] == {
+            "remaining": 1,
+            "done:1": 1,
+        }
+        assert task_request.delayed == []
+
+        # Redelivering a range that's already done doesn't count it again.
+        reindex_shard(pretend.stub(), task_request, "new", 1, "a", "b")
+
+        assert len(parallel_bulk.calls) == 1
+        assert scheduler_redis.cache["search-reindex:new"]["remaining"] == 1
+
+    def test_last_range_finishes(self, task_request, scheduler_redis, parallel_bulk):
+        scheduler_redis.hset("search-reindex:new", mapping={"remaining": 1})
+
+        reindex_shard(pretend.stub(), task_request, "new", 0, "a", "b")
+
+        assert task_request.delayed == [(finish_reindex, ("new",))]
+
+    def test_abandoned(self, task_request, scheduler_redis, parallel_bulk):
+        reindex_shard(pretend.stub(), task_request, "new", 0, "a", "b")
+
+        assert parallel_bulk.calls == []
+
+    def test_abandoned_while_indexing(
+        self, task_request, scheduler_redis, parallel_bulk
+    ):
+        scheduler_redis.hset("search-reindex:new", mapping={"remaining": 1})
+
+        def abandon(doc):
+            if doc == "doc1":
+                scheduler_redis.delete("search-reindex:new")
+
+        parallel_bulk.before_doc = abandon
+
+        reindex_shard(pretend.stub(), task_request, "new", 0, "a", "b")
+
+        # We stop before the next chunk, and don't recreate the checkpoint.
+        assert parallel_bulk.sent == ["doc0", "doc1"]
+        assert scheduler_redis.cache == {}
+        assert task_request.delayed == []
+
+    def test_abandoned_while_failing(self, task_request, scheduler_redis, monkeypatch):
+        scheduler_redis.hset("search-reindex:new", mapping={"remaining": 1})
+        task = pretend.stub(
+            request=pretend.stub(retries=0),
+            max_retries=5,
+            retry=pretend.call_recorder(pretend.raiser(celery.exceptions.Retry)),
+        )
+
+        class TestError(Exception):
+            pass
+
+        def parallel_bulk(*a, **kw):
+            # Once the index and its alias are gone, writes to it fail rather
+            # than recreating it.
+            scheduler_redis.delete("search-reindex:new")
+            raise TestError
+
+        monkeypatch.setattr(warehouse.search.tasks, "parallel_bulk", parallel_bulk)
+
+        reindex_shard(task, task_request, "new", 0, "a", "b")
+
+        assert task.retry.calls == []
+        assert task_request.es_client.indices.delete.calls == []
+        assert scheduler_redis.cache == {}
+
+    def test_retries_alone(self, task_request, scheduler_redis, monkeypatch):
+        scheduler_redis.hset("search-reindex:new", mapping={"remaining": 2})
+        task = pretend.stub(
+            request=pretend.stub(retries=0),
+            max_retries=5,
+            retry=pretend.call_recorder(pretend.raiser(celery.exceptions.Retry)),
+        )
+
+        class TestError(Exception):
+            pass
+
+        monkeypatch.setattr(
+            warehouse.search.tasks, "parallel_bulk", pretend.raiser(TestError)
+        )
+
+        with pytest.raises(celery.exceptions.Retry):
+            reindex_shard(task, task_request, "new", 0, "a", "b")
+
+        assert len(task.retry.calls) == 1
+        assert isinstance(task.retry.calls[0].kwargs["exc"], TestError)
+        assert scheduler_redis.cache["search-reindex:new"] == {"remaining": 2}
+        assert task_request.es_client.indices.delete.calls == []
+
+    @pytest.mark.parametrize("token", ["token", None])
+    def test_abandons_after_retries(
+        self, task_request, scheduler_redis, monkeypatch, token
+    ):
+        lock = FakeLock()
+        scheduler_redis.lock = pretend.call_recorder(lambda *a, **kw: lock)
+        scheduler_redis.hset("search-reindex:new", mapping={"remaining": 2})
+        if token is not None:
+            scheduler_redis.hset("search-reindex:new", "lock", token)
+        task = pretend.stub(request=pretend.stub(retries=5), max_retries=5)
+
+        class TestError(Exception):
+            pass
+
+        monkeypatch.setattr(
+            warehouse.search.tasks, "parallel_bulk", pretend.raiser(TestError)
+        )
+
+        with pytest.raises(TestError):
+            reindex_shard(task, task_request, "new", 0, "a", "b")
+
+        assert "search-reindex:new" not in scheduler_redis.cache
+        assert task_request.es_client.indices.delete.calls == [
+            pretend.call(index="new")
         ]
+        if token is not None:
+            assert scheduler_redis.lock.calls == [
+                pretend.call("search-index", thread_local=False)
+            ]
+            assert lock.release.calls == [pretend.call()]
+        else:
+            assert scheduler_redis.lock.calls == []
+
+
+class TestFinishReindex:
+    def test_adds_new(self, task_request, scheduler_redis):
+        lock = FakeLock()
+        scheduler_redis.lock = lambda *a, **kw: lock
+        scheduler_redis.hset("search-reindex:warehouse-new", mapping={"lock": "t"})
+
+        finish_reindex(pretend.stub(), task_request, "warehouse-new")
+
+        es_client = task_request.es_client
         assert es_client.indices.delete.calls == []
-        assert es_client.indices.aliases == {"warehouse": ["warehouse-cbcbcbcbcb"]}
+        assert es_client.indices.delete_alias.calls == [
+            pretend.call(index="warehouse-new", name="warehouse-new-reindex")
+        ]
+        assert es_client.indices.aliases == {"warehouse": ["warehouse-new"]}
         assert es_client.indices.put_settings.calls == [
             pretend.call(
-                index="warehouse-cbcbcbcbcb",
+                index="warehouse-new",
                 body={"index": {"number_of_replicas": 0, "refresh_interval": "1s"}},
             )
         ]
+        assert scheduler_redis.cache == {}
+        assert lock.local.token == "t"
+        assert lock.release.calls == [pretend.call()]
+
+    def test_replaces(self, task_request, scheduler_redis):
+        lock = FakeLock()
+        lock.release = pretend.raiser(redis.exceptions.LockNotOwnedError)
+        scheduler_redis.lock = lambda *a, **kw: lock
+        scheduler_redis.hset("search-reindex:warehouse-new", mapping={"lock": "t"})
+        es_client = task_request.es_client
+        es_client.indices.indices["warehouse-aaaaaaaaaa"] = None
+        es_client.indices.aliases["warehouse"] = ["warehouse-aaaaaaaaaa"]
+
+        finish_reindex(pretend.stub(), task_request, "warehouse-new")
+
+        assert es_client.indices.delete.calls == [pretend.call("warehouse-aaaaaaaaaa")]
+        assert es_client.indices.aliases == {"warehouse": ["warehouse-new"]}
+        assert scheduler_redis.cache == {}
+
+    def test_expired(self, task_request, scheduler_redis):
+        finish_reindex(pretend.stub(), task_request, "warehouse-new")
+
+        assert task_request.es_client.indices.aliases == {
+            "warehouse": ["warehouse-new"]
+        }
+        assert scheduler_redis.lock.calls == []
 
 
 class TestPartialReindex:
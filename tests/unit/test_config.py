@@ -248,6 +248,7 @@ def test_configure(monkeypatch, settings, environment):
         "pythondotorg.host": "python.org",
         "warehouse.xmlrpc.client.ratelimit_string": "3600 per hour",
         "warehouse.xmlrpc.search.enabled": True,
+        "admin_flags.cache_ttl": 30,
         "github.token_scanning_meta_api.url": (
             "https://api.github.com/meta/public_keys/token_scanning"
         ),
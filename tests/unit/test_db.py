@@ -24,7 +24,7 @@ from sqlalchemy import event
 from sqlalchemy.exc import OperationalError
 
 from warehouse import db
-from warehouse.admin.flags import AdminFlagValue
+from warehouse.admin.flags import FLAGS_CACHE_KEY, AdminFlagValue
 from warehouse.db import (
     DEFAULT_ISOLATION,
     DatabaseNotAvailableError,
@@ -212,6 +212,40 @@ def test_create_session_read_only_mode(
     assert request.tm.doom.calls == doom_calls
 
 
+@pytest.mark.parametrize(
+    "flags, doom_calls",
+    [
+        ({}, []),
+        ({AdminFlagValue.READ_ONLY.value: pretend.stub(enabled=False)}, []),
+        (
+            {AdminFlagValue.READ_ONLY.value: pretend.stub(enabled=True)},
+            [pretend.call()],
+        ),
+    ],
+)
+def test_create_session_read_only_cached(
+    flags, doom_calls, monkeypatch, pyramid_services, metrics
+):
+    session_obj = pretend.stub(close=lambda: None)
+    monkeypatch.setattr(db, "Session", lambda bind: session_obj)
+    monkeypatch.setattr(zope.sqlalchemy, "register", lambda *a, **kw: None)
+
+    flags_cache = pretend.stub(
+        get=pretend.call_recorder(lambda session, metrics: flags)
+    )
+    engine = pretend.stub(connect=lambda: pretend.stub(close=lambda: None))
+    request = pretend.stub(
+        find_service=pyramid_services.find_service,
+        registry={"sqlalchemy.engine": engine, FLAGS_CACHE_KEY: flags_cache},
+        tm=pretend.stub(doom=pretend.call_recorder(lambda: None)),
+        add_finished_callback=lambda callback: None,
+    )
+
+    assert _create_session(request) is session_obj
+    assert flags_cache.get.calls == [pretend.call(session_obj, metrics)]
+    assert request.tm.doom.calls == doom_calls
+
+
 def test_includeme(monkeypatch):
     class FakeRegistry(dict):
         settings = {"database.url": pretend.stub()}
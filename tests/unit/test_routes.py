@@ -551,6 +551,11 @@ def test_routes(warehouse):
             factory="warehouse.legacy.api.json.latest_release_factory",
             domain=warehouse,
         ),
+        pretend.call(
+            "legacy.api.json.changelog",
+            "/pypi/changelog/since/{serial}/json",
+            domain=warehouse,
+        ),
         pretend.call(
             "legacy.api.json.release",
             "/pypi/{name}/{version}/json",
@@ -252,7 +252,7 @@ def test_opensearchxml(pyramid_request):
 class TestIndex:
     def test_index(self, db_request):
 
-        project = ProjectFactory.create()
+        project = ProjectFactory.create(zscore=1.5)
         release1 = ReleaseFactory.create(project=project)
         release1.created = datetime.date(2011, 1, 1)
         release2 = ReleaseFactory.create(project=project)
@@ -15,18 +15,81 @@ import math
 import pytest
 
 from warehouse.packaging.models import Project
-from warehouse.utils.db.windowed_query import windowed_query
+from warehouse.utils.db.windowed_query import (
+    column_ranges,
+    column_windows,
+    windowed_query,
+)
 
 from ....common.db.packaging import ProjectFactory
 
 
-@pytest.mark.parametrize("window_size", [1, 2])
+@pytest.mark.parametrize("window_size", [1, 2, 3])
 def test_windowed_query(db_session, query_recorder, window_size):
     projects = {ProjectFactory.create() for _ in range(10)}
-    expected = math.ceil(len(projects) / window_size) + 1
+    # Each window takes a query to find its boundary and one to fetch it, plus
+    # one more of each for the final window.
+    expected = 2 * math.floor(len(projects) / window_size) + 2
 
     query = db_session.query(Project)
     with query_recorder:
         assert set(windowed_query(query, Project.name, window_size)) == projects
 
     assert len(query_recorder.queries) == expected
+
+
+@pytest.mark.parametrize("window_size", [1, 2, 3])
+def test_windowed_query_range(db_session, window_size):
+    projects = sorted(
+        (ProjectFactory.create() for _ in range(10)), key=lambda p: p.name
+    )
+
+    query = db_session.query(Project)
+    windowed = windowed_query(
+        query,
+        Project.name,
+        window_size,
+        start=projects[1].name,
+        end=projects[7].name,
+    )
+
+    assert list(windowed) == projects[2:8]
+
+
+def test_column_windows_streams(db_session, query_recorder):
+    [ProjectFactory.create() for _ in range(10)]
+
+    with query_recorder:
+        next(column_windows(db_session, Project.name, 2))
+
+    assert len(query_recorder.queries) == 1
+
+
+@pytest.mark.parametrize(
+    ("count", "expected"), [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (20, 10)]
+)
+def test_column_ranges(db_session, count, expected):
+    names = sorted(ProjectFactory.create().name for _ in range(10))
+
+    ranges = column_ranges(db_session, Project.name, count)
+
+    assert len(ranges) == expected
+    assert ranges[0][0] is None
+    assert ranges[-1][1] is None
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert start in names
+
+    query = db_session.query(Project)
+    assert (
+        sorted(
+            p.name
+            for start, end in ranges
+            for p in windowed_query(query, Project.name, 3, start=start, end=end)
+        )
+        == names
+    )
+
+
+def test_column_ranges_empty(db_session):
+    assert column_ranges(db_session, Project.name, 16) == [(None, None)]
@@ -13,6 +13,7 @@
 from pyramid.authorization import ACLAuthorizationPolicy
 
 from warehouse.accounts.interfaces import (
+    ICredentialCache,
     IPasswordBreachedService,
     ITokenService,
     IUserService,
@@ -25,7 +26,10 @@ from warehouse.accounts.security_policy import (
 )
 from warehouse.accounts.services import (
     HaveIBeenPwnedPasswordBreachedService,
+    NullCredentialCache,
     NullPasswordBreachedService,
+    OfflinePasswordBreachedService,
+    RedisCredentialCache,
     TokenServiceFactory,
     database_login_factory,
 )
@@ -36,7 +40,11 @@ from warehouse.macaroons.security_policy import (
 from warehouse.rate_limiting import IRateLimiter, RateLimit
 from warehouse.utils.security_policy import MultiSecurityPolicy
 
-__all__ = ["NullPasswordBreachedService", "HaveIBeenPwnedPasswordBreachedService"]
+__all__ = [
+    "NullPasswordBreachedService",
+    "HaveIBeenPwnedPasswordBreachedService",
+    "OfflinePasswordBreachedService",
+]
 
 
 REDIRECT_FIELD_NAME = "next"
@@ -77,6 +85,15 @@ def includeme(config):
         breached_pw_class.create_service, IPasswordBreachedService
     )
 
+    # Register our cache of recently verified basic auth credentials.
+    if config.registry.settings.get("accounts.credential_cache_url"):
+        credential_cache_class = RedisCredentialCache
+    else:
+        credential_cache_class = NullCredentialCache
+    config.register_service_factory(
+        credential_cache_class.create_service, ICredentialCache
+    )
+
     # Register our security policies (AuthN + AuthZ)
     authz_policy = TwoFactorAuthorizationPolicy(
         policy=MacaroonAuthorizationPolicy(policy=ACLAuthorizationPolicy())
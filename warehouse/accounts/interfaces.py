@@ -266,6 +266,19 @@ class ITokenService(Interface):
         """
 
 
+class ICredentialCache(Interface):
+    def contains(user, password):
+        """
+        Returns a boolean indicating if the given password was recently verified
+        for the given user.
+        """
+
+    def add(user, password):
+        """
+        Records that the given password has just been verified for the given user.
+        """
+
+
 class IPasswordBreachedService(Interface):
     failure_message = Attribute("The message to describe the failure that occurred")
     failure_message_plain = Attribute(
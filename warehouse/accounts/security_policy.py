@@ -21,7 +21,11 @@ from pyramid.interfaces import IAuthorizationPolicy, ISecurityPolicy
 from pyramid.threadlocal import get_current_request
 from zope.interface import implementer
 
-from warehouse.accounts.interfaces import IPasswordBreachedService, IUserService
+from warehouse.accounts.interfaces import (
+    ICredentialCache,
+    IPasswordBreachedService,
+    IUserService,
+)
 from warehouse.accounts.models import DisableReason
 from warehouse.cache.http import add_vary_callback
 from warehouse.email import send_password_compromised_email_hibp
@@ -52,6 +56,7 @@ def _basic_auth_check(username, password, request):
 
     login_service = request.find_service(IUserService, context=None)
     breach_service = request.find_service(IPasswordBreachedService, context=None)
+    credential_cache = request.find_service(ICredentialCache, context=None)
 
     userid = login_service.find_userid(username)
     if userid is not None:
@@ -74,6 +79,12 @@ def _basic_auth_check(username, password, request):
                 raise _format_exc_status(BasicAuthAccountFrozen(), "Account is frozen.")
             else:
                 raise _format_exc_status(HTTPUnauthorized(), "Account is disabled.")
+        elif credential_cache.contains(user, password):
+            # These credentials have already passed both the password and the
+            # breach check a moment ago, most likely for another file in the same
+            # upload, so there's no need to pay for either of them again.
+            login_service.update_user(user.id, last_login=datetime.datetime.utcnow())
+            return True
         elif login_service.check_password(
             user.id,
             password,
@@ -90,6 +101,7 @@ def _basic_auth_check(username, password, request):
                     BasicAuthBreachedPassword(), breach_service.failure_message_plain
                 )
 
+            credential_cache.add(user, password)
             login_service.update_user(user.id, last_login=datetime.datetime.utcnow())
             return True
         else:
@@ -14,11 +14,14 @@ import collections
 import datetime
 import functools
 import hashlib
+import hmac
 import logging
+import mmap
 import os
 import secrets
 import urllib.parse
 
+import redis
 import requests
 
 from passlib.context import CryptContext
@@ -33,6 +36,7 @@ import warehouse.utils.webauthn as webauthn
 
 from warehouse.accounts.interfaces import (
     BurnedRecoveryCode,
+    ICredentialCache,
     InvalidRecoveryCode,
     IPasswordBreachedService,
     ITokenService,
@@ -61,6 +65,8 @@ logger = logging.getLogger(__name__)
 PASSWORD_FIELD = "password"
 RECOVERY_CODE_COUNT = 8
 RECOVERY_CODE_BYTES = 8
+CREDENTIAL_CACHE_TTL = 5 * 60
+BREACHED_RANGE_CACHE_TTL = 24 * 60 * 60
 
 
 @implementer(IUserService)
@@ -686,6 +692,43 @@ class TokenServiceFactory:
         return (self.name, self.service_class) == (other.name, other.service_class)
 
 
+class SortedDigests:
+    """
+    A read only set of fixed size binary digests, stored back to back in sorted
+    order in ``buffer`` (bytes or an mmap), which is searched with a bisection
+    rather than loaded into Python objects.
+    """
+
+    def __init__(self, buffer, size):
+        if len(buffer) % size:
+            raise ValueError(f"Buffer is not made of {size} byte digests")
+
+        self.buffer = buffer
+        self.size = size
+
+    def __len__(self):
+        return len(self.buffer) // self.size
+
+    def __contains__(self, digest):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate = self.buffer[mid * self.size : (mid + 1) * self.size]
+            if candidate < digest:
+                lo = mid + 1
+            elif candidate > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+
+def _suffix_digest(suffix):
+    # The suffixes of a range response are the last 35 hex characters of a SHA1
+    # digest, which we left pad so that they fit into a whole number of bytes.
+    return bytes.fromhex("0" + suffix)
+
+
 @implementer(IPasswordBreachedService)
 class HaveIBeenPwnedPasswordBreachedService:
 
@@ -701,11 +744,15 @@ class HaveIBeenPwnedPasswordBreachedService:
         metrics,
         api_base="https://api.pwnedpasswords.com",
         help_url=None,
+        cache_url=None,
+        cache_ttl=BREACHED_RANGE_CACHE_TTL,
     ):
         self._http = session
         self._api_base = api_base
         self._metrics = metrics
         self._help_url = help_url
+        self._cache_url = cache_url
+        self._cache_ttl = cache_ttl
 
     @classmethod
     def create_service(cls, context, request):
@@ -713,6 +760,7 @@ class HaveIBeenPwnedPasswordBreachedService:
             session=request.http,
             metrics=request.find_service(IMetricsService, context=None),
             help_url=request.help_url(_anchor="compromised-password"),
+            cache_url=request.registry.settings.get("breached_passwords.cache_url"),
         )
 
     @property
@@ -738,34 +786,49 @@ class HaveIBeenPwnedPasswordBreachedService:
     def _get_url(self, prefix):
         return urllib.parse.urljoin(self._api_base, os.path.join("/range/", prefix))
 
-    def check_password(self, password, *, tags=None):
-        # The HIBP API implements a k-Anonymity scheme, by which you can take a given
-        # password, hash it using sha1, and then send only the first 5 characters of the
-        # hex encoded digest. This avoids leaking data to the HIBP API, because without
-        # the rest of the hash, the HIBP service cannot even begin to brute force or do
-        # a reverse lookup to determine what password has just been sent to it. For More
-        # information see:
-        #       https://www.troyhunt.com/ive-just-launched-pwned-passwords-version-2/
+    def _get_cached_range(self, prefix):
+        if self._cache_url is None:
+            return None
 
-        self._metrics_increment("warehouse.compromised_password_check.start", tags=tags)
+        try:
+            with redis.StrictRedis.from_url(self._cache_url) as r:
+                return r.get(f"warehouse/hibp/range/{prefix}")
+        except redis.RedisError as exc:
+            logger.warning("Error reading the HaveIBeenPwned cache: %r", exc)
+            return None
+
+    def _set_cached_range(self, prefix, digests):
+        if self._cache_url is None:
+            return
 
-        # To work with the HIBP API, we need the sha1 of the UTF8 encoded password.
-        hashed_password = hashlib.sha1(password.encode("utf8")).hexdigest().lower()
+        try:
+            with redis.StrictRedis.from_url(self._cache_url) as r:
+                r.setex(f"warehouse/hibp/range/{prefix}", self._cache_ttl, digests)
+        except redis.RedisError as exc:
+            logger.warning("Error writing the HaveIBeenPwned cache: %r", exc)
+
+    def _get_range(self, prefix, *, tags=None):
+        """
+        Returns the SortedDigests of every breached password suffix for the given
+        prefix, or None if the range could not be fetched.
+        """
+        digests = self._get_cached_range(prefix)
+        if digests is not None:
+            self._metrics_increment(
+                "warehouse.compromised_password_check.cache_hit", tags=tags
+            )
+            return SortedDigests(digests, 18)
 
         # Fetch the passwords from the HIBP data set.
         try:
-            resp = self._http.get(self._get_url(hashed_password[:5]))
+            resp = self._http.get(self._get_url(prefix))
             resp.raise_for_status()
         except requests.RequestException as exc:
             logger.warning("Error contacting HaveIBeenPwned: %r", exc)
             self._metrics_increment(
                 "warehouse.compromised_password_check.error", tags=tags
             )
-
-            # If we've failed to contact the HIBP service for some reason, we're going
-            # to "fail open" and allow the password. That's a better option then just
-            # hard failing whatever the user is attempting to do.
-            return False
+            return None
 
         # The dataset that comes back from HIBP looks like:
         #
@@ -779,20 +842,126 @@ class HaveIBeenPwnedPasswordBreachedService:
         # That is, it is a line delimited textual data, where each line is a hash, a
         # colon, and then the number of times that password has appeared in a breach.
         # For our uses, we're going to consider any password that has ever appeared in
-        # a breach to be insecure, even if only once.
-        for line in resp.text.splitlines():
-            possible, _ = line.split(":")
-            if hashed_password[5:] == possible.lower():
-                self._metrics_increment(
-                    "warehouse.compromised_password_check.compromised", tags=tags
-                )
-                return True
+        # a breach to be insecure, even if only once, so we only keep the hashes.
+        digests = b"".join(
+            sorted(
+                _suffix_digest(line.split(":")[0]) for line in resp.text.splitlines()
+            )
+        )
+        self._set_cached_range(prefix, digests)
+
+        return SortedDigests(digests, 18)
+
+    def _is_breached(self, hashed_password, *, tags=None):
+        """
+        Returns whether the given hex encoded SHA1 digest belongs to a breached
+        password, or None if we couldn't find out.
+        """
+        breached = self._get_range(hashed_password[:5], tags=tags)
+        if breached is None:
+            return None
+        return _suffix_digest(hashed_password[5:]) in breached
+
+    def check_password(self, password, *, tags=None):
+        # The HIBP API implements a k-Anonymity scheme, by which you can take a given
+        # password, hash it using sha1, and then send only the first 5 characters of the
+        # hex encoded digest. This avoids leaking data to the HIBP API, because without
+        # the rest of the hash, the HIBP service cannot even begin to brute force or do
+        # a reverse lookup to determine what password has just been sent to it. For More
+        # information see:
+        #       https://www.troyhunt.com/ive-just-launched-pwned-passwords-version-2/
+
+        self._metrics_increment("warehouse.compromised_password_check.start", tags=tags)
+
+        # To work with the HIBP API, we need the sha1 of the UTF8 encoded password.
+        hashed_password = hashlib.sha1(password.encode("utf8")).hexdigest().lower()
+
+        breached = self._is_breached(hashed_password, tags=tags)
+        if breached is None:
+            # If we've failed to contact the HIBP service for some reason, we're going
+            # to "fail open" and allow the password. That's a better option then just
+            # hard failing whatever the user is attempting to do.
+            return False
+
+        if breached:
+            self._metrics_increment(
+                "warehouse.compromised_password_check.compromised", tags=tags
+            )
+            return True
 
         # If we made it to this point, then the password is safe.
         self._metrics_increment("warehouse.compromised_password_check.ok", tags=tags)
         return False
 
 
+# The breached digests mapped in this process for each path, along with the inode
+# and modification time of the file that they were mapped from.
+_breached_digests = {}
+
+
+def _load_breached_digests(path):
+    # The import command replaces the file rather than writing to it, so when it
+    # changes we have to map the new one, or we'd keep using the old one forever.
+    st = os.stat(path)
+    loaded = _breached_digests.get(path)
+    if loaded is None or loaded[0] != (st.st_ino, st.st_mtime_ns):
+        with open(path, "rb") as fp:
+            st = os.fstat(fp.fileno())
+            digests = SortedDigests(
+                mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ), 20
+            )
+        loaded = _breached_digests[path] = ((st.st_ino, st.st_mtime_ns), digests)
+    return loaded[1]
+
+
+def write_breached_digests(lines, fp):
+    """
+    Writes the hashes of a downloaded Pwned Passwords dump, ordered by hash, to
+    fp as back to back binary SHA1 digests for the OfflinePasswordBreachedService.
+    """
+    previous = b""
+    for line in lines:
+        digest = bytes.fromhex(line.split(":")[0])
+        if len(digest) != 20:
+            raise ValueError(f"{line.strip()!r} is not a SHA1 hash")
+        if digest <= previous:
+            raise ValueError("The hashes must be unique and ordered by hash")
+        fp.write(digest)
+        previous = digest
+
+
+@implementer(IPasswordBreachedService)
+class OfflinePasswordBreachedService(HaveIBeenPwnedPasswordBreachedService):
+    """
+    Checks passwords against a local copy of the Pwned Passwords data set,
+    written by ``warehouse breached-passwords import``, instead of the API.
+    """
+
+    def __init__(self, *, path, metrics, help_url=None):
+        super().__init__(session=None, metrics=metrics, help_url=help_url)
+        self._path = path
+
+    @classmethod
+    def create_service(cls, context, request):
+        return cls(
+            path=request.registry.settings["breached_passwords.path"],
+            metrics=request.find_service(IMetricsService, context=None),
+            help_url=request.help_url(_anchor="compromised-password"),
+        )
+
+    def _is_breached(self, hashed_password, *, tags=None):
+        try:
+            digests = _load_breached_digests(self._path)
+        except (OSError, ValueError) as exc:
+            # Just like when we can't reach the API, we fail open.
+            logger.warning("Error reading the breached passwords: %r", exc)
+            self._metrics_increment(
+                "warehouse.compromised_password_check.error", tags=tags
+            )
+            return None
+        return bytes.fromhex(hashed_password) in digests
+
+
 @implementer(IPasswordBreachedService)
 class NullPasswordBreachedService:
     failure_message = "This password appears in a breach."
@@ -806,3 +975,70 @@ class NullPasswordBreachedService:
         # This service allows *every* password as a non-breached password. It will never
         # tell a user their password isn't good enough.
         return False
+
+
+@implementer(ICredentialCache)
+class RedisCredentialCache:
+    """
+    Remembers recently verified (user, password) pairs so that a burst of basic
+    auth requests, like a twine upload of many files, only pays for the password
+    hash and breach checks once.
+
+    Entries are keyed by an HMAC over the user's id, their current password hash
+    and the password, so neither the password nor anything that could be cheaply
+    brute forced is stored. Setting a new password or disabling it changes the
+    password hash, which means old entries simply stop matching.
+    """
+
+    def __init__(self, redis_url, secret, *, metrics, ttl=CREDENTIAL_CACHE_TTL):
+        self.redis_url = redis_url
+        self.secret = secret.encode("utf8")
+        self.ttl = ttl
+        self._metrics = metrics
+
+    @classmethod
+    def create_service(cls, context, request):
+        return cls(
+            request.registry.settings["accounts.credential_cache_url"],
+            request.registry.settings["sessions.secret"],
+            metrics=request.find_service(IMetricsService, context=None),
+        )
+
+    def _key(self, user, password):
+        message = "\0".join([str(user.id), user.password, password])
+        digest = hmac.new(self.secret, message.encode("utf8"), hashlib.sha256)
+        return f"warehouse/accounts/credentials/{digest.hexdigest()}"
+
+    def contains(self, user, password):
+        try:
+            with redis.StrictRedis.from_url(self.redis_url) as r:
+                found = bool(r.exists(self._key(user, password)))
+        except redis.RedisError as exc:
+            logger.warning("Error reading the credential cache: %r", exc)
+            found = False
+
+        self._metrics.increment(
+            "warehouse.authentication.credential_cache",
+            tags=["result:hit" if found else "result:miss"],
+        )
+        return found
+
+    def add(self, user, password):
+        try:
+            with redis.StrictRedis.from_url(self.redis_url) as r:
+                r.setex(self._key(user, password), self.ttl, "1")
+        except redis.RedisError as exc:
+            logger.warning("Error writing the credential cache: %r", exc)
+
+
+@implementer(ICredentialCache)
+class NullCredentialCache:
+    @classmethod
+    def create_service(cls, context, request):
+        return cls()
+
+    def contains(self, user, password):
+        return False
+
+    def add(self, user, password):
+        pass
@@ -10,11 +10,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import enum
+import logging
+import os
+import threading
+import time
+
+import redis
 
 from sqlalchemy import Boolean, Column, Text, sql
 
 from warehouse import db
+from warehouse.metrics import IMetricsService
+
+logger = logging.getLogger(__name__)
+
+FLAGS_CACHE_KEY = "warehouse.admin_flags.cache"
+FLAGS_CHANNEL = "warehouse:admin-flags"
 
 
 class AdminFlagValue(enum.Enum):
@@ -37,21 +50,140 @@ class AdminFlag(db.ModelBase):
     notify = Column(Boolean, nullable=False, server_default=sql.false())
 
 
+_FlagState = collections.namedtuple(
+    "_FlagState", ["id", "description", "enabled", "notify"]
+)
+
+
+class AdminFlagCache:
+    """
+    A process local snapshot of the admin flags.
+
+    The snapshot is reloaded once it is older than ``ttl`` seconds, or as soon as
+    another process announces a change on ``FLAGS_CHANNEL``. If Redis is not
+    available we simply fall back to the TTL.
+    """
+
+    def __init__(self, ttl, redis_url=None):
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self._lock = threading.Lock()
+        self._flags = None
+        self._expires = 0
+        self._generation = 0
+        self._subscribed_pid = None
+        self._redis = None
+
+    def _get_redis(self):
+        if self._redis is None:
+            self._redis = redis.StrictRedis.from_url(self.redis_url)
+        return self._redis
+
+    def invalidate(self, message=None):
+        with self._lock:
+            self._generation += 1
+            self._flags = None
+
+    def _on_subscriber_error(self, exc, pubsub, thread):
+        logger.warning("Lost the admin flag subscription: %s", exc)
+        thread.stop()
+        self._subscribed_pid = None
+        self.invalidate()
+
+    def _subscribe(self):
+        # Subscriptions don't survive a fork, so every worker process sets up
+        # its own listener.
+        if self.redis_url is None or self._subscribed_pid == os.getpid():
+            return
+
+        self._subscribed_pid = os.getpid()
+        try:
+            pubsub = self._get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{FLAGS_CHANNEL: self.invalidate})
+            pubsub.run_in_thread(
+                sleep_time=1,
+                daemon=True,
+                exception_handler=self._on_subscriber_error,
+            )
+        except redis.RedisError as exc:
+            logger.warning("Could not subscribe to admin flag changes: %s", exc)
+
+    def get(self, session, metrics):
+        self._subscribe()
+
+        with self._lock:
+            if self._flags is not None and time.monotonic() < self._expires:
+                metrics.increment("warehouse.admin_flags.cache.hit")
+                return self._flags
+            generation = self._generation
+
+        metrics.increment("warehouse.admin_flags.cache.miss")
+        flags = {
+            flag.id: _FlagState(flag.id, flag.description, flag.enabled, flag.notify)
+            for flag in session.query(AdminFlag).all()
+        }
+
+        with self._lock:
+            # If the flags were invalidated while we were loading them, what we
+            # have may already be stale, so hand it out but don't keep it.
+            if generation == self._generation:
+                self._flags = flags
+                self._expires = time.monotonic() + self.ttl
+
+        return flags
+
+    def publish(self):
+        self.invalidate()
+
+        if self.redis_url is None:
+            return
+
+        try:
+            self._get_redis().publish(FLAGS_CHANNEL, "changed")
+        except redis.RedisError as exc:
+            logger.warning("Could not publish admin flag change: %s", exc)
+
+
 class Flags:
     def __init__(self, request):
         self.request = request
 
+    @property
+    def _cache(self):
+        return self.request.registry.get(FLAGS_CACHE_KEY)
+
+    def _snapshot(self):
+        metrics = self.request.find_service(IMetricsService, context=None)
+        return self._cache.get(self.request.db, metrics)
+
     def notifications(self):
+        if self._cache is not None:
+            return [
+                flag
+                for _, flag in sorted(self._snapshot().items())
+                if flag.enabled and flag.notify
+            ]
+
         return (
             self.request.db.query(AdminFlag)
             .filter(AdminFlag.enabled.is_(True), AdminFlag.notify.is_(True))
+            .order_by(AdminFlag.id)
             .all()
         )
 
     def enabled(self, flag_member):
-        flag = self.request.db.query(AdminFlag).get(flag_member.value)
+        if self._cache is not None:
+            flag = self._snapshot().get(flag_member.value)
+        else:
+            flag = self.request.db.query(AdminFlag).get(flag_member.value)
         return flag.enabled if flag else False
 
 
 def includeme(config):
     config.add_request_method(Flags, name="flags", reify=True)
+
+    settings = config.registry.settings
+    config.registry[FLAGS_CACHE_KEY] = AdminFlagCache(
+        ttl=settings.get("admin_flags.cache_ttl", 30),
+        redis_url=settings.get("admin_flags.cache_url"),
+    )
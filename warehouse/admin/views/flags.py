@@ -13,7 +13,7 @@
 from pyramid.httpexceptions import HTTPSeeOther
 from pyramid.view import view_config
 
-from warehouse.admin.flags import AdminFlag
+from warehouse.admin.flags import FLAGS_CACHE_KEY, AdminFlag
 
 
 @view_config(
@@ -40,6 +40,13 @@ def edit_flag(request):
     flag.description = request.POST["description"]
     flag.enabled = bool(request.POST.get("enabled"))
 
+    # Let every process drop its cached flags once this change is visible.
+    flags_cache = request.registry.get(FLAGS_CACHE_KEY)
+    if flags_cache is not None:
+        request.tm.get().addAfterCommitHook(
+            lambda success: success and flags_cache.publish()
+        )
+
     request.session.flash(f"Edited flag {flag.id!r}", queue="success")
 
     return HTTPSeeOther(request.route_path("admin.flags"))
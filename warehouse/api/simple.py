@@ -19,7 +19,7 @@ from sqlalchemy import func
 from warehouse.cache.http import add_vary, cache_control
 from warehouse.cache.origin import origin_cache
 from warehouse.packaging.models import JournalEntry, Project
-from warehouse.packaging.utils import _simple_detail, _simple_index
+from warehouse.packaging.utils import _simple_detail, stream_simple_index
 
 
 def _select_content_type(request: Request) -> str:
@@ -53,7 +53,6 @@ def _select_content_type(request: Request) -> str:
 
 @view_config(
     route_name="api.simple.index",
-    renderer="api/simple/index.html",
     decorator=[
         add_vary("Accept"),
         cache_control(10 * 60),  # 10 minutes
@@ -68,14 +67,18 @@ def simple_index(request):
     # Determine what our content-type should be, and setup our request
     # to return the correct content types.
     request.response.content_type = _select_content_type(request)
-    if request.response.content_type == "application/vnd.pypi.simple.v1+json":
-        request.override_renderer = "json"
 
     # Get the latest serial number
     serial = request.db.query(func.max(JournalEntry.id)).scalar() or 0
     request.response.headers["X-PyPI-Last-Serial"] = str(serial)
 
-    return _simple_index(request, serial)
+    # The index contains every project that we have, so rather than rendering
+    # it all in memory we stream it out in chunks.
+    request.response.app_iter = stream_simple_index(
+        request, serial, request.response.content_type
+    )
+
+    return request.response
 
 
 @view_config(
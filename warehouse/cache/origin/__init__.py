@@ -11,35 +11,194 @@
 # limitations under the License.
 
 import collections
+import contextlib
 import functools
 import operator
+import string
 
 from itertools import chain
 
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.session import Session
 
 from warehouse import db
 from warehouse.cache.origin.derivers import html_cache_deriver
 from warehouse.cache.origin.interfaces import IOriginCache
+from warehouse.metrics import IMetricsService
 
 
-@db.listens_for(db.Session, "after_flush")
-def store_purge_keys(config, session, flush_context):
+@contextlib.contextmanager
+def _count_queries(config, session, phase):
+    queries = []
+
+    def record(*args, **kwargs):
+        queries.append(None)
+
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", record)
+    try:
+        yield
+    finally:
+        event.remove(connection, "before_cursor_execute", record)
+
+    if queries:
+        try:
+            metrics = config.find_service_factory(IMetricsService)(None, config)
+        except LookupError:
+            return
+        metrics.increment(
+            "warehouse.cache.purge_keys.queries", len(queries), tags=[f"phase:{phase}"]
+        )
+
+
+def _relationship_path(klass, path):
+    # The leading part of an attribute path that is made of relationships, like
+    # "release.project" for "release.project.normalized_name".
+    names = []
+    mapper = inspect(klass)
+    for name in path.split("."):
+        if name not in mapper.relationships:
+            break
+        names.append(name)
+        mapper = mapper.relationships[name].mapper
+    return ".".join(names)
+
+
+def _relationship_paths(klass, attributes):
+    paths = {_relationship_path(klass, attribute) for attribute in attributes}
+    # Loading a path loads every relationship along it, so we only need the
+    # longest ones.
+    return sorted(
+        path
+        for path in paths
+        if path and not any(other.startswith(f"{path}.") for other in paths)
+    )
+
+
+def _is_loaded(obj, path):
+    objs = [obj]
+    for name in path.split("."):
+        related = []
+        for item in objs:
+            state = inspect(item)
+            if name in state.unloaded:
+                return False
+            value = getattr(item, name)
+            if state.mapper.relationships[name].uselist:
+                related.extend(value)
+            elif value is not None:
+                related.append(value)
+        objs = related
+    return True
+
+
+def _selectinload_path(klass, path):
+    option = None
+    for name in path.split("."):
+        attribute = getattr(klass, name)
+        option = (
+            selectinload(attribute)
+            if option is None
+            else option.selectinload(attribute)
+        )
+        klass = attribute.property.mapper.class_
+    return option
+
+
+def _load_for_purge(session, objs, attributes):
+    # Anything that is no longer persistent has either been deleted, and had its
+    # keys worked out when it was, or was rolled back, and so needs no purge.
+    objs = [obj for obj in objs if inspect(obj).persistent]
+    if not objs:
+        return objs
+
+    # Load the relationships that the key maker will use, and haven't already
+    # been loaded, for all of our objects at once rather than one at a time.
+    klass = type(objs[0])
+    primary_key = inspect(klass).primary_key
+    paths = _relationship_paths(klass, attributes)
+    unloaded = [obj for obj in objs if not all(_is_loaded(obj, path) for path in paths)]
+    # We can only select many objects by their primary key if it's a single
+    # column, otherwise the key maker loads what it needs for each of them.
+    if unloaded and len(primary_key) == 1:
+        session.query(klass).filter(
+            primary_key[0].in_([inspect(obj).identity[0] for obj in unloaded])
+        ).options(*[_selectinload_path(klass, path) for path in paths]).all()
+
+    return objs
+
+
+def stage_purge_keys(config, session, purges_key):
+    """
+    Called after a flush to collect the keys to purge for the objects that it
+    changed, into ``session.info[purges_key]``.
+
+    Working out the keys for an object can mean walking its relationships, so
+    for new and changed objects we only note them, and work out all of their
+    keys at once before the session is committed, in ``resolve_purge_keys``.
+    """
+    cache_keys = config.registry["cache_keys"]
+    purges = session.info.setdefault(purges_key, set())
+    staged = session.info.setdefault(f"{purges_key}.staged", {})
+
+    for obj in session.new | session.dirty:
+        if obj.__class__ in cache_keys:
+            staged.setdefault(obj.__class__, set()).add(obj)
+
+    # Deleted objects will be gone by then though, so we have to work out their
+    # keys now.
+    deleted = [obj for obj in session.deleted if obj.__class__ in cache_keys]
+    if deleted:
+        with _count_queries(config, session, "flush"):
+            for obj in deleted:
+                purges.update(cache_keys[obj.__class__](obj).purge)
+                staged.get(obj.__class__, set()).discard(obj)
+
+
+def stage_attribute_purge_keys(attribute, target, purges_key):
+    """
+    Like ``stage_purge_keys``, for a change to an attribute that has its own
+    keys registered.
+    """
+    session = Session.object_session(target)
+    staged = session.info.setdefault(f"{purges_key}.staged", {})
+    staged.setdefault(attribute, set()).add(target)
+
+
+def resolve_purge_keys(config, session, purges_key):
+    """
+    Called before a commit to work out the keys to purge for everything that
+    has been staged, adding them to ``session.info[purges_key]``.
+    """
+    # The commit will flush anything left before it happens, but only after
+    # we've been called, so we flush now to make sure we've seen everything.
+    session.flush()
+
+    staged = session.info.pop(f"{purges_key}.staged", None)
+    if not staged:
+        return
+
     cache_keys = config.registry["cache_keys"]
+    purges = session.info.setdefault(purges_key, set())
 
+    with _count_queries(config, session, "commit"):
+        for key, objs in staged.items():
+            key_maker = cache_keys[key]
+            for obj in _load_for_purge(session, objs, key_maker.attributes):
+                purges.update(key_maker(obj).purge)
+
+
+@db.listens_for(db.Session, "after_flush")
+def store_purge_keys(config, session, flush_context):
     # We'll (ab)use the session.info dictionary to store a list of pending
     # purges to the session.
-    purges = session.info.setdefault("warehouse.cache.origin.purges", set())
+    stage_purge_keys(config, session, "warehouse.cache.origin.purges")
 
-    # Go through each new, changed, and deleted object and attempt to store
-    # a cache key that we'll want to purge when the session has been committed.
-    for obj in session.new | session.dirty | session.deleted:
-        try:
-            key_maker = cache_keys[obj.__class__]
-        except KeyError:
-            continue
 
-        purges.update(key_maker(obj).purge)
+@db.listens_for(db.Session, "before_commit")
+def resolve_origin_purge_keys(config, session):
+    resolve_purge_keys(config, session, "warehouse.cache.origin.purges")
 
 
 @db.listens_for(db.Session, "after_commit")
@@ -101,6 +260,18 @@ def key_factory(keystring, iterate_on=None):
         else:
             yield keystring.format(obj=obj)
 
+    generate_key.iterate_on = iterate_on
+
+    # The attributes of the object that the key is made from, so that their
+    # relationships can be loaded for many objects at once.
+    generate_key.attributes = [iterate_on] if iterate_on else []
+    for _, field, _, _ in string.Formatter().parse(keystring):
+        name, _, attribute = (field or "").partition(".")
+        if name == "obj" and attribute:
+            generate_key.attributes.append(attribute)
+        elif name == "itr" and attribute:
+            generate_key.attributes.append(f"{iterate_on}.{attribute}")
+
     return generate_key
 
 
@@ -123,6 +294,12 @@ def key_maker_factory(cache_keys, purge_keys):
             purge=chain.from_iterable(key(obj) for key in purge_keys),
         )
 
+    # The attributes our purge keys are made from, so that their relationships
+    # can be loaded for many objects at once before we generate their keys.
+    key_maker.attributes = [
+        attribute for key in purge_keys for attribute in getattr(key, "attributes", [])
+    ]
+
     return key_maker
 
 
@@ -132,12 +309,7 @@ def register_origin_cache_keys(config, klass, cache_keys=None, purge_keys=None):
 
 
 def receive_set(attribute, config, target):
-    cache_keys = config.registry["cache_keys"]
-    session = Session.object_session(target)
-    purges = session.info.setdefault("warehouse.cache.origin.purges", set())
-    key_maker = cache_keys[attribute]
-    keys = key_maker(target).purge
-    purges.update(list(keys))
+    stage_attribute_purge_keys(attribute, target, "warehouse.cache.origin.purges")
 
 
 def includeme(config):
@@ -10,14 +10,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 import urllib.parse
 
+import redis
 import requests
 
 from zope.interface import implementer
 
 from warehouse import tasks
 from warehouse.cache.origin.interfaces import IOriginCache
+from warehouse.metrics import IMetricsService
+
+# Keys waiting to be purged, scored by when a purge of them was first asked
+# for, and a flag marking that a task to purge them has been scheduled.
+PENDING_PURGES_KEY = "warehouse:origin-cache:pending-purges"
+PURGE_SCHEDULED_KEY = "warehouse:origin-cache:purge-scheduled"
+
+# Keys that a task has taken to purge, which stay here until Fastly has
+# purged them, so that they're picked up again if that task fails or dies.
+IN_PROGRESS_PURGES_KEY = "warehouse:origin-cache:in-progress-purges"
+
+# The most surrogate keys that Fastly will purge in a single request.
+PURGE_BATCH_SIZE = 256
 
 
 class UnsuccessfulPurgeError(Exception):
@@ -40,22 +55,84 @@ def purge_key(task, request, key):
         raise task.retry(exc=exc)
 
 
-@implementer(IOriginCache)
-class FastlyCache:
+@tasks.task(bind=True, ignore_result=True, acks_late=True)
+def purge_pending_keys(task, request):
+    cacher = request.find_service(IOriginCache)
+    metrics = request.find_service(IMetricsService, context=None)
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+
+    # We clear the flag before taking the pending keys, so that any key added
+    # after we've taken them will schedule another purge. The keys we take are
+    # moved rather than removed, joining any left behind by an earlier attempt,
+    # and are only removed once they've been purged.
+    pipeline = r.pipeline()
+    pipeline.delete(PURGE_SCHEDULED_KEY)
+    pipeline.zunionstore(
+        IN_PROGRESS_PURGES_KEY,
+        [IN_PROGRESS_PURGES_KEY, PENDING_PURGES_KEY],
+        aggregate="MIN",
+    )
+    pipeline.delete(PENDING_PURGES_KEY)
+    pipeline.zrange(IN_PROGRESS_PURGES_KEY, 0, -1, withscores=True)
+    *_, pending = pipeline.execute()
+    if not pending:
+        return
+
+    keys = [key.decode("utf8") for key, _ in pending]
+    request.log.info("Purging %s", " ".join(keys))
+    try:
+        cacher.purge_keys(keys)
+    except (
+        requests.ConnectionError,
+        requests.HTTPError,
+        requests.Timeout,
+        UnsuccessfulPurgeError,
+    ) as exc:
+        request.log.error("Error purging %s: %s", " ".join(keys), str(exc))
+        raise task.retry(exc=exc)
 
-    _api_domain = "https://api.fastly.com"
+    r.zrem(IN_PROGRESS_PURGES_KEY, *[key for key, _ in pending])
 
-    def __init__(self, *, api_key, service_id, purger):
+    metrics.increment("warehouse.origin_cache.purge.sent", len(keys))
+    metrics.histogram(
+        "warehouse.origin_cache.purge.lag", time.time() - min(s for _, s in pending)
+    )
+
+
+@implementer(IOriginCache)
+class FastlyCache:
+    def __init__(
+        self,
+        *,
+        api_key,
+        service_id,
+        purger,
+        redis_client=None,
+        metrics=None,
+        purge_window=5,
+        api_domain="https://api.fastly.com",
+    ):
         self.api_key = api_key
         self.service_id = service_id
         self._purger = purger
+        self._redis = redis_client
+        self._metrics = metrics
+        self.purge_window = purge_window
+        self._api_domain = api_domain
 
     @classmethod
     def create_service(cls, context, request):
+        settings = request.registry.settings
         return cls(
-            api_key=request.registry.settings["origin_cache.api_key"],
-            service_id=request.registry.settings["origin_cache.service_id"],
-            purger=request.task(purge_key).delay,
+            api_key=settings["origin_cache.api_key"],
+            service_id=settings["origin_cache.service_id"],
+            purger=request.task(purge_pending_keys).apply_async,
+            redis_client=redis.StrictRedis.from_url(settings["celery.scheduler_url"]),
+            metrics=request.find_service(IMetricsService, context=None),
+            purge_window=int(settings.get("origin_cache.purge_window", 5)),
+            api_domain=settings.get(
+                "origin_cache.api_domain", "https://api.fastly.com"
+            ),
         )
 
     def cache(
@@ -66,7 +143,7 @@ class FastlyCache:
         *,
         seconds=None,
         stale_while_revalidate=None,
-        stale_if_error=None
+        stale_if_error=None,
     ):
         existing_keys = set(response.headers.get("Surrogate-Key", "").split())
 
@@ -87,8 +164,46 @@ class FastlyCache:
             response.headers["Surrogate-Control"] = ", ".join(values)
 
     def purge(self, keys):
-        for key in keys:
-            self._purger(key)
+        # Rather than purging each key straight away, we gather them up for a
+        # short window, so that every purge of the same key within it becomes
+        # one, and they can all be sent to Fastly together.
+        keys = set(keys)
+        if not keys:
+            return
+
+        now = time.time()
+        pipeline = self._redis.pipeline()
+        pipeline.zadd(PENDING_PURGES_KEY, {key: now for key in keys}, nx=True)
+        pipeline.set(PURGE_SCHEDULED_KEY, 1, nx=True, ex=self.purge_window)
+        _, scheduled = pipeline.execute()
+
+        self._metrics.increment("warehouse.origin_cache.purge.requested", len(keys))
+        if scheduled:
+            self._purger(countdown=self.purge_window)
+
+    def purge_keys(self, keys):
+        path = "/service/{service_id}/purge".format(service_id=self.service_id)
+        url = urllib.parse.urljoin(self._api_domain, path)
+
+        keys = sorted(keys)
+        for i in range(0, len(keys), PURGE_BATCH_SIZE):
+            batch = keys[i : i + PURGE_BATCH_SIZE]
+            headers = {
+                "Accept": "application/json",
+                "Fastly-Key": self.api_key,
+                "Fastly-Soft-Purge": "1",
+                "Surrogate-Key": " ".join(batch),
+            }
+
+            resp = requests.post(url, headers=headers)
+            resp.raise_for_status()
+
+            # Fastly responds with the id of the purge of each key.
+            purged = resp.json()
+            if not set(batch) <= set(purged):
+                raise UnsuccessfulPurgeError(
+                    "Could not purge {!r}".format(sorted(set(batch) - set(purged)))
+                )
 
     def purge_key(self, key):
         path = "/service/{service_id}/purge/{key}".format(
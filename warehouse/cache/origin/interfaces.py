@@ -46,3 +46,9 @@ class IOriginCache(Interface):
         """
         Purge and responses associated with the specific keys.
         """
+
+    def purge_keys(keys):
+        """
+        Immediately purge any responses associated with the specific keys,
+        raising an exception if any of them could not be purged.
+        """
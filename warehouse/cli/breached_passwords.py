@@ -0,0 +1,40 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import click
+
+from warehouse.accounts.services import write_breached_digests
+from warehouse.cli import warehouse
+
+
+@warehouse.group()  # pragma: no branch
+def breached_passwords():
+    """
+    Manage the local copy of the Pwned Passwords data set.
+    """
+
+
+@breached_passwords.command("import")
+@click.argument("dump", type=click.File())
+@click.pass_obj
+def import_(config, dump):
+    """
+    Replace the local breached passwords file with the given Pwned Passwords SHA1
+    dump, ordered by hash.
+    """
+
+    path = config.registry.settings["breached_passwords.path"]
+    with open(f"{path}.tmp", "wb") as fp:
+        write_breached_digests(dump, fp)
+    os.replace(f"{path}.tmp", path)
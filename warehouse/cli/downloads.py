@@ -0,0 +1,37 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import click
+
+from warehouse.cli import warehouse
+from warehouse.packaging.services import LocalDownloadStatsService
+
+
+@warehouse.group()  # pragma: no branch
+def downloads():
+    """
+    Manage the locally kept download statistics.
+    """
+
+
+@downloads.command()
+@click.argument("logs", nargs=-1, type=click.File())
+@click.pass_obj
+def ingest(config, logs):
+    """
+    Add the downloads in the given logs, one JSON object per line in the same
+    format as the BigQuery downloads table, to the local download statistics.
+    """
+
+    service = LocalDownloadStatsService(config.registry.settings["download_stats.path"])
+    for log in logs:
+        service.ingest(log)
@@ -0,0 +1,95 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import timeit
+import types
+import uuid
+
+import click
+import pymacaroons
+
+from warehouse.accounts.models import User
+from warehouse.cli import warehouse
+from warehouse.macaroons import caveats
+from warehouse.macaroons.caveats import _core
+from warehouse.packaging.models import Project
+
+CAVEAT_COUNTS = [1, 5, 20]
+
+
+def _sample_token(count, user, project):
+    """
+    Returns a macaroon, its key and its predicates, carrying count of the kinds of
+    caveats that we put on real project scoped tokens.
+    """
+    now = int(time.time())
+    samples = [
+        caveats.ProjectName(normalized_names=[project.normalized_name]),
+        caveats.ProjectID(project_ids=[str(project.id)]),
+        caveats.RequestUser(user_id=str(user.id)),
+        caveats.Expiration(expires_at=now + 3600, not_before=now - 3600),
+    ]
+
+    key = b"a benchmark key"
+    macaroon = pymacaroons.Macaroon(
+        location="pypi.org",
+        identifier=str(uuid.uuid4()),
+        key=key,
+        version=pymacaroons.MACAROON_V2,
+    )
+    for i in range(count):
+        macaroon.add_first_party_caveat(caveats.serialize(samples[i % len(samples)]))
+
+    predicates = [c.caveat_id_bytes for c in macaroon.first_party_caveats()]
+    return macaroon, key, predicates
+
+
+@warehouse.group()  # pragma: no branch
+def macaroons():
+    """
+    Manage API tokens.
+    """
+
+
+@macaroons.command()
+@click.option("--number", default=1000, help="Verifications to time per token.")
+def benchmark(number):
+    """
+    Time the deserialization and verification of the caveats on tokens carrying
+    different numbers of caveats.
+    """
+
+    user = User(id=uuid.uuid4())
+    project = Project(id=uuid.uuid4(), name="sample", normalized_name="sample")
+    request = types.SimpleNamespace(identity=user)
+
+    for count in CAVEAT_COUNTS:
+        macaroon, key, predicates = _sample_token(count, user, project)
+
+        timings = {
+            "deserialize": lambda: [_core._deserialize(p) for p in predicates],
+            "deserialize (cached)": lambda: [
+                caveats.deserialize(p) for p in predicates
+            ],
+            "verify": lambda: caveats.verify(macaroon, key, request, project, "upload"),
+            "verify_caveats": lambda: caveats.verify_caveats(
+                predicates, request, project, "upload"
+            ),
+        }
+        for name, func in timings.items():
+            assert func()
+            elapsed = timeit.timeit(func, number=number)
+            click.echo(
+                f"{count:>3} caveats  {name:<22}"
+                f"{elapsed / number * 1_000_000:>10.1f} µs/token"
+            )
@@ -0,0 +1,185 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import time
+import types
+import uuid
+
+import click
+
+from packaging.utils import canonicalize_version
+from packaging.version import parse
+from sqlalchemy.orm import joinedload
+
+from warehouse.cli import warehouse
+from warehouse.packaging.models import Description, File, Project, Release
+from warehouse.packaging.utils import API_VERSION, _simple_detail
+
+# How many files each release of the sample project has.
+FILES_PER_RELEASE = 10
+
+
+def _legacy_simple_detail(project, request):
+    """
+    Renders the simple detail page the way we used to, hydrating every File and
+    its Release, and sorting them by their parsed versions in Python.
+    """
+    files = sorted(
+        request.db.query(File)
+        .options(joinedload(File.release))
+        .join(Release)
+        .filter(Release.project == project)
+        .all(),
+        key=lambda f: (parse(f.release.version), f.filename),
+    )
+
+    return {
+        "meta": {"api-version": API_VERSION, "_last-serial": project.last_serial},
+        "name": project.normalized_name,
+        "files": [
+            {
+                "filename": file.filename,
+                "url": request.route_url("packaging.file", path=file.path),
+                "hashes": {
+                    "sha256": file.sha256_digest,
+                },
+                "requires-python": file.release.requires_python,
+                "yanked": file.release.yanked_reason
+                if file.release.yanked and file.release.yanked_reason
+                else file.release.yanked,
+            }
+            for file in files
+        ],
+    }
+
+
+def _add_sample_project(connection, file_count):
+    """
+    Adds a project with file_count files, spread over releases whose versions
+    don't sort the same way as strings, and returns its id. This needs to be run
+    as a superuser, like the one in our development environment.
+    """
+    project_id = uuid.uuid4()
+    name = f"simple-benchmark-{project_id.hex[:8]}"
+    connection.execute(Project.__table__.insert(), {"id": project_id, "name": name})
+
+    descriptions, releases, files = [], [], []
+    for i in range(-(-file_count // FILES_PER_RELEASE)):
+        version = f"{i // 100}.{i % 100}"
+        description_id, release_id = uuid.uuid4(), uuid.uuid4()
+        descriptions.append(
+            {"id": description_id, "raw": "", "html": "", "rendered_by": "benchmark"}
+        )
+        releases.append(
+            {
+                "id": release_id,
+                "project_id": project_id,
+                "version": version,
+                "canonical_version": canonicalize_version(version),
+                "_pypi_ordering": i,
+                "requires_python": ">=3.7",
+                "description_id": description_id,
+            }
+        )
+        for j in range(min(FILES_PER_RELEASE, file_count - len(files))):
+            if j:
+                filename = f"{name}-{version}-{j}-py3-none-any.whl"
+            else:
+                filename = f"{name}-{version}.tar.gz"
+            digest = filename.encode("utf8")
+            files.append(
+                {
+                    "release_id": release_id,
+                    "filename": filename,
+                    "path": f"benchmark/{filename}",
+                    "packagetype": "bdist_wheel" if j else "sdist",
+                    "python_version": "py3" if j else "source",
+                    "md5_digest": hashlib.md5(digest).hexdigest(),
+                    "sha256_digest": hashlib.sha256(digest).hexdigest(),
+                    "blake2_256_digest": hashlib.blake2b(
+                        digest, digest_size=32
+                    ).hexdigest(),
+                }
+            )
+
+    connection.execute(Description.__table__.insert(), descriptions)
+    connection.execute(Release.__table__.insert(), releases)
+    # The triggers on release_files recompute the total size of the project for
+    # every file, which would take far longer than the benchmark itself, and
+    # nothing that we're timing depends on them.
+    connection.execute("SET LOCAL session_replication_role = replica")
+    connection.execute(File.__table__.insert(), files)
+    connection.execute("SET LOCAL session_replication_role = DEFAULT")
+    return project_id
+
+
+@warehouse.group()  # pragma: no branch
+def simple():
+    """
+    Manage the simple API.
+    """
+
+
+@simple.command()
+@click.option(
+    "--files",
+    default=50000,
+    type=click.IntRange(min=1),
+    help="Files to give the sample project.",
+)
+@click.option("--number", default=5, help="Renders to time for each approach.")
+@click.pass_obj
+def benchmark(config, files, number):
+    """
+    Time loading the files for the simple detail page of a sample project, the
+    way we used to against the way we do now. The sample project is only added
+    within a transaction, which is rolled back afterwards.
+    """
+    # Imported here because we don't want to trigger an import from anything
+    # but warehouse.cli at the module scope.
+    from warehouse.db import Session
+
+    engine = config.registry["sqlalchemy.engine"]
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            project_id = _add_sample_project(connection, files)
+
+            renders = {}
+            timings = {
+                "orm + packaging.version": _legacy_simple_detail,
+                "columns": _simple_detail,
+            }
+            for name, func in timings.items():
+                elapsed = 0
+                for _ in range(number):
+                    # Every page is rendered by a new session, just like every
+                    # request gets its own.
+                    session = Session(bind=connection)
+                    project = session.query(Project).get(project_id)
+                    request = types.SimpleNamespace(
+                        db=session, route_url=lambda route, path: path
+                    )
+                    start = time.perf_counter()
+                    renders[name] = func(project, request)
+                    elapsed += time.perf_counter() - start
+                    session.close()
+                click.echo(
+                    f"{files:>6} files  {name:<24}"
+                    f"{elapsed / number * 1000:>10.1f} ms/page"
+                )
+
+            # Both approaches have to render the same page.
+            assert renders["columns"] == renders["orm + packaging.version"]
+        finally:
+            transaction.rollback()
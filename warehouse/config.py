@@ -168,6 +168,24 @@ def configure(settings=None):
     maybe_set(
         settings, "warehouse.release_files_table", "WAREHOUSE_RELEASE_FILES_TABLE"
     )
+    maybe_set(
+        settings,
+        "warehouse.release_files_table.batch_size",
+        "WAREHOUSE_RELEASE_FILES_TABLE_BATCH_SIZE",
+        coercer=int,
+    )
+    maybe_set(
+        settings,
+        "warehouse.release_files_table.flush_interval",
+        "WAREHOUSE_RELEASE_FILES_TABLE_FLUSH_INTERVAL",
+        coercer=int,
+    )
+    maybe_set(
+        settings,
+        "warehouse.release_files_table.schema_ttl",
+        "WAREHOUSE_RELEASE_FILES_TABLE_SCHEMA_TTL",
+        coercer=int,
+    )
     maybe_set(settings, "github.token", "GITHUB_TOKEN")
     maybe_set(
         settings,
@@ -181,6 +199,17 @@ def configure(settings=None):
     maybe_set(settings, "celery.result_url", "REDIS_URL")
     maybe_set(settings, "celery.scheduler_url", "REDIS_URL")
     maybe_set(settings, "oidc.jwk_cache_url", "REDIS_URL")
+    maybe_set(settings, "admin_flags.cache_url", "REDIS_URL")
+    maybe_set(settings, "accounts.credential_cache_url", "REDIS_URL")
+    maybe_set(settings, "breached_passwords.cache_url", "REDIS_URL")
+    maybe_set(settings, "macaroons.cache_url", "REDIS_URL")
+    maybe_set(
+        settings,
+        "admin_flags.cache_ttl",
+        "ADMIN_FLAGS_CACHE_TTL",
+        coercer=int,
+        default=30,
+    )
     maybe_set(settings, "database.url", "DATABASE_URL")
     maybe_set(settings, "elasticsearch.url", "ELASTICSEARCH_URL")
     maybe_set(settings, "elasticsearch.url", "ELASTICSEARCH_SIX_URL")
@@ -227,10 +256,35 @@ def configure(settings=None):
         coercer=int,
         default=21600,  # 6 hours
     )
+    maybe_set(
+        settings,
+        "forklift.upload_buffer_size",
+        "FORKLIFT_UPLOAD_BUFFER_SIZE",
+        coercer=int,
+    )
+    maybe_set(
+        settings,
+        "forklift.dist_file.max_uncompressed_size",
+        "FORKLIFT_DIST_FILE_MAX_UNCOMPRESSED_SIZE",
+        coercer=int,
+    )
+    maybe_set(
+        settings,
+        "forklift.dist_file.max_members",
+        "FORKLIFT_DIST_FILE_MAX_MEMBERS",
+        coercer=int,
+    )
+    maybe_set(
+        settings,
+        "forklift.dist_file.max_seconds",
+        "FORKLIFT_DIST_FILE_MAX_SECONDS",
+        coercer=int,
+    )
     maybe_set_compound(settings, "billing", "backend", "BILLING_BACKEND")
     maybe_set_compound(settings, "files", "backend", "FILES_BACKEND")
     maybe_set_compound(settings, "simple", "backend", "SIMPLE_BACKEND")
     maybe_set_compound(settings, "docs", "backend", "DOCS_BACKEND")
+    maybe_set_compound(settings, "download_stats", "backend", "DOWNLOAD_STATS_BACKEND")
     maybe_set_compound(settings, "sponsorlogos", "backend", "SPONSORLOGOS_BACKEND")
     maybe_set_compound(settings, "origin_cache", "backend", "ORIGIN_CACHE")
     maybe_set_compound(settings, "mail", "backend", "MAIL_BACKEND")
@@ -149,9 +149,13 @@ def _create_session(request):
         connection.close()
 
     # Check if we're in read-only mode
-    from warehouse.admin.flags import AdminFlag, AdminFlagValue
+    from warehouse.admin.flags import FLAGS_CACHE_KEY, AdminFlag, AdminFlagValue
 
-    flag = session.query(AdminFlag).get(AdminFlagValue.READ_ONLY.value)
+    flags_cache = request.registry.get(FLAGS_CACHE_KEY)
+    if flags_cache is not None:
+        flag = flags_cache.get(session, metrics).get(AdminFlagValue.READ_ONLY.value)
+    else:
+        flag = session.query(AdminFlag).get(AdminFlagValue.READ_ONLY.value)
     if flag and flag.enabled:
         request.tm.doom()
 
@@ -10,6 +10,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import concurrent.futures
 import email
 import hashlib
 import hmac
@@ -17,6 +19,7 @@ import os.path
 import re
 import tarfile
 import tempfile
+import time
 import zipfile
 
 from cgi import FieldStorage, parse_header
@@ -61,7 +64,7 @@ from warehouse.packaging.models import (
     Release,
     Role,
 )
-from warehouse.packaging.tasks import update_bigquery_release_files
+from warehouse.packaging.tasks import buffer_bigquery_release_file
 from warehouse.utils import http, readme
 from warehouse.utils.project import add_project, validate_project_name
 from warehouse.utils.security_policy import AuthenticationMethod
@@ -75,6 +78,19 @@ MAX_PROJECT_SIZE = 10 * ONE_GB
 
 PATH_HASHER = "blake2_256"
 
+# The default size of the buffer that we read uploaded files in with, this can
+# be overridden with the forklift.upload_buffer_size setting.
+UPLOAD_BUFFER_SIZE = ONE_MB
+
+# The limits on how much work we're willing to do while validating the contents
+# of an uploaded distribution file, each of these can be overridden with the
+# matching forklift.dist_file.* setting.
+DistFileLimits = collections.namedtuple(
+    "DistFileLimits",
+    ["max_uncompressed_size", "max_members", "max_seconds"],
+    defaults=[MAX_PROJECT_SIZE, 100_000, 60],
+)
+
 
 # Wheel platform checking
 
@@ -621,46 +637,65 @@ _safe_zipnames = re.compile(r"(purelib|platlib|headers|scripts|data).+", re.I)
 _tar_filenames_re = re.compile(r"\.(?:tar$|t(?:ar\.)?(?P<z_type>gz|bz2)$)")
 
 
-def _is_valid_dist_file(filename, filetype):
+def _dist_file_error(filename, filetype, limits):
     """
     Perform some basic checks to see whether the indicated file could be
-    a valid distribution file.
+    a valid distribution file, returning the reason that it is not or None.
     """
 
     # If our file is a zipfile, then ensure that it's members are only
-    # compressed with supported compression methods.
+    # compressed with supported compression methods. None of this requires
+    # decompressing anything, as it all comes from the central directory.
     if zipfile.is_zipfile(filename):
         with zipfile.ZipFile(filename) as zfp:
-            for zinfo in zfp.infolist():
+            infolist = zfp.infolist()
+            if len(infolist) > limits.max_members:
+                return "too-many-members"
+            if (
+                sum(zinfo.file_size for zinfo in infolist)
+                > limits.max_uncompressed_size
+            ):
+                return "too-large-uncompressed"
+            for zinfo in infolist:
                 if zinfo.compress_type not in {
                     zipfile.ZIP_STORED,
                     zipfile.ZIP_DEFLATED,
                 }:
-                    return False
+                    return "unsupported-compression"
 
     tar_fn_match = _tar_filenames_re.search(filename)
     if tar_fn_match:
         # Ensure that this is a valid tar file, and that it contains PKG-INFO.
         z_type = tar_fn_match.group("z_type") or ""
+        deadline = time.monotonic() + limits.max_seconds
         try:
             with tarfile.open(filename, f"r:{z_type}") as tar:
-                # This decompresses the entire stream to validate it and the
-                # tar within.  Easy CPU DoS attack. :/
+                # Finding each member requires decompressing everything before
+                # it, so we stop as soon as we find the top level PKG-INFO, and
+                # bail out if the archive is costing us too much to read.
                 bad_tar = True
                 member = tar.next()
                 while member:
+                    if tar.offset > limits.max_uncompressed_size:
+                        return "too-large-uncompressed"
+                    if len(tar.members) > limits.max_members:
+                        return "too-many-members"
+                    if time.monotonic() > deadline:
+                        return "too-slow"
                     parts = os.path.split(member.name)
                     if len(parts) == 2 and parts[1] == "PKG-INFO":
                         bad_tar = False
+                        if "/" not in parts[0]:
+                            break
                     member = tar.next()
                 if bad_tar:
-                    return False
+                    return "missing-pkg-info"
         except (tarfile.ReadError, EOFError):
-            return False
+            return "invalid-tar"
     elif filename.endswith(".exe"):
         # The only valid filetype for a .exe file is "bdist_wininst".
         if filetype != "bdist_wininst":
-            return False
+            return "invalid-filetype"
 
         # Ensure that the .exe is a valid zip file, and that all of the files
         # contained within it have safe filenames.
@@ -671,20 +706,20 @@ def _is_valid_dist_file(filename, filetype):
                 # isn't one.
                 for zipname in zfp.namelist():  # pragma: no branch
                     if not _safe_zipnames.match(zipname):
-                        return False
+                        return "unsafe-filename"
         except zipfile.BadZipFile:
-            return False
+            return "invalid-zip"
     elif filename.endswith(".msi"):
         # The only valid filetype for a .msi is "bdist_msi"
         if filetype != "bdist_msi":
-            return False
+            return "invalid-filetype"
 
         # Check the first 8 bytes of the MSI file. This was taken from the
         # legacy implementation of PyPI which itself took it from the
         # implementation of `file` I believe.
         with open(filename, "rb") as fp:
             if fp.read(8) != b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1":
-                return False
+                return "invalid-msi"
     elif filename.endswith(".zip") or filename.endswith(".egg"):
         # Ensure that the .zip/.egg is a valid zip file, and that it has a
         # PKG-INFO file.
@@ -698,9 +733,9 @@ def _is_valid_dist_file(filename, filetype):
                         # where there isn't one.
                         break  # pragma: no branch
                 else:
-                    return False
+                    return "missing-pkg-info"
         except zipfile.BadZipFile:
-            return False
+            return "invalid-zip"
     elif filename.endswith(".whl"):
         # Ensure that the .whl is a valid zip file, and that it has a WHEEL
         # file.
@@ -714,13 +749,53 @@ def _is_valid_dist_file(filename, filetype):
                         # where there isn't one.
                         break  # pragma: no branch
                 else:
-                    return False
+                    return "missing-wheel"
         except zipfile.BadZipFile:
-            return False
+            return "invalid-zip"
 
     # If we haven't yet decided it's not valid, then we'll assume it is and
     # allow it.
-    return True
+    return None
+
+
+def _is_valid_dist_file(filename, filetype, limits=None, metrics=None):
+    """
+    Perform some basic checks to see whether the indicated file could be
+    a valid distribution file.
+    """
+    if limits is None:
+        limits = DistFileLimits()
+
+    error = _dist_file_error(filename, filetype, limits)
+    if error is not None and metrics is not None:
+        metrics.increment(
+            "warehouse.upload.invalid_dist_file", tags=[f"reason:{error}"]
+        )
+
+    return error is None
+
+
+def _update_hashers(hashers, chunk):
+    # hashlib releases the GIL while hashing large chunks of data, so this can
+    # actually run in parallel with the rest of our upload handling.
+    for hasher in hashers:
+        hasher.update(chunk)
+
+
+def _iter_chunks(fileobj, buffer_size):
+    # We read into two buffers that we alternate between, so that we can read
+    # the next chunk of the file while the previous one is still being hashed
+    # without allocating a new bytes object for every chunk. Callers must be
+    # done with a chunk before requesting the one after the next.
+    buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+    index = 0
+    while True:
+        view = memoryview(buffers[index])
+        size = fileobj.readinto(view)
+        if not size:
+            return
+        yield view[:size]
+        index ^= 1
 
 
 def _is_duplicate_file(db_session, filename, hashes):
@@ -1158,15 +1233,23 @@ def file_upload(request):
         temporary_filename = os.path.join(tmpdir, filename)
 
         # Buffer the entire file onto disk, checking the hash of the file as we
-        # go along.
-        with open(temporary_filename, "wb") as fp:
+        # go along. The hashing for each chunk happens on a worker thread while
+        # we write that chunk to disk and read the next one.
+        buffer_size = request.registry.settings.get(
+            "forklift.upload_buffer_size", UPLOAD_BUFFER_SIZE
+        )
+        start = time.perf_counter()
+        with open(temporary_filename, "wb") as fp, (
+            concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        ) as executor:
             file_size = 0
             file_hashes = {
                 "md5": hashlib.md5(),
                 "sha256": hashlib.sha256(),
                 "blake2_256": hashlib.blake2b(digest_size=256 // 8),
             }
-            for chunk in iter(lambda: request.POST["content"].file.read(8096), b""):
+            hashing = None
+            for chunk in _iter_chunks(request.POST["content"].file, buffer_size):
                 file_size += len(chunk)
                 if file_size > file_size_limit:
                     raise _exc_with_message(
@@ -1189,9 +1272,20 @@ def file_upload(request):
                         + "See "
                         + request.help_url(_anchor="project-size-limit"),
                     )
+                # Our hashes have to be updated in order, so we wait for the
+                # previous chunk to finish before handing off this one.
+                if hashing is not None:
+                    hashing.result()
+                hashing = executor.submit(_update_hashers, file_hashes.values(), chunk)
                 fp.write(chunk)
-                for hasher in file_hashes.values():
-                    hasher.update(chunk)
+            if hashing is not None:
+                hashing.result()
+
+        if file_size:
+            metrics.histogram(
+                "warehouse.upload.hash_and_write.ms_per_mb",
+                (time.perf_counter() - start) * 1000 / (file_size / ONE_MB),
+            )
 
         # Take our hash functions and compute the final hashes for them now.
         file_hashes = {k: h.hexdigest().lower() for k, h in file_hashes.items()}
@@ -1261,7 +1355,19 @@ def file_upload(request):
             )
 
         # Check the file to make sure it is a valid distribution file.
-        if not _is_valid_dist_file(temporary_filename, form.filetype.data):
+        dist_file_limits = DistFileLimits(
+            **{
+                field: request.registry.settings[f"forklift.dist_file.{field}"]
+                for field in DistFileLimits._fields
+                if f"forklift.dist_file.{field}" in request.registry.settings
+            }
+        )
+        if not _is_valid_dist_file(
+            temporary_filename,
+            form.filetype.data,
+            limits=dist_file_limits,
+            metrics=metrics,
+        ):
             raise _exc_with_message(HTTPBadRequest, "Invalid distribution file.")
 
         # Check that if it's a binary wheel, it's on a supported platform
@@ -1423,7 +1529,7 @@ def file_upload(request):
         "upload_time": file_data.upload_time,
     }
     if not request.registry.settings.get("warehouse.release_files_table") is None:
-        request.task(update_bigquery_release_files).delay(dist_metadata)
+        buffer_bigquery_release_file(request, dist_metadata)
 
     # Log a successful upload
     metrics.increment("warehouse.upload.ok", tags=[f"filetype:{form.filetype.data}"])
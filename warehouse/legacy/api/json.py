@@ -10,15 +10,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import functools
+
+import orjson
+
 from packaging.utils import canonicalize_name, canonicalize_version
-from pyramid.httpexceptions import HTTPMovedPermanently, HTTPNotFound
+from pyramid.httpexceptions import (
+    HTTPMovedPermanently,
+    HTTPNotFound,
+    HTTPTooManyRequests,
+)
 from pyramid.view import view_config
 from sqlalchemy.orm import Load, contains_eager, joinedload
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 from warehouse.cache.http import cache_control
 from warehouse.cache.origin import origin_cache
+from warehouse.metrics import IMetricsService
 from warehouse.packaging.models import File, Project, Release, ReleaseURL
+from warehouse.packaging.utils import iter_journal_entries
+from warehouse.rate_limiting import IRateLimiter
 
 # Generate appropriate CORS headers for the JSON endpoint.
 # We want to allow Cross-Origin requests here so that users can interact
@@ -60,6 +72,47 @@ _PROJECT_CACHE_DECORATOR = [
 ]
 
 
+def _changelog_ratelimit(view):
+    # The changelog is the same feed as the XML-RPC changelog methods, so it
+    # shares their rate limit rather than offering a way around it.
+    @functools.wraps(view)
+    def wrapped(context, request):
+        ratelimiter = request.find_service(
+            IRateLimiter, name="xmlrpc.client", context=None
+        )
+        metrics = request.find_service(IMetricsService, context=None)
+        ratelimiter.hit(request.remote_addr)
+        if not ratelimiter.test(request.remote_addr):
+            metrics.increment("warehouse.json.changelog.ratelimiter.exceeded", tags=[])
+            message = (
+                "The action could not be performed because there were too "
+                "many requests by the client."
+            )
+            _resets_in = ratelimiter.resets_in(request.remote_addr)
+            if _resets_in is not None:
+                _resets_in = max(1, int(_resets_in.total_seconds()))
+                message += f" Limit may reset in {_resets_in} seconds."
+            return HTTPTooManyRequests(message, headers=_CORS_HEADERS)
+        metrics.increment("warehouse.json.changelog.ratelimiter.hit", tags=[])
+        return view(context, request)
+
+    return wrapped
+
+
+# The rate limit comes first, so that a 429 is never given cache headers.
+# Entries are only ever appended to the journal, so a short lifetime is all
+# that is needed to pick up new ones without any purging.
+_CHANGELOG_DECORATOR = [
+    _changelog_ratelimit,
+    cache_control(60),  # 1 minute
+    origin_cache(
+        5 * 60,  # 5 minutes
+        stale_if_error=1 * 24 * 60 * 60,  # 1 day
+        keys=["all-legacy-json"],
+    ),
+]
+
+
 def _json_data(request, project, release, *, all_releases):
     # Get all of the releases and files for this project.
     release_files = (
@@ -323,3 +376,45 @@ def json_release(release, request):
 )
 def json_release_slash(release, request):
     return json_release(release, request)
+
+
+def _iter_changelog_json(pages):
+    yield b'{"changelog":['
+    first = True
+    for entries in pages:
+        # Each page is a JSON array, so we strip the brackets to splice it
+        # into the one we're streaming.
+        content = orjson.dumps(
+            [
+                {
+                    "action": e.action,
+                    "name": e.name,
+                    "serial": e.id,
+                    "timestamp": int(
+                        e.submitted_date.replace(
+                            tzinfo=datetime.timezone.utc
+                        ).timestamp()
+                    ),
+                    "version": e.version,
+                }
+                for e in entries
+            ]
+        )[1:-1]
+        yield content if first else b"," + content
+        first = False
+    yield b"]}\n"
+
+
+@view_config(route_name="legacy.api.json.changelog", decorator=_CHANGELOG_DECORATOR)
+def json_changelog(request):
+    try:
+        serial = int(request.matchdict["serial"])
+    except ValueError:
+        return HTTPNotFound(headers=_CORS_HEADERS)
+
+    request.response.headers.update(_CORS_HEADERS)
+    request.response.content_type = "application/json"
+    request.response.app_iter = _iter_changelog_json(
+        iter_journal_entries(request, serial=serial)
+    )
+    return request.response
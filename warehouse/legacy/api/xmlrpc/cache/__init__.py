@@ -16,47 +16,41 @@ from urllib.parse import urlparse
 
 from pyramid.exceptions import ConfigurationError
 from sqlalchemy.orm.base import NO_VALUE
-from sqlalchemy.orm.session import Session
 
 from warehouse import db
 from warehouse.accounts.models import Email, User
+from warehouse.cache.origin import (
+    resolve_purge_keys,
+    stage_attribute_purge_keys,
+    stage_purge_keys,
+)
 from warehouse.legacy.api.xmlrpc.cache.derivers import cached_return_view
-from warehouse.legacy.api.xmlrpc.cache.fncache import RedisLru
+from warehouse.legacy.api.xmlrpc.cache.fncache import LocalLru, RedisLru
 from warehouse.legacy.api.xmlrpc.cache.interfaces import IXMLRPCCache
 from warehouse.legacy.api.xmlrpc.cache.services import NullXMLRPCCache, RedisXMLRPCCache
 
-__all__ = ["RedisLru"]
+__all__ = ["LocalLru", "RedisLru"]
 
 
 CacheKeys = collections.namedtuple("CacheKeys", ["cache", "purge"])
 
 
 def receive_set(attribute, config, target):
-    cache_keys = config.registry["cache_keys"]
-    session = Session.object_session(target)
-    purges = session.info.setdefault("warehouse.legacy.api.xmlrpc.cache.purges", set())
-    key_maker = cache_keys[attribute]
-    keys = key_maker(target).purge
-    purges.update(list(keys))
+    stage_attribute_purge_keys(
+        attribute, target, "warehouse.legacy.api.xmlrpc.cache.purges"
+    )
 
 
 @db.listens_for(db.Session, "after_flush")
 def store_purge_keys(config, session, flush_context):
-    cache_keys = config.registry["cache_keys"]
-
     # We'll (ab)use the session.info dictionary to store a list of pending
     # purges to the session.
-    purges = session.info.setdefault("warehouse.legacy.api.xmlrpc.cache.purges", set())
+    stage_purge_keys(config, session, "warehouse.legacy.api.xmlrpc.cache.purges")
 
-    # Go through each new, changed, and deleted object and attempt to store
-    # a cache key that we'll want to purge when the session has been committed.
-    for obj in session.new | session.dirty | session.deleted:
-        try:
-            key_maker = cache_keys[obj.__class__]
-        except KeyError:
-            continue
 
-        purges.update(key_maker(obj).purge)
+@db.listens_for(db.Session, "before_commit")
+def resolve_xmlrpc_purge_keys(config, session):
+    resolve_purge_keys(config, session, "warehouse.legacy.api.xmlrpc.cache.purges")
 
 
 @db.listens_for(db.Session, "after_commit")
@@ -89,6 +83,12 @@ def includeme(config):
     xmlrpc_cache_expires = config.registry.settings.get(
         "warehouse.xmlrpc.cache.expires", 25 * 60 * 60
     )
+    xmlrpc_cache_local_max_bytes = config.registry.settings.get(
+        "warehouse.xmlrpc.cache.local.max_bytes", 32 * 1024 * 1024
+    )
+    xmlrpc_cache_local_expires = config.registry.settings.get(
+        "warehouse.xmlrpc.cache.local.expires", 5 * 60
+    )
 
     if xmlrpc_cache_url is None:
         raise ConfigurationError(
@@ -113,6 +113,19 @@ def includeme(config):
             " to integer"
         )
 
+    try:
+        xmlrpc_cache_local_max_bytes = int(xmlrpc_cache_local_max_bytes)
+        xmlrpc_cache_local_expires = int(xmlrpc_cache_local_expires)
+    except ValueError:
+        raise ConfigurationError("Unable to cast local XMLRPCCache limits to integer")
+
+    # Each process keeps its own small cache in front of Redis, which is kept
+    # in sync by listening for purges. Setting max_bytes to 0 disables it.
+    if xmlrpc_cache_class is RedisXMLRPCCache and xmlrpc_cache_local_max_bytes > 0:
+        config.registry["warehouse.xmlrpc.cache.local"] = LocalLru(
+            xmlrpc_cache_local_max_bytes, xmlrpc_cache_local_expires
+        )
+
     config.register_service_factory(
         xmlrpc_cache_class.create_service, iface=IXMLRPCCache
     )
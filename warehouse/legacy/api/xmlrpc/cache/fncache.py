@@ -10,7 +10,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import json
+import os
+import threading
+import time
 
 import redis
 
@@ -18,24 +22,119 @@ from warehouse.legacy.api.xmlrpc.cache.interfaces import CacheError
 
 DEFAULT_EXPIRES = 86400
 
+# Part of every key, after the tag, so that we never read an entry cached before
+# keys were indexed by tag, as we'd have no way to purge it. Keeping the tag
+# where it was means that any older processes still purging with SCAN will
+# match our keys too.
+KEY_VERSION = "v2"
+
 
 class StubMetricReporter(object):
     def increment(self, metric_name):
         return
 
 
+class LocalLru(object):
+    """
+    In process LRU cache, bounded by the total size of the serialized values
+    that it holds rather than by the number of entries, which sits in front
+    of a RedisLru. Entries are evicted once they expire, when we need to make
+    room, or when their tag is purged.
+    """
+
+    def __init__(self, max_bytes, expires, clock=time.monotonic):
+        """
+        max_bytes: Maximum total size of the serialized values in the cache
+        expires:   Number of seconds until an entry expires
+        clock:     Function returning the current time in seconds
+        """
+        self.max_bytes = max_bytes
+        self.expires = expires
+        self.clock = clock
+        self.size = 0
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()
+        self._tags = collections.defaultdict(set)
+        self._pid = None
+        self._listener = None
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires_at, _, _, value = self._entries[key]
+            except KeyError:
+                return None
+            if expires_at <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def add(self, key, value, size, tag):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + self.expires, size, tag, value)
+            self._tags[tag].add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def purge(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def listen(self, conn, channel):
+        """
+        Ensure that this process is subscribed to the channel that purges are
+        published on, clearing the cache if we weren't as we may have missed
+        some of them.
+        """
+        pid = os.getpid()
+        with self._lock:
+            # Threads don't survive a fork, and the listener may have died if
+            # its connection to Redis did, so check both.
+            if self._pid == pid and self._listener.is_alive():
+                return
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: self._handle_purge})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self._pid = pid
+
+    def _handle_purge(self, message):
+        self.purge(message["data"].decode("utf8"))
+
+    def _remove(self, key):
+        _, size, tag, _ = self._entries.pop(key)
+        self.size -= size
+        keys = self._tags[tag]
+        keys.discard(key)
+        if not keys:
+            del self._tags[tag]
+
+
 class RedisLru(object):
     """
     Redis backed LRU cache for functions which return an object which
     can survive json.dumps() and json.loads() intact
     """
 
-    def __init__(self, conn, name="lru", expires=None, metric_reporter=None):
+    def __init__(
+        self, conn, name="lru", expires=None, metric_reporter=None, local=None
+    ):
         """
         conn:            Redis Connection Object
         name:            Prefix for all keys in the cache
         expires:         Default expiration
         metric_reporter: Object implementing an `increment(<string>)` method
+        local:           Optional LocalLru to check before going to Redis
         """
         self.conn = conn
         self.name = name
@@ -44,48 +143,115 @@ class RedisLru(object):
             self.metric_reporter = metric_reporter
         else:
             self.metric_reporter = StubMetricReporter()
+        self.local = local
+        self.purge_channel = ":".join([self.name, "purge"])
 
     def format_key(self, func_name, tag):
         if tag is not None and tag != "None":
-            return ":".join([self.name, tag, func_name])
-        return ":".join([self.name, "tag", func_name])
+            return ":".join([self.name, tag, KEY_VERSION, func_name])
+        return ":".join([self.name, "tag", KEY_VERSION, func_name])
+
+    def format_tag_key(self, tag):
+        if tag is not None and tag != "None":
+            return ":".join([f"{self.name}-tags", tag])
+        return ":".join([f"{self.name}-tags", "tag"])
+
+    def get_local(self):
+        # We can only trust our local cache if we're going to hear about any
+        # purges that happen, otherwise we skip it and go straight to Redis.
+        if self.local is None:
+            return None
+        try:
+            self.local.listen(self.conn, self.purge_channel)
+        except (redis.exceptions.RedisError, redis.exceptions.ConnectionError):
+            self.metric_reporter.increment(f"{self.name}.cache.error")
+            return None
+        return self.local
 
     def get(self, func_name, key, tag):
+        local = self.get_local()
+        if local is not None:
+            value = local.get((self.format_key(func_name, tag), str(key)))
+            if value is not None:
+                self.metric_reporter.increment(f"{self.name}.cache.local.hit")
+                return value
+
         try:
-            value = self.conn.hget(self.format_key(func_name, tag), str(key))
+            serialized = self.conn.hget(self.format_key(func_name, tag), str(key))
         except (redis.exceptions.RedisError, redis.exceptions.ConnectionError):
             self.metric_reporter.increment(f"{self.name}.cache.error")
             return None
+        value = serialized
         if value:
             self.metric_reporter.increment(f"{self.name}.cache.hit")
             value = json.loads(value)
+            if local is not None:
+                local.add(
+                    (self.format_key(func_name, tag), str(key)),
+                    value,
+                    len(serialized),
+                    tag,
+                )
         return value
 
     def add(self, func_name, key, value, tag, expires):
         try:
             self.metric_reporter.increment(f"{self.name}.cache.miss")
+            serialized = json.dumps(value)
             pipeline = self.conn.pipeline()
-            pipeline.hset(self.format_key(func_name, tag), str(key), json.dumps(value))
+            pipeline.hset(self.format_key(func_name, tag), str(key), serialized)
             ttl = expires if expires else self.expires
             pipeline.expire(self.format_key(func_name, tag), ttl)
+            # Index the hash under its tag so purges don't have to scan for it.
+            # The index has to outlive every hash in it, so it never gets a
+            # shorter expiry than our default.
+            pipeline.sadd(self.format_tag_key(tag), self.format_key(func_name, tag))
+            pipeline.expire(self.format_tag_key(tag), max(ttl, self.expires))
             pipeline.execute()
+            local = self.get_local()
+            if local is not None:
+                local.add(
+                    (self.format_key(func_name, tag), str(key)),
+                    value,
+                    len(serialized),
+                    tag,
+                )
             return value
         except (redis.exceptions.RedisError, redis.exceptions.ConnectionError):
             self.metric_reporter.increment(f"{self.name}.cache.error")
             return value
 
     def purge(self, tag):
+        self.purge_many([tag])
+
+    def purge_many(self, tags):
+        tags = list(tags)
         try:
-            keys = self.conn.scan_iter(":".join([self.name, tag, "*"]), count=1000)
             pipeline = self.conn.pipeline()
-            for key in keys:
-                pipeline.delete(key)
+            for tag in tags:
+                pipeline.smembers(self.format_tag_key(tag))
+            indexed = pipeline.execute()
+
+            pipeline = self.conn.pipeline()
+            for tag, keys in zip(tags, indexed):
+                if keys:
+                    # UNLINK frees the memory in the background, and we only
+                    # remove the keys we've seen from the index so that any
+                    # added since are still purged next time.
+                    pipeline.unlink(*keys)
+                    pipeline.srem(self.format_tag_key(tag), *keys)
+                # Let every process with a local cache know to drop this tag.
+                pipeline.publish(self.purge_channel, tag)
             pipeline.execute()
-            self.metric_reporter.increment(f"{self.name}.cache.purge")
         except (redis.exceptions.RedisError, redis.exceptions.ConnectionError):
             self.metric_reporter.increment(f"{self.name}.cache.error")
             raise CacheError()
 
+        for tag in tags:
+            if self.local is not None:
+                self.local.purge(tag)
+            self.metric_reporter.increment(f"{self.name}.cache.purge")
+
     def fetch(self, func, args, kwargs, key, tag, expires):
         return self.get(func.__name__, str(key), str(tag)) or self.add(
             func.__name__, str(key), func(*args, **kwargs), str(tag), expires
@@ -39,6 +39,12 @@ class IXMLRPCCache(Interface):
         from the cache.
         """
 
+    def purge_many(tags):
+        """
+        Issues a single purge, clearing all cached objects associated with
+        each tag in the iterable tags.
+        """
+
     def purge_tags(tags):
         """
         Issues a purge, clearing all cached objects associated with each tag
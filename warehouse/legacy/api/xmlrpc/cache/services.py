@@ -30,6 +30,17 @@ def purge_tag(task, request, tag):
         raise task.retry(exc=exc)
 
 
+@tasks.task(bind=True, ignore_result=True, acks_late=True)
+def purge_tags(task, request, tags):
+    service = request.find_service(interfaces.IXMLRPCCache)
+    request.log.info("Purging %s", ", ".join(tags))
+    try:
+        service.purge_many(tags)
+    except (interfaces.CacheError) as exc:
+        request.log.error("Error purging %s: %s", ", ".join(tags), str(exc))
+        raise task.retry(exc=exc)
+
+
 @implementer(interfaces.IXMLRPCCache)
 class RedisXMLRPCCache:
     def __init__(
@@ -40,10 +51,15 @@ class RedisXMLRPCCache:
         name="lru",
         expires=None,
         metric_reporter=None,
+        local=None,
     ):
         self.redis_conn = redis.StrictRedis.from_url(redis_url, db=redis_db)
         self.redis_lru = cache.RedisLru(
-            self.redis_conn, name=name, expires=expires, metric_reporter=metric_reporter
+            self.redis_conn,
+            name=name,
+            expires=expires,
+            metric_reporter=metric_reporter,
+            local=local,
         )
         self._purger = purger
 
@@ -51,13 +67,14 @@ class RedisXMLRPCCache:
     def create_service(cls, context, request):
         return cls(
             request.registry.settings.get("warehouse.xmlrpc.cache.url"),
-            request.task(purge_tag).delay,
+            request.task(purge_tags).delay,
             name=request.registry.settings.get("warehouse.xmlrpc.cache.name", "xmlrpc"),
             expires=int(
                 request.registry.settings.get(
                     "warehouse.xmlrpc.cache.expires", 25 * 60 * 60
                 )
             ),
+            local=request.registry.get("warehouse.xmlrpc.cache.local"),
         )
 
     def fetch(self, func, args, kwargs, key, tag, expires):
@@ -66,9 +83,14 @@ class RedisXMLRPCCache:
     def purge(self, tag):
         return self.redis_lru.purge(tag)
 
+    def purge_many(self, tags):
+        return self.redis_lru.purge_many(tags)
+
     def purge_tags(self, tags):
-        for tag in tags:
-            self._purger(tag)
+        # Coalesce all of the tags into a single task, and a single purge.
+        tags = sorted(tags)
+        if tags:
+            self._purger(tags)
 
 
 @implementer(interfaces.IXMLRPCCache)
@@ -80,7 +102,7 @@ class NullXMLRPCCache:
     def create_service(cls, context, request):
         return cls(
             request.registry.settings.get("warehouse.xmlrpc.cache.url"),
-            request.task(purge_tag).delay,
+            request.task(purge_tags).delay,
         )
 
     def fetch(self, func, args, kwargs, key, tag, expires):
@@ -89,6 +111,10 @@ class NullXMLRPCCache:
     def purge(self, tag):
         return
 
+    def purge_many(self, tags):
+        return
+
     def purge_tags(self, tags):
-        for tag in tags:
-            self._purger(tag)
+        tags = sorted(tags)
+        if tags:
+            self._purger(tags)
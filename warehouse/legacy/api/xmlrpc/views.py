@@ -46,6 +46,7 @@ from warehouse.packaging.models import (
     Role,
     release_classifiers,
 )
+from warehouse.packaging.utils import iter_journal_entries
 from warehouse.rate_limiting import IRateLimiter
 from warehouse.search.queries import SEARCH_BOOSTS
 
@@ -91,6 +92,48 @@ def _clean_for_xml(data):
     return data
 
 
+def _stream_array(request, chunks, *, method):
+    """
+    Stream an XML-RPC response holding a single array, made up of the values
+    in each of the chunks, without building the whole document in memory.
+
+    The chunks are only read once the response is being sent, which is after
+    submit_xmlrpc_metrics has stopped timing the call, so the time taken to
+    query and serialize them is submitted as warehouse.xmlrpc.stream.timing.
+    """
+    marshaller = xmlrpc.client.Marshaller(allow_none=True)
+    metrics = request.find_service(IMetricsService, context=None)
+
+    def body():
+        with metrics.timed(
+            "warehouse.xmlrpc.stream.timing", tags=[f"rpc_method:{method}"]
+        ):
+            yield (
+                b"<?xml version='1.0'?>\n<methodResponse>\n<params>\n<param>\n"
+                b"<value><array><data>\n"
+            )
+            for values in chunks:
+                out = []
+                for value in values:
+                    marshaller.dispatch[type(value)](marshaller, value, out.append)
+                yield "".join(out).encode("utf8")
+            yield b"</data></array></value>\n</param>\n</params>\n</methodResponse>\n"
+
+    request.response.content_type = "text/xml"
+    request.response.app_iter = body()
+    return request.response
+
+
+def _changelog_tuple(entry, *, clean=False):
+    return (
+        entry.name,
+        entry.version,
+        int(entry.submitted_date.replace(tzinfo=datetime.timezone.utc).timestamp()),
+        _clean_for_xml(entry.action) if clean else entry.action,
+        entry.id,
+    )
+
+
 def submit_xmlrpc_metrics(method=None):
     """
     Submit metrics.
@@ -529,51 +572,27 @@ def changelog_last_serial(request):
 
 @xmlrpc_method(method="changelog_since_serial")
 def changelog_since_serial(request, serial: int):
-    entries = (
-        request.db.query(JournalEntry)
-        .filter(JournalEntry.id > serial)
-        .order_by(JournalEntry.id)
-        .limit(50000)
-    )
+    pages = iter_journal_entries(request, serial=serial)
 
-    return [
-        (
-            e.name,
-            e.version,
-            int(e.submitted_date.replace(tzinfo=datetime.timezone.utc).timestamp()),
-            _clean_for_xml(e.action),
-            e.id,
-        )
-        for e in entries
-    ]
+    return _stream_array(
+        request,
+        ([_changelog_tuple(e, clean=True) for e in entries] for entries in pages),
+        method="changelog_since_serial",
+    )
 
 
 @xmlrpc_method(method="changelog")
 def changelog(request, since: int, with_ids: bool = False):
     since_dt = datetime.datetime.utcfromtimestamp(since)
-    entries = (
-        request.db.query(JournalEntry)
-        .filter(JournalEntry.submitted_date > since_dt)
-        .order_by(JournalEntry.id)
-        .limit(50000)
-    )
+    pages = iter_journal_entries(request, since=since_dt)
+    end = None if with_ids else -1
 
-    results = (
-        (
-            e.name,
-            e.version,
-            int(e.submitted_date.replace(tzinfo=datetime.timezone.utc).timestamp()),
-            e.action,
-            e.id,
-        )
-        for e in entries
+    return _stream_array(
+        request,
+        ([_changelog_tuple(e)[:end] for e in entries] for entries in pages),
+        method="changelog",
     )
 
-    if with_ids:
-        return list(results)
-    else:
-        return [r[:-1] for r in results]
-
 
 @xmlrpc_method(method="browse")
 def browse(request, classifiers: List[str]):
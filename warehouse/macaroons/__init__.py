@@ -10,12 +10,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from celery.schedules import crontab
+
 from warehouse.macaroons.errors import InvalidMacaroonError
 from warehouse.macaroons.interfaces import IMacaroonService
-from warehouse.macaroons.services import database_macaroon_factory
+from warehouse.macaroons.services import (
+    MACAROON_CACHE_KEY,
+    VerifiedMacaroonCache,
+    database_macaroon_factory,
+)
+from warehouse.macaroons.tasks import flush_last_used
 
 __all__ = ["InvalidMacaroonError", "includeme"]
 
 
 def includeme(config):
     config.register_service_factory(database_macaroon_factory, IMacaroonService)
+
+    # Only verify each macaroon fully once in a while and write when they were
+    # last used in bulk, when we have somewhere to keep track of them.
+    cache_url = config.registry.settings.get("macaroons.cache_url")
+    if cache_url:
+        config.registry[MACAROON_CACHE_KEY] = VerifiedMacaroonCache(cache_url)
+        config.add_periodic_task(crontab(minute="*"), flush_last_used)
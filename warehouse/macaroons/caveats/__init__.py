@@ -12,6 +12,7 @@
 
 import time
 
+from collections.abc import Callable, Sequence
 from typing import Any
 
 from pydantic import StrictInt, StrictStr
@@ -35,7 +36,7 @@ from warehouse.macaroons.caveats._core import (
 )
 from warehouse.packaging.models import Project
 
-__all__ = ["deserialize", "serialize", "verify"]
+__all__ = ["deserialize", "serialize", "verify", "verify_caveats"]
 
 
 @as_caveat(tag=0)
@@ -100,12 +101,10 @@ class RequestUser(Caveat):
         return Success()
 
 
-def verify(
-    macaroon: Macaroon, key: bytes, request: Request, context: Any, permission: str
-) -> Allowed | WarehouseDenied:
-    errors: list[str] = []
-
-    def _verify_caveat(predicate: bytes):
+def _caveat_verifier(
+    request: Request, context: Any, permission: str, errors: list[str]
+) -> Callable[[str | bytes], bool]:
+    def _verify_caveat(predicate: str | bytes):
         try:
             caveat = deserialize(predicate)
         except CaveatError as exc:
@@ -121,8 +120,16 @@ def verify(
 
         return True
 
+    return _verify_caveat
+
+
+def verify(
+    macaroon: Macaroon, key: bytes, request: Request, context: Any, permission: str
+) -> Allowed | WarehouseDenied:
+    errors: list[str] = []
+
     verifier = Verifier()
-    verifier.satisfy_general(_verify_caveat)
+    verifier.satisfy_general(_caveat_verifier(request, context, permission, errors))
 
     result = False
     try:
@@ -141,3 +148,18 @@ def verify(
     if not result:
         return WarehouseDenied("unknown error", reason="invalid_api_token")
     return Allowed("signature and caveats OK")
+
+
+def verify_caveats(
+    predicates: Sequence[str | bytes], request: Request, context: Any, permission: str
+) -> Allowed | WarehouseDenied:
+    """
+    Checks the caveats of a macaroon whose signature has already been verified
+    against the given request, context and permission.
+    """
+    errors: list[str] = []
+
+    verify_caveat = _caveat_verifier(request, context, permission, errors)
+    if not all([verify_caveat(predicate) for predicate in predicates]):
+        return WarehouseDenied(", ".join(errors), reason="invalid_api_token")
+    return Allowed("caveats OK")
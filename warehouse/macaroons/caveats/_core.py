@@ -12,6 +12,7 @@
 from __future__ import annotations
 
 import dataclasses
+import functools
 import json
 import typing
 
@@ -125,7 +126,7 @@ def serialize(caveat: Caveat) -> bytes:
     ).encode("utf8")
 
 
-def deserialize(data: bytes) -> Caveat:
+def _deserialize(data: bytes) -> Caveat:
     loaded = json.loads(data)
 
     # Our original caveats were implemented as a mapping with arbitrary keys,
@@ -149,3 +150,19 @@ def deserialize(data: bytes) -> Caveat:
         raise CaveatDeserializationError(f"caveat has unknown tag: {tag}")
 
     return cls.__deserialize__(fields)
+
+
+# Caveats are frozen, so the same one can be handed out for every token that
+# carries it, rather than validating it again on every request.
+_deserialize_cached = functools.lru_cache(maxsize=4096)(_deserialize)
+
+
+def deserialize(data: bytes | str) -> Caveat:
+    if isinstance(data, str):
+        data = data.encode("utf8")
+
+    # Only caveats in our current format are cached, as adapting some legacy
+    # caveats depends on the current request.
+    if data.startswith(b"["):
+        return _deserialize_cached(data)
+    return _deserialize(data)
@@ -10,10 +10,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import datetime
+import hashlib
+import logging
+import threading
+import time
 import uuid
 
 import pymacaroons
+import redis
 
 from pymacaroons.exceptions import MacaroonDeserializationException
 from sqlalchemy.orm import joinedload
@@ -26,11 +32,113 @@ from warehouse.macaroons.errors import InvalidMacaroonError
 from warehouse.macaroons.interfaces import IMacaroonService
 from warehouse.macaroons.models import Macaroon
 
+logger = logging.getLogger(__name__)
+
+MACAROON_CACHE_KEY = "warehouse.macaroons.cache"
+LAST_USED_KEY = "warehouse/macaroons/last_used"
+
+VerifiedMacaroon = collections.namedtuple(
+    "VerifiedMacaroon", ["macaroon_id", "user_id", "caveats", "expires"]
+)
+
+
+class VerifiedMacaroonCache:
+    """
+    A process local LRU of macaroons which recently passed a full verification,
+    so that further requests with the same token only need to check its caveats
+    instead of loading it from the database and checking its signature.
+
+    Uses are recorded in Redis, to be written to the database in bulk by the
+    flush_last_used task, in the same round trip that checks whether the
+    macaroon has been deleted since it was cached. Deleted macaroons are marked
+    as revoked for as long as any process could still have them cached.
+    """
+
+    def __init__(self, redis_url, *, ttl=60, maxsize=10000):
+        self.redis = redis.StrictRedis.from_url(redis_url)
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def _key(raw_macaroon):
+        return hashlib.sha256(raw_macaroon.encode("utf8")).digest()
+
+    @staticmethod
+    def _revoked_key(macaroon_id):
+        return f"warehouse/macaroons/revoked/{macaroon_id}"
+
+    def get(self, raw_macaroon):
+        key = self._key(raw_macaroon)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def add(self, raw_macaroon, macaroon_id, user_id, caveats):
+        entry = VerifiedMacaroon(
+            macaroon_id, user_id, tuple(caveats), time.monotonic() + self.ttl
+        )
+        with self._lock:
+            self._entries[self._key(raw_macaroon)] = entry
+            self._entries.move_to_end(self._key(raw_macaroon))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def record_use(self, macaroon_id):
+        """
+        Records that the given macaroon has just been used.
+
+        Returns False if the macaroon has been revoked, or None if Redis could not
+        be reached.
+        """
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.hset(
+                LAST_USED_KEY, macaroon_id, datetime.datetime.now().isoformat()
+            )
+            pipeline.exists(self._revoked_key(macaroon_id))
+            _, revoked = pipeline.execute()
+        except redis.RedisError as exc:
+            logger.warning("Error recording macaroon use: %r", exc)
+            return None
+
+        return not revoked
+
+    def revoke(self, macaroon_id):
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.macaroon_id == macaroon_id:
+                    del self._entries[key]
+
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.setex(self._revoked_key(macaroon_id), self.ttl, "1")
+            pipeline.hdel(LAST_USED_KEY, macaroon_id)
+            pipeline.execute()
+        except redis.RedisError as exc:
+            # Other processes will keep accepting this macaroon until it expires
+            # from their cache, which is the best we can do without Redis.
+            logger.warning("Error revoking macaroon %s: %r", macaroon_id, exc)
+
 
 @implementer(IMacaroonService)
 class DatabaseMacaroonService:
-    def __init__(self, db_session):
+    def __init__(self, db_session, cache=None, transaction_manager=None):
         self.db = db_session
+        self.cache = cache
+        self.transaction_manager = transaction_manager
+
+    def _get_cached(self, raw_macaroon):
+        if self.cache is None or raw_macaroon is None:
+            return None
+        return self.cache.get(raw_macaroon)
 
     def _extract_raw_macaroon(self, prefixed_macaroon):
         """
@@ -85,6 +193,10 @@ class DatabaseMacaroonService:
         Returns the id of the user associated with the given raw (serialized)
         macaroon.
         """
+        cached = self._get_cached(raw_macaroon)
+        if cached is not None:
+            return cached.user_id
+
         try:
             m = self._deserialize_raw_macaroon(raw_macaroon)
         except InvalidMacaroonError:
@@ -114,6 +226,22 @@ class DatabaseMacaroonService:
 
         Raises InvalidMacaroonError if the macaroon is not valid.
         """
+        cached = self._get_cached(raw_macaroon)
+        if cached is not None:
+            verified = caveats.verify_caveats(
+                cached.caveats, request, context, permission
+            )
+            if not verified:
+                raise InvalidMacaroonError(verified.msg)
+
+            live = self.cache.record_use(cached.macaroon_id)
+            if live:
+                return True
+            elif live is False:
+                raise InvalidMacaroonError("deleted or nonexistent macaroon")
+            # Otherwise we couldn't tell whether the macaroon was revoked, so we'll
+            # fall back to verifying it against the database.
+
         m = self._deserialize_raw_macaroon(raw_macaroon)
         dm = self.find_macaroon(m.identifier.decode())
 
@@ -122,6 +250,16 @@ class DatabaseMacaroonService:
 
         verified = caveats.verify(m, dm.key, request, context, permission)
         if verified:
+            if self.cache is not None:
+                self.cache.add(
+                    raw_macaroon,
+                    str(dm.id),
+                    dm.user_id,
+                    [caveat.caveat_id_bytes for caveat in m.first_party_caveats()],
+                )
+                if self.cache.record_use(str(dm.id)) is not None:
+                    return True
+
             dm.last_used = datetime.datetime.now()
             return True
 
@@ -177,6 +315,12 @@ class DatabaseMacaroonService:
         self.db.delete(dm)
         self.db.flush()
 
+        # Only once the macaroon is really gone can caches stop honouring it.
+        if self.cache is not None:
+            self.transaction_manager.get().addAfterCommitHook(
+                lambda success: success and self.cache.revoke(macaroon_id)
+            )
+
     def get_macaroon_by_description(self, user_id, description):
         """
         Returns a macaroon model from the DB with the given description,
@@ -199,4 +343,8 @@ class DatabaseMacaroonService:
 
 
 def database_macaroon_factory(context, request):
-    return DatabaseMacaroonService(request.db)
+    return DatabaseMacaroonService(
+        request.db,
+        cache=request.registry.get(MACAROON_CACHE_KEY),
+        transaction_manager=request.tm,
+    )
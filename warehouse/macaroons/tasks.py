@@ -0,0 +1,45 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import redis
+
+from sqlalchemy import DateTime, Text, cast, column, update, values
+from sqlalchemy.dialects.postgresql import UUID
+
+from warehouse import tasks
+from warehouse.macaroons.models import Macaroon
+from warehouse.macaroons.services import LAST_USED_KEY
+
+
+@tasks.task(ignore_result=True, acks_late=True)
+def flush_last_used(request):
+    r = redis.StrictRedis.from_url(request.registry.settings["macaroons.cache_url"])
+
+    # Take everything that has been recorded so far in one transaction, so that
+    # uses recorded while we're writing these wait for the next flush.
+    pipeline = r.pipeline()
+    pipeline.hgetall(LAST_USED_KEY)
+    pipeline.delete(LAST_USED_KEY)
+    last_used, _ = pipeline.execute()
+
+    if not last_used:
+        return
+
+    used = values(column("id", Text), column("last_used", Text), name="used").data(
+        [(id_.decode(), when.decode()) for id_, when in last_used.items()]
+    )
+    request.db.execute(
+        update(Macaroon)
+        .where(Macaroon.id == cast(used.c.id, UUID(as_uuid=True)))
+        .values(last_used=cast(used.c.last_used, DateTime))
+        .execution_options(synchronize_session=False)
+    )
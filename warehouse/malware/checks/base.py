@@ -12,9 +12,15 @@
 
 from warehouse.malware.models import MalwareCheck, MalwareCheckState, MalwareVerdict
 from warehouse.packaging import models
+from warehouse.packaging.interfaces import IFileStorage
+from warehouse.packaging.services import LocalFileStorage
 
 
 class MalwareCheckBase:
+    # Scheduled checks can be split across this many workers, each of which
+    # is passed its own `partition` to scan.
+    _partitions = 1
+
     def __init__(self, db):
         self.db = db
         self._name = self.__class__.__name__
@@ -26,15 +32,41 @@ class MalwareCheckBase:
         """
         Prepare some context for scanning the given object.
         """
-        kwargs = {"obj_id": obj_id}
+        model = getattr(models, cls.hooked_object)
+        return cls._prepare_obj(request, obj_id, request.db.query(model).get(obj_id))
 
+    @classmethod
+    def prepare_batch(cls, request, obj_ids):
+        """
+        Prepare some context for scanning each of the given objects, loading
+        all of them with a single query. Objects that no longer exist are
+        skipped.
+        """
         model = getattr(models, cls.hooked_object)
-        kwargs["obj"] = request.db.query(model).get(obj_id)
+        objs = {
+            str(obj.id): obj
+            for obj in request.db.query(model).filter(model.id.in_(obj_ids))
+        }
+
+        return [
+            cls._prepare_obj(request, obj_id, objs[str(obj_id)])
+            for obj_id in obj_ids
+            if str(obj_id) in objs
+        ]
+
+    @classmethod
+    def _prepare_obj(cls, request, obj_id, obj):
+        kwargs = {"obj_id": obj_id, "obj": obj}
 
         if cls.hooked_object == "File":
-            kwargs["file_url"] = request.route_url(
-                "packaging.file", path=kwargs["obj"].path
-            )
+            kwargs["file_url"] = request.route_url("packaging.file", path=obj.path)
+            kwargs["http"] = request.http
+
+            # When files are stored locally (i.e. in development), there's no
+            # point in fetching them back over HTTP.
+            file_storage = request.find_service(IFileStorage)
+            if isinstance(file_storage, LocalFileStorage):
+                kwargs["file_storage"] = file_storage
 
         return kwargs
 
@@ -52,6 +84,14 @@ class MalwareCheckBase:
         self.scan(**kwargs)
         self.db.add_all(self._verdicts)
 
+    def insert_verdicts(self):
+        """
+        Bulk insert the verdicts gathered so far, for checks that are scanning
+        many objects in one go.
+        """
+        self.db.bulk_save_objects(self._verdicts)
+        self._verdicts = []
+
     def scan(self, **kwargs):
         """
         Scan the object and return a verdict. Subclasses should implement
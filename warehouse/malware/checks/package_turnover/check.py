@@ -10,12 +10,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import defaultdict
 from datetime import datetime, timedelta
 from textwrap import dedent
 
-from sqlalchemy import select
+from sqlalchemy import Text, cast, exists, func, select
+from sqlalchemy.orm import aliased
 
-from warehouse.accounts.models import User
+from warehouse.accounts.models import User, WebAuthn
 from warehouse.events.tags import EventTag
 from warehouse.malware.checks.base import MalwareCheckBase
 from warehouse.malware.models import (
@@ -23,7 +25,7 @@ from warehouse.malware.models import (
     VerdictClassification,
     VerdictConfidence,
 )
-from warehouse.packaging.models import Project, Release
+from warehouse.packaging.models import Project, Release, Role
 
 
 class PackageTurnoverCheck(MalwareCheckBase):
@@ -39,78 +41,107 @@ class PackageTurnoverCheck(MalwareCheckBase):
     check_type = "scheduled"
     schedule = {"minute": 0, "hour": 0}
 
+    _partitions = 4
+
     def __init__(self, db):
         super().__init__(db)
         self._scan_interval = datetime.utcnow() - timedelta(hours=24)
 
-    def user_posture_verdicts(self, project):
-        for user in project.users:
-            has_removed_2fa_method = self.db.query(
-                self.db.query(User.Event)
-                .filter(User.Event.source_id == user.id)
-                .filter(User.Event.time >= self._scan_interval)
-                .filter(User.Event.tag == EventTag.Account.TwoFactorMethodRemoved)
-                .exists()
-            ).scalar()
-
-            if has_removed_2fa_method and not user.has_two_factor:
-                self.add_verdict(
-                    project_id=project.id,
-                    classification=VerdictClassification.Threat,
-                    confidence=VerdictConfidence.High,
-                    message="User with control over this package has disabled 2FA",
-                )
+    def user_posture_verdicts(self, project_ids):
+        users_without_2fa = (
+            self.db.query(Role.project_id)
+            .join(User, Role.user_id == User.id)
+            .filter(Role.project_id.in_(project_ids))
+            .filter(User.totp_secret.is_(None))
+            .filter(~exists().where(WebAuthn.user_id == User.id))
+            .filter(
+                exists()
+                .where(User.Event.source_id == User.id)
+                .where(User.Event.time >= self._scan_interval)
+                .where(User.Event.tag == EventTag.Account.TwoFactorMethodRemoved)
+            )
+            .order_by(Role.project_id, User.id)
+        )
 
-    def user_turnover_verdicts(self, project):
+        for (project_id,) in users_without_2fa:
+            self.add_verdict(
+                project_id=project_id,
+                classification=VerdictClassification.Threat,
+                confidence=VerdictConfidence.High,
+                message="User with control over this package has disabled 2FA",
+            )
+
+    def user_turnover_verdicts(self, project_ids):
         # NOTE: This could probably be more involved to check for the case
         # where someone adds themself, removes the real maintainers, pushes a malicious
         # release, then reverts the ownership to the original maintainers and removes
         # themself again.
         recent_role_adds = (
-            self.db.query(Project.Event.additional)
-            .filter(Project.Event.source_id == project.id)
+            self.db.query(
+                Project.Event.source_id, Project.Event.additional["target_user"].astext
+            )
+            .filter(Project.Event.source_id.in_(project_ids))
             .filter(Project.Event.time >= self._scan_interval)
             .filter(
                 (Project.Event.tag == EventTag.Project.RoleAdd)
                 | (Project.Event.tag == "project:role:accepted")
             )
-            .all()
+        )
+        current_roles = (
+            self.db.query(Role.project_id, User.username)
+            .join(User, Role.user_id == User.id)
+            .filter(Role.project_id.in_(project_ids))
         )
 
-        added_users = {role_add["target_user"] for role_add, in recent_role_adds}
-        current_users = {user.username for user in project.users}
+        added_users = defaultdict(set)
+        for project_id, username in recent_role_adds:
+            added_users[project_id].add(username)
 
-        if added_users == current_users:
-            self.add_verdict(
-                project_id=project.id,
-                classification=VerdictClassification.Threat,
-                confidence=VerdictConfidence.High,
-                message="Suspicious user turnover; all current maintainers are new",
-            )
+        current_users = defaultdict(set)
+        for project_id, username in current_roles:
+            current_users[project_id].add(username)
+
+        for project_id in project_ids:
+            if added_users[project_id] == current_users[project_id]:
+                self.add_verdict(
+                    project_id=project_id,
+                    classification=VerdictClassification.Threat,
+                    confidence=VerdictConfidence.High,
+                    message="Suspicious user turnover; all current maintainers are new",
+                )
 
-    def scan(self, **kwargs):
+    def scan(self, partition=None, **kwargs):
         prior_verdicts = select(MalwareVerdict.release_id).where(
             MalwareVerdict.check_id == self.id
         )
 
-        releases = (
-            self.db.query(Release)
+        # Skip projects for which this is the first release,
+        # since we need a baseline to compare against
+        other_release = aliased(Release)
+        project_ids = (
+            self.db.query(Release.project_id)
             .filter(Release.created >= self._scan_interval)
             .filter(~Release.id.in_(prior_verdicts))
-            .all()
+            .filter(
+                exists()
+                .where(other_release.project_id == Release.project_id)
+                .where(other_release.id != Release.id)
+            )
+            .distinct()
         )
 
-        visited_project_ids = set()
-        for release in releases:
-            # Skip projects for which this is the first release,
-            # since we need a baseline to compare against
-            if len(release.project.releases) < 2:
-                continue
-
-            if release.project.id in visited_project_ids:
-                continue
+        # When the scan is split across several workers, each one only looks at
+        # the projects which hash into its own partition.
+        if partition is not None:
+            project_ids = project_ids.filter(
+                func.hashtext(cast(Release.project_id, Text)).op("&")(0x7FFFFFFF)
+                % self._partitions
+                == partition
+            )
 
-            visited_project_ids.add(release.project.id)
+        project_ids = sorted(project_id for project_id, in project_ids)
+        if not project_ids:
+            return
 
-            self.user_posture_verdicts(release.project)
-            self.user_turnover_verdicts(release.project)
+        self.user_posture_verdicts(project_ids)
+        self.user_turnover_verdicts(project_ids)
@@ -10,6 +10,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import os
 
 from textwrap import dedent
@@ -22,6 +23,13 @@ from warehouse.malware.errors import FatalCheckError
 from warehouse.malware.models import VerdictClassification, VerdictConfidence
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_yara_rules(filepath):
+    # Compiling the rules is far more expensive than the rest of setting up
+    # the check, so it's only done once per process.
+    return yara.compile(filepath=filepath)
+
+
 class SetupPatternCheck(MalwareCheckBase):
     _yara_rule_file = os.path.join(
         os.path.dirname(os.path.abspath(__file__)), "setup_py_rules.yara"
@@ -43,7 +51,7 @@ class SetupPatternCheck(MalwareCheckBase):
         self._yara_rules = self._load_yara_rules()
 
     def _load_yara_rules(self):
-        return yara.compile(filepath=self._yara_rule_file)
+        return _compile_yara_rules(self._yara_rule_file)
 
     def scan(self, **kwargs):
         release_file = kwargs.get("obj")
@@ -59,8 +67,14 @@ class SetupPatternCheck(MalwareCheckBase):
             # we have nothing to perform.
             return
 
-        archive_stream = fetch_url_content(file_url)
-        setup_py_contents = extract_file_content(archive_stream, "setup.py")
+        file_storage = kwargs.get("file_storage")
+        if file_storage is not None:
+            archive_stream = file_storage.get(release_file.path)
+        else:
+            archive_stream = fetch_url_content(file_url, session=kwargs.get("http"))
+
+        with archive_stream:
+            setup_py_contents = extract_file_content(archive_stream, "setup.py")
         if setup_py_contents is None:
             self.add_verdict(
                 file_id=release_file.id,
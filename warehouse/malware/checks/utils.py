@@ -10,24 +10,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import io
 import pathlib
 import tarfile
+import tempfile
 import zipfile
 
 import requests
 
+# Dists up to this size are kept in memory, anything larger is spooled to disk.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
 
-def fetch_url_content(url):
+
+def fetch_url_content(url, *, session=None):
     """
-    Retrieves the contents of the given (presumed CDN) URL as a BytesIO.
+    Retrieves the contents of the given (presumed CDN) URL as a seekable,
+    temporary file object, which the caller is responsible for closing.
+
+    The response is streamed in chunks into a file that only spills over onto
+    disk once it grows past SPOOL_MAX_SIZE, so large dists don't have to fit
+    in memory. Passing a session (e.g. request.http) reuses its connection
+    pool across checks.
 
     Performs no error checking; exceptions are handled in the check harness
     as part of check retrying behavior.
     """
-    response = requests.get(url)
-    response.raise_for_status()
-    return io.BytesIO(response.content)
+    if session is None:
+        session = requests
+
+    archive_stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                archive_stream.write(chunk)
+    except Exception:
+        archive_stream.close()
+        raise
+
+    archive_stream.seek(0)
+    return archive_stream
 
 
 def extract_file_content(archive_stream, file_path):
@@ -44,6 +66,10 @@ def extract_file_content(archive_stream, file_path):
     will extract and return the contents of {base}/setup.py where {base}
     is frequently (but not guaranteed to be) something like $name-$version.
 
+    Only the requested member is decompressed: for zips, that means reading
+    the central directory and the member itself; tarballs are read forwards
+    until the member is found.
+
     Returns None on any sort of failure.
     """
     if zipfile.is_zipfile(archive_stream):
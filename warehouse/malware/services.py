@@ -13,7 +13,10 @@
 from zope.interface import implementer
 
 from warehouse.malware.interfaces import IMalwareCheckService
-from warehouse.malware.tasks import run_check
+from warehouse.malware.tasks import run_check, run_check_batch
+
+# The most objects a single task will run a hooked check against.
+HOOKED_CHECK_BATCH_SIZE = 100
 
 
 @implementer(IMalwareCheckService)
@@ -32,20 +35,29 @@ class PrinterMalwareCheckService:
 
 @implementer(IMalwareCheckService)
 class DatabaseMalwareCheckService:
-    def __init__(self, executor):
+    def __init__(self, executor, batch_executor):
         self.executor = executor
+        self.batch_executor = batch_executor
 
     @classmethod
     def create_service(cls, context, request):
-        return cls(request.task(run_check).delay)
+        return cls(request.task(run_check).delay, request.task(run_check_batch).delay)
 
     def run_checks(self, checks, **kwargs):
+        hooked_checks = {}
         for check_info in checks:
             # Hooked checks
             if ":" in check_info:
                 check_name, obj_id = check_info.split(":")
-                kwargs["obj_id"] = obj_id
+                hooked_checks.setdefault(check_name, []).append(obj_id)
             # Scheduled checks
             else:
-                check_name = check_info
-            self.executor(check_name, **kwargs)
+                self.executor(check_info, **kwargs)
+
+        # Hooked checks are run against batches of objects, rather than one
+        # task per object.
+        for check_name, obj_ids in hooked_checks.items():
+            for i in range(0, len(obj_ids), HOOKED_CHECK_BATCH_SIZE):
+                self.batch_executor(
+                    check_name, obj_ids[i : i + HOOKED_CHECK_BATCH_SIZE], **kwargs
+                )
@@ -23,14 +23,15 @@ from warehouse.malware.models import MalwareCheck, MalwareCheckState, MalwareVer
 from warehouse.malware.utils import get_check_fields
 from warehouse.tasks import task
 
+BACKFILL_BATCH_SIZE = 1000
 
-@task(bind=True, ignore_result=True, acks_late=True, retry_backoff=True)
-def run_check(task, request, check_name, obj_id=None, manually_triggered=False):
+
+def _load_check(request, check_name, manually_triggered):
     try:
         check = getattr(checks, check_name)(request.db)
     except NoResultFound:
         request.log.info("Check %s isn't active. Aborting." % check_name)
-        return
+        return None
 
     # Don't run scheduled checks if they are in evaluation mode, unless manually
     # triggered.
@@ -39,6 +40,17 @@ def run_check(task, request, check_name, obj_id=None, manually_triggered=False):
             "%s is in the `evaluation` state and must be manually triggered to run."
             % check_name
         )
+        return None
+
+    return check
+
+
+@task(bind=True, ignore_result=True, acks_late=True, retry_backoff=True)
+def run_check(
+    task, request, check_name, obj_id=None, manually_triggered=False, partition=None
+):
+    check = _load_check(request, check_name, manually_triggered)
+    if check is None:
         return
 
     kwargs = {}
@@ -46,6 +58,18 @@ def run_check(task, request, check_name, obj_id=None, manually_triggered=False):
     # Hooked checks require `obj_id`s.
     if obj_id is not None:
         kwargs = check.prepare(request, obj_id)
+    # Partitioned scheduled checks fan out into one task per partition.
+    elif check._partitions > 1:
+        if partition is None:
+            for partition in range(check._partitions):
+                request.task(run_check).delay(
+                    check_name,
+                    manually_triggered=manually_triggered,
+                    partition=partition,
+                )
+            return
+
+        kwargs = {"partition": partition}
 
     try:
         check.run(**kwargs)
@@ -57,6 +81,31 @@ def run_check(task, request, check_name, obj_id=None, manually_triggered=False):
         raise task.retry(exc=exc)
 
 
+@task(bind=True, ignore_result=True, acks_late=True, retry_backoff=True)
+def run_check_batch(task, request, check_name, obj_ids, manually_triggered=False):
+    """
+    Runs a hooked check over a batch of objects, loading them all at once and
+    inserting all of the resulting verdicts together.
+    """
+    check = _load_check(request, check_name, manually_triggered)
+    if check is None:
+        return
+
+    try:
+        for kwargs in check.prepare_batch(request, obj_ids):
+            try:
+                check.scan(**kwargs)
+            except FatalCheckError as exc:
+                request.log.error(
+                    "Fatal exception: %s: %s: %s"
+                    % (check_name, kwargs["obj_id"], str(exc))
+                )
+        check.insert_verdicts()
+    except Exception as exc:
+        request.log.error("Error executing check %s: %s" % (check_name, str(exc)))
+        raise task.retry(exc=exc)
+
+
 @task(bind=True, ignore_result=True, acks_late=True)
 def run_scheduled_check(task, request, check_name, manually_triggered=False):
     malware_check_service = request.find_service_factory(IMalwareCheckService)
@@ -75,13 +124,18 @@ def backfill(task, request, check_name, num_objects):
 
     request.log.info("Running backfill on %d %ss." % (num_objects, check.hooked_object))
 
-    runs = set()
-    for (elem_id,) in query:
-        runs.update([f"{check_name}:{elem_id}"])
-
     malware_check_service = request.find_service_factory(IMalwareCheckService)
     malware_check = malware_check_service(None, request)
-    malware_check.run_checks(runs, manually_triggered=True)
+
+    runs = []
+    for (elem_id,) in query.yield_per(BACKFILL_BATCH_SIZE):
+        runs.append(f"{check_name}:{elem_id}")
+        if len(runs) == BACKFILL_BATCH_SIZE:
+            malware_check.run_checks(runs, manually_triggered=True)
+            runs = []
+
+    if runs:
+        malware_check.run_checks(runs, manually_triggered=True)
 
 
 @task(bind=True, ignore_result=True, acks_late=True)
@@ -17,13 +17,20 @@ from warehouse import db
 from warehouse.accounts.models import Email, User
 from warehouse.cache.origin import key_factory, receive_set
 from warehouse.manage.tasks import update_role_invitation_status
-from warehouse.packaging.interfaces import IDocsStorage, IFileStorage, ISimpleStorage
+from warehouse.packaging.interfaces import (
+    IDocsStorage,
+    IDownloadStatsService,
+    IFileStorage,
+    ISimpleStorage,
+)
 from warehouse.packaging.models import File, Project, Release, Role
 from warehouse.packaging.tasks import (
     compute_2fa_mandate,
     compute_2fa_metrics,
     compute_trending,
+    flush_bigquery_release_files,
     update_description_html,
+    update_simple_index_shards,
 )
 
 
@@ -53,6 +60,18 @@ def includeme(config):
     docs_storage_class = config.maybe_dotted(config.registry.settings["docs.backend"])
     config.register_service_factory(docs_storage_class.create_service, IDocsStorage)
 
+    # Register whichever source of download statistics has been configured,
+    # which is BigQuery unless we've been told otherwise.
+    download_stats_class = config.maybe_dotted(
+        config.registry.settings.get(
+            "download_stats.backend",
+            "warehouse.packaging.services.BigQueryDownloadStatsService",
+        )
+    )
+    config.register_service_factory(
+        download_stats_class.create_service, IDownloadStatsService
+    )
+
     # Register our origin cache keys
     config.register_origin_cache_keys(
         File,
@@ -102,6 +121,7 @@ def includeme(config):
 
     config.add_periodic_task(crontab(minute="*/5"), update_description_html)
     config.add_periodic_task(crontab(minute="*/5"), update_role_invitation_status)
+    config.add_periodic_task(crontab(minute="*/5"), update_simple_index_shards)
 
     # Add a periodic task to recompute the critical projects list once a day
     if config.get_settings().get("warehouse.two_factor_mandate.available", False):
@@ -111,10 +131,22 @@ def includeme(config):
     config.add_periodic_task(crontab(minute="*/5"), compute_2fa_metrics)
 
     # Add a periodic task to compute trending once a day, assuming we have
-    # been configured to be able to access BigQuery.
-    if config.get_settings().get("warehouse.trending_table"):
+    # been configured to be able to access BigQuery, or some other source of
+    # download statistics.
+    if any(
+        config.get_settings().get(setting)
+        for setting in ["warehouse.trending_table", "download_stats.backend"]
+    ):
         config.add_periodic_task(crontab(minute=0, hour=3), compute_trending)
 
+    # Add a periodic task to flush uploaded files to BigQuery, assuming we have
+    # been configured to be able to access BigQuery.
+    if config.get_settings().get("warehouse.release_files_table"):
+        flush_interval = config.get_settings().get(
+            "warehouse.release_files_table.flush_interval", 60
+        )
+        config.add_periodic_task(int(flush_interval), flush_bigquery_release_files)
+
     # TODO: restore this
     # if config.get_settings().get("warehouse.release_files_table"):
     #     config.add_periodic_task(crontab(minute=0), sync_bigquery_release_files)
@@ -53,3 +53,24 @@ class IDocsStorage(Interface):
         """
         Remove all files matching the given prefix.
         """
+
+
+class IDownloadStatsService(Interface):
+    def create_service(context, request):
+        """
+        Create the service, given the context and request for which it is being
+        created for.
+        """
+
+    def trending_zscores():
+        """
+        Return a mapping of normalized project name to the zscore of its most
+        recent day of downloads, compared against its downloads over the last
+        month, for every project downloaded often enough to be considered.
+        """
+
+    def top_projects(limit):
+        """
+        Return the normalized names of the most downloaded projects over the
+        last six months, up to the given limit.
+        """
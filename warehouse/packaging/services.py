@@ -10,8 +10,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
+import collections
+import datetime
+import json
+import math
 import os.path
 import shutil
+import tempfile
 import warnings
 
 import botocore.exceptions
@@ -21,7 +27,12 @@ import sentry_sdk
 
 from zope.interface import implementer
 
-from warehouse.packaging.interfaces import IDocsStorage, IFileStorage, ISimpleStorage
+from warehouse.packaging.interfaces import (
+    IDocsStorage,
+    IDownloadStatsService,
+    IFileStorage,
+    ISimpleStorage,
+)
 
 
 class InsecureStorageWarning(UserWarning):
@@ -248,3 +259,239 @@ class GCSSimpleStorage(GenericGCSBlobStorage):
         prefix = request.registry.settings.get("simple.prefix")
 
         return cls(bucket, prefix=prefix)
+
+
+# The smallest number of downloads over the last month for a project to be
+# considered for trending.
+TRENDING_MIN_DOWNLOADS = 5000
+
+
+@implementer(IDownloadStatsService)
+class BigQueryDownloadStatsService:
+    def __init__(self, bigquery, *, trending_table=None, downloads_table=None):
+        self.bigquery = bigquery
+        self.trending_table = trending_table
+        self.downloads_table = downloads_table
+
+    @classmethod
+    def create_service(cls, context, request):
+        return cls(
+            request.find_service(name="gcloud.bigquery"),
+            trending_table=request.registry.settings.get("warehouse.trending_table"),
+            downloads_table=request.registry.settings.get("warehouse.downloads_table"),
+        )
+
+    def trending_zscores(self):
+        query = self.bigquery.query(
+            """ SELECT project,
+                   IF(
+                        STDDEV(downloads) > 0,
+                        (todays_downloads - AVG(downloads))/STDDEV(downloads),
+                        NULL
+                    ) as zscore
+            FROM (
+                SELECT project,
+                       date,
+                       downloads,
+                       FIRST_VALUE(downloads) OVER (
+                            PARTITION BY project
+                            ORDER BY DATE DESC
+                            ROWS BETWEEN UNBOUNDED PRECEDING
+                                AND UNBOUNDED FOLLOWING
+                        ) as todays_downloads
+                FROM (
+                    SELECT file.project as project,
+                           DATE(timestamp) AS date,
+                           COUNT(*) as downloads
+                    FROM `{table}`
+                    WHERE _TABLE_SUFFIX BETWEEN
+                        FORMAT_DATE(
+                            "%Y%m%d",
+                            DATE_ADD(CURRENT_DATE(), INTERVAL -31 day))
+                        AND
+                        FORMAT_DATE(
+                            "%Y%m%d",
+                            DATE_ADD(CURRENT_DATE(), INTERVAL -1 day))
+                    GROUP BY file.project, date
+                )
+            )
+            GROUP BY project, todays_downloads
+            HAVING SUM(downloads) >= {min_downloads}
+            ORDER BY zscore DESC
+        """.format(
+                table=self.trending_table, min_downloads=TRENDING_MIN_DOWNLOADS
+            )
+        )
+
+        zscores = {}
+        for row in query.result():
+            row = dict(row)
+            zscores[row["project"]] = row["zscore"]
+        return zscores
+
+    def top_projects(self, limit):
+        query = self.bigquery.query(
+            """ SELECT
+              COUNT(*) AS num_downloads,
+              file.project as project_name
+            FROM
+              {table}
+            WHERE
+              DATE(timestamp) BETWEEN DATE_TRUNC(
+                DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH), MONTH
+              )
+              AND CURRENT_DATE()
+            GROUP BY
+              file.project
+            ORDER BY
+              num_downloads DESC
+            LIMIT
+              {cohort_size}
+        """.format(
+                table=self.downloads_table, cohort_size=limit
+            )
+        )
+        return [row.get("project_name") for row in query.result()]
+
+
+@implementer(IDownloadStatsService)
+class LocalDownloadStatsService:
+    """
+    Download statistics for deployments without access to BigQuery, kept on
+    local disk.
+
+    Every project that has been downloaded is given a fixed position in the
+    ``projects`` file, and each day's downloads are stored as a compact array
+    of unsigned 64-bit counts in those positions, in a file named after the
+    day. Projects added after a day was written are simply past the end of
+    its array.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def create_service(cls, context, request):
+        return cls(request.registry.settings["download_stats.path"])
+
+    def _project_names(self):
+        try:
+            with open(os.path.join(self.path, "projects")) as fp:
+                return fp.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def _day_path(self, day):
+        return os.path.join(self.path, day.strftime("%Y%m%d"))
+
+    def _read_day(self, day):
+        counts = array.array("Q")
+        try:
+            with open(self._day_path(day), "rb") as fp:
+                counts.frombytes(fp.read())
+        except FileNotFoundError:
+            pass
+        return counts
+
+    def _write(self, path, data):
+        # Write the new file alongside the old one, and then swap it in, so that
+        # readers never see a partially written file.
+        with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as fp:
+            fp.write(data)
+        os.replace(fp.name, path)
+
+    def ingest(self, downloads):
+        """
+        Add the given downloads to our counts. Each download is a JSON encoded
+        line in the same format as the BigQuery downloads table, of which only
+        ``timestamp`` and ``file.project`` are used.
+        """
+        counts = collections.defaultdict(collections.Counter)
+        for line in downloads:
+            download = json.loads(line)
+            day = datetime.datetime.fromisoformat(
+                download["timestamp"].replace(" UTC", "").replace("Z", "")
+            ).date()
+            counts[day][download["file"]["project"]] += 1
+
+        os.makedirs(self.path, exist_ok=True)
+
+        names = self._project_names()
+        positions = {name: i for i, name in enumerate(names)}
+        new_names = {
+            name for day_counts in counts.values() for name in day_counts
+        } - positions.keys()
+        for name in sorted(new_names):
+            positions[name] = len(names)
+            names.append(name)
+        if new_names:
+            self._write(
+                os.path.join(self.path, "projects"),
+                "".join(f"{name}\n" for name in names).encode("utf8"),
+            )
+
+        for day, day_counts in counts.items():
+            totals = self._read_day(day)
+            totals.extend([0] * (len(names) - len(totals)))
+            for name, count in day_counts.items():
+                totals[positions[name]] += count
+            self._write(self._day_path(day), totals.tobytes())
+
+    def _downloads(self, start, end):
+        """
+        Return the project names, along with each project's downloads for every
+        day from start up to and including end.
+        """
+        names = self._project_names()
+        days = []
+        day = start
+        while day <= end:
+            days.append(self._read_day(day))
+            day += datetime.timedelta(days=1)
+        return names, days
+
+    def trending_zscores(self, *, today=None):
+        if today is None:
+            today = datetime.datetime.utcnow().date()
+
+        names, days = self._downloads(
+            today - datetime.timedelta(days=31), today - datetime.timedelta(days=1)
+        )
+
+        zscores = {}
+        for i, name in enumerate(names):
+            # Like BigQuery, we're only looking at the days on which a project
+            # was actually downloaded.
+            downloads = [c for c in (d[i] for d in days if i < len(d)) if c]
+            total = sum(downloads)
+            if total < TRENDING_MIN_DOWNLOADS:
+                continue
+
+            n = len(downloads)
+            mean = total / n
+            stddev = (
+                math.sqrt(sum((c - mean) ** 2 for c in downloads) / (n - 1))
+                if n > 1
+                else 0
+            )
+            zscores[name] = (downloads[-1] - mean) / stddev if stddev > 0 else None
+
+        return zscores
+
+    def top_projects(self, limit, *, today=None):
+        if today is None:
+            today = datetime.datetime.utcnow().date()
+
+        # From the start of the month, six months ago.
+        month = today.year * 12 + today.month - 1 - 6
+        names, days = self._downloads(
+            datetime.date(month // 12, month % 12 + 1, 1), today
+        )
+
+        totals = collections.Counter()
+        for counts in days:
+            for i, count in enumerate(counts):
+                if count:
+                    totals[names[i]] += count
+
+        return [name for name, _ in totals.most_common(limit)]
@@ -11,22 +11,81 @@
 # limitations under the License.
 
 import datetime
-
-from itertools import product
+import json
+import time
 
 import pip_api
+import redis
 
 from google.cloud.bigquery import LoadJobConfig
 from packaging.utils import canonicalize_name
+from sqlalchemy import (
+    BigInteger,
+    Float,
+    Text,
+    and_,
+    cast,
+    column,
+    func,
+    or_,
+    select,
+    true,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import BIT
 
 from warehouse import tasks
 from warehouse.accounts.models import User, WebAuthn
 from warehouse.cache.origin import IOriginCache
 from warehouse.email import send_two_factor_mandate_email
 from warehouse.metrics import IMetricsService
-from warehouse.packaging.models import Description, File, Project, Release, Role
+from warehouse.packaging.interfaces import IDownloadStatsService
+from warehouse.packaging.models import (
+    Description,
+    File,
+    JournalEntry,
+    Project,
+    Release,
+    Role,
+)
+from warehouse.packaging.utils import (
+    SIMPLE_INDEX_SHARDS,
+    render_simple_index_shard,
+    trending_project_ids,
+)
 from warehouse.utils import readme
 
+SIMPLE_INDEX_SERIAL_KEY = "warehouse:simple-index:last-serial"
+
+# Uploaded files waiting to be added to BigQuery, as JSON encoded dist metadata,
+# with the most recent first.
+BIGQUERY_RELEASE_FILES_KEY = "warehouse:bigquery:release-files"
+# The batch of files currently being added to BigQuery, along with the tables
+# that they have already been added to, so that a flush which fails or crashes
+# part way through is picked up where it left off by the next one.
+BIGQUERY_RELEASE_FILES_PROCESSING_KEY = "warehouse:bigquery:release-files:processing"
+BIGQUERY_RELEASE_FILES_TABLES_KEY = "warehouse:bigquery:release-files:tables"
+# Files that BigQuery has rejected too many times, and how many times each of the
+# files in the current batch has been rejected, by their sha256 digest. Rejected
+# files are set aside so that they don't hold up every later batch.
+BIGQUERY_RELEASE_FILES_FAILED_KEY = "warehouse:bigquery:release-files:failed"
+BIGQUERY_RELEASE_FILES_REJECTIONS_KEY = "warehouse:bigquery:release-files:rejections"
+BIGQUERY_RELEASE_FILES_MAX_REJECTIONS = 5
+# Only one flush may run at once, and must finish each batch within the timeout.
+BIGQUERY_RELEASE_FILES_LOCK = "warehouse:bigquery:release-files:lock"
+BIGQUERY_RELEASE_FILES_LOCK_TIMEOUT = 5 * 60
+
+# How long after an upload before we expect to find it in BigQuery, and how many
+# missing files we'll add to BigQuery at once.
+BIGQUERY_SYNC_GRACE = datetime.timedelta(hours=1)
+BIGQUERY_SYNC_BATCH_SIZE = 1000
+BIGQUERY_SYNC_PENDING_TTL = datetime.timedelta(days=1)
+
+# The schemas of our BigQuery tables, cached for each process, as a mapping of
+# table name to when the schema expires and the schema itself.
+_table_schemas = {}
+
 
 @tasks.task(ignore_result=True, acks_late=True)
 def compute_2fa_mandate(request):
@@ -36,34 +95,13 @@ def compute_2fa_mandate(request):
         | pip_api.parse_requirements("./requirements/deploy.txt")
     )
 
-    bq = request.find_service(name="gcloud.bigquery")
-
     # Get the top N projects in the last 6 months
-    query = bq.query(
-        """ SELECT
-              COUNT(*) AS num_downloads,
-              file.project as project_name
-            FROM
-              {table}
-            WHERE
-              DATE(timestamp) BETWEEN DATE_TRUNC(
-                DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH), MONTH
-              )
-              AND CURRENT_DATE()
-            GROUP BY
-              file.project
-            ORDER BY
-              num_downloads DESC
-            LIMIT
-              {cohort_size}
-        """.format(
-            table=request.registry.settings["warehouse.downloads_table"],
-            cohort_size=request.registry.settings[
-                "warehouse.two_factor_mandate.cohort_size"
-            ],
+    download_stats = request.find_service(IDownloadStatsService)
+    top_projects = set(
+        download_stats.top_projects(
+            request.registry.settings["warehouse.two_factor_mandate.cohort_size"]
         )
     )
-    top_projects = set(row.get("project_name") for row in query.result())
 
     project_names = {canonicalize_name(n) for n in our_dependencies | top_projects}
 
@@ -89,181 +127,161 @@ def compute_2fa_mandate(request):
 def compute_2fa_metrics(request):
     metrics = request.find_service(IMetricsService, context=None)
 
-    critical_projects = request.db.query(Project).where(
-        Project.pypi_mandates_2fa.is_(True)
-    )
+    # Every figure is worked out in a single pass over projects and users, so
+    # rather than one query per gauge, this is one (timed) query in total.
     critical_maintainers = (
-        request.db.query(User).join(Project.users).join(critical_projects.subquery())
+        select(Role.user_id.label("user_id"))
+        .join(Project, Project.id == Role.project_id)
+        .where(Project.pypi_mandates_2fa)
+        .distinct()
+        .cte("critical_maintainers")
+    )
+    webauthn_users = (
+        select(WebAuthn.user_id.label("user_id")).distinct().cte("webauthn_users")
     )
 
-    # Number of projects marked critical
-    metrics.gauge(
-        "warehouse.2fa.total_critical_projects",
-        critical_projects.count(),
+    is_critical = critical_maintainers.c.user_id.is_not(None)
+    has_totp = User.totp_secret.is_not(None)
+    has_webauthn = webauthn_users.c.user_id.is_not(None)
+    has_2fa = or_(has_totp, has_webauthn)
+
+    user_counts = (
+        select(
+            func.count()
+            .filter(and_(is_critical, has_totp))
+            .label("critical_maintainers_with_totp"),
+            func.count()
+            .filter(and_(is_critical, has_webauthn))
+            .label("critical_maintainers_with_webauthn"),
+            func.count()
+            .filter(and_(is_critical, has_2fa))
+            .label("critical_maintainers_with_2fa"),
+            func.count().filter(has_totp).label("users_with_totp"),
+            func.count().filter(has_webauthn).label("users_with_webauthn"),
+            func.count().filter(has_2fa).label("users_with_2fa"),
+        )
+        .select_from(User)
+        .outerjoin(critical_maintainers, critical_maintainers.c.user_id == User.id)
+        .outerjoin(webauthn_users, webauthn_users.c.user_id == User.id)
+        .where(or_(is_critical, has_2fa))
+        .subquery()
     )
+    project_counts = select(
+        func.count().filter(Project.pypi_mandates_2fa).label("critical_projects"),
+        func.count().filter(Project.owners_require_2fa).label("opt_in_projects"),
+        func.count()
+        .filter(Project.two_factor_required)
+        .label("two_factor_required_projects"),
+    ).subquery()
+
+    # Critical maintainers have always been counted once for each of their roles
+    # on a critical project, while the ones with 2FA are counted once each.
+    critical_roles = (
+        select(func.count())
+        .select_from(Role)
+        .join(Project, Project.id == Role.project_id)
+        .where(Project.pypi_mandates_2fa)
+        .scalar_subquery()
+    )
+
+    with metrics.timed("warehouse.2fa.compute_metrics"):
+        counts = request.db.execute(
+            select(
+                project_counts,
+                user_counts,
+                critical_roles.label("critical_maintainers"),
+            ).select_from(project_counts.join(user_counts, true()))
+        ).one()
+
+    # Number of projects marked critical
+    metrics.gauge("warehouse.2fa.total_critical_projects", counts.critical_projects)
 
     # Number of critical project maintainers
     metrics.gauge(
-        "warehouse.2fa.total_critical_maintainers",
-        critical_maintainers.count(),
+        "warehouse.2fa.total_critical_maintainers", counts.critical_maintainers
     )
 
     # Number of critical project maintainers with TOTP enabled
-    total_critical_project_maintainers_with_totp_enabled = (
-        request.db.query(User.id)
-        .distinct()
-        .join(Role, Role.user_id == User.id)
-        .join(Project, Project.id == Role.project_id)
-        .where(Project.pypi_mandates_2fa)
-        .where(User.totp_secret.is_not(None))
-        .count()
-    )
     metrics.gauge(
         "warehouse.2fa.total_critical_maintainers_with_totp_enabled",
-        total_critical_project_maintainers_with_totp_enabled,
+        counts.critical_maintainers_with_totp,
     )
 
     # Number of critical project maintainers with WebAuthn enabled
     metrics.gauge(
         "warehouse.2fa.total_critical_maintainers_with_webauthn_enabled",
-        request.db.query(User.id)
-        .distinct()
-        .join(Role.user)
-        .join(Role.project)
-        .join(WebAuthn, WebAuthn.user_id == User.id)
-        .where(Project.pypi_mandates_2fa)
-        .count(),
+        counts.critical_maintainers_with_webauthn,
     )
 
     # Number of critical project maintainers with 2FA enabled
     metrics.gauge(
         "warehouse.2fa.total_critical_maintainers_with_2fa_enabled",
-        total_critical_project_maintainers_with_totp_enabled
-        + request.db.query(User.id)
-        .distinct()
-        .join(Role.user)
-        .join(Role.project)
-        .join(WebAuthn, WebAuthn.user_id == User.id)
-        .where(Project.pypi_mandates_2fa)
-        .where(User.totp_secret.is_(None))
-        .count(),
+        counts.critical_maintainers_with_2fa,
     )
 
     # Number of projects manually requiring 2FA
     metrics.gauge(
-        "warehouse.2fa.total_projects_with_2fa_opt_in",
-        request.db.query(Project).where(Project.owners_require_2fa).count(),
+        "warehouse.2fa.total_projects_with_2fa_opt_in", counts.opt_in_projects
     )
 
     # Total number of projects requiring 2FA
     metrics.gauge(
         "warehouse.2fa.total_projects_with_two_factor_required",
-        request.db.query(Project).where(Project.two_factor_required).count(),
+        counts.two_factor_required_projects,
     )
 
     # Total number of users with TOTP enabled
-    total_users_with_totp_enabled = (
-        request.db.query(User).where(User.totp_secret.is_not(None)).count()
-    )
-    metrics.gauge(
-        "warehouse.2fa.total_users_with_totp_enabled",
-        total_users_with_totp_enabled,
-    )
+    metrics.gauge("warehouse.2fa.total_users_with_totp_enabled", counts.users_with_totp)
 
     # Total number of users with WebAuthn enabled
     metrics.gauge(
-        "warehouse.2fa.total_users_with_webauthn_enabled",
-        request.db.query(User.id)
-        .distinct()
-        .join(WebAuthn, WebAuthn.user_id == User.id)
-        .count(),
+        "warehouse.2fa.total_users_with_webauthn_enabled", counts.users_with_webauthn
     )
 
     # Total number of users with 2FA enabled
     metrics.gauge(
-        "warehouse.2fa.total_users_with_two_factor_enabled",
-        total_users_with_totp_enabled
-        + request.db.query(User.id)
-        .distinct()
-        .join(WebAuthn, WebAuthn.user_id == User.id)
-        .where(User.totp_secret.is_(None))
-        .count(),
+        "warehouse.2fa.total_users_with_two_factor_enabled", counts.users_with_2fa
     )
 
 
 @tasks.task(ignore_result=True, acks_late=True)
 def compute_trending(request):
-    bq = request.find_service(name="gcloud.bigquery")
-    query = bq.query(
-        """ SELECT project,
-                   IF(
-                        STDDEV(downloads) > 0,
-                        (todays_downloads - AVG(downloads))/STDDEV(downloads),
-                        NULL
-                    ) as zscore
-            FROM (
-                SELECT project,
-                       date,
-                       downloads,
-                       FIRST_VALUE(downloads) OVER (
-                            PARTITION BY project
-                            ORDER BY DATE DESC
-                            ROWS BETWEEN UNBOUNDED PRECEDING
-                                AND UNBOUNDED FOLLOWING
-                        ) as todays_downloads
-                FROM (
-                    SELECT file.project as project,
-                           DATE(timestamp) AS date,
-                           COUNT(*) as downloads
-                    FROM `{table}`
-                    WHERE _TABLE_SUFFIX BETWEEN
-                        FORMAT_DATE(
-                            "%Y%m%d",
-                            DATE_ADD(CURRENT_DATE(), INTERVAL -31 day))
-                        AND
-                        FORMAT_DATE(
-                            "%Y%m%d",
-                            DATE_ADD(CURRENT_DATE(), INTERVAL -1 day))
-                    GROUP BY file.project, date
-                )
-            )
-            GROUP BY project, todays_downloads
-            HAVING SUM(downloads) >= 5000
-            ORDER BY zscore DESC
-        """.format(
-            table=request.registry.settings["warehouse.trending_table"]
+    download_stats = request.find_service(IDownloadStatsService)
+    zscores = download_stats.trending_zscores()
+
+    trending_before = trending_project_ids(request.db)
+
+    # Only the projects whose zscore has actually changed are updated, matching
+    # the normalized names that we get out of BigQuery against our projects in
+    # the database, rather than in Python.
+    if zscores:
+        trending = values(
+            column("normalized_name", Text), column("zscore", Float), name="trending"
+        ).data(list(zscores.items()))
+        request.db.execute(
+            update(Project)
+            .where(Project.normalized_name == trending.c.normalized_name)
+            .where(Project.zscore.is_distinct_from(cast(trending.c.zscore, Float)))
+            .values(zscore=cast(trending.c.zscore, Float))
+            .execution_options(synchronize_session=False)
         )
-    )
 
-    zscores = {}
-    for row in query.result():
-        row = dict(row)
-        zscores[row["project"]] = row["zscore"]
-
-    # We're going to "reset" all of our zscores to a steady state where they
-    # are all equal to ``None``. The next query will then set any that have a
-    # value back to the expected value.
-    (
-        request.db.query(Project)
-        .filter(Project.zscore != None)  # noqa
-        .update({Project.zscore: None})
+    # Anything that's no longer in the result set goes back to not having a
+    # zscore at all.
+    no_longer_trending = (
+        update(Project).where(Project.zscore.is_not(None)).values(zscore=None)
     )
+    if zscores:
+        no_longer_trending = no_longer_trending.where(
+            Project.normalized_name.not_in(select(trending.c.normalized_name))
+        )
+    request.db.execute(no_longer_trending.execution_options(synchronize_session=False))
 
-    # We need to convert the normalized name that we get out of BigQuery and
-    # turn it into the primary key of the Project object and construct a list
-    # of primary key: new zscore, including a default of None if the item isn't
-    # in the result set.
-    query = request.db.query(Project.id, Project.normalized_name).all()
-    to_update = [
-        {"id": id, "zscore": zscores[normalized_name]}
-        for id, normalized_name in query
-        if normalized_name in zscores
-    ]
-
-    # Reflect out updated ZScores into the database.
-    request.db.bulk_update_mappings(Project, to_update)
+    # Trigger a purge of the trending surrogate key, but only if that would
+    # change which projects we're showing as trending.
+    if trending_project_ids(request.db) == trending_before:
+        return
 
-    # Trigger a purge of the trending surrogate key.
     try:
         cacher = request.find_service(IOriginCache)
     except LookupError:
@@ -288,6 +306,238 @@ def update_description_html(request):
         description.rendered_by = renderer_version
 
 
+@tasks.task(ignore_result=True, acks_late=True)
+def update_simple_index_shards(request):
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+
+    last_serial = int(r.get(SIMPLE_INDEX_SERIAL_KEY) or 0)
+    serial = request.db.query(func.max(JournalEntry.id)).scalar() or 0
+
+    if serial == last_serial:
+        return
+
+    # If we've never rendered the shards before, then we have to render all of
+    # them. Otherwise we only need to render the shards containing projects
+    # that have had something happen to them since the last time we ran.
+    if not last_serial:
+        shards = set(SIMPLE_INDEX_SHARDS)
+    else:
+        names = (
+            request.db.query(JournalEntry.name)
+            .filter(JournalEntry.id > last_serial, JournalEntry.id <= serial)
+            .filter(JournalEntry.name.is_not(None))
+            .distinct()
+        )
+        shards = {canonicalize_name(name)[:1] for name, in names}
+        shards &= set(SIMPLE_INDEX_SHARDS)
+
+    for shard in sorted(shards):
+        render_simple_index_shard(request, shard, serial, store=True)
+
+    r.set(SIMPLE_INDEX_SERIAL_KEY, serial)
+
+
+def _get_table_schema(request, bq, table_name):
+    now = time.monotonic()
+    expires, schema = _table_schemas.get(table_name, (None, None))
+    if expires is None or expires <= now:
+        ttl = int(
+            request.registry.settings.get(
+                "warehouse.release_files_table.schema_ttl", 60 * 60
+            )
+        )
+        schema = bq.get_table(table_name).schema
+        _table_schemas[table_name] = (now + ttl, schema)
+    return schema
+
+
+def _release_file_row(table_schema, dist_metadata):
+    # Using the schema to populate the data allows us to automatically
+    # set the values to their respective fields rather than assigning
+    # values individually
+    json_row = dict()
+    for sch in table_schema:
+        field_data = dist_metadata[sch.name]
+
+        if isinstance(field_data, datetime.datetime):
+            field_data = field_data.isoformat()
+
+        # Replace all empty objects to None will ensure
+        # proper checks if a field is nullable or not
+        if not isinstance(field_data, bool) and not field_data:
+            field_data = None
+
+        if field_data is None and sch.mode == "REPEATED":
+            json_row[sch.name] = []
+        elif field_data and sch.mode == "REPEATED":
+            # Currently, some of the metadata fields such as
+            # the 'platform' tag are incorrectly classified as a
+            # str instead of a list, hence, this workaround to comply
+            # with PEP 345 and the Core Metadata specifications.
+            # This extra check can be removed once
+            # https://github.com/pypi/warehouse/issues/8257 is fixed
+            if isinstance(field_data, str):
+                json_row[sch.name] = [field_data]
+            else:
+                json_row[sch.name] = list(field_data)
+        else:
+            json_row[sch.name] = field_data
+    return json_row
+
+
+def buffer_bigquery_release_file(request, dist_metadata):
+    """
+    Buffers release file metadata to be added to the public BigQuery database
+    by flush_bigquery_release_files, kicking off a flush whenever another full
+    batch of files has been buffered.
+    """
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+    batch_size = int(
+        request.registry.settings.get("warehouse.release_files_table.batch_size", 500)
+    )
+
+    def default(obj):
+        if isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        raise TypeError(f"{obj!r} is not JSON serializable")
+
+    row = json.dumps(dist_metadata, default=default)
+
+    # Just like our tasks, we only want to buffer the file once the upload has
+    # actually been committed. LPUSH hands us back the length of the buffer, so
+    # we know when it holds another full batch without asking Redis again.
+    def buffer(success):
+        if success and r.lpush(BIGQUERY_RELEASE_FILES_KEY, row) % batch_size == 0:
+            request.task(flush_bigquery_release_files).delay()
+
+    request.tm.get().addAfterCommitHook(buffer)
+
+
+def _next_release_files_batch(r, batch_size):
+    # Carry on with the batch that a previous flush didn't finish, if there is
+    # one. It was pushed onto the front of the list, so we put it back in the
+    # order that the files were uploaded in.
+    batch = r.lrange(BIGQUERY_RELEASE_FILES_PROCESSING_KEY, 0, -1)
+    if batch:
+        return list(reversed(batch)), True
+
+    # Otherwise, move the oldest buffered files over to be processed.
+    pipeline = r.pipeline()
+    for _ in range(batch_size):
+        pipeline.rpoplpush(
+            BIGQUERY_RELEASE_FILES_KEY, BIGQUERY_RELEASE_FILES_PROCESSING_KEY
+        )
+    return [row for row in pipeline.execute() if row is not None], False
+
+
+def _reject_release_files(request, r, table_name, batch, errors):
+    # Unless BigQuery is told to skip them, a batch with any invalid rows is
+    # rejected as a whole, with the valid rows reported as "stopped". We only
+    # hold the invalid rows against their files, and once a file has been
+    # rejected too many times we set it aside, so the rest of the batch can be
+    # retried without it.
+    rejected = [
+        batch[error["index"]]
+        for error in errors
+        if any(e.get("reason") != "stopped" for e in error["errors"])
+    ]
+    digests = [json.loads(row)["sha256_digest"] for row in rejected]
+
+    pipeline = r.pipeline()
+    for digest in digests:
+        pipeline.hincrby(BIGQUERY_RELEASE_FILES_REJECTIONS_KEY, digest)
+    rejections = pipeline.execute()
+
+    pipeline = r.pipeline()
+    for row, digest, count in zip(rejected, digests, rejections):
+        if count >= BIGQUERY_RELEASE_FILES_MAX_REJECTIONS:
+            request.log.error(
+                "Giving up on adding release file %s to %s", digest, table_name
+            )
+            pipeline.lrem(BIGQUERY_RELEASE_FILES_PROCESSING_KEY, 1, row)
+            pipeline.lpush(BIGQUERY_RELEASE_FILES_FAILED_KEY, row)
+            pipeline.hdel(BIGQUERY_RELEASE_FILES_REJECTIONS_KEY, digest)
+    pipeline.execute()
+
+
+@tasks.task(ignore_result=True, acks_late=True)
+def flush_bigquery_release_files(request):
+    """
+    Adds buffered release file metadata to public BigQuery database, in batches
+    """
+    bq = request.find_service(name="gcloud.bigquery")
+    metrics = request.find_service(IMetricsService, context=None)
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+    batch_size = int(
+        request.registry.settings.get("warehouse.release_files_table.batch_size", 500)
+    )
+    # Multiple table names can be specified by separating them with whitespace
+    table_names = request.registry.settings["warehouse.release_files_table"].split()
+
+    lock = r.lock(
+        BIGQUERY_RELEASE_FILES_LOCK,
+        timeout=BIGQUERY_RELEASE_FILES_LOCK_TIMEOUT,
+        thread_local=False,
+    )
+    if not lock.acquire(blocking=False):
+        # Another flush is already running, and will pick up our files.
+        return
+
+    try:
+        while True:
+            lock.reacquire()
+
+            batch, resumed = _next_release_files_batch(r, batch_size)
+            if not batch:
+                return
+
+            dist_metadatas = [json.loads(dist_metadata) for dist_metadata in batch]
+            for table_name in table_names:
+                if r.sismember(BIGQUERY_RELEASE_FILES_TABLES_KEY, table_name):
+                    continue
+
+                table_schema = _get_table_schema(request, bq, table_name)
+                # BigQuery uses the row ids to drop any rows that we insert
+                # again, if we crash before recording that this table is done.
+                errors = bq.insert_rows_json(
+                    table=table_name,
+                    json_rows=[
+                        _release_file_row(table_schema, dist_metadata)
+                        for dist_metadata in dist_metadatas
+                    ],
+                    row_ids=[
+                        dist_metadata["sha256_digest"]
+                        for dist_metadata in dist_metadatas
+                    ],
+                )
+                if errors:
+                    _reject_release_files(request, r, table_name, batch, errors)
+                    raise RuntimeError(
+                        f"Failed to insert release files into {table_name}: "
+                        f"{errors!r}"
+                    )
+                r.sadd(BIGQUERY_RELEASE_FILES_TABLES_KEY, table_name)
+
+            pipeline = r.pipeline()
+            pipeline.delete(BIGQUERY_RELEASE_FILES_PROCESSING_KEY)
+            pipeline.delete(BIGQUERY_RELEASE_FILES_TABLES_KEY)
+            pipeline.delete(BIGQUERY_RELEASE_FILES_REJECTIONS_KEY)
+            pipeline.execute()
+
+            metrics.increment("warehouse.bigquery.release_files.flushed", len(batch))
+
+            # A short batch that we've just taken from the buffer has emptied
+            # it, but a resumed one may have had files set aside.
+            if len(batch) < batch_size and not resumed:
+                return
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            # It has already expired.
+            pass
+
+
 @tasks.task(
     bind=True,
     ignore_result=True,
@@ -306,132 +556,225 @@ def update_bigquery_release_files(task, request, dist_metadata):
     table_names = request.registry.settings["warehouse.release_files_table"].split()
 
     for table_name in table_names:
-        table_schema = bq.get_table(table_name).schema
-
-        # Using the schema to populate the data allows us to automatically
-        # set the values to their respective fields rather than assigning
-        # values individually
-        json_rows = dict()
-        for sch in table_schema:
-            field_data = dist_metadata[sch.name]
-
-            if isinstance(field_data, datetime.datetime):
-                field_data = field_data.isoformat()
-
-            # Replace all empty objects to None will ensure
-            # proper checks if a field is nullable or not
-            if not isinstance(field_data, bool) and not field_data:
-                field_data = None
-
-            if field_data is None and sch.mode == "REPEATED":
-                json_rows[sch.name] = []
-            elif field_data and sch.mode == "REPEATED":
-                # Currently, some of the metadata fields such as
-                # the 'platform' tag are incorrectly classified as a
-                # str instead of a list, hence, this workaround to comply
-                # with PEP 345 and the Core Metadata specifications.
-                # This extra check can be removed once
-                # https://github.com/pypi/warehouse/issues/8257 is fixed
-                if isinstance(field_data, str):
-                    json_rows[sch.name] = [field_data]
-                else:
-                    json_rows[sch.name] = list(field_data)
-            else:
-                json_rows[sch.name] = field_data
-        json_rows = [json_rows]
+        table_schema = _get_table_schema(request, bq, table_name)
+        json_rows = [_release_file_row(table_schema, dist_metadata)]
 
         bq.insert_rows_json(table=table_name, json_rows=json_rows)
 
 
+def _file_row(table_schema, file):
+    release = file.release
+    project = release.project
+
+    row_data = dict()
+    for sch in table_schema:
+        # The order of data extraction below is determined based on the
+        # classes that are most recently updated
+        if hasattr(file, sch.name):
+            field_data = getattr(file, sch.name)
+        elif hasattr(release, sch.name) and sch.name == "description":
+            field_data = getattr(release, sch.name).raw
+        elif sch.name == "description_content_type":
+            field_data = getattr(release, "description").content_type
+        elif hasattr(release, sch.name):
+            field_data = getattr(release, sch.name)
+        elif hasattr(project, sch.name):
+            field_data = getattr(project, sch.name)
+        else:
+            field_data = None
+
+        if isinstance(field_data, datetime.datetime):
+            field_data = field_data.isoformat()
+
+        # Replace all empty objects to None will ensure
+        # proper checks if a field is nullable or not
+        if not isinstance(field_data, bool) and not field_data:
+            field_data = None
+
+        if field_data is None and sch.mode == "REPEATED":
+            row_data[sch.name] = []
+        elif field_data and sch.mode == "REPEATED":
+            # Currently, some of the metadata fields such as
+            # the 'platform' tag are incorrectly classified as a
+            # str instead of a list, hence, this workaround to comply
+            # with PEP 345 and the Core Metadata specifications.
+            # This extra check can be removed once
+            # https://github.com/pypi/warehouse/issues/8257 is fixed
+            if isinstance(field_data, str):
+                row_data[sch.name] = [field_data]
+            else:
+                row_data[sch.name] = list(field_data)
+        else:
+            row_data[sch.name] = field_data
+    return row_data
+
+
+def _db_upload_window(start, end):
+    window = [File.upload_time < datetime.datetime.fromisoformat(end)]
+    if start is not None:
+        window.append(File.upload_time >= datetime.datetime.fromisoformat(start))
+    return window
+
+
+def _bq_upload_window(start, end):
+    window = f"upload_time < TIMESTAMP('{end}')"
+    if start is not None:
+        window += f" AND upload_time >= TIMESTAMP('{start}')"
+    return window
+
+
+def _db_prefix_checksums(request, start, end):
+    # We checksum the files in each md5 prefix by counting them, and summing the
+    # 32 bits of their digests that follow the prefix, which is something both
+    # PostgreSQL and BigQuery can do without overflowing.
+    prefix = func.substr(File.md5_digest, 1, 2)
+    bits = cast(
+        cast(
+            func.concat("x", func.lpad(func.substr(File.md5_digest, 3, 8), 16, "0")),
+            BIT(64),
+        ),
+        BigInteger,
+    )
+    checksums = (
+        request.db.query(prefix, func.count(), func.sum(bits))
+        .filter(*_db_upload_window(start, end))
+        .group_by(prefix)
+    )
+    return {prefix: (count, int(checksum)) for prefix, count, checksum in checksums}
+
+
+def _bq_prefix_checksums(bq, table_name, start, end):
+    # Rows can be duplicated in BigQuery, so we only count each digest once.
+    # That has to happen before summing, as different digests can share the
+    # same 32 bits, and each of them is summed in the database.
+    checksums = bq.query(
+        "SELECT SUBSTR(md5_digest, 1, 2) AS prefix, "
+        "COUNT(*) AS count, "
+        "SUM(CAST(CONCAT('0x', SUBSTR(md5_digest, 3, 8)) AS INT64)) AS checksum "
+        "FROM ("
+        f"SELECT DISTINCT md5_digest FROM {table_name} "
+        f"WHERE {_bq_upload_window(start, end)}"
+        ") "
+        "GROUP BY prefix"
+    ).result()
+    return {
+        row.get("prefix"): (row.get("count"), row.get("checksum")) for row in checksums
+    }
+
+
+def _bigquery_sync_key(table_name):
+    return f"warehouse:bigquery:release-files-synced:{table_name}"
+
+
+def _bigquery_sync_pending_key(table_name, end):
+    return f"warehouse:bigquery:release-files-sync-pending:{table_name}:{end}"
+
+
 @tasks.task(ignore_result=True, acks_late=True)
 def sync_bigquery_release_files(request):
+    """
+    Finds the md5 prefixes where files uploaded since we last found everything
+    in sync are missing from BigQuery, and syncs each of them in parallel.
+    """
     bq = request.find_service(name="gcloud.bigquery")
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
     # Multiple table names can be specified by separating them with whitespace
     table_names = request.registry.settings["warehouse.release_files_table"].split()
 
+    # Files uploaded recently might still be buffered, waiting to be added to
+    # BigQuery, so we leave them for a later run.
+    end = (datetime.datetime.utcnow() - BIGQUERY_SYNC_GRACE).isoformat()
+    db_checksums = {}
+
     for table_name in table_names:
-        table_schema = bq.get_table(table_name).schema
-
-        # Using the schema to populate the data allows us to automatically
-        # set the values to their respective fields rather than assigning
-        # values individually
-        def populate_data_using_schema(file):
-            release = file.release
-            project = release.project
-
-            row_data = dict()
-            for sch in table_schema:
-                # The order of data extraction below is determined based on the
-                # classes that are most recently updated
-                if hasattr(file, sch.name):
-                    field_data = getattr(file, sch.name)
-                elif hasattr(release, sch.name) and sch.name == "description":
-                    field_data = getattr(release, sch.name).raw
-                elif sch.name == "description_content_type":
-                    field_data = getattr(release, "description").content_type
-                elif hasattr(release, sch.name):
-                    field_data = getattr(release, sch.name)
-                elif hasattr(project, sch.name):
-                    field_data = getattr(project, sch.name)
-                else:
-                    field_data = None
-
-                if isinstance(field_data, datetime.datetime):
-                    field_data = field_data.isoformat()
-
-                # Replace all empty objects to None will ensure
-                # proper checks if a field is nullable or not
-                if not isinstance(field_data, bool) and not field_data:
-                    field_data = None
-
-                if field_data is None and sch.mode == "REPEATED":
-                    row_data[sch.name] = []
-                elif field_data and sch.mode == "REPEATED":
-                    # Currently, some of the metadata fields such as
-                    # the 'platform' tag are incorrectly classified as a
-                    # str instead of a list, hence, this workaround to comply
-                    # with PEP 345 and the Core Metadata specifications.
-                    # This extra check can be removed once
-                    # https://github.com/pypi/warehouse/issues/8257 is fixed
-                    if isinstance(field_data, str):
-                        row_data[sch.name] = [field_data]
-                    else:
-                        row_data[sch.name] = list(field_data)
-                else:
-                    row_data[sch.name] = field_data
-            return row_data
-
-        for first, second in product("fedcba9876543210", repeat=2):
-            db_release_files = (
-                request.db.query(File.md5_digest)
-                .filter(File.md5_digest.like(f"{first}{second}%"))
-                .yield_per(1000)
-                .all()
+        start = r.get(_bigquery_sync_key(table_name))
+        if start is not None:
+            start = start.decode("utf8")
+
+        # Every table we sync to will usually have been synced up to the same
+        # point, so we can usually share our checksums between them.
+        if start not in db_checksums:
+            db_checksums[start] = _db_prefix_checksums(request, start, end)
+        bq_checksums = _bq_prefix_checksums(bq, table_name, start, end)
+
+        # Files that have been deleted remain in BigQuery, so a prefix can
+        # differ without anything missing from it, but we sync it anyway in
+        # case something is.
+        prefixes = [
+            prefix
+            for prefix, checksum in sorted(db_checksums[start].items())
+            if checksum != bq_checksums.get(prefix, (0, 0))
+        ]
+        if not prefixes:
+            r.set(_bigquery_sync_key(table_name), end)
+            continue
+
+        # We only move on once every prefix we're syncing has finished, so that
+        # anything a failed sync missed is looked at again by a later run.
+        r.set(
+            _bigquery_sync_pending_key(table_name, end),
+            len(prefixes),
+            ex=BIGQUERY_SYNC_PENDING_TTL,
+        )
+        for prefix in prefixes:
+            request.task(sync_bigquery_release_files_prefix).delay(
+                table_name, prefix, start, end
             )
-            db_file_digests = [file.md5_digest for file in db_release_files]
-
-            bq_file_digests = bq.query(
-                "SELECT md5_digest "
-                f"FROM {table_name} "
-                f"WHERE md5_digest LIKE '{first}{second}%'"
-            ).result()
-            bq_file_digests = [row.get("md5_digest") for row in bq_file_digests]
-
-            md5_diff_list = list(set(db_file_digests) - set(bq_file_digests))[:1000]
-            if not md5_diff_list:
-                # There are no files that need synced to BigQuery
-                continue
-
-            release_files = (
-                request.db.query(File)
-                .join(Release, Release.id == File.release_id)
-                .filter(File.md5_digest.in_(md5_diff_list))
-                .all()
+
+
+@tasks.task(
+    bind=True,
+    ignore_result=True,
+    acks_late=True,
+    autoretry_for=(Exception,),
+    retry_backoff=15,
+    retry_jitter=False,
+    max_retries=5,
+)
+def sync_bigquery_release_files_prefix(task, request, table_name, prefix, start, end):
+    """
+    Adds any files with the given md5 prefix, and uploaded within the given
+    window, that are missing from BigQuery.
+    """
+    bq = request.find_service(name="gcloud.bigquery")
+    table_schema = _get_table_schema(request, bq, table_name)
+
+    db_file_digests = {
+        md5_digest
+        for md5_digest, in request.db.query(File.md5_digest)
+        .filter(File.md5_digest.like(f"{prefix}%"))
+        .filter(*_db_upload_window(start, end))
+    }
+
+    bq_file_digests = bq.query(
+        "SELECT md5_digest "
+        f"FROM {table_name} "
+        f"WHERE md5_digest LIKE '{prefix}%' AND {_bq_upload_window(start, end)}"
+    ).result()
+    bq_file_digests = {row.get("md5_digest") for row in bq_file_digests}
+
+    md5_diff_list = sorted(db_file_digests - bq_file_digests)
+    for i in range(0, len(md5_diff_list), BIGQUERY_SYNC_BATCH_SIZE):
+        release_files = (
+            request.db.query(File)
+            .join(Release, Release.id == File.release_id)
+            .filter(
+                File.md5_digest.in_(md5_diff_list[i : i + BIGQUERY_SYNC_BATCH_SIZE])
             )
+            .all()
+        )
+
+        json_rows = [_file_row(table_schema, file) for file in release_files]
 
-            json_rows = [populate_data_using_schema(file) for file in release_files]
+        bq.load_table_from_json(
+            json_rows, table_name, job_config=LoadJobConfig(schema=table_schema)
+        ).result()
 
-            bq.load_table_from_json(
-                json_rows, table_name, job_config=LoadJobConfig(schema=table_schema)
-            ).result()
-            break
+    # The last of the prefixes from a run to finish moves its table on.
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+    pending_key = _bigquery_sync_pending_key(table_name, end)
+    remaining = r.decr(pending_key)
+    if remaining <= 0:
+        r.delete(pending_key)
+    if remaining == 0:
+        r.set(_bigquery_sync_key(table_name), end)
@@ -12,25 +12,64 @@
 
 import hashlib
 import os.path
+import string
 import tempfile
 
-from packaging.version import parse
+import orjson
+
 from pyramid_jinja2 import IJinja2Environment
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select
 
 from warehouse.packaging.interfaces import ISimpleStorage
-from warehouse.packaging.models import File, Project, Release
+from warehouse.packaging.models import File, JournalEntry, Project, Release
 
 API_VERSION = "1.0"
 
+# The global simple index is split into shards based on the first character of
+# the normalized project name, which must always be a letter or a digit.
+SIMPLE_INDEX_SHARDS = string.digits + string.ascii_lowercase
+
+# How many projects we will fetch from the database, and render, at a time when
+# streaming the global simple index.
+SIMPLE_INDEX_CHUNK_SIZE = 10000
+
+# How much rendered output we will buffer before handing it off to the WSGI
+# server when streaming the global simple index.
+SIMPLE_INDEX_BUFFER_SIZE = 64 * 1024
+
+# How many journal entries we will fetch from the database at a time when
+# streaming the changelog.
+JOURNAL_PAGE_SIZE = 5000
+
+# How many trending projects we show on the home page.
+TRENDING_PROJECTS_SHOWN = 5
+
+
+def trending_project_ids(session):
+    """
+    The ids of the projects that we show as trending, most trending first. Both
+    the home page and compute_trending, when deciding whether the home page
+    needs purging, have to agree on these, so ties are broken by id.
+    """
+    return [
+        id_
+        for id_, in session.query(Project.id)
+        .filter(Project.zscore.is_not(None))
+        .order_by(Project.zscore.desc(), Project.id)
+        .limit(TRENDING_PROJECTS_SHOWN)
+    ]
 
-def _simple_index(request, serial):
+
+def _simple_index_query(shard=None):
+    query = select(Project.name, Project.normalized_name, Project.last_serial)
+    if shard is not None:
+        query = query.where(Project.normalized_name.startswith(shard, autoescape=True))
+    return query.order_by(Project.normalized_name)
+
+
+def _simple_index(request, serial, shard=None):
     # Fetch the name and normalized name for all of our projects
-    projects = (
-        request.db.query(Project.name, Project.normalized_name, Project.last_serial)
-        .order_by(Project.normalized_name)
-        .all()
-    )
+    projects = request.db.execute(_simple_index_query(shard)).all()
 
     return {
         "meta": {"api-version": API_VERSION, "_last-serial": serial},
@@ -38,15 +77,147 @@ def _simple_index(request, serial):
     }
 
 
+def _iter_simple_index_projects(request):
+    # The response is consumed by the WSGI server after our request (and its
+    # transaction) has finished, so we use a dedicated connection with a server
+    # side cursor rather than request.db to stream our projects.
+    engine = request.registry["sqlalchemy.engine"]
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            _simple_index_query()
+        )
+        for rows in result.partitions(SIMPLE_INDEX_CHUNK_SIZE):
+            yield [{"name": p.name, "_last-serial": p.last_serial} for p in rows]
+
+
+def iter_journal_entries(request, *, serial=None, since=None, limit=50000):
+    """
+    Yield lists of up to JOURNAL_PAGE_SIZE journal entries, as rows of name,
+    version, submitted_date, action and id, ordered by id and newer than the
+    given serial and/or submitted date.
+    """
+    # Like the simple index, the changelog is streamed after our transaction
+    # has finished. Rather than holding a cursor open, we page through the
+    # journals with a keyset on their id.
+    engine = request.registry["sqlalchemy.engine"]
+    with engine.connect() as connection:
+        while limit > 0:
+            query = (
+                select(
+                    JournalEntry.name,
+                    JournalEntry.version,
+                    JournalEntry.submitted_date,
+                    JournalEntry.action,
+                    JournalEntry.id,
+                )
+                .order_by(JournalEntry.id)
+                .limit(min(limit, JOURNAL_PAGE_SIZE))
+            )
+            if serial is not None:
+                query = query.where(JournalEntry.id > serial)
+            if since is not None:
+                query = query.where(JournalEntry.submitted_date > since)
+
+            entries = connection.execute(query).all()
+            if entries:
+                yield entries
+            if len(entries) < JOURNAL_PAGE_SIZE:
+                break
+            limit -= len(entries)
+            serial = entries[-1].id
+
+
+def _iter_simple_index_json(meta, chunks):
+    option = orjson.OPT_SORT_KEYS
+
+    yield b'{"meta":' + orjson.dumps(meta, option=option) + b',"projects":['
+    first = True
+    for projects in chunks:
+        # Each chunk is a JSON array, so we strip the brackets to splice it
+        # into the one we're streaming.
+        content = orjson.dumps(projects, option=option)[1:-1]
+        yield content if first else b"," + content
+        first = False
+    yield b"]}\n"
+
+
+def _iter_simple_index_html(request, meta, chunks):
+    env = request.registry.queryUtility(IJinja2Environment, name=".jinja2")
+    template = env.get_template("templates/api/simple/index.html")
+
+    # Jinja2 yields output for every piece of the template that it renders,
+    # which would be a write per project, so we buffer it into larger blocks.
+    buffered, size = [], 0
+    for content in template.generate(
+        meta=meta,
+        projects=(project for projects in chunks for project in projects),
+        request=request,
+    ):
+        buffered.append(content)
+        size += len(content)
+        if size >= SIMPLE_INDEX_BUFFER_SIZE:
+            yield "".join(buffered).encode("utf-8")
+            buffered, size = [], 0
+    if buffered:
+        yield "".join(buffered).encode("utf-8")
+
+
+def stream_simple_index(request, serial, content_type):
+    meta = {"api-version": API_VERSION, "_last-serial": serial}
+    chunks = _iter_simple_index_projects(request)
+
+    if content_type == "application/vnd.pypi.simple.v1+json":
+        return _iter_simple_index_json(meta, chunks)
+    return _iter_simple_index_html(request, meta, chunks)
+
+
+def render_simple_index_shard(request, shard, serial, store=False):
+    context = _simple_index(request, serial, shard=shard)
+
+    env = request.registry.queryUtility(IJinja2Environment, name=".jinja2")
+    template = env.get_template("templates/api/simple/index.html")
+    content = template.render(**context, request=request).encode("utf-8")
+    json_content = orjson.dumps(
+        context, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+    )
+
+    # Normalized project names can never start with an underscore, so our
+    # shards can't collide with the detail pages of any project.
+    simple_index_shard_path = f"_index/{shard}.html"
+
+    if store:
+        storage = request.find_service(ISimpleStorage)
+        meta = {"shard": shard, "pypi-last-serial": serial}
+        for path, data in [
+            (simple_index_shard_path, content),
+            (f"_index/{shard}.json", json_content),
+        ]:
+            with tempfile.NamedTemporaryFile() as f:
+                f.write(data)
+                f.flush()
+
+                storage.store(path, f.name, meta=meta)
+
+    return simple_index_shard_path
+
+
 def _simple_detail(project, request):
-    # Get all of the files for this project.
-    files = sorted(
-        request.db.query(File)
-        .options(joinedload(File.release))
+    # Get all of the files for this project. We only load the columns that we
+    # actually need, and rely on the precomputed Release._pypi_ordering to sort
+    # by version instead of parsing every version in Python.
+    files = (
+        request.db.query(
+            File.filename,
+            File.path,
+            File.sha256_digest,
+            Release.requires_python,
+            Release.yanked,
+            Release.yanked_reason,
+        )
         .join(Release)
         .filter(Release.project == project)
-        .all(),
-        key=lambda f: (parse(f.release.version), f.filename),
+        .order_by(Release._pypi_ordering, File.filename)
+        .all()
     )
 
     return {
@@ -59,25 +230,50 @@ def _simple_detail(project, request):
                 "hashes": {
                     "sha256": file.sha256_digest,
                 },
-                "requires-python": file.release.requires_python,
-                "yanked": file.release.yanked_reason
-                if file.release.yanked and file.release.yanked_reason
-                else file.release.yanked,
+                "requires-python": file.requires_python,
+                "yanked": file.yanked_reason
+                if file.yanked and file.yanked_reason
+                else file.yanked,
             }
             for file in files
         ],
     }
 
 
+def _store_simple_detail(storage, project, content, content_hash, ext):
+    meta = {
+        "project": project.normalized_name,
+        "pypi-last-serial": project.last_serial,
+        "hash": content_hash,
+    }
+
+    path = f"{project.normalized_name}/{content_hash}.{project.normalized_name}.{ext}"
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(content)
+        f.flush()
+
+        storage.store(
+            path,
+            f.name,
+            meta=meta,
+        )
+        storage.store(
+            os.path.join(project.normalized_name, f"index.{ext}"),
+            f.name,
+            meta=meta,
+        )
+
+
 def render_simple_detail(project, request, store=False):
     context = _simple_detail(project, request)
 
     env = request.registry.queryUtility(IJinja2Environment, name=".jinja2")
     template = env.get_template("templates/api/simple/detail.html")
-    content = template.render(**context, request=request)
+    content = template.render(**context, request=request).encode("utf-8")
 
     content_hasher = hashlib.blake2b(digest_size=256 // 8)
-    content_hasher.update(content.encode("utf-8"))
+    content_hasher.update(content)
     content_hash = content_hasher.hexdigest().lower()
 
     simple_detail_path = (
@@ -85,28 +281,16 @@ def render_simple_detail(project, request, store=False):
     )
 
     if store:
+        # The JSON rendition is built from the same context as the HTML, so we
+        # key it by the same content hash and serial, allowing both formats to
+        # be served straight out of storage. This matches the output of the
+        # ``json`` renderer used by the simple API views.
+        json_content = orjson.dumps(
+            context, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+        )
+
         storage = request.find_service(ISimpleStorage)
-        with tempfile.NamedTemporaryFile() as f:
-            f.write(content.encode("utf-8"))
-            f.flush()
-
-            storage.store(
-                simple_detail_path,
-                f.name,
-                meta={
-                    "project": project.normalized_name,
-                    "pypi-last-serial": project.last_serial,
-                    "hash": content_hash,
-                },
-            )
-            storage.store(
-                os.path.join(project.normalized_name, "index.html"),
-                f.name,
-                meta={
-                    "project": project.normalized_name,
-                    "pypi-last-serial": project.last_serial,
-                    "hash": content_hash,
-                },
-            )
+        _store_simple_detail(storage, project, content, content_hash, "html")
+        _store_simple_detail(storage, project, json_content, content_hash, "json")
 
     return (content_hash, simple_detail_path)
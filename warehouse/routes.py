@@ -559,6 +559,12 @@ def includeme(config):
         domain=warehouse,
     )
 
+    config.add_route(
+        "legacy.api.json.changelog",
+        "/pypi/changelog/since/{serial}/json",
+        domain=warehouse,
+    )
+
     config.add_route(
         "legacy.api.json.release",
         "/pypi/{name}/{version}/json",
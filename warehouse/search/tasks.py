@@ -34,10 +34,20 @@ from warehouse.packaging.models import (
 )
 from warehouse.packaging.search import Project as ProjectDocument
 from warehouse.search.utils import get_index
-from warehouse.utils.db import windowed_query
+from warehouse.utils.db import column_ranges, windowed_query
 
+# How many ranges of Project.id a full reindex is split into, each of which is
+# indexed by its own task.
+REINDEX_SHARDS = 16
 
-def _project_docs(db, project_name=None):
+# How long a full reindex can take before its lock, and its checkpoints, expire.
+REINDEX_TIMEOUT = 2 * 60 * 60
+
+# How many documents are sent to Elasticsearch at once by a reindex_shard task.
+REINDEX_CHUNK_SIZE = 500
+
+
+def _project_docs(db, project_name=None, *, start=None, end=None):
 
     releases_list = (
         db.query(Release.id)
@@ -52,6 +62,10 @@ def _project_docs(db, project_name=None):
 
     if project_name:
         releases_list = releases_list.join(Project).filter(Project.name == project_name)
+    if start is not None:
+        releases_list = releases_list.filter(Release.project_id > start)
+    if end is not None:
+        releases_list = releases_list.filter(Release.project_id <= end)
 
     releases_list = releases_list.subquery()
 
@@ -101,7 +115,9 @@ def _project_docs(db, project_name=None):
         .outerjoin(Release.project)
     )
 
-    for release in windowed_query(release_data, Project.id, 25000):
+    for release in windowed_query(
+        release_data, Project.id, 25000, start=start, end=end
+    ):
         p = ProjectDocument.from_db(release)
         p._index = None
         p.full_clean()
@@ -126,104 +142,241 @@ class SearchLock:
         self.lock.release()
 
 
+def _reindex_client(request):
+    p = urllib.parse.urlparse(request.registry.settings["elasticsearch.url"])
+    qs = urllib.parse.parse_qs(p.query)
+    kwargs = {
+        "hosts": [urllib.parse.urlunparse(p[:2] + ("",) * 4)],
+        "verify_certs": True,
+        "ca_certs": certifi.where(),
+        "timeout": 30,
+        "retry_on_timeout": True,
+        "serializer": serializer.serializer,
+    }
+    aws_auth = bool(qs.get("aws_auth", False))
+    if aws_auth:
+        aws_region = qs.get("region", ["us-east-1"])[0]
+        kwargs["connection_class"] = elasticsearch.RequestsHttpConnection
+        kwargs["http_auth"] = requests_aws4auth.AWS4Auth(
+            request.registry.settings["aws.key_id"],
+            request.registry.settings["aws.secret_key"],
+            aws_region,
+            "es",
+        )
+    return elasticsearch.Elasticsearch(**kwargs)
+
+
+def _reindex_key(index_name):
+    return f"search-reindex:{index_name}"
+
+
+def _reindex_alias(index_name):
+    # Shards write to the new index through an alias, and require it to exist,
+    # so that once the index has been deleted Elasticsearch can't recreate it.
+    return f"{index_name}-reindex"
+
+
+def _reindex_docs(r, key, docs):
+    # Before each chunk of documents is sent, check that our reindex hasn't been
+    # abandoned, so that we stop writing to its deleted index.
+    for i, doc in enumerate(docs):
+        if not i % REINDEX_CHUNK_SIZE and not r.exists(key):
+            return
+        yield doc
+
+
+def _mark_shard_done(r, key, shard):
+    # Only the first time that any range is marked as done counts, and only while
+    # the reindex hasn't been abandoned, so its checkpoint is never recreated.
+    def mark(pipe):
+        if not pipe.exists(key) or pipe.hexists(key, f"done:{shard}"):
+            return
+        pipe.multi()
+        pipe.hset(key, f"done:{shard}", 1)
+        pipe.hincrby(key, "remaining", -1)
+
+    results = r.transaction(mark, key)
+    # Only the last range to be done finishes the reindex.
+    return bool(results) and results[-1] == 0
+
+
+def _release_reindex_lock(r, token):
+    # The lock was acquired by another task, so we release it with its token.
+    lock = r.lock("search-index", thread_local=False)
+    lock.local.token = token
+    try:
+        lock.release()
+    except redis.exceptions.LockError:
+        # It has already expired.
+        pass
+
+
+def _abandon_reindex(r, client, index_name):
+    token = r.hget(_reindex_key(index_name), "lock")
+    r.delete(_reindex_key(index_name))
+    client.indices.delete(index=index_name)
+    if token is not None:
+        _release_reindex_lock(r, token)
+
+
 @tasks.task(bind=True, ignore_result=True, acks_late=True)
 def reindex(self, request):
     """
     Recreate the Search Index.
+
+    The new index is populated by a reindex_shard task for each range of
+    projects, and is only swapped in by finish_reindex once all of them have
+    succeeded. We hold the search lock until then, so that no updates to the
+    old index are lost.
     """
     r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+    lock = r.lock(
+        "search-index",
+        timeout=REINDEX_TIMEOUT,
+        blocking_timeout=30,
+        thread_local=False,
+    )
+    token = binascii.hexlify(os.urandom(16)).decode("ascii")
     try:
-        with SearchLock(r, timeout=30 * 60, blocking_timeout=30):
-            p = urllib.parse.urlparse(request.registry.settings["elasticsearch.url"])
-            qs = urllib.parse.parse_qs(p.query)
-            kwargs = {
-                "hosts": [urllib.parse.urlunparse(p[:2] + ("",) * 4)],
-                "verify_certs": True,
-                "ca_certs": certifi.where(),
-                "timeout": 30,
-                "retry_on_timeout": True,
-                "serializer": serializer.serializer,
-            }
-            aws_auth = bool(qs.get("aws_auth", False))
-            if aws_auth:
-                aws_region = qs.get("region", ["us-east-1"])[0]
-                kwargs["connection_class"] = elasticsearch.RequestsHttpConnection
-                kwargs["http_auth"] = requests_aws4auth.AWS4Auth(
-                    request.registry.settings["aws.key_id"],
-                    request.registry.settings["aws.secret_key"],
-                    aws_region,
-                    "es",
-                )
-            client = elasticsearch.Elasticsearch(**kwargs)
-            number_of_replicas = request.registry.get("elasticsearch.replicas", 0)
-            refresh_interval = request.registry.get("elasticsearch.interval", "1s")
-
-            # We use a randomly named index so that we can do a zero downtime reindex.
-            # Essentially we'll use a randomly named index which we will use until all
-            # of the data has been reindexed, at which point we'll point an alias at
-            # our randomly named index, and then delete the old randomly named index.
-
-            # Create the new index and associate all of our doc types with it.
-            index_base = request.registry["elasticsearch.index"]
-            random_token = binascii.hexlify(os.urandom(5)).decode("ascii")
-            new_index_name = "{}-{}".format(index_base, random_token)
-            doc_types = request.registry.get("search.doc_types", set())
-            shards = request.registry.get("elasticsearch.shards", 1)
+        if not lock.acquire(token=token):
+            raise redis.exceptions.LockError("Could not acquire lock!")
+    except redis.exceptions.LockError as exc:
+        raise self.retry(countdown=60, exc=exc)
 
-            # Create the new index with zero replicas and index refreshes disabled
-            # while we are bulk indexing.
-            new_index = get_index(
-                new_index_name,
-                doc_types,
-                using=client,
-                shards=shards,
-                replicas=0,
-                interval="-1",
-            )
-            new_index.create(wait_for_active_shards=shards)
+    client = _reindex_client(request)
+
+    # We use a randomly named index so that we can do a zero downtime reindex.
+    # Essentially we'll use a randomly named index which we will use until all
+    # of the data has been reindexed, at which point we'll point an alias at
+    # our randomly named index, and then delete the old randomly named index.
+
+    # Create the new index and associate all of our doc types with it.
+    index_base = request.registry["elasticsearch.index"]
+    random_token = binascii.hexlify(os.urandom(5)).decode("ascii")
+    new_index_name = "{}-{}".format(index_base, random_token)
+    doc_types = request.registry.get("search.doc_types", set())
+    shards = request.registry.get("elasticsearch.shards", 1)
+
+    # Create the new index with zero replicas and index refreshes disabled
+    # while we are bulk indexing.
+    new_index = get_index(
+        new_index_name,
+        doc_types,
+        using=client,
+        shards=shards,
+        replicas=0,
+        interval="-1",
+    )
+    new_index.aliases(**{_reindex_alias(new_index_name): {}})
+    new_index.create(wait_for_active_shards=shards)
 
-            # From this point on, if any error occurs, we want to be able to delete our
-            # in progress index.
-            try:
-                request.db.execute("SET statement_timeout = '600s'")
-
-                for _ in parallel_bulk(
-                    client, _project_docs(request.db), index=new_index_name
-                ):
-                    pass
-            except:  # noqa
-                new_index.delete()
-                raise
-            finally:
-                request.db.rollback()
-                request.db.close()  # pragma: no cover
-
-            # Now that we've finished indexing all of our data we can update the
-            # replicas and refresh intervals.
-            client.indices.put_settings(
-                index=new_index_name,
-                body={
-                    "index": {
-                        "number_of_replicas": number_of_replicas,
-                        "refresh_interval": refresh_interval,
-                    }
-                },
-            )
+    # From this point on, if any error occurs, we want to be able to delete our
+    # in progress index, and give up our lock.
+    try:
+        # Our ranges are sent to each task as JSON, so we can't pass UUIDs.
+        ranges = [
+            (start and str(start), end and str(end))
+            for start, end in column_ranges(request.db, Project.id, REINDEX_SHARDS)
+        ]
+
+        # Checkpoint which ranges are still to be indexed, so that each of them
+        # can be retried on its own, and we know when they're all done.
+        key = _reindex_key(new_index_name)
+        r.hset(key, mapping={"lock": token, "remaining": len(ranges)})
+        r.expire(key, REINDEX_TIMEOUT)
+    except:  # noqa
+        new_index.delete()
+        _release_reindex_lock(r, token)
+        raise
+
+    for shard, (start, end) in enumerate(ranges):
+        request.task(reindex_shard).delay(new_index_name, shard, start, end)
+
+
+@tasks.task(bind=True, ignore_result=True, acks_late=True, max_retries=5)
+def reindex_shard(self, request, index_name, shard, start, end):
+    """
+    Index the projects with an id in (start, end] into the given new index.
+    """
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+    key = _reindex_key(index_name)
 
-            # Point the alias at our new randomly named index and delete the old index.
-            if client.indices.exists_alias(name=index_base):
-                to_delete = set()
-                actions = []
-                for name in client.indices.get_alias(name=index_base):
-                    to_delete.add(name)
-                    actions.append({"remove": {"index": name, "alias": index_base}})
-                actions.append({"add": {"index": new_index_name, "alias": index_base}})
-                client.indices.update_aliases({"actions": actions})
-                client.indices.delete(",".join(to_delete))
-            else:
-                client.indices.put_alias(name=index_base, index=new_index_name)
-    except redis.exceptions.LockError as exc:
+    # If our reindex has been abandoned, or this range has already been done,
+    # then there is nothing for us to do.
+    if not r.exists(key) or r.hexists(key, f"done:{shard}"):
+        return
+
+    client = _reindex_client(request)
+    try:
+        request.db.execute("SET statement_timeout = '600s'")
+
+        for _ in parallel_bulk(
+            client,
+            _reindex_docs(r, key, _project_docs(request.db, start=start, end=end)),
+            index=_reindex_alias(index_name),
+            chunk_size=REINDEX_CHUNK_SIZE,
+            require_alias=True,
+        ):
+            pass
+    except Exception as exc:
+        # Our reindex was abandoned while we were writing to it.
+        if not r.exists(key):
+            return
+        if self.request.retries >= self.max_retries:
+            _abandon_reindex(r, client, index_name)
+            raise
         raise self.retry(countdown=60, exc=exc)
+    finally:
+        request.db.rollback()
+        request.db.close()
+
+    if _mark_shard_done(r, key, shard):
+        request.task(finish_reindex).delay(index_name)
+
+
+@tasks.task(bind=True, ignore_result=True, acks_late=True)
+def finish_reindex(self, request, index_name):
+    """
+    Swap in a fully populated new index, replacing the old one.
+    """
+    r = redis.StrictRedis.from_url(request.registry.settings["celery.scheduler_url"])
+    client = _reindex_client(request)
+    number_of_replicas = request.registry.get("elasticsearch.replicas", 0)
+    refresh_interval = request.registry.get("elasticsearch.interval", "1s")
+    index_base = request.registry["elasticsearch.index"]
+
+    # Now that we've finished indexing all of our data we can update the
+    # replicas and refresh intervals.
+    client.indices.put_settings(
+        index=index_name,
+        body={
+            "index": {
+                "number_of_replicas": number_of_replicas,
+                "refresh_interval": refresh_interval,
+            }
+        },
+    )
+
+    # Nothing else will be written to our new index through its reindex alias.
+    client.indices.delete_alias(index=index_name, name=_reindex_alias(index_name))
+
+    # Point the alias at our new randomly named index and delete the old index.
+    if client.indices.exists_alias(name=index_base):
+        to_delete = set()
+        actions = []
+        for name in client.indices.get_alias(name=index_base):
+            to_delete.add(name)
+            actions.append({"remove": {"index": name, "alias": index_base}})
+        actions.append({"add": {"index": index_name, "alias": index_base}})
+        client.indices.update_aliases({"actions": actions})
+        client.indices.delete(",".join(to_delete))
+    else:
+        client.indices.put_alias(name=index_base, index=index_name)
+
+    token = r.hget(_reindex_key(index_name), "lock")
+    r.delete(_reindex_key(index_name))
+    if token is not None:
+        _release_reindex_lock(r, token)
 
 
 @tasks.task(bind=True, ignore_result=True, acks_late=True)
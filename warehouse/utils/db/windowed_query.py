@@ -10,57 +10,80 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# Taken from "Theatrum Chemicum" at
+# Originally taken from "Theatrum Chemicum" at
 # https://github.com/sqlalchemy/sqlalchemy/wiki/RangeQuery-and-WindowedRangeQuery
-
-from sqlalchemy import and_, func, text
-
-
-def column_windows(session, column, windowsize):
+# but finding each window with keyset pagination, rather than numbering every
+# row up front.
+
+import itertools
+
+from sqlalchemy import and_, func, true
+
+
+def _window(column, start, end):
+    clauses = []
+    if start is not None:
+        clauses.append(column > start)
+    if end is not None:
+        clauses.append(column <= end)
+    return and_(true(), *clauses)
+
+
+def _column_boundaries(session, column, windowsize, start=None, end=None):
+    # Each boundary is found by skipping over the next windowsize values of
+    # the column, which only needs its index, so we can start yielding windows
+    # straight away.
+    while True:
+        boundary = (
+            session.query(column)
+            .filter(_window(column, start, end))
+            .order_by(column)
+            .offset(windowsize - 1)
+            .limit(1)
+            .scalar()
+        )
+        if boundary is None:
+            return
+        yield boundary
+        start = boundary
+
+
+def column_windows(session, column, windowsize, *, start=None, end=None):
     """
     Return a series of WHERE clauses against a given column that break it into
-    windows.
-
-    Result is an iterable of tuples, consisting of ((start, end), whereclause),
-    where (start, end) are the ids.
-
-    Requires a database that supports window functions, i.e. Postgresql,
-    SQL Server, Oracle.
-
-    Enhance this yourself !  Add a "where" argument so that windows of just a
-    subset of rows can be computed.
+    windows of (up to) windowsize values, optionally limited to the values in
+    (start, end].
     """
+    for boundary in _column_boundaries(session, column, windowsize, start, end):
+        yield _window(column, start, boundary)
+        start = boundary
+    yield _window(column, start, end)
 
-    def int_for_range(start_id, end_id):
-        if end_id:
-            return and_(column >= start_id, column < end_id)
-        else:
-            return column >= start_id
 
-    q = session.query(
-        column, func.row_number().over(order_by=column).label("rownum")
-    ).from_self(column)
-
-    if windowsize > 1:
-        q = q.filter(text("rownum %% %d=1" % windowsize))
-
-    intervals = [row[0] for row in q]
-
-    while intervals:
-        start = intervals.pop(0)
-        if intervals:
-            end = intervals[0]
-        else:
-            end = None
-
-        yield int_for_range(start, end)
+def column_ranges(session, column, count):
+    """
+    Split a given column into up to count roughly equally sized ranges, as a
+    list of (start, end) tuples suitable for passing to windowed_query so that
+    each can be processed in parallel. Together they cover every value.
+    """
+    total = session.query(func.count(column)).scalar()
+    size = max(1, -(-total // count))
+    boundaries = list(
+        itertools.islice(
+            _column_boundaries(session, column, size), max(0, -(-total // size) - 1)
+        )
+    )
+    return list(zip([None] + boundaries, boundaries + [None]))
 
 
-def windowed_query(q, column, windowsize):
+def windowed_query(q, column, windowsize, *, start=None, end=None):
     """
-    Break a Query into windows on a given column.
+    Break a Query into windows on a given column, optionally limited to the
+    values of that column in (start, end].
     """
 
-    for whereclause in column_windows(q.session, column, windowsize):
+    for whereclause in column_windows(
+        q.session, column, windowsize, start=start, end=end
+    ):
         for row in q.filter(whereclause).order_by(column):
             yield row
@@ -53,6 +53,7 @@ from warehouse.forms import SetLocaleForm
 from warehouse.i18n import LOCALE_ATTR
 from warehouse.metrics import IMetricsService
 from warehouse.packaging.models import File, Project, Release, release_classifiers
+from warehouse.packaging.utils import trending_project_ids
 from warehouse.search.queries import SEARCH_FILTER_ORDER, get_es_query
 from warehouse.utils.http import is_safe_url
 from warehouse.utils.paginate import ElasticsearchPage, paginate_url_factory
@@ -200,15 +201,7 @@ def opensearchxml(request):
     has_translations=True,
 )
 def index(request):
-    project_ids = [
-        r[0]
-        for r in (
-            request.db.query(Project.id)
-            .order_by(Project.zscore.desc().nullslast(), func.random())
-            .limit(5)
-            .all()
-        )
-    ]
+    project_ids = trending_project_ids(request.db)
     release_a = aliased(
         Release,
         request.db.query(Release)